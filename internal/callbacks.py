@@ -1,6 +1,7 @@
 import os
 import sys
 import math
+from typing import Optional, Tuple
 from lightning.pytorch.callbacks import Callback
 from lightning.pytorch.callbacks.progress.tqdm_progress import TQDMProgressBar, Tqdm
 
@@ -36,6 +37,15 @@ class KeepRunningIfWebViewerEnabled(Callback):
 
 class StopImageSavingThreads(Callback):
     def on_exception(self, trainer, pl_module, exception: BaseException) -> None:
+        if pl_module.image_writer_pool is not None:
+            pl_module.image_writer_pool.close(cancel=True)
+            pl_module.image_writer_pool = None
+
+        # release the file handle of the interrupted epoch
+        if pl_module.val_metrics_writer is not None:
+            pl_module.val_metrics_writer.close()
+            pl_module.val_metrics_writer = None
+
         alive_threads = pl_module.image_saving_threads
 
         while len(alive_threads) > 0:
@@ -100,6 +110,166 @@ class ValidateOnTrainEnd(Callback):
             trainer.validating = False
 
 
+class ReorderGaussians(Callback):
+    """
+    Sort the Gaussians along the Morton curve periodically, so that the spatially nearby ones are also nearby in memory.
+    The densification appends new Gaussians to the tail, which breaks the locality gradually.
+
+    Enable it by `--trainer.callbacks+=internal.callbacks.ReorderGaussians --trainer.callbacks.interval=1000`.
+    """
+
+    def __init__(self, interval: int = 1000, until: int = -1, n_bits: int = 21):
+        """
+        Args:
+            interval: reorder every `interval` steps, non-positive value disables reordering
+            until: stop reordering after this step, negative value means never stop
+            n_bits: the precision of the Morton codes, per axis
+        """
+
+        super().__init__()
+        self.interval = interval
+        self.until = until
+        self.n_bits = n_bits
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx) -> None:
+        step = trainer.global_step
+        if self.interval <= 0 or step % self.interval != 0:
+            return
+        if self.until >= 0 and step > self.until:
+            return
+        self.reorder(pl_module, self.n_bits)
+
+    @staticmethod
+    def reorder(pl_module, n_bits: int = 21):
+        import torch
+        from internal.utils.morton_code import get_morton_order
+        from internal.density_controllers.density_controller import Utils
+
+        gaussian_model = pl_module.gaussian_model
+        with torch.no_grad():
+            indices = get_morton_order(gaussian_model.get_means(), n_bits=n_bits)
+            gaussian_model.properties = Utils.reorder_properties(indices, gaussian_model, pl_module.gaussian_optimizers)
+            pl_module.density_controller.reorder_states(indices)
+
+        return indices
+
+
+class ProfileTrainingSteps(Callback):
+    """
+    Time the phases of the training steps, e.g. forward, backward and the densification, see `internal.utils.step_profiler`.
+    The percentiles of each phase are logged periodically, and all the records are written as a Chrome trace after the training.
+
+    Enable it by `--trainer.callbacks+=internal.callbacks.ProfileTrainingSteps --trainer.callbacks.log_interval=100`.
+    """
+
+    def __init__(
+            self,
+            window_size: int = 100,
+            log_interval: int = 100,
+            percentiles: Tuple[float, ...] = (50, 90, 99),
+            trace_path: Optional[str] = None,
+            use_cuda_events: bool = True,
+    ):
+        """
+        Args:
+            window_size: the percentiles are calculated over the latest `window_size` steps
+            log_interval: log the percentiles every `log_interval` steps, non-positive value disables logging
+            trace_path: the path of the Chrome trace, defaults to `{output_path}/step_profile.json`, empty string disables it
+            use_cuda_events: time by CUDA events, which do not synchronize the device, instead of the wall-clock
+        """
+
+        super().__init__()
+        self.window_size = window_size
+        self.log_interval = log_interval
+        self.percentiles = percentiles
+        self.trace_path = trace_path
+        self.use_cuda_events = use_cuda_events
+
+        self.profiler = None
+
+    def on_train_start(self, trainer, pl_module) -> None:
+        from internal.utils.step_profiler import StepProfiler, set_active_profiler
+
+        self.profiler = StepProfiler(window_size=self.window_size, use_cuda_events=self.use_cuda_events)
+        set_active_profiler(self.profiler)
+
+    def on_train_batch_start(self, trainer, pl_module, batch, batch_idx) -> None:
+        self.profiler.begin_step(trainer.global_step + 1)
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx) -> None:
+        self.profiler.end_step()
+
+        step = trainer.global_step
+        if self.log_interval <= 0 or step % self.log_interval != 0 or pl_module.logger is None:
+            return
+        pl_module.logger.log_metrics(self.profiler.get_summary(self.percentiles), step=step)
+
+    def on_train_end(self, trainer, pl_module) -> None:
+        from internal.utils.step_profiler import set_active_profiler
+
+        set_active_profiler(None)
+        self.profiler.resolve(block=True)
+
+        trace_path = self.trace_path
+        if trace_path is None:
+            trace_path = os.path.join(pl_module.hparams["output_path"], "step_profile.json")
+        if trace_path == "" or trainer.global_rank != 0:
+            return
+        self.profiler.export_chrome_trace(trace_path)
+        print("Step profile saved to {}".format(trace_path))
+
+
+class CountSyncCalls(Callback):
+    """
+    Count the calls synchronizing the host with the device in each training step, see `internal.utils.sync_counter`.
+    It slows down every tensor method call it watches, so it is for finding the synchronizations only.
+
+    Enable it by `--trainer.callbacks+=internal.callbacks.CountSyncCalls --trainer.callbacks.max_per_step=0`.
+    """
+
+    def __init__(self, max_per_step: int = -1, include_cpu: bool = False):
+        """
+        Args:
+            max_per_step: print the call sites of the steps having more calls than it, negative value disables it
+            include_cpu: count the calls on CPU tensors too
+        """
+
+        super().__init__()
+        self.max_per_step = max_per_step
+        self.include_cpu = include_cpu
+
+        self.counter = None
+
+    def on_train_start(self, trainer, pl_module) -> None:
+        from internal.utils.sync_counter import SyncCounter
+
+        self.counter = SyncCounter(include_cpu=self.include_cpu)
+        self.counter.start()
+
+    def on_train_batch_start(self, trainer, pl_module, batch, batch_idx) -> None:
+        self._check(self.counter.step)
+        # the calls made by Lightning after `on_train_batch_end()` are counted to the step too
+        self.counter.begin_step(trainer.global_step + 1)
+
+    def _check(self, step: int):
+        if self.max_per_step < 0 or len(self.counter.calls.get(step, [])) <= self.max_per_step:
+            return
+        print("step {}: {} synchronizing calls".format(step, len(self.counter.calls[step])))
+        for call, count in self.counter.get_call_sites(step).most_common():
+            print("    {} x{}".format(call, count))
+
+    def _stop(self):
+        if self.counter is not None:
+            self.counter.stop()
+
+    def on_train_end(self, trainer, pl_module) -> None:
+        self._stop()
+        self._check(self.counter.step)
+
+    def on_exception(self, trainer, pl_module, exception: BaseException) -> None:
+        self._stop()
+
+
 class StopDataLoaderCacheThread(Callback):
     def _stop_thread(self, data_loader):
         import queue
@@ -9,3 +9,5 @@ class LightGaussian:
     prune_percent: float = 0.66
     prune_type: Literal["v_important_score"] = "v_important_score"
     v_pow: float = 0.1
+    camera_batch_size: int = 16
+    """The number of the cameras counted at a time when calculating the importance scores"""
@@ -147,8 +147,15 @@ class CacheDataLoader(torch.utils.data.DataLoader):
             world_size: int = -1,
             global_rank: int = -1,
             async_caching: bool = False,
+            camera_assigner=None,
             **kwargs,
     ):
+        """
+        Args:
+            camera_assigner: a `CameraRankAssigner`, used to select the images of this rank in distributed training,
+                the selection is updated at the beginning of each epoch
+        """
+
         assert kwargs.get("batch_size", 1) == 1, "only batch_size=1 is supported"
 
         self.dataset = dataset
@@ -158,9 +165,19 @@ class CacheDataLoader(torch.utils.data.DataLoader):
         self.shuffle = shuffle
         self.max_cache_num = max_cache_num
 
+        self.camera_assigner = None
+        self.global_rank = global_rank
+        self.epoch = 0
+
         # image indices to use
         self.indices = list(range(len(self.dataset)))
-        if distributed is True and self.max_cache_num != 0:
+        if distributed is True and camera_assigner is not None:
+            assert global_rank >= 0
+            self.camera_assigner = camera_assigner
+            self.indices = camera_assigner.get_indices(global_rank, epoch=self.epoch)
+
+            print("#{} assigned indices (total: {}): {}".format(os.getpid(), len(self.indices), self.indices))
+        elif distributed is True and self.max_cache_num != 0:
             assert world_size > 0
             assert global_rank >= 0
             image_num_to_use = math.ceil(len(self.indices) / world_size)
@@ -203,7 +220,8 @@ class CacheDataLoader(torch.utils.data.DataLoader):
         # TODO: GC will freeze program a while
         while not self.stop_caching:
             if self.shuffle is True:
-                indices = torch.randperm(len(self.indices), generator=self.generator).tolist()  # shuffle for each epoch
+                # shuffle for each epoch, the permutation is applied to the image indices of this rank
+                indices = [self.indices[i] for i in torch.randperm(len(self.indices), generator=self.generator).tolist()]
                 # print("#{} 1st index: {}".format(os.getpid(), indices[0]))
             else:
                 indices = self.indices.copy()
@@ -241,8 +259,28 @@ class CacheDataLoader(torch.utils.data.DataLoader):
     def __getitem__(self, idx):
         return self.dataset.__getitem__(idx)
 
+    def _update_assigned_indices(self):
+        if self.camera_assigner is None:
+            return
+
+        indices = self.camera_assigner.get_indices(self.global_rank, epoch=self.epoch)
+        self.epoch += 1
+        if indices == self.indices:
+            return
+
+        if self.max_cache_num < 0:
+            # reuse the cached ones, and load the new ones
+            cached_by_index = {index: data for index, data in zip(self.indices, self.cached)}
+            to_cache = sorted(set([i for i in indices if i not in cached_by_index]))
+            if len(to_cache) > 0:
+                cached_by_index.update(zip(to_cache, self._cache_data(to_cache, pbar_leave=False)))
+            self.cached = [cached_by_index[i] for i in indices]
+        self.indices = indices
+
     def __iter__(self):
         # TODO: support batching
+        self._update_assigned_indices()
+
         if self.max_cache_num < 0:
             if self.shuffle is True:
                 indices = torch.randperm(len(self.cached), generator=self.generator).tolist()  # shuffle for each epoch
@@ -254,7 +292,8 @@ class CacheDataLoader(torch.utils.data.DataLoader):
                 yield self.cached[i]
         else:
             if self.shuffle is True:
-                indices = torch.randperm(len(self.indices), generator=self.generator).tolist()  # shuffle for each epoch
+                # shuffle for each epoch, the permutation is applied to the image indices of this rank
+                indices = [self.indices[i] for i in torch.randperm(len(self.indices), generator=self.generator).tolist()]
                 # print("#{} 1st index: {}".format(os.getpid(), indices[0]))
             else:
                 indices = self.indices.copy()
@@ -317,6 +356,7 @@ class DataModule(LightningDataModule):
             image_on_cpu: bool = True,
             image_uint8: bool = False,
             async_caching: bool = False,
+            align_cameras_with_gaussians: bool = False,
     ) -> None:
         r"""Load dataset
 
@@ -324,6 +364,9 @@ class DataModule(LightningDataModule):
                 path: the path to the dataset
 
                 type: the dataset type
+
+                align_cameras_with_gaussians: in distributed training, assign the images to the ranks owning most of the Gaussians they see,
+                    the ownership is provided by the renderer, e.g. `GSplatDistributedRenderer` with the spatial redistribution
         """
 
         super().__init__()
@@ -494,6 +537,18 @@ class DataModule(LightningDataModule):
             world_size=self.trainer.world_size,
             global_rank=self.trainer.global_rank,
             async_caching=self.hparams["async_caching"],
+            camera_assigner=self.get_camera_assigner(),
+        )
+
+    def get_camera_assigner(self):
+        if self.hparams["distributed"] is False or self.hparams["align_cameras_with_gaussians"] is False:
+            return None
+
+        from internal.utils.camera_rank_assignment import CameraRankAssigner
+        return CameraRankAssigner(
+            self.dataparser_outputs.train_set.cameras,
+            world_size=self.trainer.world_size,
+            seed=torch.initial_seed(),  # should be the same on all the ranks
         )
 
     def test_dataloader(self) -> EVAL_DATALOADERS:
@@ -28,6 +28,18 @@ class DensityControllerImpl(torch.nn.Module):
         """
         pass
 
+    def reorder_states(self, indices: torch.Tensor) -> None:
+        """
+        This interface will be invoked when the Gaussians are reordered, the per-Gaussian states should be permuted by `indices`.
+        By default, the buffers whose first dimension equals the number of the Gaussians are permuted, the others are left unchanged.
+        Override it if the per-Gaussian states are not stored that way.
+        """
+
+        n_gaussians = indices.shape[0]
+        for name, buffer in list(self.named_buffers(recurse=False)):
+            if buffer.dim() > 0 and buffer.shape[0] == n_gaussians:
+                setattr(self, name, buffer[indices.to(device=buffer.device)])
+
 
 class DensityController(InstantiatableConfig):
     def instantiate(self, *args, **kwargs) -> DensityControllerImpl:
@@ -145,6 +157,23 @@ class Utils:
 
         return new_parameters
 
+    @classmethod
+    def reorder_optimizers_(cls, indices: torch.Tensor, optimizers):
+        """
+        Permute the parameters and their optimizer states
+
+        :param indices: a permutation of `[0, N)`, the i-th one after reordering is the `indices[i]`-th one before
+        :param optimizers:
+        :return: a new dict
+        """
+
+        # indexing by a permutation is the same as pruning by a mask
+        return cls.prune_optimizers_(indices, optimizers)
+
+    @classmethod
+    def reorder_properties(cls, indices: torch.Tensor, model: "internal.models.gaussian.GaussianModel", optimizers: List[torch.optim.Optimizer]):
+        return cls.prune_properties(indices, model, optimizers)
+
     @staticmethod
     def replace_tensors_to_optimizers_(tensors: Dict[str, torch.Tensor], optimizers, selector=None):
         """
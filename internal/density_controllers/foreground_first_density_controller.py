@@ -345,6 +345,12 @@ class ForegroundFirstDensityControllerModule(DensityControllerImpl):
         self.denom = self.denom[valid_points_mask]
         self.max_radii2D = self.max_radii2D[valid_points_mask]
 
+    def reorder_states(self, indices: torch.Tensor) -> None:
+        indices = indices.to(device=self.max_radii2D.device)
+        self.xyz_gradient_accum = self.xyz_gradient_accum[indices]
+        self.denom = self.denom[indices]
+        self.max_radii2D = self.max_radii2D[indices]
+
     def _reset_opacities(self, gaussian_model: VanillaGaussianModel, optimizers: List):
         opacities_new = gaussian_model.opacity_inverse_activation(torch.min(
             gaussian_model.get_opacities(),
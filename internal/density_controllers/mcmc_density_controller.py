@@ -65,6 +65,10 @@ class MCMCDensityControllerImpl(DensityControllerImpl):
 
         pl_module.on_train_batch_end_hooks.append(self._add_xyz_noise)
 
+    def reorder_states(self, indices: torch.Tensor) -> None:
+        # `binoms` is a lookup table, there are no per-Gaussian states
+        pass
+
     @staticmethod
     def _opacities_and_scales_initialization(gaussian_model) -> None:
         # looks like it does not affect the final result
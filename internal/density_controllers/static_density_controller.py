@@ -10,4 +10,6 @@ class StaticDensityController(DensityController):
 
 
 class StaticDensityControllerImpl(DensityControllerImpl):
-    pass
+    def reorder_states(self, indices) -> None:
+        # no per-Gaussian states
+        pass
@@ -6,6 +6,7 @@ from lightning import LightningModule
 
 from internal.models.vanilla_gaussian import VanillaGaussianModel
 from internal.utils.general_utils import build_rotation
+from internal.utils.step_profiler import profile_scope
 from .density_controller import DensityController, DensityControllerImpl, Utils
 
 
@@ -32,6 +33,18 @@ class VanillaDensityController(DensityController):
 
     absgrad: bool = False
 
+    max_n_gaussians: int = -1
+    """stop densifying once the number of Gaussians reaches it, non-positive value means unlimited"""
+
+    max_memory_mb: float = -1.
+    """
+    the memory budget of the Gaussians, including their parameters, optimizer states and density statistics, non-positive value means unlimited.
+    Once a budget is reached, the Gaussians with the largest gradients are cloned or split first.
+    """
+
+    log_memory: bool = False
+    """log the memory of each component on densification, see `internal.utils.memory_ledger`"""
+
     def instantiate(self, *args, **kwargs) -> DensityControllerImpl:
         return VanillaDensityControllerImpl(self)
 
@@ -81,12 +94,15 @@ class VanillaDensityControllerImpl(DensityControllerImpl):
                     gaussian_model=gaussian_model,
                     optimizers=optimizers,
                 )
+                if self.config.log_memory:
+                    self._log_memory(outputs, pl_module)
 
             if global_step % self.config.opacity_reset_interval == 0 or \
                     (
                             torch.all(pl_module.background_color == 1.) and global_step == self.config.densify_from_iter
                     ):
-                self._reset_opacities(gaussian_model, optimizers)
+                with profile_scope("opacity_reset"):
+                    self._reset_opacities(gaussian_model, optimizers)
 
     def update_states(self, outputs):
         viewspace_point_tensor, visibility_filter, radii = outputs["viewspace_points"], outputs["visibility_filter"], outputs["radii"]
@@ -121,16 +137,18 @@ class VanillaDensityControllerImpl(DensityControllerImpl):
         grads[grads.isnan()] = 0.0
 
         # densify
-        self._densify_and_clone(grads, gaussian_model, optimizers)
-        self._densify_and_split(grads, gaussian_model, optimizers)
+        with profile_scope("densify"):
+            self._densify_and_clone(grads, gaussian_model, optimizers)
+            self._densify_and_split(grads, gaussian_model, optimizers)
 
         # prune
-        prune_mask = (gaussian_model.get_opacities() < min_opacity).squeeze()
-        if max_screen_size:
-            big_points_vs = self.max_radii2D > max_screen_size
-            big_points_ws = gaussian_model.get_scales().max(dim=1).values > 0.1 * prune_extent
-            prune_mask = torch.logical_or(torch.logical_or(prune_mask, big_points_vs), big_points_ws)
-        self._prune_points(prune_mask, gaussian_model, optimizers)
+        with profile_scope("prune"):
+            prune_mask = (gaussian_model.get_opacities() < min_opacity).squeeze()
+            if max_screen_size:
+                big_points_vs = self.max_radii2D > max_screen_size
+                big_points_ws = gaussian_model.get_scales().max(dim=1).values > 0.1 * prune_extent
+                prune_mask = torch.logical_or(torch.logical_or(prune_mask, big_points_vs), big_points_ws)
+            self._prune_points(prune_mask, gaussian_model, optimizers)
 
         torch.cuda.empty_cache()
 
@@ -146,6 +164,7 @@ class VanillaDensityControllerImpl(DensityControllerImpl):
             selected_pts_mask,
             torch.max(gaussian_model.get_scales(), dim=1).values <= percent_dense * scene_extent,
         )
+        selected_pts_mask = self._limit_to_budget(selected_pts_mask, torch.norm(grads, dim=-1), 1, gaussian_model, optimizers)
 
         # Copy selected Gaussians
         new_properties = {}
@@ -208,6 +227,8 @@ class VanillaDensityControllerImpl(DensityControllerImpl):
                 dim=1,
             ).values > percent_dense * scene_extent,
         )
+        # the selected ones are pruned after splitting
+        selected_pts_mask = self._limit_to_budget(selected_pts_mask, padded_grad, N - 1, gaussian_model, optimizers)
 
         # Split
         new_properties = self._split_properties(gaussian_model, selected_pts_mask, N)
@@ -226,6 +247,55 @@ class VanillaDensityControllerImpl(DensityControllerImpl):
         ))
         self._prune_points(prune_filter, gaussian_model, optimizers)
 
+    def _get_max_n_gaussians(self, gaussian_model, optimizers: List) -> int:
+        """
+        Returns:
+            the number of Gaussians allowed by the budgets, -1 means unlimited
+        """
+
+        max_n_gaussians = self.config.max_n_gaussians if self.config.max_n_gaussians > 0 else -1
+        if self.config.max_memory_mb > 0:
+            from internal.utils.memory_ledger import get_nbytes_per_gaussian
+            nbytes_per_gaussian = get_nbytes_per_gaussian(gaussian_model, optimizers, self)
+            if nbytes_per_gaussian > 0:
+                n_by_memory = int(self.config.max_memory_mb * 1024 * 1024 // nbytes_per_gaussian)
+                max_n_gaussians = n_by_memory if max_n_gaussians < 0 else min(max_n_gaussians, n_by_memory)
+        return max_n_gaussians
+
+    def _limit_to_budget(self, selected_pts_mask, scores, n_new_per_selected: int, gaussian_model, optimizers: List):
+        """
+        Keep the selected ones with the largest `scores` if selecting all of them exceeds the budget.
+
+        Args:
+            selected_pts_mask: [N]
+            scores: [N], the gradient magnitudes
+            n_new_per_selected: the increase of the number of Gaussians for each selected one
+        """
+
+        max_n_gaussians = self._get_max_n_gaussians(gaussian_model, optimizers)
+        if max_n_gaussians < 0:
+            return selected_pts_mask
+
+        n_allowed = max(max_n_gaussians - gaussian_model.n_gaussians, 0) // max(n_new_per_selected, 1)
+        if selected_pts_mask.sum().item() <= n_allowed:
+            return selected_pts_mask
+
+        limited_mask = torch.zeros_like(selected_pts_mask)
+        if n_allowed > 0:
+            masked_scores = torch.where(selected_pts_mask, scores, -torch.inf)
+            limited_mask[torch.topk(masked_scores, n_allowed, sorted=False).indices] = True
+        return limited_mask
+
+    def _log_memory(self, outputs: dict, pl_module: LightningModule):
+        if pl_module.logger is None:
+            return
+        from internal.utils.memory_ledger import get_memory_ledger
+
+        pl_module.logger.log_metrics(
+            {"memory/{}_mb".format(name): nbytes / 1024 / 1024 for name, nbytes in get_memory_ledger(pl_module, outputs).items()},
+            step=pl_module.trainer.global_step,
+        )
+
     def _densification_postfix(self, new_properties: Dict, gaussian_model, optimizers):
         new_parameters = Utils.cat_tensors_to_properties(new_properties, gaussian_model, optimizers)
         gaussian_model.properties = new_parameters
@@ -249,6 +319,12 @@ class VanillaDensityControllerImpl(DensityControllerImpl):
         self.denom = self.denom[valid_points_mask]
         self.max_radii2D = self.max_radii2D[valid_points_mask]
 
+    def reorder_states(self, indices: torch.Tensor) -> None:
+        indices = indices.to(device=self.max_radii2D.device)
+        self.xyz_gradient_accum = self.xyz_gradient_accum[indices]
+        self.denom = self.denom[indices]
+        self.max_radii2D = self.max_radii2D[indices]
+
     def _reset_opacities(self, gaussian_model: VanillaGaussianModel, optimizers: List):
         opacities_new = gaussian_model.opacity_inverse_activation(torch.min(
             gaussian_model.get_opacities(),
@@ -25,6 +25,16 @@ class CLIArgs:
 
     mesh_res: int = 1024
 
+    sparse_marching_cubes: bool = False
+
+    marching_cubes_processes: int = 0
+
+    sparse_tsdf: bool = False
+
+    tsdf_batch_size: int = 8
+
+    max_in_memory_maps_gb: float = -1.
+
 
 def main():
     args = CLI(CLIArgs)
@@ -93,7 +103,13 @@ def main():
     # set the active_sh to 0 to export only diffuse texture
     model.active_sh_degree = 0
     bg_color = torch.zeros((3,), dtype=torch.float, device=device)
-    maps = GS2DMeshUtils.render_views(model, renderer, cameras, bg_color)
+    maps = GS2DMeshUtils.render_views(
+        model,
+        renderer,
+        cameras,
+        bg_color,
+        max_in_memory_bytes=-1 if args.max_in_memory_maps_gb < 0 else int(args.max_in_memory_maps_gb * 1024 ** 3),
+    )
     bound = GS2DMeshUtils.estimate_bounding_sphere(cameras)
 
     if args.unbounded:
@@ -104,6 +120,8 @@ def main():
             cameras=cameras,
             model=model,
             resolution=args.mesh_res,
+            sparse=args.sparse_marching_cubes,
+            n_processes=args.marching_cubes_processes,
         )
     else:
         name = 'fuse.ply'
@@ -111,7 +129,18 @@ def main():
         depth_trunc = (radius * 2.0) if args.depth_trunc < 0 else args.depth_trunc
         voxel_size = (depth_trunc / args.mesh_res) if args.voxel_size < 0 else args.voxel_size
         sdf_trunc = 5.0 * voxel_size if args.sdf_trunc < 0 else args.sdf_trunc
-        mesh = GS2DMeshUtils.extract_mesh_bounded(maps=maps, cameras=cameras, voxel_size=voxel_size, sdf_trunc=sdf_trunc, depth_trunc=depth_trunc)
+        if args.sparse_tsdf:
+            mesh = GS2DMeshUtils.extract_mesh_bounded_sparse(
+                maps=maps,
+                cameras=cameras,
+                voxel_size=voxel_size,
+                sdf_trunc=sdf_trunc,
+                depth_trunc=depth_trunc,
+                batch_size=args.tsdf_batch_size,
+                device=device,
+            )
+        else:
+            mesh = GS2DMeshUtils.extract_mesh_bounded(maps=maps, cameras=cameras, voxel_size=voxel_size, sdf_trunc=sdf_trunc, depth_trunc=depth_trunc)
 
     output_dir = args.model_path
     if os.path.isfile(output_dir):
@@ -42,6 +42,8 @@ def cli():
     parser.add_argument("--vanilla_seganygs", action="store_true", default=False)
     parser.add_argument("--vanilla_mip", action="store_true", default=False)
     parser.add_argument("--vanilla_pvg", action="store_true", default=False)
+    parser.add_argument("--pvg_keyframes", "--pvg-keyframes", type=str, default=None,
+                        help="Path to the keyframes of a Periodic Vibration Gaussian model baked by `utils/bake_pvg_keyframes.py`")
     parser.add_argument("--float32_matmul_precision", "--fp", type=str, default=None)
     args = parser.parse_args()
 
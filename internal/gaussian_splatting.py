@@ -1,3 +1,4 @@
+import math
 import os.path
 import queue
 import threading
@@ -8,7 +9,6 @@ from typing_extensions import Self
 import torch.optim
 import torchvision
 import wandb
-import csv
 from lightning.pytorch.core.module import MODULE_OPTIMIZERS
 from lightning.pytorch import LightningDataModule, LightningModule
 from lightning.pytorch.utilities.types import OptimizerLRScheduler, LRSchedulerPLType, STEP_OUTPUT
@@ -29,6 +29,11 @@ from jsonargparse import lazy_instance
 
 from internal.utils.sh_utils import eval_sh
 from internal.utils.graphics_utils import store_ply
+from internal.utils.step_profiler import profile_scope
+from internal.utils.metric_accumulator import MetricAccumulator
+from internal.utils.image_writer_pool import ImageWriterPool, to_uint8_image
+from internal.utils.light_gaussian import ImportanceScoreEngine
+from internal.utils.metrics_csv_writer import MetricsCSVWriter
 
 
 class GaussianSplatting(LightningModule):
@@ -50,6 +55,10 @@ class GaussianSplatting(LightningModule):
             web_viewer: bool = False,
             initialize_from: str = None,
             renderer_output_types: Optional[List[str]] = None,
+            metrics_flush_interval: int = 0,
+            val_render_batch_size: int = 1,
+            val_output_processes: int = 0,
+            max_in_flight_val_outputs: int = 16,
     ) -> None:
         super().__init__()
         self.automatic_optimization = False
@@ -60,6 +69,8 @@ class GaussianSplatting(LightningModule):
         self.frozen_gaussians = None
 
         self.light_gaussian_hparams = light_gaussian
+        # the importance scores are cached, and saved to the checkpoints
+        self.light_gaussian_importance = ImportanceScoreEngine(anti_aliased=False, camera_batch_size=light_gaussian.camera_batch_size)
 
         # instantiate renderer
         if isinstance(renderer, RendererConfig):
@@ -91,7 +102,18 @@ class GaussianSplatting(LightningModule):
         self.image_queue = queue.Queue(maxsize=self.max_image_saving_threads)
         self.image_saving_threads = []
 
-        self.val_metrics: List[Tuple[str, Dict]] = []
+        # batched validation, the batches are buffered until `val_render_batch_size` of them are available
+        self.pending_val_batches: List[Tuple[Any, int]] = []
+        # write the validation outputs in a process pool instead of the threads above if `val_output_processes` > 0
+        self.image_writer_pool: Optional[ImageWriterPool] = None
+        # the metrics of each validation image are written once they are available
+        self.val_metrics_writer: Optional[MetricsCSVWriter] = None
+
+        # accumulate the training metrics on device, and log them every `metrics_flush_interval` steps,
+        # instead of converting them to Python numbers on every step
+        self.metric_accumulator = None
+        if metrics_flush_interval > 0:
+            self.metric_accumulator = MetricAccumulator(flush_interval=metrics_flush_interval)
 
         # hooks
         self.on_after_backward_hooks: List[Callable[[Dict, Any, GaussianModel, int, Self], None]] = []
@@ -116,6 +138,27 @@ class GaussianSplatting(LightningModule):
                 batch_size=self.batch_size,
             )
 
+    def log_accumulated_metrics(self, flushed: List[Tuple[int, Dict[str, float]]], prog_bar: dict):
+        for step, values in flushed:
+            self.logger.log_metrics({"train/{}".format(name): value for name, value in values.items()}, step=step)
+        if len(flushed) == 0:
+            return
+
+        # Lightning converts the values to tensors on device, so updating the progress bar costs a synchronization,
+        # but only on the steps collecting the flushed values
+        for name, value in flushed[-1][1].items():
+            if prog_bar.get(name, False) is False:
+                continue
+            self.log(
+                "train/{}".format(name),
+                value,
+                prog_bar=True,
+                logger=False,
+                on_step=True,
+                on_epoch=False,
+                batch_size=self.batch_size,
+            )
+
     def _fixed_background_color(self):
         return self.background_color
 
@@ -144,6 +187,7 @@ class GaussianSplatting(LightningModule):
                 device=self.device,
                 eval_mode=False,
                 pre_activate=False,
+                model_states_only=True,
             )
 
         # replace config
@@ -187,6 +231,8 @@ class GaussianSplatting(LightningModule):
         self.restored_epoch = checkpoint["epoch"]
         self.restored_global_step = checkpoint["global_step"]
 
+        self.light_gaussian_importance.load_state_dict(checkpoint.get("light_gaussian_importance_scores", None))
+
         # call for renderer
         self.renderer.on_load_checkpoint(self, checkpoint)
         # call density controller's hook
@@ -203,6 +249,10 @@ class GaussianSplatting(LightningModule):
         #     "spatial_lr_scale": self.gaussian_model.spatial_lr_scale,
         #     "active_sh_degree": self.gaussian_model.active_sh_degree,
         # }
+        # only the scores of the current Gaussians can be reused
+        light_gaussian_importance_state_dict = self.light_gaussian_importance.state_dict(self.gaussian_model)
+        if light_gaussian_importance_state_dict is not None:
+            checkpoint["light_gaussian_importance_scores"] = light_gaussian_importance_state_dict
         super().on_save_checkpoint(checkpoint)
 
     def tensorboard_log_image(self, tag: str, image_tensor):
@@ -254,6 +304,14 @@ class GaussianSplatting(LightningModule):
             render_types=self.renderer_output_types,
         )
 
+    def batch_forward(self, cameras):
+        return self.renderer.batch_forward(
+            cameras,
+            self.gaussian_model,
+            bg_color=self._fixed_background_color().to(cameras[0].R.device),
+            render_types=self.renderer_output_types,
+        )
+
     def optimizers(self, use_pl_optimizer: bool = True):
         optimizers = super().optimizers(use_pl_optimizer=use_pl_optimizer)
 
@@ -338,64 +396,77 @@ class GaussianSplatting(LightningModule):
         # save checkpoint
         # checkpoint will always be saved after final step, so do not save for final step here
         if global_step in self.hparams["save_iterations"] and self.is_final_step(global_step) is False and self.trainer.global_step != self.restored_global_step:
-            self.save_gaussians()
+            with profile_scope("save"):
+                self.save_gaussians()
 
         # call renderer hook
-        self.renderer.before_training_step(global_step, self)
+        with profile_scope("renderer_before_training_step"):
+            self.renderer.before_training_step(global_step, self)
 
         # forward
-        outputs = self(camera)
+        with profile_scope("forward"):
+            outputs = self(camera)
         # metrics
-        metrics, prog_bar = self.metric.get_train_metrics(self, self.gaussian_model, global_step, batch, outputs)
-        self.log_metrics(metrics, prog_bar, prefix="train", on_step=True, on_epoch=False)
-
-        # log learning rate and gaussian count every 100 iterations (without plus one step)
-        if self.trainer.global_step % 100 == 0:
-            metrics_to_log = {
-                "train/gaussians_count": self.gaussian_model.get_xyz.shape[0],
-            }
-            for opt_idx, opt in enumerate(optimizers):
-                if opt is None:
-                    continue
-                for idx, param_group in enumerate(opt.param_groups):
-                    param_group_name = param_group["name"] if "name" in param_group else str(idx)
-                    metrics_to_log["lr/{}_{}".format(opt_idx, param_group_name)] = param_group["lr"]
-            self.logger.log_metrics(
-                metrics_to_log,
-                step=self.trainer.global_step,
-            )
+        with profile_scope("metrics"):
+            metrics, prog_bar = self.metric.get_train_metrics(self, self.gaussian_model, global_step, batch, outputs)
+            if self.metric_accumulator is None:
+                self.log_metrics(metrics, prog_bar, prefix="train", on_step=True, on_epoch=False)
+            else:
+                self.log_accumulated_metrics(self.metric_accumulator.step(global_step, metrics), prog_bar)
+
+            # log learning rate and gaussian count every 100 iterations (without plus one step)
+            if self.trainer.global_step % 100 == 0:
+                metrics_to_log = {
+                    "train/gaussians_count": self.gaussian_model.get_xyz.shape[0],
+                }
+                for opt_idx, opt in enumerate(optimizers):
+                    if opt is None:
+                        continue
+                    for idx, param_group in enumerate(opt.param_groups):
+                        param_group_name = param_group["name"] if "name" in param_group else str(idx)
+                        metrics_to_log["lr/{}_{}".format(opt_idx, param_group_name)] = param_group["lr"]
+                self.logger.log_metrics(
+                    metrics_to_log,
+                    step=self.trainer.global_step,
+                )
 
         # invoke `before_backward` interface of density controller
-        self.density_controller.before_backward(
-            outputs=outputs,
-            batch=batch,
-            gaussian_model=self.gaussian_model,
-            optimizers=self.gaussian_optimizers,
-            global_step=global_step,
-            pl_module=self,
-        )
+        with profile_scope("before_backward"):
+            self.density_controller.before_backward(
+                outputs=outputs,
+                batch=batch,
+                gaussian_model=self.gaussian_model,
+                optimizers=self.gaussian_optimizers,
+                global_step=global_step,
+                pl_module=self,
+            )
         # backward
-        self.manual_backward(metrics["loss"])
+        with profile_scope("backward"):
+            self.manual_backward(metrics["loss"])
         # invoke `after_backward` interface of density controller
-        self.density_controller.after_backward(
-            outputs=outputs,
-            batch=batch,
-            gaussian_model=self.gaussian_model,
-            optimizers=self.gaussian_optimizers,
-            global_step=global_step,
-            pl_module=self,
-        )
+        with profile_scope("after_backward"):
+            self.density_controller.after_backward(
+                outputs=outputs,
+                batch=batch,
+                gaussian_model=self.gaussian_model,
+                optimizers=self.gaussian_optimizers,
+                global_step=global_step,
+                pl_module=self,
+            )
         # invoke other hooks
-        for i in self.on_after_backward_hooks:
-            i(outputs, batch, self.gaussian_model, global_step, self)
+        with profile_scope("after_backward_hooks"):
+            for i in self.on_after_backward_hooks:
+                i(outputs, batch, self.gaussian_model, global_step, self)
 
         # optimize
-        for optimizer in optimizers:
-            optimizer.step()
+        with profile_scope("optimizers"):
+            for optimizer in optimizers:
+                optimizer.step()
 
         # schedule lr
-        for scheduler in schedulers:
-            scheduler.step()
+        with profile_scope("schedulers"):
+            for scheduler in schedulers:
+                scheduler.step()
 
     def light_gaussian_prune(self, global_step):
         # TODO: move elsewhere
@@ -406,7 +477,6 @@ class GaussianSplatting(LightningModule):
         if global_step not in self.light_gaussian_hparams.prune_steps:
             return
 
-        from internal.utils.light_gaussian import get_count_and_score
         from internal.utils.light_gaussian import calculate_v_imp_score
         from internal.utils.light_gaussian import get_prune_mask
 
@@ -417,14 +487,15 @@ class GaussianSplatting(LightningModule):
             anti_aliased = False
 
         with torch.no_grad():
-            count, score, _, _ = get_count_and_score(
+            # reuse the cached scores if the Gaussians have not been changed since they were calculated
+            self.light_gaussian_importance.anti_aliased = anti_aliased
+            scores = self.light_gaussian_importance.get_scores(
                 self.gaussian_model,
                 self.trainer.datamodule.dataparser_outputs.train_set.cameras,
-                anti_aliased,
             )
             v_list = calculate_v_imp_score(
                 self.gaussian_model.get_scaling,
-                score,
+                scores.opacity_score,
                 self.light_gaussian_hparams.v_pow,
             )
 
@@ -433,16 +504,19 @@ class GaussianSplatting(LightningModule):
             prune_percent = self.light_gaussian_hparams.prune_percent * (self.light_gaussian_hparams.prune_decay ** prune_step_index)
             prune_mask = get_prune_mask(prune_percent, v_list)
 
-            print(f"number_of_gaussian={self.gaussian_model.get_xyz.shape[0]}, "
-                  f"number_to_prune={prune_mask.sum().item()}, "
-                  f"prune_percent={prune_percent}, "
-                  f"anti_aliased={anti_aliased}")
+            # the number to prune is derived from the shapes, avoid an extra synchronization by `.item()`
+            n_gaussians_before_pruning = self.gaussian_model.get_xyz.shape[0]
 
             from internal.density_controllers.density_controller import Utils
             valid_points_mask = ~prune_mask  # `True` to keep
             self.gaussian_model.properties = Utils.prune_properties(valid_points_mask, self.gaussian_model, self.gaussian_optimizers)
             self.density_updated_by_renderer()
+            self.light_gaussian_importance.prune(valid_points_mask, self.gaussian_model)
 
+            print(f"number_of_gaussian={n_gaussians_before_pruning}, "
+                  f"number_to_prune={n_gaussians_before_pruning - self.gaussian_model.get_xyz.shape[0]}, "
+                  f"prune_percent={prune_percent}, "
+                  f"anti_aliased={anti_aliased}")
             print(f"number_of_gaussian_after_pruning={self.gaussian_model.get_xyz.shape[0]}")
 
     def on_train_batch_end(self, outputs: STEP_OUTPUT, batch: Any, batch_idx: int) -> None:
@@ -461,6 +535,15 @@ class GaussianSplatting(LightningModule):
 
         super().on_train_batch_end(outputs, batch, batch_idx)
 
+    def on_train_end(self) -> None:
+        if self.metric_accumulator is not None:
+            # the ones since the last flush
+            self.metric_accumulator.flush(self.trainer.global_step)
+            for step, values in self.metric_accumulator.collect(block=True):
+                self.logger.log_metrics({"train/{}".format(name): value for name, value in values.items()}, step=step)
+
+        super().on_train_end()
+
     def on_validation_batch_start(self, batch: Any, batch_idx: int, dataloader_idx: int = 0) -> None:
         super().on_validation_batch_start(batch, batch_idx, dataloader_idx)
         if self.web_viewer is not None:
@@ -472,14 +555,49 @@ class GaussianSplatting(LightningModule):
             )
 
     def validation_step(self, batch, batch_idx, name: str = "val"):
-        camera, image_info, _ = batch
-        gt_image = image_info[1]
+        if self.hparams["val_render_batch_size"] > 1:
+            self.pending_val_batches.append((batch, batch_idx))
+            if len(self.pending_val_batches) >= self.hparams["val_render_batch_size"] or self._is_last_val_batch(batch_idx, name):
+                self._validate_pending_batches(name)
+            return
 
         # forward
-        outputs = self(camera)
+        outputs = self(batch[0])
         metrics, prog_bar = self.metric.get_validate_metrics(self, self.gaussian_model, batch, outputs)
+        self._on_validated(batch, batch_idx, outputs, metrics, prog_bar, name)
+
+    def _is_last_val_batch(self, batch_idx: int, name: str) -> bool:
+        """Always `True` if the number of the batches is unknown, so that no batches are left pending at the end of the epoch"""
+
+        if self.trainer.sanity_checking:
+            n_batches = self.trainer.num_sanity_val_batches
+        elif name == "test":
+            n_batches = self.trainer.num_test_batches
+        else:
+            n_batches = self.trainer.num_val_batches
+        if len(n_batches) == 0 or math.isinf(n_batches[0]):
+            return True
+        return batch_idx + 1 >= n_batches[0]
+
+    def _validate_pending_batches(self, name: str):
+        if len(self.pending_val_batches) == 0:
+            return
+        batches = [i[0] for i in self.pending_val_batches]
+        batch_indices = [i[1] for i in self.pending_val_batches]
+        self.pending_val_batches = []
+
+        outputs = self.batch_forward([i[0] for i in batches])
+        metrics_list, prog_bar = self.metric.get_batch_validate_metrics(self, self.gaussian_model, batches, outputs)
+        for batch, batch_idx, batch_outputs, metrics in zip(batches, batch_indices, outputs, metrics_list):
+            self._on_validated(batch, batch_idx, batch_outputs, metrics, prog_bar, name)
+
+    def _on_validated(self, batch, batch_idx: int, outputs: Dict, metrics: Dict, prog_bar: Dict, name: str):
+        _, image_info, _ = batch
+        gt_image = image_info[1]
+
         self.log_metrics(metrics, prog_bar, prefix=name, on_step=False, on_epoch=True)
-        self.val_metrics.append((image_info[0], metrics))
+        if self.val_metrics_writer is not None:
+            self.val_metrics_writer.write(image_info[0], metrics)
 
         # write validation image
         if self.trainer.global_rank == 0 and self.hparams["save_val_output"] is True and (
@@ -487,49 +605,68 @@ class GaussianSplatting(LightningModule):
         ):
             output_images = []
             if self.renderer_output_types is None:
-                output_images.append(outputs["render"].cpu())
+                output_images.append(outputs["render"])
             else:
                 for i in self.renderer_output_types:
-                    output_images.append(self.renderer_output_visualizers[i](outputs).cpu())
+                    output_images.append(self.renderer_output_visualizers[i](outputs))
             if "extra_image" in outputs:
-                output_images.append(outputs["extra_image"].cpu())
+                output_images.append(outputs["extra_image"])
+
+            epoch = max(self.trainer.current_epoch, self.restored_epoch)
+            step = max(self.trainer.global_step, self.restored_global_step)
+            if self.image_writer_pool is not None:
+                image = torch.concat([gt_image] + output_images, dim=-1)
+                if self.log_image is not None:
+                    self.log_image(
+                        tag="{}_images/{}".format(name, image_info[0].replace("/", "_")),
+                        image_tensor=torchvision.utils.make_grid(image),
+                    )
+                # the conversion runs on the device, only the uint8 pixels are copied to the host
+                self.image_writer_pool.submit(
+                    to_uint8_image(image),
+                    self._get_val_output_path(name, epoch, step, image_info[0]),
+                )
+                return
+
             self.image_queue.put({
-                "output_images": output_images,
+                "output_images": [i.cpu() for i in output_images],
                 "gt_image": gt_image.cpu(),
                 "stage": name,
                 "image_name": image_info[0],
-                "epoch": max(self.trainer.current_epoch, self.restored_epoch),
-                "step": max(self.trainer.global_step, self.restored_global_step),
+                "epoch": epoch,
+                "step": step,
             })
 
-            # if self.log_image is not None:
-            #     grid = torchvision.utils.make_grid(torch.concat([outputs["render"], gt_image], dim=-1))
-            #     self.log_image(
-            #         tag="{}_images/{}".format(name, image_info[0].replace("/", "_")),
-            #         image_tensor=grid,
-            #     )
-            #
-            # image_output_path = os.path.join(
-            #     self.hparams["output_path"],
-            #     name,
-            #     "epoch={}-step={}".format(
-            #         max(self.trainer.current_epoch, self.restored_epoch),
-            #         max(self.trainer.global_step, self.restored_global_step),
-            #     ),
-            #     "{}.png".format(image_info[0].replace("/", "_"))
-            # )
-            # os.makedirs(os.path.dirname(image_output_path), exist_ok=True)
-            # torchvision.utils.save_image(
-            #     torch.concat([outputs["render"], gt_image], dim=-1),
-            #     image_output_path,
-            # )
-
-    def on_validation_epoch_start(self) -> None:
+    def _get_val_output_path(self, stage: str, epoch: int, step: int, image_name: str) -> str:
+        return os.path.join(
+            self.hparams["output_path"],
+            stage,
+            "epoch={}-step={}".format(
+                epoch,
+                step,
+            ),
+            "{}.png".format(image_name.replace("/", "_"))
+        )
+
+    def on_validation_epoch_start(self, name="val") -> None:
         super().on_validation_epoch_start()
+        self.pending_val_batches = []
+
+        if self.hparams["save_val_metrics"] is True and self.global_rank == 0:
+            step = max(self.trainer.global_step, self.restored_global_step)
+            self.val_metrics_writer = MetricsCSVWriter(os.path.join(self.hparams["output_path"], "metrics", f"{name}-step={step}.csv"))
+
         if self.hparams["save_val_output"] is True:
             from internal.utils.visualizers import Visualizers
             self.renderer_output_visualizers = Visualizers.get_simplified_visualizer_by_renderer_output_info(self.renderer.get_available_outputs())
 
+            if self.hparams["val_output_processes"] > 0:
+                self.image_writer_pool = ImageWriterPool(
+                    n_processes=self.hparams["val_output_processes"],
+                    max_in_flight=self.hparams["max_in_flight_val_outputs"],
+                )
+                return
+
             for i in range(self.max_image_saving_threads):
                 thread = threading.Thread(target=self.save_images)
                 self.image_saving_threads.append(thread)
@@ -537,46 +674,26 @@ class GaussianSplatting(LightningModule):
 
     def on_validation_epoch_end(self, name="val") -> None:
         super().on_validation_epoch_end()
+        # normally flushed by the last `validation_step()`, this is only a guard
+        self._validate_pending_batches(name)
+
         for i in range(len(self.image_saving_threads)):
             self.image_queue.put(None)
         for i in self.image_saving_threads:
             i.join()
         self.image_saving_threads = []
+        if self.image_writer_pool is not None:
+            self.image_writer_pool.close()
+            self.image_writer_pool = None
 
-        # save metrics
-        if self.hparams["save_val_metrics"] is True and self.global_rank == 0 and len(self.val_metrics) > 0:
-            metrics_output_dir = os.path.join(self.hparams["output_path"], "metrics")
-            os.makedirs(metrics_output_dir, exist_ok=True)
-            step = max(self.trainer.global_step, self.restored_global_step)
-
-            metric_list_key_by_name = {}  # [metric_name] = metric_value_list
-            metric_fields = list(self.val_metrics[0][1].keys())
-            for i in metric_fields:
-                metric_list_key_by_name[i] = []
-
-            with open(os.path.join(metrics_output_dir, f"{name}-step={step}.csv"), "w") as f:
-                metrics_writer = csv.writer(f)
-                metrics_writer.writerow(["name"] + list(metric_fields))
-
-                for image_name, metrics in self.val_metrics:
-                    metric_row = [image_name]
-                    for metric_name in metric_fields:
-                        metric_list_key_by_name[metric_name].append(metrics[metric_name])
-                        metric_row.append("{:.8f}".format(metrics[metric_name].item()))
-                    metrics_writer.writerow(metric_row)
-
-                # calculate mean metrics
-                metrics_writer.writerow([""] + ["" for _ in range(len(metric_fields))])
-                mean_metrics = ["MEAN"]
-                for i in metric_fields:
-                    mean_metrics.append("{:.8f}".format(torch.stack(metric_list_key_by_name[i]).mean(dim=0).item()))
-                metrics_writer.writerow(mean_metrics)
-
-        self.val_metrics.clear()
+        # the means of the metrics
+        if self.val_metrics_writer is not None:
+            self.val_metrics_writer.close()
+            self.val_metrics_writer = None
 
     def on_test_epoch_start(self) -> None:
         super().on_test_epoch_start()
-        self.on_validation_epoch_start()
+        self.on_validation_epoch_start(name="test")
 
     def on_test_epoch_end(self) -> None:
         super().on_test_epoch_end()
@@ -601,15 +718,7 @@ class GaussianSplatting(LightningModule):
                         image_tensor=grid,
                     )
 
-                image_output_path = os.path.join(
-                    self.hparams["output_path"],
-                    item["stage"],
-                    "epoch={}-step={}".format(
-                        item["epoch"],
-                        item["step"],
-                    ),
-                    "{}.png".format(item["image_name"].replace("/", "_"))
-                )
+                image_output_path = self._get_val_output_path(item["stage"], item["epoch"], item["step"], item["image_name"])
                 os.makedirs(os.path.dirname(image_output_path), exist_ok=True)
                 torchvision.utils.save_image(
                     image,
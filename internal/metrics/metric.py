@@ -1,4 +1,4 @@
-from typing import Tuple, Dict, Any
+from typing import Tuple, Dict, Any, List
 import torch
 from internal.configs.instantiate_config import InstantiatableConfig
 
@@ -33,6 +33,28 @@ class MetricModule(torch.nn.Module):
     def get_validate_metrics(self, pl_module, gaussian_model, batch, outputs) -> Tuple[Dict[str, float], Dict[str, bool]]:
         pass
 
+    def get_batch_validate_metrics(self, pl_module, gaussian_model, batches: List, outputs: List[Dict]) -> Tuple[List[Dict[str, float]], Dict[str, bool]]:
+        """
+        The metrics of the images rendered together by the batched validation,
+        override it to calculate them batched, this one calculates them one by one.
+
+        :return:
+            The first list: the metric values of each image
+            The second dict: the same as `get_validate_metrics()`
+        """
+
+        metrics_list = []
+        prog_bar = {}
+        for batch, batch_outputs in zip(batches, outputs):
+            metrics, prog_bar = self.get_validate_metrics(
+                pl_module=pl_module,
+                gaussian_model=gaussian_model,
+                batch=batch,
+                outputs=batch_outputs,
+            )
+            metrics_list.append(metrics)
+        return metrics_list, prog_bar
+
     def on_parameter_move(self, *args, **kwargs):
         pass
 
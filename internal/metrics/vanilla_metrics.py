@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Tuple, Dict, Literal, Any
+from typing import Tuple, Dict, Literal, Any, List
 import torch
 from torchmetrics.image import PeakSignalNoiseRatio
 from torchmetrics.image.lpip import LearnedPerceptualImagePatchSimilarity
@@ -100,6 +100,69 @@ class VanillaMetricsImpl(MetricImpl):
 
         return metrics, prog_bar
 
+    def get_batch_validate_metrics(self, pl_module, gaussian_model, batches: List, outputs: List[Dict]) -> Tuple[List[Dict[str, Any]], Dict[str, bool]]:
+        gt_images = [batch[1][1] for batch in batches]
+        images = [i["render"] for i in outputs]
+        if (
+                self._is_validate_metrics_overridden()
+                or self.config.fused_ssim
+                or any(batch[1][2] is not None for batch in batches)
+                or any(i.shape != images[0].shape for i in images + gt_images)
+        ):
+            return super().get_batch_validate_metrics(pl_module, gaussian_model, batches, outputs)
+
+        images = torch.stack(images)
+        gt_images = torch.stack(gt_images)
+        reduce_dims = list(range(1, images.dim()))
+
+        if self.config.rgb_diff_loss == "l2":
+            rgb_diff_losses = torch.mean((images - gt_images) ** 2, dim=reduce_dims)
+        else:
+            rgb_diff_losses = torch.abs(images - gt_images).mean(dim=reduce_dims)
+        ssim_metrics = self.ssim(images, gt_images, size_average=False)
+        losses = (1.0 - self.lambda_dssim) * rgb_diff_losses + self.lambda_dssim * (1. - ssim_metrics)
+        psnrs = self._batch_psnr(images, gt_images)
+        lpips = self._batch_lpips(images.clamp(0., 1.), gt_images)
+
+        metrics_list = [
+            {
+                "loss": losses[i],
+                "rgb_diff": rgb_diff_losses[i],
+                "ssim": ssim_metrics[i],
+                "psnr": psnrs[i],
+                "lpips": lpips[i],
+            }
+            for i in range(images.shape[0])
+        ]
+        return metrics_list, {
+            "loss": True,
+            "rgb_diff": True,
+            "ssim": True,
+            "psnr": True,
+            "lpips": True,
+        }
+
+    def _is_validate_metrics_overridden(self) -> bool:
+        # the batched path only calculates the metrics of this class, the ones added by the subclasses would be dropped
+        return type(self).get_validate_metrics is not VanillaMetricsImpl.get_validate_metrics \
+            or type(self)._get_basic_metrics is not VanillaMetricsImpl._get_basic_metrics
+
+    @staticmethod
+    def _batch_psnr(images: torch.Tensor, gt_images: torch.Tensor) -> torch.Tensor:
+        # the same as `PeakSignalNoiseRatio()` without `data_range`, whose range is inferred from the G.T. and includes 0
+        gt_images = gt_images.flatten(1)
+        data_ranges = gt_images.amax(dim=1).clamp(min=0.) - gt_images.amin(dim=1).clamp(max=0.)
+        mse = torch.mean((images.flatten(1) - gt_images) ** 2, dim=1)
+        return 10. * torch.log10(data_ranges ** 2 / mse)
+
+    def _batch_lpips(self, images: torch.Tensor, gt_images: torch.Tensor) -> torch.Tensor:
+        lpips = self.no_state_dict_models["lpips"]
+        net = getattr(lpips, "net", None)
+        if net is None:
+            return torch.stack([lpips(image.unsqueeze(0), gt_image.unsqueeze(0)) for image, gt_image in zip(images, gt_images)])
+        # `LearnedPerceptualImagePatchSimilarity` averages the outputs of this network over the batch
+        return net(images, gt_images, normalize=True).reshape(-1)
+
     def on_parameter_move(self, *args, **kwargs):
         if "lpips" in self.no_state_dict_models:
             self.no_state_dict_models["lpips"] = self.no_state_dict_models["lpips"].to(*args, **kwargs)
@@ -119,6 +119,11 @@ class PeriodicVibrationGaussianModel(VanillaGaussianModel):
         a = 1 / self.config.cycle * torch.pi * 2
         return self.get_means() + self.get_velocity() * torch.sin((t - self.get_t()) * a) / a
 
+    def get_mean_SHM_derivative(self, t):
+        # the derivative of `get_mean_SHM()` w.r.t. t
+        a = 1 / self.config.cycle * torch.pi * 2
+        return self.get_velocity() * torch.cos((t - self.get_t()) * a)
+
     def get_marginal_t(self, timestamp):
         # the factor of vibrating opacity; e.q. #7
         return torch.exp(-0.5 * (self.get_t() - timestamp) ** 2 / self.get_scale_t() ** 2)
@@ -0,0 +1,261 @@
+from .renderer import *
+from internal.utils.gaussian_projection import project_gaussians
+from internal.utils.sh_utils import eval_sh
+
+
+class CPUReferenceRenderer(Renderer):
+    """
+    A rasterizer implemented by pure PyTorch operations, no CUDA extension is required.
+
+    It follows the gsplat pipeline:
+        1. project the Gaussians by `internal.utils.gaussian_projection.project_gaussians()`;
+        2. duplicate every Gaussian for each tile it touches, then sort the duplicates by tile and depth;
+        3. alpha composite the Gaussians of each tile from front to back, some tiles at a time to bound the memory.
+    All the steps are differentiable through autograd, so it can be used as a correctness oracle,
+    and to run the training loop on a CPU-only machine, though it is much slower than the CUDA ones.
+    """
+
+    def __init__(
+            self,
+            block_size: int = 16,
+            anti_aliased: bool = True,
+            max_elements_per_chunk: int = 1 << 24,
+            transmittance_threshold: float = 1e-4,
+    ) -> None:
+        """
+        Args:
+            block_size: the side length of a tile
+            anti_aliased: multiply the opacities by the compensation factors of the 2D low-pass filter
+            max_elements_per_chunk: the upper bound of `n_tiles * n_pixels_per_tile * n_gaussians_per_tile` evaluated at once
+            transmittance_threshold: stop compositing a pixel when its transmittance falls below this value
+        """
+
+        super().__init__()
+        self.block_size = block_size
+        self.anti_aliased = anti_aliased
+        self.max_elements_per_chunk = max_elements_per_chunk
+        self.transmittance_threshold = transmittance_threshold
+
+    def forward(
+            self,
+            viewpoint_camera: Camera,
+            pc: GaussianModel,
+            bg_color: torch.Tensor,
+            scaling_modifier=1.0,
+            render_types: list = None,
+            extra_features: torch.Tensor = None,
+            **kwargs,
+    ):
+        """
+        Args:
+            extra_features: [N, C], composited into `extra_features` output if provided
+        """
+
+        img_height = int(viewpoint_camera.height.item())
+        img_width = int(viewpoint_camera.width.item())
+
+        xys, depths, radii, conics, comp, num_tiles_hit, cov3d, mask, rect_min, rect_max = project_gaussians(
+            means_3d=pc.get_xyz,
+            scales=pc.get_scaling,
+            scale_modifier=scaling_modifier,
+            quaternions=pc.get_rotation,
+            world_to_camera=viewpoint_camera.world_to_camera,
+            fx=viewpoint_camera.fx,
+            fy=viewpoint_camera.fy,
+            cx=viewpoint_camera.cx,
+            cy=viewpoint_camera.cy,
+            img_height=viewpoint_camera.height,
+            img_width=viewpoint_camera.width,
+            block_width=self.block_size,
+        )
+
+        # colors
+        viewdirs = pc.get_xyz.detach() - viewpoint_camera.camera_center  # (N, 3)
+        viewdirs = viewdirs / viewdirs.norm(dim=-1, keepdim=True)
+        rgbs = eval_sh(pc.active_sh_degree, pc.get_features.transpose(1, 2), viewdirs)
+        rgbs = torch.clamp(rgbs + 0.5, min=0.0)
+
+        opacities = pc.get_opacity
+        if self.anti_aliased is True:
+            opacities = opacities * comp[:, None]
+
+        # composite rgb, depth and extra features together
+        features = [rgbs, depths.unsqueeze(-1)]
+        if extra_features is not None:
+            features.append(extra_features)
+        features = torch.concat(features, dim=-1)
+        background = torch.zeros((features.shape[-1],), dtype=features.dtype, device=features.device)
+        background[:3] = bg_color
+
+        image, alpha = self.rasterize(
+            xys=xys,
+            depths=depths,
+            conics=conics,
+            opacities=opacities,
+            features=features,
+            background=background,
+            rect_min=rect_min,
+            rect_max=rect_max,
+            visibility_filter=radii > 0,
+            img_height=img_height,
+            img_width=img_width,
+        )
+        image = image.permute(2, 0, 1)  # [C, H, W]
+        alpha = alpha.permute(2, 0, 1)  # [1, H, W]
+
+        acc_depth_im = image[3:4]
+        exp_depth_im = torch.where(alpha > 0, acc_depth_im / alpha.clamp_min(1e-8), acc_depth_im.detach().max())
+
+        return {
+            "render": image[:3],
+            "alpha": alpha,
+            "acc_depth": acc_depth_im,
+            "exp_depth": exp_depth_im,
+            "extra_features": image[4:] if extra_features is not None else None,
+            "viewspace_points": xys,
+            "viewspace_points_grad_scale": 0.5 * torch.tensor([[img_width, img_height]]).to(xys),
+            "visibility_filter": radii > 0,
+            "radii": radii,
+        }
+
+    def get_tile_intersections(self, depths, rect_min, rect_max, visibility_filter, n_tiles_x: int):
+        """
+        Returns:
+            gaussian_ids: [M], the Gaussian of each intersection, sorted by tile then depth
+            tile_ids: [M]
+        """
+
+        rect_min = rect_min.long()
+        rect_max = rect_max.long()
+        rect_size = torch.where(visibility_filter[:, None], rect_max - rect_min, 0)  # [N, 2]
+        n_tiles_per_gaussian = rect_size[:, 0] * rect_size[:, 1]
+
+        # duplicate each Gaussian for each tile it touches
+        gaussian_ids = torch.repeat_interleave(torch.arange(depths.shape[0], device=depths.device), n_tiles_per_gaussian)
+        # the index of the intersection among the ones of the same Gaussian
+        offsets = torch.cumsum(n_tiles_per_gaussian, dim=0) - n_tiles_per_gaussian
+        local_ids = torch.arange(gaussian_ids.shape[0], device=depths.device) - offsets[gaussian_ids]
+        tile_x = rect_min[gaussian_ids, 0] + local_ids % rect_size[gaussian_ids, 0].clamp_min(1)
+        tile_y = rect_min[gaussian_ids, 1] + local_ids // rect_size[gaussian_ids, 0].clamp_min(1)
+        tile_ids = tile_y * n_tiles_x + tile_x
+
+        # sort by depth, then stable sort by tile, results in depth order inside each tile
+        depth_order = torch.argsort(depths.detach()[gaussian_ids], stable=True)
+        gaussian_ids = gaussian_ids[depth_order]
+        tile_ids = tile_ids[depth_order]
+        tile_order = torch.argsort(tile_ids, stable=True)
+
+        return gaussian_ids[tile_order], tile_ids[tile_order]
+
+    def rasterize(
+            self,
+            xys: torch.Tensor,
+            depths: torch.Tensor,
+            conics: torch.Tensor,
+            opacities: torch.Tensor,
+            features: torch.Tensor,
+            background: torch.Tensor,
+            rect_min: torch.Tensor,
+            rect_max: torch.Tensor,
+            visibility_filter: torch.Tensor,
+            img_height: int,
+            img_width: int,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Args:
+            xys: [N, 2]
+            depths: [N]
+            conics: [N, 3]
+            opacities: [N, 1]
+            features: [N, C]
+            background: [C]
+            rect_min, rect_max: [N, 2], the touched tiles, inclusive min, exclusive max
+
+        Returns:
+            image: [H, W, C]
+            alpha: [H, W, 1]
+        """
+
+        block_size = self.block_size
+        device = xys.device
+        n_tiles_x = (img_width + block_size - 1) // block_size
+        n_tiles_y = (img_height + block_size - 1) // block_size
+        n_tiles = n_tiles_x * n_tiles_y
+        n_pixels_per_tile = block_size * block_size
+        n_channels = features.shape[-1]
+
+        gaussian_ids, tile_ids = self.get_tile_intersections(depths, rect_min, rect_max, visibility_filter, n_tiles_x)
+        if gaussian_ids.shape[0] == 0:
+            return (
+                background.expand(img_height, img_width, n_channels).clone(),
+                torch.zeros((img_height, img_width, 1), dtype=features.dtype, device=device),
+            )
+        n_gaussians_per_tile = torch.bincount(tile_ids, minlength=n_tiles)
+        tile_offsets = torch.cumsum(n_gaussians_per_tile, dim=0) - n_gaussians_per_tile
+
+        # pixel centers of a tile
+        pixel_y, pixel_x = torch.meshgrid(
+            torch.arange(block_size, device=device),
+            torch.arange(block_size, device=device),
+            indexing="ij",
+        )
+        local_pixels = torch.stack([pixel_x, pixel_y], dim=-1).reshape(-1, 2).to(xys.dtype) + 0.5  # [P, 2]
+
+        max_gaussians_per_tile = n_gaussians_per_tile.max().item()
+        n_tiles_per_chunk = max(self.max_elements_per_chunk // (n_pixels_per_tile * max_gaussians_per_tile), 1)
+
+        tile_images = []
+        tile_alphas = []
+        for tile_start in range(0, n_tiles, n_tiles_per_chunk):
+            tile_end = min(tile_start + n_tiles_per_chunk, n_tiles)
+            chunk_tile_ids = torch.arange(tile_start, tile_end, device=device)
+            chunk_counts = n_gaussians_per_tile[tile_start:tile_end]
+            k = max(chunk_counts.max().item(), 1)  # at least one slot, the padded ones are masked out
+
+            # [T, K], the Gaussians of each tile, padded
+            slots = torch.arange(k, device=device)
+            is_valid = slots[None, :] < chunk_counts[:, None]
+            intersection_ids = torch.clamp(tile_offsets[tile_start:tile_end, None] + slots[None, :], max=gaussian_ids.shape[0] - 1)
+            chunk_gaussian_ids = gaussian_ids[intersection_ids]  # [T, K]
+
+            # [T, P, 2]
+            tile_origins = torch.stack([chunk_tile_ids % n_tiles_x, chunk_tile_ids // n_tiles_x], dim=-1) * block_size
+            pixels = tile_origins[:, None, :].to(xys.dtype) + local_pixels[None, :, :]
+
+            # [T, P, K]
+            delta = xys[chunk_gaussian_ids][:, None, :, :] - pixels[:, :, None, :]
+            conic = conics[chunk_gaussian_ids][:, None, :, :]
+            power = -0.5 * (conic[..., 0] * delta[..., 0] ** 2 + conic[..., 2] * delta[..., 1] ** 2) - conic[..., 1] * delta[..., 0] * delta[..., 1]
+            alpha = torch.clamp_max(opacities[chunk_gaussian_ids, 0][:, None, :] * torch.exp(power), 0.99)
+            alpha = torch.where(
+                is_valid[:, None, :] & (power <= 0.) & (alpha >= 1. / 255.),
+                alpha,
+                torch.zeros_like(alpha),
+            )
+
+            # front-to-back, stop when the transmittance falls below the threshold
+            next_transmittance = torch.cumprod(1. - alpha, dim=-1)
+            transmittance = torch.concat([torch.ones_like(next_transmittance[..., :1]), next_transmittance[..., :-1]], dim=-1)
+            is_composited = next_transmittance.detach() > self.transmittance_threshold
+            weights = torch.where(is_composited, alpha * transmittance, torch.zeros_like(alpha))
+
+            # [T, P, C]
+            pixel_alphas = torch.sum(weights, dim=-1, keepdim=True)
+            pixel_features = torch.matmul(weights, features[chunk_gaussian_ids])  # [T, P, K] @ [T, K, C]
+            tile_images.append(pixel_features + (1. - pixel_alphas) * background)
+            tile_alphas.append(pixel_alphas)
+
+        def tiles_to_image(tiles):
+            image = torch.concat(tiles, dim=0).reshape(n_tiles_y, n_tiles_x, block_size, block_size, -1)
+            image = image.permute(0, 2, 1, 3, 4).reshape(n_tiles_y * block_size, n_tiles_x * block_size, -1)
+            return image[:img_height, :img_width]
+
+        return tiles_to_image(tile_images), tiles_to_image(tile_alphas)
+
+    def get_available_outputs(self) -> Dict:
+        return {
+            "rgb": RendererOutputInfo("render"),
+            "alpha": RendererOutputInfo("alpha", type=RendererOutputTypes.GRAY),
+            "acc_depth": RendererOutputInfo("acc_depth", type=RendererOutputTypes.GRAY),
+            "exp_depth": RendererOutputInfo("exp_depth", type=RendererOutputTypes.GRAY),
+        }
@@ -1,10 +1,12 @@
 import traceback
+from typing import Literal
 from gsplat import project_gaussians
 from gsplat.rasterize import rasterize_gaussians
 from gsplat.sh import spherical_harmonics
 from .renderer import *
 from lightning.pytorch.profilers import PassThroughProfiler
 from internal.density_controllers.density_controller import Utils as DensityControllerUtils
+from internal.utils.distributed_gaussian_utils import DistributedGaussianUtils
 import torch.distributed.nn.functional
 
 DEFAULT_BLOCK_SIZE: int = 16
@@ -30,6 +32,27 @@ class GSplatDistributedRenderer(RendererConfig):
     redistribute_threshold: float = 1.1
     """Redistribute if min*threshold < max"""
 
+    redistribute_strategy: Literal["random", "spatial"] = "random"
+    """
+    random: send each Gaussian to a random rank;
+    spatial: assign each rank a spatially coherent slab of the Morton curve, so fewer ranks contribute to a view.
+    """
+
+    redistribute_bucket_bits: int = 15
+    """The Morton curve is split into `2^bits` buckets, the slab boundaries are aligned to buckets"""
+
+    visibility_balance_weight: float = 1.
+    """For the spatial strategy, the weight of the per-rank visible Gaussian count in the load balancing cost"""
+
+    camera_assignment_resolution: int = 32
+    """
+    The resolution of the voxel grid describing the Gaussian ownership,
+    used to assign cameras to ranks when `--data.align_cameras_with_gaussians` is enabled
+    """
+
+    packed_all2all: bool = True
+    """Send all the Gaussian properties and optimizer states by a single All-to-All when redistributing"""
+
     def instantiate(self, *args, **kwargs) -> Renderer:
         return GSplatDistributedRendererImpl(self)
 
@@ -52,6 +75,10 @@ class GSplatDistributedRendererImpl(Renderer):
         self.profile_prefix = "[Renderer]GSplatDistributedRenderer."
         self.profiler = PassThroughProfiler()
 
+        # for spatial redistribution
+        self.spatial_bounding_box = None
+        self.bucket_visible_counts = None
+
     def training_setup(self, module: lightning.LightningModule) -> Tuple[
         Optional[Union[
             List[torch.optim.Optimizer],
@@ -84,6 +111,10 @@ class GSplatDistributedRendererImpl(Renderer):
         self.on_density_changed = module.density_updated_by_renderer
         self.on_density_changed()
 
+        if self.config.redistribute_strategy == "spatial":
+            with torch.no_grad():
+                self.spatial_redistribute(module)
+
         try:
             self.profiler = module.trainer.profiler
         except:
@@ -271,6 +302,9 @@ class GSplatDistributedRendererImpl(Renderer):
                     device=bg_color.device,
                 )
 
+            if self.training and self.bucket_visible_counts is not None:
+                self.accumulate_bucket_visible_counts(pc, visible_mask_list)
+
             # rasterization below is the same as non-distributed renderer
 
             xys, depths, radii, conics, comp, num_tiles_hit = projection_results
@@ -352,22 +386,80 @@ class GSplatDistributedRendererImpl(Renderer):
             if self.global_rank == 0:
                 print(f"[rank={self.global_rank}] member_n_gaussians={member_n_gaussians}")
 
-            if min(member_n_gaussians) * self.config.redistribute_threshold >= max(member_n_gaussians):
+            # the spatial slabs are always refreshed, since the visible Gaussian counts may be unbalanced
+            if self.config.redistribute_strategy != "spatial" and min(member_n_gaussians) * self.config.redistribute_threshold >= max(member_n_gaussians):
                 print(f"[rank={self.global_rank}] skip redistribution: under threshold")
                 return
 
             print(f"[rank={self.global_rank}] begin redistribution")
-            self.random_redistribute(module)
+            if self.config.redistribute_strategy == "spatial":
+                self.spatial_redistribute(module)
+            else:
+                self.random_redistribute(module)
 
     def random_redistribute(self, module):
         destination = torch.randint(0, self.world_size, (module.gaussian_model.get_xyz.shape[0],), device=module.device)
-        count_by_destination = list(torch.bincount(destination, minlength=self.world_size).chunk(self.world_size))
+        self.redistribute_by_destination(destination, module)
+
+    def spatial_redistribute(self, module):
+        means = module.gaussian_model.get_xyz
+        if self.bucket_visible_counts is None or self.spatial_bounding_box is None:
+            self.spatial_bounding_box = DistributedGaussianUtils.get_global_bounding_box(means)
+        # otherwise, keep the bounding box the visible counts are binned under,
+        # the Gaussians densified outside it are clamped into the boundary buckets, the same as when they are counted
+        destination = DistributedGaussianUtils.get_spatial_destination(
+            means,
+            world_size=self.world_size,
+            bounding_box=self.spatial_bounding_box,
+            n_bucket_bits=self.config.redistribute_bucket_bits,
+            bucket_visible_counts=self.bucket_visible_counts,
+            visibility_balance_weight=self.config.visibility_balance_weight,
+        )
+        self.redistribute_by_destination(destination, module)
 
-        print(f"[rank={self.global_rank}] destination_count={[i.item() for i in count_by_destination]}")
+        # the bounding box may change after densification, so update it and restart the accumulation
+        self.spatial_bounding_box = DistributedGaussianUtils.get_global_bounding_box(module.gaussian_model.get_xyz)
+        if self.config.visibility_balance_weight > 0:
+            self.bucket_visible_counts = torch.zeros(
+                (1 << self.config.redistribute_bucket_bits,),
+                dtype=torch.float,
+                device=means.device,
+            )
+
+        self.update_camera_assigner(module)
+
+    def update_camera_assigner(self, module):
+        """Make the cameras follow the Gaussians, takes effect from the next epoch"""
+
+        try:
+            camera_assigner = getattr(module.trainer.train_dataloader, "camera_assigner", None)
+        except:
+            camera_assigner = None
+        if camera_assigner is None:
+            return
 
-        # number of gaussians to receive all-to-all
-        number_of_gaussians_to_receive = list(torch.zeros((self.world_size,), dtype=count_by_destination[0].dtype, device=module.device).chunk(self.world_size))
-        torch.distributed.nn.functional.all_to_all(number_of_gaussians_to_receive, count_by_destination)
+        from internal.utils.camera_rank_assignment import RankBoundingVolumes
+        volumes = RankBoundingVolumes.from_local_points(
+            module.gaussian_model.get_xyz,
+            world_size=self.world_size,
+            global_rank=self.global_rank,
+            resolution=self.config.camera_assignment_resolution,
+            bounding_box=self.spatial_bounding_box,
+        )
+        camera_assigner.update(volumes)
+
+        if self.global_rank == 0:
+            communication_volume = camera_assigner.get_communication_volume(camera_assigner.assign())
+            contiguous_communication_volume = camera_assigner.get_communication_volume(camera_assigner.get_contiguous_assignment())
+            print(f"[rank={self.global_rank}] expected Gaussians received per epoch: {communication_volume.sum().item():.0f}, contiguous: {contiguous_communication_volume.sum().item():.0f}")
+
+    def redistribute_by_destination(self, destination, module):
+        count_by_destination, number_of_gaussians_to_receive = DistributedGaussianUtils.get_number_of_gaussians_to_receive(
+            destination,
+            self.world_size,
+        )
+
+        print(f"[rank={self.global_rank}] destination_count={count_by_destination}")
 
         self.optimizer_all2all(destination, number_of_gaussians_to_receive, module.gaussian_model, module.gaussian_optimizers)
 
@@ -376,53 +468,39 @@ class GSplatDistributedRendererImpl(Renderer):
 
         self.on_density_changed()
 
-    def all2all_gaussian_state(self, local_tensor, destination, number_of_gaussians_to_receive):
-        output_tensor_list = []
-        input_tensor_list = []
-
-        for i in range(self.world_size):
-            output_tensor_list.append(torch.empty(
-                [number_of_gaussians_to_receive[i]] + list(local_tensor.shape[1:]),
-                dtype=local_tensor.dtype,
-                device=local_tensor.device,
-            ))
-            input_tensor_list.append(local_tensor[destination == i])
+    @torch.no_grad()
+    def accumulate_bucket_visible_counts(self, pc: GaussianModel, visible_mask_list: List[torch.Tensor]):
+        """Count how many times the Gaussians of each bucket are visible, used to balance the rendering load"""
 
-        torch.distributed.nn.functional.all_to_all(output_tensor_list, input_tensor_list)
+        bucket_ids = DistributedGaussianUtils.get_bucket_ids(
+            pc.get_xyz,
+            self.spatial_bounding_box,
+            self.config.redistribute_bucket_bits,
+        )
+        n_visible_views = torch.sum(torch.stack(visible_mask_list, dim=0), dim=0, dtype=torch.float)
+        self.bucket_visible_counts += torch.bincount(
+            bucket_ids,
+            weights=n_visible_views,
+            minlength=self.bucket_visible_counts.shape[0],
+        )
 
-        return torch.concat(output_tensor_list, dim=0).contiguous()
+    def all2all_gaussian_state(self, local_tensor, destination, number_of_gaussians_to_receive):
+        return DistributedGaussianUtils.all2all_gaussian_state(
+            local_tensor,
+            destination=destination,
+            number_of_gaussians_to_receive=number_of_gaussians_to_receive,
+            world_size=self.world_size,
+        )
 
     def optimizer_all2all(self, destination, number_of_gaussians_to_receive, gaussian_model, optimizers):
-        def invoke_all2all(local_tensor):
-            return self.all2all_gaussian_state(local_tensor, destination=destination, number_of_gaussians_to_receive=number_of_gaussians_to_receive)
-
-        new_tensors = {}
-        # optimizable
-        for opt in optimizers:
-            for group in opt.param_groups:
-                assert len(group["params"]) == 1
-                stored_state = opt.state.get(group['params'][0], None)
-                if stored_state is not None:
-                    stored_state["exp_avg"] = invoke_all2all(stored_state["exp_avg"])
-                    stored_state["exp_avg_sq"] = invoke_all2all(stored_state["exp_avg_sq"])
-
-                    # replace with new tensor and state
-                    del opt.state[group['params'][0]]
-                    group["params"][0] = torch.nn.Parameter(invoke_all2all(group["params"][0]).requires_grad_(True))
-                    opt.state[group['params'][0]] = stored_state
-                else:
-                    group["params"][0] = torch.nn.Parameter(invoke_all2all(group["params"][0]).requires_grad_(True))
-
-                new_tensors[group["name"]] = group["params"][0]
-
-        # tensors
-        for name in gaussian_model.get_property_names():
-            if name in new_tensors:
-                continue
-            new_tensors[name] = invoke_all2all(gaussian_model.get_property(name))
-
-        # update
-        gaussian_model.properties = new_tensors
+        DistributedGaussianUtils.optimizer_all2all(
+            destination,
+            number_of_gaussians_to_receive,
+            gaussian_model,
+            optimizers,
+            world_size=self.world_size,
+            packed=self.config.packed_all2all,
+        )
 
     def get_available_outputs(self) -> Dict:
         return {
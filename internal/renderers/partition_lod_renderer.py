@@ -23,6 +23,8 @@ class PartitionLoDRenderer(RendererConfig):
     freeze: bool = False
     filter_2d_kernel_size: float = 0.3
     drop_shs_rest: bool = False
+    sh_energy_threshold: float = -1.
+    """ store SHs of each Gaussian up to its effective degree, the bands with energy less than this value are dropped; disabled if < 0 """
 
     def instantiate(self, *args, **kwargs) -> "PartitionLoDRendererModule":
         return PartitionLoDRendererModule(self)
@@ -66,10 +68,13 @@ class PartitionLoDRendererModule(Renderer):
         # load partitions' models
         from internal.utils.gaussian_model_loader import GaussianModelLoader
         from utils.train_partitions import PartitionTraining, PartitionTrainingConfig
+        from internal.utils.adaptive_sh_utils import AdaptiveSHGaussians
         lods = []  # [N_lods, N_partitions]
+        lod_adaptive_shs = []  # [N_lods, N_partitions]
 
         for lod in tqdm(self.config.names):
             models = []
+            adaptive_shs_list = []
 
             partition_training = PartitionTraining(PartitionTrainingConfig(
                 partition_dir=self.config.data,
@@ -87,25 +92,39 @@ class PartitionLoDRendererModule(Renderer):
             )
 
             for partition_idx in tqdm(trainable_partition_idx_list, leave=False):
-                ckpt = torch.load(os.path.join(
-                    os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
-                    "outputs",
-                    lod,
-                    partition_training.get_experiment_name(partition_idx),
-                    "preprocessed.ckpt"
-                ), map_location="cpu")
+                ckpt = GaussianModelLoader.load_checkpoint(
+                    os.path.join(
+                        os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+                        "outputs",
+                        lod,
+                        partition_training.get_experiment_name(partition_idx),
+                        "preprocessed.ckpt"
+                    ),
+                    state_dict_prefixes=("gaussian_model.",),
+                    load_optimizer_states=False,
+                )
                 gaussian_model = GaussianModelLoader.initialize_model_from_checkpoint(ckpt, device)
                 if self.config.drop_shs_rest:
                     gaussian_model.config.sh_degree = 0
                     gaussian_model.active_sh_degree = 0
                     gaussian_model.shs_rest = torch.empty((gaussian_model.n_gaussians, 0, 3), device=gaussian_model.shs_dc.device)
+                elif self.config.sh_energy_threshold >= 0:
+                    adaptive_shs, _ = AdaptiveSHGaussians.from_model(gaussian_model, self.config.sh_energy_threshold)
+                    # the model holds the reordered properties, only the SH buckets are retained here
+                    properties = adaptive_shs.properties
+                    adaptive_shs.properties = {}
+                    properties["shs_rest"] = torch.empty((gaussian_model.n_gaussians, 0, 3), device=gaussian_model.shs_dc.device)
+                    gaussian_model.properties = properties
+                    adaptive_shs_list.append(adaptive_shs.to(device=device))
                 gaussian_model.pre_activate_all_properties()
                 gaussian_model.freeze()
                 gaussian_model.to(device=device)
                 models.append(gaussian_model)
 
             lods.append(models)
+            lod_adaptive_shs.append(adaptive_shs_list)
         self.lods = lods
+        self.lod_adaptive_shs = lod_adaptive_shs
 
         # retain trainable partitions only
         trainable_partition_idx = torch.tensor(trainable_partition_idx_list)
@@ -231,6 +250,9 @@ class PartitionLoDRendererModule(Renderer):
                 if not is_partition_visible[partition_idx]:
                     continue
                 for k, v in self.lods[lod.item()][partition_idx].properties.items():
+                    if k == "shs" and self.config.sh_energy_threshold >= 0 and not self.config.drop_shs_rest:
+                        # `v` contains `shs_dc` only, expand the SH buckets to the dense one
+                        v = torch.concat([v, self.lod_adaptive_shs[lod.item()][partition_idx].get_shs_rest()], dim=1)
                     properties.setdefault(k, []).append(v)
 
             for k in list(properties.keys()):
@@ -47,12 +47,37 @@ class PeriodicVibrationGaussianRendererModule(Renderer):
     def setup(self, stage: str, *args: Any, **kwargs: Any) -> Any:
         self.register_buffer("_time_interval", torch.tensor(0., dtype=torch.float))
 
+        self.keyframes = None
+
         self.env_map = None
         if self.config.env_map_res > 0:
             from internal.model_components.envlight import EnvLight
             self.env_map = EnvLight(resolution=self.config.env_map_res)
         return super().setup(stage, *args, **kwargs)
 
+    def load_keyframes(self, path: str):
+        """
+        Load the keyframes baked by `utils/bake_pvg_keyframes.py`.
+        They are used when rendering without gradients, until the Gaussians are transformed or edited.
+        """
+
+        from internal.utils.pvg_keyframes import PVGKeyframes
+        self.keyframes = PVGKeyframes.load(path, map_location="cpu").to(self._time_interval.device)
+        print("{} keyframes loaded, time range: {}".format(self.keyframes.n_keyframes, self.keyframes.time_range))
+
+    def get_baked_means_and_marginal_t(self, pc: GaussianModel, timestamp):
+        """
+        Returns:
+            `None` if not available, otherwise the indices of the Gaussians, and their means and marginal opacities at the timestamp
+        """
+
+        if self.keyframes is None or self.training or torch.is_grad_enabled():
+            return None
+        # the Gaussians may be transformed or edited after baking
+        if not self.keyframes.is_baked_from(pc):
+            return None
+        return self.keyframes.interpolate(float(timestamp))
+
     def vanilla_forward(self, viewpoint_camera: Camera, pc: GaussianModel, bg_color: torch.Tensor, scaling_modifier=1.0, render_types: list = None, **kwargs):
         from diff_gaussian_rasterization import GaussianRasterizationSettings, GaussianRasterizer
 
@@ -84,10 +109,19 @@ class PeriodicVibrationGaussianRendererModule(Renderer):
         rasterizer = GaussianRasterizer(raster_settings=raster_settings)
 
         # TODO: `time_shift`
-        means3D = pc.get_mean_SHM(viewpoint_camera.time + self.config.time_offset)
-        marginal_t = pc.get_marginal_t(viewpoint_camera.time + self.config.time_offset)
+        baked = self.get_baked_means_and_marginal_t(pc, viewpoint_camera.time + self.config.time_offset)
+        if baked is not None:
+            indices, means3D, marginal_t = baked
+        else:
+            means3D = pc.get_mean_SHM(viewpoint_camera.time + self.config.time_offset)
+            marginal_t = pc.get_marginal_t(viewpoint_camera.time + self.config.time_offset)
+
+        def select(v: torch.Tensor) -> torch.Tensor:
+            if baked is None:
+                return v
+            return v[indices]
 
-        opacities = pc.get_opacities() * marginal_t
+        opacities = select(pc.get_opacities()) * marginal_t
 
         mask = marginal_t[:, 0] > 0.05
         masked_means3D = means3D[mask]
@@ -101,16 +135,16 @@ class PeriodicVibrationGaussianRendererModule(Renderer):
         features = depth_alpha
 
         # Rasterize visible Gaussians to image, obtain their radii (on screen).
-        screenspace_points = torch.zeros_like(pc.get_xyz, dtype=pc.get_xyz.dtype, requires_grad=True, device=bg_color.device)
+        screenspace_points = torch.zeros_like(means3D, dtype=means3D.dtype, requires_grad=True, device=bg_color.device)
         contrib, rendered_image, rendered_feature, radii = rasterizer(
             means3D=means3D,
             means2D=screenspace_points,
-            shs=pc.get_shs(),
+            shs=select(pc.get_shs()),
             colors_precomp=None,
             features=features,
             opacities=opacities,
-            scales=pc.get_scales(),
-            rotations=pc.get_rotations(),
+            scales=select(pc.get_scales()),
+            rotations=select(pc.get_rotations()),
             cov3D_precomp=None,
             mask=mask,
         )
@@ -144,7 +178,14 @@ class PeriodicVibrationGaussianRendererModule(Renderer):
                 # "scale_t",
             ]
 
-        if time_shift is not None:
+        # only the Gaussians not transparent at the timestamp if the baked keyframes are available
+        baked = None
+        if time_shift is None:
+            baked = self.get_baked_means_and_marginal_t(pc, viewpoint_camera.time + self.config.time_offset)
+
+        if baked is not None:
+            indices, means3D, marginal_t = baked
+        elif time_shift is not None:
             means3D = pc.get_mean_SHM(viewpoint_camera.time + self.config.time_offset - time_shift)
             means3D = means3D + pc.get_average_velocity() * time_shift
             marginal_t = pc.get_marginal_t(viewpoint_camera.time + self.config.time_offset - time_shift)
@@ -152,13 +193,18 @@ class PeriodicVibrationGaussianRendererModule(Renderer):
             means3D = pc.get_mean_SHM(viewpoint_camera.time + self.config.time_offset)
             marginal_t = pc.get_marginal_t(viewpoint_camera.time + self.config.time_offset)
 
-        opacities = pc.get_opacities() * marginal_t
+        def select(v: torch.Tensor) -> torch.Tensor:
+            if baked is None:
+                return v
+            return v[indices]
+
+        opacities = select(pc.get_opacities()) * marginal_t
 
         # project
         xys, depths, radii, conics, comp, num_tiles_hit, cov3d = GSPlatRenderer.project(
             means3D=means3D,
-            scales=pc.get_scales(),
-            rotations=pc.get_rotations(),
+            scales=select(pc.get_scales()),
+            rotations=select(pc.get_rotations()),
             viewpoint_camera=viewpoint_camera,
             scaling_modifier=scaling_modifier,
         )
@@ -172,9 +218,9 @@ class PeriodicVibrationGaussianRendererModule(Renderer):
         if self.config.anti_aliased is True:
             opacities = opacities * comp.unsqueeze(-1)
 
-        viewdirs = pc.get_xyz.detach() - viewpoint_camera.camera_center  # (N, 3)
+        viewdirs = select(pc.get_xyz.detach()) - viewpoint_camera.camera_center  # (N, 3)
         # viewdirs = viewdirs / viewdirs.norm(dim=-1, keepdim=True)
-        rgbs = spherical_harmonics(pc.active_sh_degree, viewdirs, pc.get_features)
+        rgbs = spherical_harmonics(pc.active_sh_degree, viewdirs, select(pc.get_features))
         rgbs = torch.clamp(rgbs + 0.5, min=0.0)  # type: ignore
 
         img_height = int(viewpoint_camera.height.item())
@@ -220,14 +266,14 @@ class PeriodicVibrationGaussianRendererModule(Renderer):
         average_velocity_map = None
         if "average_velocity" in render_types:
             average_velocity_map = rasterize(
-                colors=pc.get_average_velocity(),
+                colors=select(pc.get_average_velocity()),
                 background=torch.zeros((3,), dtype=torch.float, device=xys.device)
             ).permute(2, 0, 1)
 
         scale_t_map = None
         if "scale_t" in render_types:
             scale_t_map = rasterize(
-                colors=pc.get_scale_t(),
+                colors=select(pc.get_scale_t()),
                 background=torch.zeros((1,), dtype=torch.float, device=xys.device),
             ).permute(2, 0, 1)
 
@@ -52,6 +52,32 @@ class Renderer(torch.nn.Module):
     ):
         pass
 
+    def batch_forward(
+            self,
+            viewpoint_cameras: List[Camera],
+            pc: GaussianModel,
+            bg_color: torch.Tensor,
+            scaling_modifier=1.0,
+            render_types: list = None,
+            **kwargs,
+    ) -> List[Dict]:
+        """
+        Render several cameras at once, used by the batched validation.
+        The renderers able to process the cameras together should override it, this one renders them one by one.
+        """
+
+        return [
+            self(
+                viewpoint_camera=viewpoint_camera,
+                pc=pc,
+                bg_color=bg_color,
+                scaling_modifier=scaling_modifier,
+                render_types=render_types,
+                **kwargs,
+            )
+            for viewpoint_camera in viewpoint_cameras
+        ]
+
     def training_forward(
             self,
             step: int,
@@ -11,7 +11,6 @@
 
 import math
 from .renderer import *
-from diff_gaussian_rasterization import GaussianRasterizationSettings, GaussianRasterizer
 from internal.utils.sh_utils import eval_sh
 
 
@@ -59,6 +58,8 @@ class VanillaRenderer(Renderer):
         tanfovx = math.tan(viewpoint_camera.fov_x * 0.5)
         tanfovy = math.tan(viewpoint_camera.fov_y * 0.5)
 
+        from diff_gaussian_rasterization import GaussianRasterizationSettings, GaussianRasterizer
+
         raster_settings = GaussianRasterizationSettings(
             image_height=int(viewpoint_camera.height),
             image_width=int(viewpoint_camera.width),
@@ -160,6 +161,8 @@ class VanillaRenderer(Renderer):
         tanfovx = math.tan(viewpoint_camera.fov_x * 0.5)
         tanfovy = math.tan(viewpoint_camera.fov_y * 0.5)
 
+        from diff_gaussian_rasterization import GaussianRasterizationSettings, GaussianRasterizer
+
         raster_settings = GaussianRasterizationSettings(
             image_height=int(viewpoint_camera.height),
             image_width=int(viewpoint_camera.width),
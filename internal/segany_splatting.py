@@ -11,13 +11,14 @@ from typing_extensions import Self
 
 import lightning
 import torch.nn
-import pytorch3d.ops
 from lightning.pytorch.utilities.types import STEP_OUTPUT, OptimizerLRScheduler
 
 from internal.configs.segany_splatting import Optimization as OptimizationConfig
 from internal.renderers.gsplat_contrastive_feature_renderer import GSplatContrastiveFeatureRenderer
 # from internal.renderers.contrastive_feature_renderer import ContrastiveFeatureRenderer
 from internal.utils.gaussian_model_loader import GaussianModelLoader
+from internal.utils.knn_graph import KNNGraph, smooth_features
+from internal.utils.seganygs_targets import mask_preprocess
 
 
 class SegAnySplatting(lightning.LightningModule):
@@ -51,7 +52,7 @@ class SegAnySplatting(lightning.LightningModule):
         # self.renderer = ContrastiveFeatureRenderer()
         self.renderer = GSplatContrastiveFeatureRenderer()
 
-        self.feature_smooth_map = None
+        self.knn_graph: Optional[KNNGraph] = None
 
         # hyper parameters
         self.scale_aware_dim = scale_aware_dim
@@ -96,11 +97,14 @@ class SegAnySplatting(lightning.LightningModule):
         self.bg_color = torch.nn.Parameter(torch.zeros((self.n_feature_dims,), dtype=torch.float, device=self.device), requires_grad=False)
 
     def on_save_checkpoint(self, checkpoint: Dict[str, Any]) -> None:
-        checkpoint["feature_smooth_map"] = self.feature_smooth_map
+        checkpoint["feature_smooth_map"] = None if self.knn_graph is None else self.knn_graph.state_dict()
 
     def on_load_checkpoint(self, checkpoint: Dict[str, Any]) -> None:
         super().on_load_checkpoint(checkpoint)
-        self.feature_smooth_map = checkpoint["feature_smooth_map"]
+        feature_smooth_map = checkpoint.get("feature_smooth_map", None)
+        if feature_smooth_map is not None:
+            self.knn_graph = KNNGraph(feature_smooth_map["K"])
+            self.knn_graph.load_state_dict(feature_smooth_map)
 
     @staticmethod
     def get_quantile_func(scales: torch.Tensor, distribution="normal"):
@@ -150,114 +154,15 @@ class SegAnySplatting(lightning.LightningModule):
             self.fixed_scale_gate = torch.tensor([[1 for j in range(32 - scale_aware_dim + i)] + [0 for k in range(scale_aware_dim - i)] for i in range(scale_aware_dim + 1)]).cuda()
 
     def mask_preprocess(self, sam_masks, mask_scales):
-        ray_sample_rate = self.ray_sample_rate
-        num_sampled_rays = self.num_sampled_rays
-
-        with torch.no_grad():
-            upper_bound_scale = self.upper_bound_scale
-
-            # build Scale-Aware Pixel Identity Vector mentioned in the paper
-
-            # sort scales
-            mask_scales, sort_indices = torch.sort(mask_scales, descending=True)
-            # reorder masks according to the sorted scales
-            sam_masks = sam_masks.float()[sort_indices, :, :]
-
-            # pick `num_sampled_scales` scales randomly
-            num_sampled_scales = 8
-            sampled_scale_index = torch.randperm(len(mask_scales))[:num_sampled_scales]
-
-            tmp = torch.zeros(num_sampled_scales + 2)
-            tmp[1:len(sampled_scale_index) + 1] = sampled_scale_index
-            tmp[-1] = len(mask_scales) - 1
-            tmp[0] = -1  # attach a bigger scale
-            sampled_scale_index = tmp.long()  # = [-1, the indices of num_sampled_scales..., N_scales - 1]
-
-            sampled_scales = mask_scales[sampled_scale_index]
-
-            second_big_scale = mask_scales[mask_scales < upper_bound_scale].max()
-
-            # pick some pixels to sample
-            ray_sample_rate = ray_sample_rate if ray_sample_rate > 0 else num_sampled_rays / (sam_masks.shape[-1] * sam_masks.shape[-2])
-
-            sampled_ray = torch.rand(sam_masks.shape[-2], sam_masks.shape[-1]).cuda() < ray_sample_rate
-            non_mask_region = sam_masks.sum(dim=0) == 0
-
-            # do not sample pixels that not being masked by any masks
-            sampled_ray = torch.logical_and(sampled_ray, ~non_mask_region)
-
-            # Appendix A.1: Re-weighting
-
-            # H W
-            # foreach mask, set the value of the masked pixel to the `number of total mask pixels`
-            per_pixel_mask_size = sam_masks * sam_masks.sum(-1).sum(-1)[:, None, None]  # [N_masks, H, W]
-
-            # `per_pixel_mask_size.sum(dim=0)` is the total number of the masked pixels of all masks, in [H, W]
-            # `sam_masks.sum(dim=0)` is the total masked times of each pixel, in [H, W]
-            # `per_pixel_mean_mask_size` is the average number of masked pixels, in [H, W]
-            per_pixel_mean_mask_size = per_pixel_mask_size.sum(dim=0) / (sam_masks.sum(dim=0) + 1e-9)
-
-            # pick those pixels selected to be sampled
-            per_pixel_mean_mask_size = per_pixel_mean_mask_size[sampled_ray]  # [N_sampled_rays]
-
-            # [1, N_sampled_rays] * [N_sampled_rays, 1] = [N_sampled_rays, N_sampled_rays]
-            # the mean mask size multiplication results of all pixel paris
-            pixel_to_pixel_mask_size = per_pixel_mean_mask_size.unsqueeze(0) * per_pixel_mean_mask_size.unsqueeze(1)
-            # weights min-max normalization
-            ptp_max_size = pixel_to_pixel_mask_size.max()
-            pixel_to_pixel_mask_size[pixel_to_pixel_mask_size == 0] = 1e10
-            per_pixel_weight = torch.clamp(ptp_max_size / pixel_to_pixel_mask_size, 1.0, None)  # smaller one has bigger weight
-            # first normalize the weight to [0, 1], then enlarge to [1, 10]
-            per_pixel_weight = (per_pixel_weight - per_pixel_weight.min()) / (per_pixel_weight.max() - per_pixel_weight.min()) * 9. + 1.
-
-            sam_masks_sampled_ray = sam_masks[:, sampled_ray]  # [N_masks, N_sampled_rays]
-
-            gt_corrs = []
-
-            # set the first value of `sampled_scales` to a scale bigger than upper one a bit, which will trigger operation when `upper_bound=True` below
-            sampled_scales[0] = upper_bound_scale + upper_bound_scale * torch.rand(1)[0]
-            for idx, si in enumerate(sampled_scale_index):
-                upper_bound = sampled_scales[idx] >= upper_bound_scale
-
-                if si != len(mask_scales) - 1 and not upper_bound:  # not the last scale, and not upper_bound
-                    # make it a little smaller, according to the diff to the later one
-                    sampled_scales[idx] -= (sampled_scales[idx] - mask_scales[si + 1]) * torch.rand(1)[0]
-                elif upper_bound:
-                    # make it a little smaller, according to the diff to the second_big_scale
-                    sampled_scales[idx] -= (sampled_scales[idx] - second_big_scale) * torch.rand(1)[0]
-                else:
-                    sampled_scales[idx] -= sampled_scales[idx] * torch.rand(1)[0]
-
-                if not upper_bound:
-                    gt_vec = torch.zeros_like(sam_masks_sampled_ray)  # V(s, p), [N_masks, N_sampled_rays (or pixels)]
-                    gt_vec[:si + 1, :] = sam_masks_sampled_ray[:si + 1, :]  # add bigger and equal scale masks
-                    for j in range(si, -1, -1):  # from si to 0
-                        # `gt_vec[j + 1:, :].any(dim=0)`: in all smaller masks, is pixel masked?, [N_smaller_masks, N_sampled_pixels]
-                        #    torch.logical_not() mark the unmasked pixel to True
-                        # if the pixel is not masked in all smaller mask, and masked at current scale, mark it to True ("the i-th entry of V(s, p) equals to 1 only if ...")
-                        gt_vec[j, :] = torch.logical_and(
-                            torch.logical_not(gt_vec[j + 1:, :].any(dim=0)), gt_vec[j, :]
-                        )
-                    # add smaller scale masks ("when ... < s, the i-th entry of V(s, p) is set to ...")
-                    gt_vec[si + 1:, :] = sam_masks_sampled_ray[si + 1:, :]
-                else:
-                    gt_vec = sam_masks_sampled_ray
-
-                # gt_vec.T multiply with gt_vec
-                # gt_vec is [N_masks (or N_scales), N_sampled_rays]
-                gt_corr = torch.einsum('nh,nj->hj', gt_vec, gt_vec)  # for each pair of pixels, how many common masks do they have?
-                gt_corr[gt_corr != 0] = 1  # mark those pairs having any common masks (or masked in the same mask; "(i.e., V(s, p1) · V(s, p2) > 0), they should have similar features at scale s")
-                gt_corrs.append(gt_corr)
-
-            # N_scale S C_clip
-            # gt_clip_features = torch.stack(gt_clip_features, dim = 0)
-            # N_scale S S
-            gt_corrs = torch.stack(gt_corrs, dim=0)  # [N_sample_scales, N_sampled_rays, N_sampled_rays], marks indicating whether pixel paris have common masks
-            # map the distribution of scales to Gaussian distribution
-            sampled_scales = self.q_trans(sampled_scales).squeeze()
-            sampled_scales = sampled_scales.squeeze()  # [N_sampled_scales]
-
-        return sampled_ray, per_pixel_weight, gt_corrs, sampled_scales
+        # the targets of all the sampled scales are built at once, see `internal.utils.seganygs_targets`
+        return mask_preprocess(
+            sam_masks=sam_masks,
+            mask_scales=mask_scales,
+            upper_bound_scale=self.upper_bound_scale,
+            q_trans=self.q_trans,
+            ray_sample_rate=self.ray_sample_rate,
+            num_sampled_rays=self.num_sampled_rays,
+        )
 
     def get_smoothed_point_features(self, K=16, dropout=0.5):
         # Local Feature Smoothing
@@ -267,27 +172,15 @@ class SegAnySplatting(lightning.LightningModule):
 
         assert dropout < 0 or int(K * dropout) >= 1
 
-        with torch.no_grad():
-            if self.feature_smooth_map is None or self.feature_smooth_map["K"] != K:
-                xyz = self.models.gaussian.get_xyz
-                nearest_k_idx = pytorch3d.ops.knn_points(
-                    xyz.unsqueeze(0),
-                    xyz.unsqueeze(0),
-                    K=K,
-                ).idx.squeeze()
-                self.feature_smooth_map = {"K": K, "m": nearest_k_idx}
+        if self.knn_graph is None or self.knn_graph.k != K:
+            self.knn_graph = KNNGraph(K)
+        # rebuilt only if the Gaussians changed
+        nearest_k_idx = self.knn_graph.get(self.models.gaussian.get_xyz)  # [N_gaussians, K]
 
         normed_features = torch.nn.functional.normalize(self.gaussian_semantic_features, dim=-1, p=2)
 
-        if dropout > 0 and dropout < 1:
-            # discard some points randomly
-            select_point = torch.randperm(K)[: int(K * dropout)]
-
-            select_idx = self.feature_smooth_map["m"][:, select_point]  # [N_gaussians, N_selected_points]
-            # `normed_features[select_idx, :]`: [N_gaussians, N_selected_points, N_semantic_feature_dims]
-            ret = normed_features[select_idx, :].mean(dim=1)  # [N_gaussians, N_semantic_feature_dims]
-        else:
-            ret = normed_features[self.feature_smooth_map["m"], :].mean(dim=1)
+        # the mean of the features of the neighbors, some of them are discarded randomly if `0 < dropout < 1`
+        ret = smooth_features(normed_features, nearest_k_idx, dropout)  # [N_gaussians, N_semantic_feature_dims]
 
         return ret
 
@@ -0,0 +1,219 @@
+from typing import Dict, List, Tuple
+from dataclasses import dataclass
+
+import torch
+
+
+def sh_degree_to_n_coefficients(sh_degree: int) -> int:
+    return (sh_degree + 1) ** 2
+
+
+def get_sh_band_energies(shs_rest: torch.Tensor) -> torch.Tensor:
+    """
+    Args:
+        shs_rest: [N, (D+1)^2-1, 3]
+
+    Returns:
+        [N, D], the sum of squared coefficients of each band l=1..D
+    """
+
+    n_rest = shs_rest.shape[1]
+    energies = []
+    degree = 1
+    while sh_degree_to_n_coefficients(degree) - 1 <= n_rest:
+        band = shs_rest[:, sh_degree_to_n_coefficients(degree - 1) - 1:sh_degree_to_n_coefficients(degree) - 1]
+        energies.append(torch.sum(torch.pow(band, 2), dim=(1, 2)))
+        degree += 1
+    if len(energies) == 0:
+        return torch.zeros((shs_rest.shape[0], 0), dtype=shs_rest.dtype, device=shs_rest.device)
+    return torch.stack(energies, dim=-1)
+
+
+def get_effective_sh_degrees(shs_rest: torch.Tensor, energy_threshold: float) -> torch.Tensor:
+    """
+    The effective degree of a Gaussian is the highest band whose energy is not less than `energy_threshold`.
+
+    Args:
+        shs_rest: [N, (D+1)^2-1, 3]
+        energy_threshold: bands with smaller energy are treated as empty
+
+    Returns:
+        [N], int64
+    """
+
+    band_energies = get_sh_band_energies(shs_rest)  # [N, D]
+    if band_energies.shape[1] == 0:
+        return torch.zeros((shs_rest.shape[0],), dtype=torch.long, device=shs_rest.device)
+    is_significant = band_energies >= energy_threshold
+    # degree of the last significant band, 0 if no one is significant
+    band_degrees = torch.arange(1, band_energies.shape[1] + 1, device=shs_rest.device)
+    return torch.max(is_significant * band_degrees[None, :], dim=-1).values
+
+
+@dataclass
+class AdaptiveSHGaussians:
+    """
+    Store the Gaussians bucketed by their effective SH degree.
+
+    The Gaussians are sorted by degree, so the bucket of degree `d` is the slice `bucket_offsets[d]:bucket_offsets[d+1]`,
+    and only `(d+1)^2-1` SH rest coefficients are stored for the Gaussians in it.
+    """
+
+    sh_degree: int  # the maximum degree
+
+    properties: Dict[str, torch.Tensor]  # all the properties except `shs_rest`, in bucket order
+
+    shs_rest_buckets: List[torch.Tensor]  # [sh_degree + 1], the d-th one is [n_d, (d+1)^2-1, 3]
+
+    bucket_offsets: torch.Tensor  # [sh_degree + 2], int64, on CPU
+
+    @property
+    def n_gaussians(self) -> int:
+        return self.bucket_offsets[-1].item()
+
+    @property
+    def bucket_sizes(self) -> torch.Tensor:
+        return self.bucket_offsets[1:] - self.bucket_offsets[:-1]
+
+    def get_bucket_slice(self, degree: int) -> slice:
+        return slice(self.bucket_offsets[degree].item(), self.bucket_offsets[degree + 1].item())
+
+    @classmethod
+    def from_properties(
+            cls,
+            properties: Dict[str, torch.Tensor],
+            energy_threshold: float,
+            sh_degree: int = -1,
+    ) -> Tuple["AdaptiveSHGaussians", torch.Tensor]:
+        """
+        Args:
+            properties: raw properties, must contain `shs_rest`
+            energy_threshold: SH bands with energy less than this value will be dropped
+            sh_degree: -1 means detecting from the shape of `shs_rest`
+
+        Returns:
+            the compact representation, and the indices that map the bucket order to the order of `properties`
+        """
+
+        from internal.utils.gaussian_utils import SHS_REST_DIM_TO_DEGREE
+
+        shs_rest = properties["shs_rest"]
+        if sh_degree < 0:
+            sh_degree = SHS_REST_DIM_TO_DEGREE[shs_rest.shape[1]]
+        assert shs_rest.shape[1] == sh_degree_to_n_coefficients(sh_degree) - 1, "sh_degree not match"
+
+        with torch.no_grad():
+            effective_degrees = get_effective_sh_degrees(shs_rest, energy_threshold)
+            sorted_indices = torch.argsort(effective_degrees, stable=True)
+            bucket_sizes = torch.bincount(effective_degrees, minlength=sh_degree + 1).cpu()
+            bucket_offsets = torch.zeros((sh_degree + 2,), dtype=torch.long)
+            bucket_offsets[1:] = torch.cumsum(bucket_sizes, dim=0)
+
+            sorted_shs_rest = shs_rest[sorted_indices]
+            shs_rest_buckets = []
+            for degree in range(sh_degree + 1):
+                shs_rest_buckets.append(sorted_shs_rest[
+                    bucket_offsets[degree]:bucket_offsets[degree + 1],
+                    :sh_degree_to_n_coefficients(degree) - 1,
+                ].contiguous())
+
+            compact_properties = {}
+            for name, value in properties.items():
+                if name == "shs_rest":
+                    continue
+                compact_properties[name] = value.detach()[sorted_indices]
+
+        return cls(
+            sh_degree=sh_degree,
+            properties=compact_properties,
+            shs_rest_buckets=shs_rest_buckets,
+            bucket_offsets=bucket_offsets,
+        ), sorted_indices
+
+    @classmethod
+    def from_model(cls, model, energy_threshold: float):
+        return cls.from_properties(
+            model.get_non_pre_activated_properties() if getattr(model, "is_pre_activated", False) else model.properties,
+            energy_threshold=energy_threshold,
+            sh_degree=model.max_sh_degree,
+        )
+
+    def get_shs_rest(self, sh_degree: int = -1) -> torch.Tensor:
+        """
+        Expand the buckets to a dense `[N, (sh_degree+1)^2-1, 3]` tensor, the absent coefficients are filled with zeros.
+
+        Args:
+            sh_degree: -1 means the maximum degree, lower value will truncate the higher bands
+        """
+
+        if sh_degree < 0:
+            sh_degree = self.sh_degree
+        n_rest = sh_degree_to_n_coefficients(sh_degree) - 1
+
+        reference = self.shs_rest_buckets[0]
+        shs_rest = torch.zeros((self.n_gaussians, n_rest, 3), dtype=reference.dtype, device=reference.device)
+        for degree, bucket in enumerate(self.shs_rest_buckets):
+            if bucket.shape[0] == 0:
+                continue
+            n_bucket_rest = min(bucket.shape[1], n_rest)
+            shs_rest[self.get_bucket_slice(degree), :n_bucket_rest] = bucket[:, :n_bucket_rest]
+        return shs_rest
+
+    def get_shs(self, sh_degree: int = -1) -> torch.Tensor:
+        """
+        Return: [N, (sh_degree+1)^2, 3]
+        """
+
+        return torch.concat([self.properties["shs_dc"], self.get_shs_rest(sh_degree)], dim=1)
+
+    def get_properties(self) -> Dict[str, torch.Tensor]:
+        """Return the properties with the dense `shs_rest`, can be used to set up a Gaussian model"""
+
+        properties = dict(self.properties)
+        properties["shs_rest"] = self.get_shs_rest()
+        return properties
+
+    def to_model(self, model_config=None):
+        """
+        Args:
+            model_config: a `Gaussian` config, default is `VanillaGaussian`
+        """
+
+        if model_config is None:
+            from internal.models.vanilla_gaussian import VanillaGaussian
+            model_config = VanillaGaussian(sh_degree=self.sh_degree)
+        model = model_config.instantiate()
+        model.setup_from_tensors(self.get_properties())
+        return model
+
+    def get_n_sh_coefficients(self) -> int:
+        return sum([bucket.shape[0] * bucket.shape[1] for bucket in self.shs_rest_buckets])
+
+    def to(self, *args, **kwargs):
+        self.properties = {name: value.to(*args, **kwargs) for name, value in self.properties.items()}
+        self.shs_rest_buckets = [bucket.to(*args, **kwargs) for bucket in self.shs_rest_buckets]
+        return self
+
+    def state_dict(self) -> dict:
+        return {
+            "sh_degree": self.sh_degree,
+            "bucket_offsets": self.bucket_offsets,
+            "properties": self.properties,
+            "shs_rest_buckets": self.shs_rest_buckets,
+        }
+
+    @classmethod
+    def from_state_dict(cls, state_dict: dict):
+        return cls(
+            sh_degree=state_dict["sh_degree"],
+            properties=state_dict["properties"],
+            shs_rest_buckets=state_dict["shs_rest_buckets"],
+            bucket_offsets=state_dict["bucket_offsets"],
+        )
+
+    def save(self, path: str):
+        torch.save(self.state_dict(), path)
+
+    @classmethod
+    def load(cls, path: str, map_location="cpu"):
+        return cls.from_state_dict(torch.load(path, map_location=map_location))
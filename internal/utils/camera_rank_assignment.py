@@ -0,0 +1,297 @@
+import math
+from typing import List, Optional, Tuple
+from dataclasses import dataclass
+import torch
+import torch.distributed
+
+from internal.cameras.cameras import Cameras
+
+
+@dataclass
+class RankBoundingVolumes:
+    """
+    Describe where the Gaussians of each rank are, by counting them on a coarse voxel grid.
+    """
+
+    bounding_box_min: torch.Tensor  # [3]
+
+    bounding_box_max: torch.Tensor  # [3]
+
+    counts: torch.Tensor  # [world_size, R, R, R], the number of Gaussians owned by each rank in each voxel
+
+    @property
+    def world_size(self) -> int:
+        return self.counts.shape[0]
+
+    @property
+    def resolution(self) -> int:
+        return self.counts.shape[1]
+
+    @property
+    def voxel_size(self) -> torch.Tensor:
+        return (self.bounding_box_max - self.bounding_box_min) / self.resolution
+
+    def get_voxel_centers(self) -> torch.Tensor:
+        """
+        Returns:
+            [R^3, 3], in the same order as `counts[i].reshape(-1)`
+        """
+
+        coordinates = torch.arange(self.resolution, dtype=torch.float, device=self.counts.device) + 0.5
+        grid = torch.stack(torch.meshgrid(coordinates, coordinates, coordinates, indexing="ij"), dim=-1).reshape(-1, 3)
+        return self.bounding_box_min.to(grid.device) + grid * self.voxel_size.to(grid.device)
+
+    @staticmethod
+    def count_points(
+            points: torch.Tensor,
+            bounding_box_min: torch.Tensor,
+            bounding_box_max: torch.Tensor,
+            resolution: int,
+    ) -> torch.Tensor:
+        """
+        Returns:
+            [R, R, R], float64
+        """
+
+        extent = torch.clamp_min(bounding_box_max - bounding_box_min, 1e-12)
+        voxel_coordinates = ((points.detach() - bounding_box_min) / extent * resolution).to(torch.long)
+        voxel_coordinates = torch.clamp(voxel_coordinates, min=0, max=resolution - 1)
+        voxel_ids = (voxel_coordinates[:, 0] * resolution + voxel_coordinates[:, 1]) * resolution + voxel_coordinates[:, 2]
+        return torch.bincount(voxel_ids, minlength=resolution ** 3).to(torch.float64).reshape(resolution, resolution, resolution)
+
+    @classmethod
+    def from_points(
+            cls,
+            points_of_ranks: List[torch.Tensor],
+            resolution: int = 32,
+            bounding_box: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
+    ):
+        """
+        Args:
+            points_of_ranks: the means of the Gaussians owned by each rank, [N_i, 3] each
+            resolution: the number of voxels along each axis
+            bounding_box: default is the one of all the points
+        """
+
+        if bounding_box is None:
+            all_points = torch.concat(points_of_ranks, dim=0)
+            bounding_box = (torch.min(all_points, dim=0).values, torch.max(all_points, dim=0).values)
+
+        return cls(
+            bounding_box_min=bounding_box[0],
+            bounding_box_max=bounding_box[1],
+            counts=torch.stack([
+                cls.count_points(points, bounding_box[0], bounding_box[1], resolution)
+                for points in points_of_ranks
+            ], dim=0),
+        )
+
+    @classmethod
+    def from_local_points(
+            cls,
+            points: torch.Tensor,
+            world_size: int,
+            global_rank: int,
+            resolution: int = 32,
+            bounding_box: Optional[Tuple[torch.Tensor, torch.Tensor]] = None,
+    ):
+        """
+        The distributed version of `from_points()`, must be called by all the ranks, every rank will get the same result.
+
+        Args:
+            points: the means of the local Gaussians
+            bounding_box: the global one, e.g. from `DistributedGaussianUtils.get_global_bounding_box()`
+        """
+
+        if bounding_box is None:
+            from internal.utils.distributed_gaussian_utils import DistributedGaussianUtils
+            bounding_box = DistributedGaussianUtils.get_global_bounding_box(points)
+
+        counts = torch.zeros((world_size, resolution, resolution, resolution), dtype=torch.float64, device=points.device)
+        counts[global_rank] = cls.count_points(points, bounding_box[0], bounding_box[1], resolution)
+        torch.distributed.all_reduce(counts)
+
+        return cls(
+            bounding_box_min=bounding_box[0],
+            bounding_box_max=bounding_box[1],
+            counts=counts,
+        )
+
+
+def get_frustum_gaussian_counts(
+        cameras: Cameras,
+        volumes: RankBoundingVolumes,
+        near: float = 0.01,
+        camera_chunk_size: int = 64,
+) -> torch.Tensor:
+    """
+    Estimate how many Gaussians of each rank are inside each camera's frustum.
+    A voxel is treated as inside if its bounding sphere intersects the frustum approximately.
+
+    Returns:
+        [N_cameras, world_size], float64
+    """
+
+    device = volumes.counts.device
+    counts = volumes.counts.reshape(volumes.world_size, -1)
+    # only the non-empty voxels are tested
+    non_empty = torch.sum(counts, dim=0) > 0
+    counts = counts[:, non_empty]
+    centers = volumes.get_voxel_centers()[non_empty]
+    homogeneous_centers = torch.concat([centers, torch.ones_like(centers[:, :1])], dim=-1)  # [V, 4]
+    radius = torch.linalg.norm(volumes.voxel_size.to(device)).item() / 2.
+
+    world_to_camera = cameras.world_to_camera.to(device=device, dtype=torch.float)  # [C, 4, 4], transposed
+    fx = cameras.fx.to(device=device, dtype=torch.float)
+    fy = cameras.fy.to(device=device, dtype=torch.float)
+    cx = cameras.cx.to(device=device, dtype=torch.float)
+    cy = cameras.cy.to(device=device, dtype=torch.float)
+    width = cameras.width.to(device=device, dtype=torch.float)
+    height = cameras.height.to(device=device, dtype=torch.float)
+
+    frustum_counts = []
+    for start in range(0, len(cameras), camera_chunk_size):
+        end = min(start + camera_chunk_size, len(cameras))
+        points_in_camera = torch.matmul(homogeneous_centers[None], world_to_camera[start:end])  # [C, V, 4]
+        z = points_in_camera[..., 2]
+        clamped_z = torch.clamp_min(z, near)
+        # pad the image plane by the projected radius of the voxel
+        x_padding = fx[start:end, None] * radius / clamped_z
+        y_padding = fy[start:end, None] * radius / clamped_z
+        x = fx[start:end, None] * points_in_camera[..., 0] / clamped_z + cx[start:end, None]
+        y = fy[start:end, None] * points_in_camera[..., 1] / clamped_z + cy[start:end, None]
+        is_inside = (z > near - radius) & \
+                    (x > -x_padding) & (x < width[start:end, None] + x_padding) & \
+                    (y > -y_padding) & (y < height[start:end, None] + y_padding)
+        frustum_counts.append(torch.matmul(is_inside.to(torch.float64), counts.T))
+
+    if len(frustum_counts) == 0:
+        return torch.zeros((0, volumes.world_size), dtype=torch.float64, device=device)
+    return torch.concat(frustum_counts, dim=0)
+
+
+class CameraRankAssigner:
+    """
+    Assign the training cameras to the ranks, so that a camera is rendered by the rank owning the largest share of its visible Gaussians,
+    which reduces the Gaussians transferred by the renderer's All-to-All.
+
+    Every image is assigned once per epoch, and every rank gets the same number of steps,
+    the ranks with fewer images are padded with their most preferred ones.
+    The assignment is deterministic given the seed and the epoch, so all the ranks compute the same one without communication.
+    """
+
+    def __init__(
+            self,
+            cameras: Cameras,
+            world_size: int,
+            seed: int = 0,
+            near: float = 0.01,
+    ):
+        self.cameras = cameras
+        self.world_size = world_size
+        self.seed = seed
+        self.near = near
+
+        self.frustum_counts = None  # [N_cameras, world_size]
+
+    @property
+    def n_cameras(self) -> int:
+        return len(self.cameras)
+
+    @property
+    def n_steps_per_epoch(self) -> int:
+        return math.ceil(self.n_cameras / self.world_size)
+
+    def update(self, volumes: RankBoundingVolumes):
+        assert volumes.world_size == self.world_size
+        self.frustum_counts = get_frustum_gaussian_counts(self.cameras, volumes, near=self.near).cpu()
+
+    def get_contiguous_assignment(self) -> List[List[int]]:
+        """The one used when no bounding volume available, the same as the `CacheDataLoader`'s static splitting"""
+
+        indices = list(range(self.n_cameras))
+        n_per_rank = self.n_steps_per_epoch
+        assignment = []
+        for rank in range(self.world_size):
+            rank_indices = indices[rank * n_per_rank:(rank + 1) * n_per_rank]
+            rank_indices += indices[:n_per_rank - len(rank_indices)]
+            assignment.append(rank_indices)
+        return assignment
+
+    def assign(self, epoch: int = 0) -> List[List[int]]:
+        """
+        Returns:
+            the camera indices of each rank, every rank has `n_steps_per_epoch` ones
+        """
+
+        if self.frustum_counts is None:
+            return self.get_contiguous_assignment()
+
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + epoch)
+
+        quota = self.n_steps_per_epoch
+        preferred_ranks = torch.argsort(self.frustum_counts, dim=-1, descending=True, stable=True)  # [N_cameras, world_size]
+
+        # the cameras with stronger preference choose first, ties are broken randomly
+        shares = self.frustum_counts / torch.clamp_min(torch.sum(self.frustum_counts, dim=-1, keepdim=True), 1.)
+        sorted_shares = torch.gather(shares, -1, preferred_ranks)
+        margins = sorted_shares[:, 0] - (sorted_shares[:, 1] if self.world_size > 1 else 0.)
+        random_order = torch.randperm(self.n_cameras, generator=generator)
+        camera_order = random_order[torch.argsort(margins[random_order], descending=True, stable=True)]
+
+        # in the k-th round, every unassigned camera tries its k-th preferred rank
+        assignment = [[] for _ in range(self.world_size)]
+        unassigned = camera_order.tolist()
+        for preference in range(self.world_size):
+            still_unassigned = []
+            for camera_idx in unassigned:
+                rank = preferred_ranks[camera_idx, preference].item()
+                if len(assignment[rank]) < quota:
+                    assignment[rank].append(camera_idx)
+                else:
+                    still_unassigned.append(camera_idx)
+            unassigned = still_unassigned
+        assert len(unassigned) == 0
+
+        # padding
+        for rank in range(self.world_size):
+            n_padding = quota - len(assignment[rank])
+            if n_padding <= 0:
+                continue
+            assigned = set(assignment[rank])
+            candidates = torch.argsort(shares[:, rank], descending=True, stable=True).tolist()
+            padding = [i for i in candidates if i not in assigned][:n_padding]
+            # fewer cameras than ranks
+            while len(padding) < n_padding:
+                padding.append(candidates[len(padding) % len(candidates)])
+            assignment[rank] += padding
+
+        # shuffle the order of the steps
+        return [
+            [rank_indices[i] for i in torch.randperm(len(rank_indices), generator=generator).tolist()]
+            for rank_indices in assignment
+        ]
+
+    def get_indices(self, global_rank: int, epoch: int = 0) -> List[int]:
+        return self.assign(epoch)[global_rank]
+
+    def get_communication_volume(self, assignment: List[List[int]]) -> torch.Tensor:
+        """
+        The expected number of Gaussians that each rank receives from others in an epoch,
+        i.e. the Gaussians of other ranks inside the frustums of the cameras it renders.
+
+        Returns:
+            [world_size], float64
+        """
+
+        assert self.frustum_counts is not None, "call `update()` first"
+
+        total_counts = torch.sum(self.frustum_counts, dim=-1)
+        volumes = torch.zeros((self.world_size,), dtype=torch.float64)
+        for rank, rank_indices in enumerate(assignment):
+            if len(rank_indices) == 0:
+                continue
+            rank_indices = torch.tensor(rank_indices, dtype=torch.long)
+            volumes[rank] = torch.sum(total_counts[rank_indices] - self.frustum_counts[rank_indices, rank])
+        return volumes
@@ -0,0 +1,256 @@
+"""
+Columnar views of the COLMAP binary `images.bin` and `points3D.bin`,
+used to process large sparse models without creating a Python object for every record.
+
+The records are walked once to locate them, all the other work is done on flat arrays,
+and the unchanged bytes are copied as they are, so the outputs are identical to the ones written by `internal.utils.colmap`.
+"""
+
+import struct
+from dataclasses import dataclass
+from typing import List
+import numpy as np
+
+# point3D_id, xyz, rgb, error, track_length
+POINT3D_HEADER_DTYPE = np.dtype([
+    ("id", "<u8"),
+    ("xyz", "<f8", (3,)),
+    ("rgb", "u1", (3,)),
+    ("error", "<f8"),
+    ("track_length", "<u8"),
+])
+TRACK_ELEMENT_DTYPE = np.dtype([("image_id", "<i4"), ("point2D_idx", "<i4")])
+
+IMAGE_HEADER_DTYPE = np.dtype([
+    ("id", "<i4"),
+    ("qvec", "<f8", (4,)),
+    ("tvec", "<f8", (3,)),
+    ("camera_id", "<i4"),
+])
+POINT2D_DTYPE = np.dtype([("xy", "<f8", (2,)), ("point3D_id", "<i8")])
+
+_UINT64 = struct.Struct("<Q")
+_INT32 = struct.Struct("<i")
+_IMAGE_HEADER_SIZE = IMAGE_HEADER_DTYPE.itemsize
+
+
+@dataclass
+class TrackTable:
+    """The tracks of all the 3D points, in CSR layout"""
+
+    headers: np.ndarray  # [P], POINT3D_HEADER_DTYPE
+    track_offsets: np.ndarray  # [P + 1], int64, the observations of point `p` are `[track_offsets[p], track_offsets[p + 1])`
+    image_ids: np.ndarray  # [M], int32
+    point2D_idxs: np.ndarray  # [M], int32
+
+    @property
+    def n_points(self) -> int:
+        return self.headers.shape[0]
+
+    @property
+    def n_observations(self) -> int:
+        return self.image_ids.shape[0]
+
+    @property
+    def point_ids(self) -> np.ndarray:
+        return self.headers["id"]
+
+    @property
+    def track_lengths(self) -> np.ndarray:
+        return np.diff(self.track_offsets)
+
+    @classmethod
+    def read(cls, path: str) -> "TrackTable":
+        with open(path, "rb") as f:
+            buffer = f.read()
+
+        n_points = _UINT64.unpack_from(buffer, 0)[0]
+        track_length_offset = 8 + POINT3D_HEADER_DTYPE.fields["track_length"][1]
+
+        # the records have variable lengths, so only the track lengths are parsed one by one to locate them
+        track_lengths = []
+        offset = 0
+        for _ in range(n_points):
+            track_length = _UINT64.unpack_from(buffer, offset + track_length_offset)[0]
+            track_lengths.append(track_length)
+            offset += POINT3D_HEADER_DTYPE.itemsize + TRACK_ELEMENT_DTYPE.itemsize * track_length
+        track_offsets = np.zeros((n_points + 1,), dtype=np.int64)
+        np.cumsum(np.asarray(track_lengths, dtype=np.int64), out=track_offsets[1:])
+
+        records = np.frombuffer(buffer, dtype=np.uint8, count=offset, offset=8)
+        is_header_byte = _get_header_byte_mask(track_offsets)
+        headers = records[is_header_byte].view(POINT3D_HEADER_DTYPE)
+        tracks = records[~is_header_byte].view(TRACK_ELEMENT_DTYPE)
+
+        return cls(
+            headers=headers,
+            track_offsets=track_offsets,
+            image_ids=tracks["image_id"].copy(),
+            point2D_idxs=tracks["point2D_idx"].copy(),
+        )
+
+    def remove_images(self, image_ids) -> "TrackTable":
+        """
+        Drop all the observations of `image_ids`, then the points not observed by any image any more.
+        The ones having empty tracks originally are preserved.
+        """
+
+        is_observation_kept = ~np.isin(self.image_ids, np.asarray(image_ids, dtype=self.image_ids.dtype))
+
+        track_lengths = self.track_lengths
+        point_indices = np.repeat(np.arange(self.n_points), track_lengths)
+        new_track_lengths = np.bincount(point_indices[is_observation_kept], minlength=self.n_points)
+        is_point_kept = (new_track_lengths > 0) | (track_lengths == 0)
+        # the observations of the removed points are all dropped already
+
+        headers = self.headers[is_point_kept].copy()
+        headers["track_length"] = new_track_lengths[is_point_kept]
+        track_offsets = np.zeros((headers.shape[0] + 1,), dtype=np.int64)
+        np.cumsum(headers["track_length"], out=track_offsets[1:])
+
+        return TrackTable(
+            headers=headers,
+            track_offsets=track_offsets,
+            image_ids=self.image_ids[is_observation_kept],
+            point2D_idxs=self.point2D_idxs[is_observation_kept],
+        )
+
+    def write(self, path: str):
+        tracks = np.empty((self.n_observations,), dtype=TRACK_ELEMENT_DTYPE)
+        tracks["image_id"] = self.image_ids
+        tracks["point2D_idx"] = self.point2D_idxs
+
+        # interleave the headers and the tracks
+        is_header_byte = _get_header_byte_mask(self.track_offsets)
+        records = np.empty(is_header_byte.shape, dtype=np.uint8)
+        records[is_header_byte] = np.ascontiguousarray(self.headers).view(np.uint8)
+        records[~is_header_byte] = tracks.view(np.uint8)
+
+        with open(path, "wb") as f:
+            f.write(_UINT64.pack(self.n_points))
+            records.tofile(f)
+
+
+def _get_header_byte_mask(track_offsets: np.ndarray) -> np.ndarray:
+    """
+    Args:
+        track_offsets: [P + 1], the CSR offsets of the tracks
+
+    Returns:
+        [P * header_size + M * element_size], bool, whether each byte of the records belongs to a point header
+    """
+
+    n_points = track_offsets.shape[0] - 1
+    header_size = POINT3D_HEADER_DTYPE.itemsize
+    n_bytes = n_points * header_size + int(track_offsets[-1]) * TRACK_ELEMENT_DTYPE.itemsize
+    header_starts = np.arange(n_points, dtype=np.int64) * header_size + track_offsets[:-1] * TRACK_ELEMENT_DTYPE.itemsize
+
+    # +1 at the start of every header, -1 at the end, a header never overlaps the next one
+    deltas = np.zeros((n_bytes + 1,), dtype=np.int8)
+    deltas[header_starts] += 1
+    deltas[header_starts + header_size] -= 1
+    return np.cumsum(deltas[:-1], dtype=np.int8).astype(bool)
+
+
+@dataclass
+class ImageTable:
+    """The records of `images.bin`, kept as raw bytes"""
+
+    image_ids: np.ndarray  # [I], int32
+    record_offsets: np.ndarray  # [I + 1], int64, the bytes of image `i` are `buffer[record_offsets[i]:record_offsets[i + 1]]`
+    buffer: bytes
+
+    @property
+    def n_images(self) -> int:
+        return self.image_ids.shape[0]
+
+    @classmethod
+    def read(cls, path: str) -> "ImageTable":
+        with open(path, "rb") as f:
+            buffer = f.read()
+
+        n_images = _UINT64.unpack_from(buffer, 0)[0]
+        image_ids = []
+        record_offsets = [8]
+        offset = 8
+        for _ in range(n_images):
+            image_ids.append(_INT32.unpack_from(buffer, offset)[0])
+            name_end = buffer.index(b"\x00", offset + _IMAGE_HEADER_SIZE)
+            n_points2D = _UINT64.unpack_from(buffer, name_end + 1)[0]
+            offset = name_end + 1 + 8 + POINT2D_DTYPE.itemsize * n_points2D
+            record_offsets.append(offset)
+
+        return cls(
+            image_ids=np.asarray(image_ids, dtype=np.int32),
+            record_offsets=np.asarray(record_offsets, dtype=np.int64),
+            buffer=buffer,
+        )
+
+    def read_columns(self) -> "ImageColumns":
+        buffer = memoryview(self.buffer)
+        headers = []
+        names = []
+        points2D = []
+        points2D_offsets = [0]
+        for start, end in zip(self.record_offsets[:-1].tolist(), self.record_offsets[1:].tolist()):
+            name_end = self.buffer.index(b"\x00", start + _IMAGE_HEADER_SIZE)
+            headers.append(buffer[start:start + _IMAGE_HEADER_SIZE])
+            names.append(bytes(buffer[start + _IMAGE_HEADER_SIZE:name_end]).decode("utf-8"))
+            points2D.append(buffer[name_end + 1 + 8:end])
+            points2D_offsets.append(points2D_offsets[-1] + (end - name_end - 1 - 8) // POINT2D_DTYPE.itemsize)
+
+        headers = np.frombuffer(b"".join(headers), dtype=IMAGE_HEADER_DTYPE)
+        points2D = np.frombuffer(b"".join(points2D), dtype=POINT2D_DTYPE)
+        points2D_offsets = np.asarray(points2D_offsets, dtype=np.int64)
+
+        return ImageColumns(
+            image_ids=headers["id"].copy(),
+            qvecs=headers["qvec"].copy(),
+            tvecs=headers["tvec"].copy(),
+            camera_ids=headers["camera_id"].copy(),
+            names=names,
+            points2D_offsets=points2D_offsets,
+            xys=points2D["xy"].copy(),
+            point3D_ids=points2D["point3D_id"].copy(),
+        )
+
+    def remove_images(self, image_ids) -> "ImageTable":
+        is_kept = ~np.isin(self.image_ids, np.asarray(image_ids, dtype=self.image_ids.dtype))
+        kept_indices = np.nonzero(is_kept)[0].tolist()
+
+        buffer = memoryview(self.buffer)
+        offsets = self.record_offsets.tolist()
+        records = [buffer[offsets[i]:offsets[i + 1]] for i in kept_indices]
+        lengths = np.asarray([offsets[i + 1] - offsets[i] for i in kept_indices], dtype=np.int64)
+
+        record_offsets = np.full((len(kept_indices) + 1,), 8, dtype=np.int64)
+        np.cumsum(lengths, out=record_offsets[1:])
+        record_offsets[1:] += 8
+
+        return ImageTable(
+            image_ids=self.image_ids[is_kept],
+            record_offsets=record_offsets,
+            buffer=_UINT64.pack(len(kept_indices)) + b"".join(records),
+        )
+
+    def write(self, path: str):
+        with open(path, "wb") as f:
+            f.write(self.buffer)
+
+
+@dataclass
+class ImageColumns:
+    """The parsed fields of `images.bin`, the 2D points of all the images are concatenated in CSR layout"""
+
+    image_ids: np.ndarray  # [I], int32
+    qvecs: np.ndarray  # [I, 4]
+    tvecs: np.ndarray  # [I, 3]
+    camera_ids: np.ndarray  # [I], int32
+    names: List[str]
+    points2D_offsets: np.ndarray  # [I + 1], int64
+    xys: np.ndarray  # [M, 2]
+    point3D_ids: np.ndarray  # [M], int64, -1 means no 3D point
+
+    @property
+    def n_images(self) -> int:
+        return self.image_ids.shape[0]
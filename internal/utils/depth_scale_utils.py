@@ -0,0 +1,249 @@
+"""
+Estimate the scales and offsets aligning the monocular inverse depth maps to the SfM sparse points, for all the images at once.
+
+It is the batched version of the per-image implementation in `utils/get_depth_scales.py`:
+    1. the COLMAP model is read columnar, the valid observations of all the images are grouped by image in CSR layout;
+    2. the depth maps are sampled in a process pool, only the rows around the observations are read from the memory-mapped `.npy` files;
+    3. the medians and the mean absolute deviations are computed by segmented reductions over all the images.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+import numpy as np
+import cv2
+from internal.utils import colmap
+from internal.utils.colmap_track_table import ImageTable, TrackTable
+
+MIN_VALID_POINTS = 10
+MIN_INVERSE_DEPTH_RANGE = 1e-3
+
+
+def qvecs_to_rotation_matrices(qvecs: np.ndarray) -> np.ndarray:
+    """
+    Args:
+        qvecs: [N, 4], wxyz
+
+    Returns:
+        [N, 3, 3]
+    """
+
+    w, x, y, z = qvecs[:, 0], qvecs[:, 1], qvecs[:, 2], qvecs[:, 3]
+    return np.stack([
+        np.stack([1 - 2 * y ** 2 - 2 * z ** 2, 2 * x * y - 2 * w * z, 2 * z * x + 2 * w * y], axis=-1),
+        np.stack([2 * x * y + 2 * w * z, 1 - 2 * x ** 2 - 2 * z ** 2, 2 * y * z - 2 * w * x], axis=-1),
+        np.stack([2 * z * x - 2 * w * y, 2 * y * z + 2 * w * x, 1 - 2 * x ** 2 - 2 * y ** 2], axis=-1),
+    ], axis=1)
+
+
+def segmented_median(values: np.ndarray, segment_ids: np.ndarray, n_segments: int) -> np.ndarray:
+    """
+    Returns:
+        [n_segments], the empty segments are NaN
+    """
+
+    order = np.lexsort((values, segment_ids))
+    sorted_values = values[order]
+    counts = np.bincount(segment_ids, minlength=n_segments)
+    starts = np.cumsum(counts) - counts
+
+    medians = np.full((n_segments,), np.nan, dtype=np.float64)
+    non_empty = counts > 0
+    lower = sorted_values[starts[non_empty] + (counts[non_empty] - 1) // 2]
+    upper = sorted_values[starts[non_empty] + counts[non_empty] // 2]
+    medians[non_empty] = (lower.astype(np.float64) + upper) / 2.
+    return medians
+
+
+def segmented_mean(values: np.ndarray, segment_ids: np.ndarray, n_segments: int) -> np.ndarray:
+    counts = np.bincount(segment_ids, minlength=n_segments)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.bincount(segment_ids, weights=values, minlength=n_segments) / counts
+
+
+def segmented_range(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    Args:
+        offsets: [S + 1], CSR offsets
+
+    Returns:
+        [S], `max - min` of each segment, the empty ones are 0
+    """
+
+    ranges = np.zeros((offsets.shape[0] - 1,), dtype=np.float64)
+    non_empty = np.nonzero(np.diff(offsets) > 0)[0]
+    if non_empty.shape[0] == 0:
+        return ranges
+    starts = offsets[non_empty]
+    with np.errstate(invalid="ignore"):
+        ranges[non_empty] = np.maximum.reduceat(values, starts) - np.minimum.reduceat(values, starts)
+    return ranges
+
+
+def sample_depth_map(
+        path: str,
+        xys: np.ndarray,
+        inverse_depths: np.ndarray,
+        width: int,
+        height: int,
+) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Bilinear sample the inverse depth map at the observations inside the image and in front of the camera.
+
+    Args:
+        xys: [N, 2], the observations, in the image space of the COLMAP camera
+        inverse_depths: [N], the inverse depths of the observations' 3D points
+        width, height: the size of the COLMAP camera
+
+    Returns:
+        valid: [N], the sampled ones
+        samples: [valid.sum()], None if there are not enough valid observations
+    """
+
+    depth_map = np.load(path, mmap_mode="r")
+    depth_map_height = depth_map.shape[0]
+    s = depth_map_height / height
+
+    maps = (xys * s).astype(np.float32)
+    valid = (
+            (maps[..., 0] >= 0) &
+            (maps[..., 1] >= 0) &
+            (maps[..., 0] < width * s) &
+            (maps[..., 1] < height * s) &
+            (inverse_depths > 0)
+    )
+    if valid.sum() <= MIN_VALID_POINTS:
+        return valid, None
+    maps = maps[valid, :]
+
+    # Read the rows at and below the observations only, and remap on the compacted rows.
+    # Three rows are kept so that the ones selected after the sub-pixel rounding of `cv2.remap()` are always adjacent.
+    # The coordinates are only shifted by integers, so the interpolation weights are unchanged.
+    base_rows = np.minimum(np.floor(maps[:, 1]).astype(np.int64), depth_map_height - 1)
+    rows = np.unique(np.minimum(base_rows[:, None] + np.arange(3)[None, :], depth_map_height - 1))
+    compacted_y = np.searchsorted(rows, base_rows).astype(np.float32) + (maps[:, 1] - base_rows.astype(np.float32))
+    compacted_depth_map = np.ascontiguousarray(depth_map[rows])
+
+    samples = cv2.remap(
+        compacted_depth_map,
+        maps[..., 0],
+        compacted_y,
+        interpolation=cv2.INTER_LINEAR,
+        borderMode=cv2.BORDER_REPLICATE,
+    )[..., 0]
+    return valid, samples
+
+
+def _sample_depth_map(task):
+    return sample_depth_map(*task)
+
+
+def get_depth_scales(
+        sparse_model_dir: str,
+        depth_dir: str,
+        point_max_error: float = 1.5,
+        n_processes: int = -1,
+        chunk_size: int = 16,
+) -> Dict[str, Dict[str, float]]:
+    """
+    Args:
+        sparse_model_dir: contains the binary COLMAP model
+        depth_dir: contains the inverse depth map `{image_name}.npy` of each image
+        n_processes: the number of processes sampling the depth maps, -1 means `os.cpu_count()`, 0 means in the current one
+        chunk_size: the number of images sent to a process at a time
+
+    Returns:
+        {image_name: {"scale": ..., "offset": ...}}, both are `0` for the images without enough valid points
+    """
+
+    cameras = colmap.read_cameras_binary(os.path.join(sparse_model_dir, "cameras.bin"))
+    images = ImageTable.read(os.path.join(sparse_model_dir, "images.bin")).read_columns()
+    points = TrackTable.read(os.path.join(sparse_model_dir, "points3D.bin"))
+
+    # order the points by their ids, the ids without points are at the origin with zero error
+    point_ids = points.point_ids.astype(np.int64)
+    n_ordered_points = point_ids.max() + 1 if point_ids.shape[0] > 0 else 0
+    ordered_xyzs = np.zeros((n_ordered_points, 3))
+    ordered_errors = np.zeros((n_ordered_points,))
+    ordered_xyzs[point_ids] = points.headers["xyz"]
+    ordered_errors[point_ids] = points.headers["error"]
+    del points
+
+    # keep the observations of the valid points with small errors
+    image_indices = np.repeat(np.arange(images.n_images), np.diff(images.points2D_offsets))
+    point3D_ids = images.point3D_ids
+    is_kept = (point3D_ids >= 0) & (point3D_ids < n_ordered_points)
+    is_kept[is_kept] = ordered_errors[point3D_ids[is_kept]] < point_max_error
+    image_indices = image_indices[is_kept]
+    point3D_ids = point3D_ids[is_kept]
+    xys = images.xys[is_kept]
+    observation_offsets = np.zeros((images.n_images + 1,), dtype=np.int64)
+    np.cumsum(np.bincount(image_indices, minlength=images.n_images), out=observation_offsets[1:])
+
+    # the inverse depths in camera space
+    rotations = qvecs_to_rotation_matrices(images.qvecs)
+    depths = np.sum(ordered_xyzs[point3D_ids] * rotations[image_indices, 2], axis=-1) + images.tvecs[image_indices, 2]
+    with np.errstate(divide="ignore"):
+        inverse_depths = 1. / depths
+
+    # skip the ones can not pass the checks without reading their depth maps
+    n_in_front = np.bincount(image_indices[inverse_depths > 0], minlength=images.n_images)
+    candidates = np.nonzero(
+        (n_in_front > MIN_VALID_POINTS) &
+        (segmented_range(inverse_depths, observation_offsets) > MIN_INVERSE_DEPTH_RANGE)
+    )[0].tolist()
+
+    tasks = []
+    for i in candidates:
+        camera = cameras[images.camera_ids[i].item()]
+        start, end = observation_offsets[i], observation_offsets[i + 1]
+        tasks.append((
+            os.path.join(depth_dir, "{}.npy".format(images.names[i])),
+            xys[start:end],
+            inverse_depths[start:end],
+            camera.width,
+            camera.height,
+        ))
+
+    if n_processes == 0:
+        sample_results = list(map(_sample_depth_map, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=None if n_processes < 0 else n_processes) as executor:
+            sample_results = list(executor.map(_sample_depth_map, tasks, chunksize=chunk_size))
+
+    # gather the valid observations of the images having enough of them
+    colmap_values = []
+    mono_values = []
+    segment_ids = []
+    for image_index, (valid, samples) in zip(candidates, sample_results):
+        if samples is None:
+            continue
+        colmap_values.append(inverse_depths[observation_offsets[image_index]:observation_offsets[image_index + 1]][valid])
+        mono_values.append(samples)
+        segment_ids.append(np.full((samples.shape[0],), image_index, dtype=np.int64))
+
+    is_estimated = np.zeros((images.n_images,), dtype=bool)
+    scales = np.zeros((images.n_images,), dtype=np.float64)
+    offsets = np.zeros((images.n_images,), dtype=np.float64)
+    if len(segment_ids) > 0:
+        colmap_values = np.concatenate(colmap_values)
+        mono_values = np.concatenate(mono_values)
+        segment_ids = np.concatenate(segment_ids)
+        is_estimated[segment_ids] = True
+
+        # median / mean absolute deviation
+        t_colmap = segmented_median(colmap_values, segment_ids, images.n_images)
+        s_colmap = segmented_mean(np.abs(colmap_values - t_colmap[segment_ids]), segment_ids, images.n_images)
+        t_mono = segmented_median(mono_values, segment_ids, images.n_images)
+        s_mono = segmented_mean(np.abs(mono_values - t_mono[segment_ids]), segment_ids, images.n_images)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scales = s_colmap / s_mono
+            offsets = t_colmap - t_mono * scales
+
+    depth_scales = {}
+    for i, name in enumerate(images.names):
+        if is_estimated[i]:
+            depth_scales[name] = {"scale": scales[i].item(), "offset": offsets[i].item()}
+        else:
+            depth_scales[name] = {"scale": 0, "offset": 0}
+    return depth_scales
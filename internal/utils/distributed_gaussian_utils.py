@@ -0,0 +1,373 @@
+from typing import List, Optional, Tuple
+from dataclasses import dataclass
+import torch
+import torch.distributed
+
+from internal.utils.morton_code import MAX_BITS_PER_AXIS, get_morton_codes
+
+"""
+Helpers moving Gaussians between the members of a process group.
+They depend on nothing but `torch.distributed`, so that they work with both `nccl` and `gloo` backends.
+"""
+
+
+@dataclass
+class PackedGaussianStateHeader:
+    """
+    Describe how the per-Gaussian tensors are laid out in a row of a packed `[N, n_bytes_per_gaussian]` uint8 buffer.
+    The tensors of every rank have the same dtypes and trailing shapes, so the header is built locally.
+    """
+
+    dtypes: List[torch.dtype]
+
+    shapes: List[Tuple[int, ...]]  # the shape of each tensor excluding the first dimension
+
+    n_bytes: List[int]  # the number of bytes of each tensor per Gaussian
+
+    @property
+    def n_bytes_per_gaussian(self) -> int:
+        return sum(self.n_bytes)
+
+    @classmethod
+    def from_tensors(cls, tensors: List[torch.Tensor]):
+        dtypes = []
+        shapes = []
+        n_bytes = []
+        for tensor in tensors:
+            dtypes.append(tensor.dtype)
+            shapes.append(tuple(tensor.shape[1:]))
+            n_bytes.append(tensor.shape[1:].numel() * tensor.element_size())
+        return cls(dtypes=dtypes, shapes=shapes, n_bytes=n_bytes)
+
+
+class DistributedGaussianUtils:
+    @staticmethod
+    def get_number_of_gaussians_to_receive(destination: torch.Tensor, world_size: int) -> Tuple[List[int], List[int]]:
+        """
+        Args:
+            destination: [N], the rank that each local Gaussian will be sent to
+
+        Returns:
+            the number of Gaussians sent to each rank, and the number of Gaussians received from each rank
+        """
+
+        count_by_destination = torch.bincount(destination, minlength=world_size).to(torch.long)
+        count_by_source = torch.empty_like(count_by_destination)
+        torch.distributed.all_to_all_single(count_by_source, count_by_destination)
+
+        return count_by_destination.tolist(), count_by_source.tolist()
+
+    @staticmethod
+    def all2all_gaussian_state(
+            local_tensor: torch.Tensor,
+            destination: torch.Tensor,
+            number_of_gaussians_to_receive: List[int],
+            world_size: int,
+    ) -> torch.Tensor:
+        """
+        Send the i-th row of `local_tensor` to the rank `destination[i]`.
+        The received rows are ordered by the source rank, and the order of the rows from the same source is kept.
+        """
+
+        n_to_send = torch.bincount(destination, minlength=world_size).tolist()
+        # stable sort keeps the original order inside every destination
+        order = torch.argsort(destination, stable=True)
+        output = torch.empty(
+            [sum(number_of_gaussians_to_receive)] + list(local_tensor.shape[1:]),
+            dtype=local_tensor.dtype,
+            device=local_tensor.device,
+        )
+        torch.distributed.all_to_all_single(
+            output,
+            local_tensor.detach()[order].contiguous(),
+            output_split_sizes=[int(i) for i in number_of_gaussians_to_receive],
+            input_split_sizes=n_to_send,
+        )
+
+        return output
+
+    @staticmethod
+    def pack_gaussian_states(tensors: List[torch.Tensor]) -> Tuple[torch.Tensor, PackedGaussianStateHeader]:
+        """
+        Reinterpret every tensor as bytes, and concatenate them, so the row `i` of the buffer holds all the states of the Gaussian `i`.
+
+        Args:
+            tensors: [N, ...] each, can be of different dtypes
+
+        Returns:
+            [N, n_bytes_per_gaussian], uint8
+        """
+
+        header = PackedGaussianStateHeader.from_tensors(tensors)
+        n = tensors[0].shape[0]
+        byte_tensors = []
+        for tensor, n_bytes in zip(tensors, header.n_bytes):
+            assert tensor.shape[0] == n, "the number of Gaussians not match"
+            if n_bytes == 0:
+                continue
+            tensor = tensor.detach().contiguous()
+            if tensor.dtype == torch.bool:
+                tensor = tensor.to(torch.uint8)
+            # the explicit row width, `-1` is ambiguous when `n == 0`
+            byte_tensors.append(tensor.reshape(n, n_bytes // tensor.element_size()).view(torch.uint8))
+
+        if len(byte_tensors) == 0:
+            return torch.empty((n, 0), dtype=torch.uint8, device=tensors[0].device), header
+        return torch.concat(byte_tensors, dim=1), header
+
+    @staticmethod
+    def unpack_gaussian_states(buffer: torch.Tensor, header: PackedGaussianStateHeader) -> List[torch.Tensor]:
+        """The inverse of `pack_gaussian_states()`"""
+
+        n = buffer.shape[0]
+        tensors = []
+        offset = 0
+        for dtype, shape, n_bytes in zip(header.dtypes, header.shapes, header.n_bytes):
+            if n_bytes == 0 or n == 0:
+                tensors.append(torch.empty((n, *shape), dtype=dtype, device=buffer.device))
+                offset += n_bytes
+                continue
+            byte_tensor = buffer[:, offset:offset + n_bytes].contiguous()
+            if dtype == torch.bool:
+                tensor = byte_tensor.to(torch.bool)
+            else:
+                tensor = byte_tensor.view(dtype)
+            tensors.append(tensor.view((n, *shape)))
+            offset += n_bytes
+        return tensors
+
+    @classmethod
+    def packed_all2all_gaussian_states(
+            cls,
+            local_tensors: List[torch.Tensor],
+            destination: torch.Tensor,
+            number_of_gaussians_to_receive: List[int],
+            world_size: int,
+    ) -> List[torch.Tensor]:
+        """
+        Same as invoking `all2all_gaussian_state()` on each tensor, but use a single collective call.
+        """
+
+        buffer, header = cls.pack_gaussian_states(local_tensors)
+        received_buffer = cls.all2all_gaussian_state(
+            buffer,
+            destination=destination,
+            number_of_gaussians_to_receive=number_of_gaussians_to_receive,
+            world_size=world_size,
+        )
+        return cls.unpack_gaussian_states(received_buffer, header)
+
+    @classmethod
+    def optimizer_all2all(
+            cls,
+            destination: torch.Tensor,
+            number_of_gaussians_to_receive: List[int],
+            gaussian_model,
+            optimizers,
+            world_size: int,
+            packed: bool = True,
+    ):
+        """
+        Move the Gaussian properties, together with their optimizer states, to the `destination` ranks
+
+        Args:
+            packed: send all the tensors by a single collective call, instead of one call per tensor
+        """
+
+        if packed:
+            return cls.packed_optimizer_all2all(destination, number_of_gaussians_to_receive, gaussian_model, optimizers, world_size)
+
+        def invoke_all2all(local_tensor):
+            return cls.all2all_gaussian_state(
+                local_tensor,
+                destination=destination,
+                number_of_gaussians_to_receive=number_of_gaussians_to_receive,
+                world_size=world_size,
+            )
+
+        new_tensors = {}
+        # optimizable
+        for opt in optimizers:
+            for group in opt.param_groups:
+                assert len(group["params"]) == 1
+                stored_state = opt.state.get(group['params'][0], None)
+                if stored_state is not None:
+                    stored_state["exp_avg"] = invoke_all2all(stored_state["exp_avg"])
+                    stored_state["exp_avg_sq"] = invoke_all2all(stored_state["exp_avg_sq"])
+
+                    # replace with new tensor and state
+                    del opt.state[group['params'][0]]
+                    group["params"][0] = torch.nn.Parameter(invoke_all2all(group["params"][0]).requires_grad_(True))
+                    opt.state[group['params'][0]] = stored_state
+                else:
+                    group["params"][0] = torch.nn.Parameter(invoke_all2all(group["params"][0]).requires_grad_(True))
+
+                new_tensors[group["name"]] = group["params"][0]
+
+        # tensors
+        for name in gaussian_model.get_property_names():
+            if name in new_tensors:
+                continue
+            new_tensors[name] = invoke_all2all(gaussian_model.get_property(name))
+
+        # update
+        gaussian_model.properties = new_tensors
+
+    @classmethod
+    def packed_optimizer_all2all(
+            cls,
+            destination: torch.Tensor,
+            number_of_gaussians_to_receive: List[int],
+            gaussian_model,
+            optimizers,
+            world_size: int,
+    ):
+        # collect all the tensors to be sent
+        local_tensors = []
+        groups = []  # [(optimizer, param_group, stored_state), ...]
+        for opt in optimizers:
+            for group in opt.param_groups:
+                assert len(group["params"]) == 1
+                stored_state = opt.state.get(group['params'][0], None)
+                local_tensors.append(group["params"][0])
+                if stored_state is not None:
+                    local_tensors.append(stored_state["exp_avg"])
+                    local_tensors.append(stored_state["exp_avg_sq"])
+                groups.append((opt, group, stored_state))
+        optimizable_names = set([group["name"] for _, group, _ in groups])
+        non_optimizable_names = [name for name in gaussian_model.get_property_names() if name not in optimizable_names]
+        for name in non_optimizable_names:
+            local_tensors.append(gaussian_model.get_property(name))
+
+        received_tensors = iter(cls.packed_all2all_gaussian_states(
+            local_tensors,
+            destination=destination,
+            number_of_gaussians_to_receive=number_of_gaussians_to_receive,
+            world_size=world_size,
+        ))
+
+        # assign the received tensors in the same order
+        new_tensors = {}
+        for opt, group, stored_state in groups:
+            new_param = torch.nn.Parameter(next(received_tensors).requires_grad_(True))
+            if stored_state is not None:
+                stored_state["exp_avg"] = next(received_tensors)
+                stored_state["exp_avg_sq"] = next(received_tensors)
+                del opt.state[group['params'][0]]
+                opt.state[new_param] = stored_state
+            group["params"][0] = new_param
+            new_tensors[group["name"]] = new_param
+        for name in non_optimizable_names:
+            new_tensors[name] = next(received_tensors)
+
+        # update
+        gaussian_model.properties = new_tensors
+
+    @staticmethod
+    def get_global_bounding_box(means: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Returns:
+            the minimum and maximum of the means of all ranks, [3] each
+        """
+
+        means = means.detach()
+        if means.shape[0] > 0:
+            bounding_box_min = torch.min(means, dim=0).values.to(torch.float)
+            bounding_box_max = torch.max(means, dim=0).values.to(torch.float)
+        else:
+            bounding_box_min = torch.full((means.shape[-1],), torch.inf, dtype=torch.float, device=means.device)
+            bounding_box_max = torch.full((means.shape[-1],), -torch.inf, dtype=torch.float, device=means.device)
+
+        torch.distributed.all_reduce(bounding_box_min, op=torch.distributed.ReduceOp.MIN)
+        torch.distributed.all_reduce(bounding_box_max, op=torch.distributed.ReduceOp.MAX)
+
+        return bounding_box_min, bounding_box_max
+
+    @staticmethod
+    def get_bucket_ids(
+            means: torch.Tensor,
+            bounding_box: Tuple[torch.Tensor, torch.Tensor],
+            n_bucket_bits: int,
+    ) -> torch.Tensor:
+        """
+        Bucket the Gaussians by the leading `n_bucket_bits` bits of their Morton codes,
+        so consecutive buckets are spatially adjacent.
+
+        Returns:
+            [N], int64, in [0, 2^n_bucket_bits)
+        """
+
+        assert 0 < n_bucket_bits <= 3 * MAX_BITS_PER_AXIS
+        morton_codes = get_morton_codes(means, bounding_box[0], bounding_box[1], n_bits=MAX_BITS_PER_AXIS)
+        return morton_codes >> (3 * MAX_BITS_PER_AXIS - n_bucket_bits)
+
+    @staticmethod
+    def get_bucket_ranks(
+            bucket_costs: torch.Tensor,
+            world_size: int,
+    ) -> torch.Tensor:
+        """
+        Split the buckets into `world_size` contiguous ranges of approximately equal total cost.
+
+        Args:
+            bucket_costs: [N_buckets], non-negative
+
+        Returns:
+            [N_buckets], int64, non-decreasing, the rank that each bucket belongs to
+        """
+
+        cumulative_costs = torch.cumsum(bucket_costs, dim=0)
+        total_cost = cumulative_costs[-1]
+        if total_cost <= 0:
+            return torch.zeros_like(bucket_costs, dtype=torch.long)
+        # assign a bucket by the position of its center, so a heavy bucket goes to the rank holding its major part
+        bucket_centers = cumulative_costs - bucket_costs / 2.
+        return torch.clamp((bucket_centers / total_cost * world_size).to(torch.long), min=0, max=world_size - 1)
+
+    @classmethod
+    def get_spatial_destination(
+            cls,
+            means: torch.Tensor,
+            world_size: int,
+            bounding_box: Tuple[torch.Tensor, torch.Tensor],
+            n_bucket_bits: int,
+            bucket_visible_counts: Optional[torch.Tensor] = None,
+            visibility_balance_weight: float = 0.,
+    ) -> torch.Tensor:
+        """
+        Assign each rank a contiguous slab of the Morton curve, so every rank owns a spatially coherent region.
+
+        The cost of a bucket is its share of the Gaussians,
+        plus `visibility_balance_weight` times its share of the visible Gaussians,
+        then the slabs are chosen to balance the cost among the ranks.
+        Must be called by all the ranks.
+
+        Args:
+            means: [N, 3], the local Gaussians
+            bounding_box: the global one, see `get_global_bounding_box()`
+            n_bucket_bits: the Morton curve is divided into `2^n_bucket_bits` buckets
+            bucket_visible_counts: [2^n_bucket_bits], the local number of visible Gaussians in each bucket,
+                accumulated over the rendered views since the previous redistribution
+            visibility_balance_weight: 0 means only the number of Gaussians is balanced
+
+        Returns:
+            [N], int64, the destination rank of each local Gaussian
+        """
+
+        n_buckets = 1 << n_bucket_bits
+        bucket_ids = cls.get_bucket_ids(means, bounding_box, n_bucket_bits)
+
+        bucket_counts = torch.bincount(bucket_ids, minlength=n_buckets).to(torch.float64)
+        torch.distributed.all_reduce(bucket_counts)
+        bucket_costs = bucket_counts / bucket_counts.sum().clamp_min(1.)
+
+        if bucket_visible_counts is not None and visibility_balance_weight > 0:
+            bucket_visible_counts = bucket_visible_counts.to(device=means.device, dtype=torch.float64)
+            torch.distributed.all_reduce(bucket_visible_counts)
+            n_visible = bucket_visible_counts.sum()
+            if n_visible > 0:
+                bucket_costs = bucket_costs + visibility_balance_weight * bucket_visible_counts / n_visible
+
+        bucket_ranks = cls.get_bucket_ranks(bucket_costs, world_size)
+
+        return bucket_ranks[bucket_ids]
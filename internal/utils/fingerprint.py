@@ -0,0 +1,29 @@
+"""
+Identify a set of tensors, e.g. the properties of the Gaussians, to invalidate the data derived from them.
+
+The fingerprints are calculated from the weighted sums of the values on the device,
+instead of hashing all the bytes, which requires copying them to the host.
+"""
+
+import struct
+import hashlib
+from typing import Iterable
+import torch
+
+
+@torch.no_grad()
+def get_tensors_fingerprint(tensors: Iterable[torch.Tensor]) -> str:
+    shapes = []
+    digests = []
+    for value in tensors:
+        shapes += [value.dim()] + list(value.shape)
+        value = value.detach().reshape(-1).to(torch.float64)
+        weights = torch.cos(torch.arange(value.shape[0], dtype=torch.float64, device=value.device) * 0.7548776662466927)
+        digests.append(torch.stack([value.sum(), (value * weights).sum()]).cpu())
+    # synchronize only once
+    digests = torch.concat(digests).tolist() if len(digests) > 0 else []
+
+    h = hashlib.sha1()
+    h.update(struct.pack("<{}q".format(len(shapes)), *shapes))
+    h.update(struct.pack("<{}d".format(len(digests)), *digests))
+    return h.hexdigest()
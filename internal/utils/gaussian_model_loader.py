@@ -1,7 +1,7 @@
 import os
 import glob
 import torch
-from typing import Tuple
+from typing import Tuple, Iterable, Optional
 from internal.models.gaussian import Gaussian
 from internal.renderers import RendererConfig
 from internal.renderers.vanilla_renderer import VanillaRenderer
@@ -66,6 +66,45 @@ class GaussianModelLoader:
 
         return load_from
 
+    @staticmethod
+    def load_checkpoint(
+            checkpoint_path: str,
+            lazy: bool = True,
+            state_dict_prefixes: Optional[Iterable[str]] = None,
+            load_optimizer_states: bool = True,
+    ) -> dict:
+        """
+        Args:
+            checkpoint_path
+            lazy: memory-map the checkpoint, so only the bytes of the tensors being accessed will be read from disk
+            state_dict_prefixes: retain only the `state_dict` entries starting with one of them, `None` retains all
+            load_optimizer_states: `False` to drop `optimizer_states`
+        """
+
+        checkpoint = None
+        if lazy is True:
+            try:
+                checkpoint = torch.load(checkpoint_path, map_location="cpu", mmap=True)
+            except (TypeError, RuntimeError) as err:
+                # `mmap` is not supported by the installed PyTorch, or the checkpoint is not in the zipfile format
+                print("can not memory-map '{}', fallback to loading entirely: {}".format(checkpoint_path, err))
+        if checkpoint is None:
+            checkpoint = torch.load(checkpoint_path, map_location="cpu")
+
+        if state_dict_prefixes is not None and "state_dict" in checkpoint:
+            state_dict_prefixes = tuple(state_dict_prefixes)
+            state_dict = checkpoint["state_dict"]
+            checkpoint["state_dict"] = state_dict.__class__()
+            for name in state_dict:
+                if name.startswith(state_dict_prefixes):
+                    checkpoint["state_dict"][name] = state_dict[name]
+            del state_dict
+
+        if load_optimizer_states is False:
+            checkpoint.pop("optimizer_states", None)
+
+        return checkpoint
+
     @staticmethod
     def filter_state_dict_by_prefix(state_dict, prefix: str, device=None):
         prefix_len = len(prefix)
@@ -131,12 +170,29 @@ class GaussianModelLoader:
             device,
             eval_mode: bool = True,
             pre_activate: bool = True,
+            lazy: bool = True,
+            model_states_only: bool = False,
     ) -> Tuple[torch.nn.Module, torch.nn.Module, dict]:
+        """
+        Args:
+            lazy: see `load_checkpoint()`
+            model_states_only: `True` if the returned checkpoint is not used, it will only contain the states of the Gaussian model and the renderer, without optimizer states.
+                The viewer saves the edited checkpoint from the returned one, so it must be `False` there.
+        """
+
         stage = "fit"
         if eval_mode is True:
             stage = "validation"
 
-        checkpoint = torch.load(checkpoint_path, map_location="cpu")
+        if model_states_only is True:
+            checkpoint = cls.load_checkpoint(
+                checkpoint_path,
+                lazy=lazy,
+                state_dict_prefixes=("gaussian_model.", "renderer."),
+                load_optimizer_states=False,
+            )
+        else:
+            checkpoint = cls.load_checkpoint(checkpoint_path, lazy=lazy)
 
         model = cls.initialize_model_from_checkpoint(checkpoint, device)
         renderer = cls.initialize_renderer_from_checkpoint(checkpoint, stage, device)
@@ -206,6 +262,7 @@ class GaussianModelLoader:
                 device=device,
                 eval_mode=eval_mode,
                 pre_activate=pre_activate,
+                model_states_only=True,
             )
         elif load_from.endswith(".ply"):
             model, renderer = cls.initialize_model_and_renderer_from_ply_file(
@@ -285,3 +285,116 @@ def compute_cov_2d(t, tan_fovx, tan_fovy, focal_x, focal_y, cov_3d, world_to_cam
     cov_2d = T @ cov_3d @ T.transpose(1, 2)
 
     return cov_2d[:, :2, :2]
+
+
+def project_gaussians_batched(
+        means_3d: torch.Tensor,  # [n, 3]
+        scales: torch.Tensor,  # [n, 3]
+        scale_modifier: float,
+        quaternions: torch.Tensor,  # [n, 4]
+        cameras,  # internal.cameras.cameras.Cameras
+        block_width: int = 16,
+        min_depth: float = 0.01,
+        chunk_size: int = -1,
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    The multi-camera version of `project_gaussians()`, computes the same means 2D, depths, radii and masks for every camera at once.
+    Unlike the single camera one, Gaussians with a non-positive 2D covariance determinant are simply masked out instead of raising an error.
+
+    Args
+       cameras (Cameras): a batch of C cameras
+       chunk_size (int): the number of Gaussians projected at a time, bounding the memory to about `C * chunk_size * 100` bytes, -1 means all of them
+
+    Returns
+       means_2d (Tensor): [C, n, 2]
+       depths (Tensor): [C, n]
+       radii (Tensor): [C, n], int
+       mask (Tensor): [C, n], bool, whether the Gaussian is in front of the camera and touches any tiles
+    """
+
+    device = means_3d.device
+    dtype = means_3d.dtype
+    world_to_camera = cameras.world_to_camera.to(device=device, dtype=dtype)  # [C, 4, 4], transposed
+    fx = cameras.fx.to(device=device, dtype=dtype)[:, None]  # [C, 1]
+    fy = cameras.fy.to(device=device, dtype=dtype)[:, None]
+    cx = cameras.cx.to(device=device, dtype=dtype)[:, None]
+    cy = cameras.cy.to(device=device, dtype=dtype)[:, None]
+    img_width = cameras.width.to(device=device)[:, None]
+    img_height = cameras.height.to(device=device)[:, None]
+    limx = 1.3 * (0.5 * img_width) / fx
+    limy = 1.3 * (0.5 * img_height) / fy
+    # the number of tiles along each axis
+    tile_grid = torch.stack([
+        (img_width + block_width - 1) // block_width,
+        (img_height + block_width - 1) // block_width,
+    ], dim=-1).long()  # [C, 1, 2]
+
+    rotations = world_to_camera[:, :3, :3].transpose(1, 2)  # [C, 3, 3], world-to-camera, not transposed
+
+    if chunk_size <= 0:
+        chunk_size = max(means_3d.shape[0], 1)
+
+    means_2d_list, depths_list, radii_list, mask_list = [], [], [], []
+    for start in range(0, means_3d.shape[0], chunk_size):
+        end = min(start + chunk_size, means_3d.shape[0])
+
+        # [C, n, 3]
+        t = torch.matmul(means_3d[start:end], world_to_camera[:, :3, :3]) + world_to_camera[:, None, 3, :3]
+        tx, ty, tz = t[..., 0], t[..., 1], t[..., 2]
+
+        # 3D covariance in camera space, [C, n, 3, 3]
+        cov_3d = compute_cov_3d(scales[start:end], scale_modifier, quaternions=quaternions[start:end])
+        cov_camera = torch.einsum("cij,njk,clk->cnil", rotations, cov_3d, rotations)
+
+        # only the first two rows of the Jacobian are non-zero: [a, 0, b], [0, c, d]
+        clamped_x = torch.clamp(tx / tz, min=-limx, max=limx) * tz
+        clamped_y = torch.clamp(ty / tz, min=-limy, max=limy) * tz
+        a = fx / tz
+        b = -(fx * clamped_x) / (tz * tz)
+        c = fy / tz
+        d = -(fy * clamped_y) / (tz * tz)
+        cov_2d_00 = a * a * cov_camera[..., 0, 0] + 2 * a * b * cov_camera[..., 0, 2] + b * b * cov_camera[..., 2, 2]
+        cov_2d_01 = a * c * cov_camera[..., 0, 1] + a * d * cov_camera[..., 0, 2] + b * c * cov_camera[..., 1, 2] + b * d * cov_camera[..., 2, 2]
+        cov_2d_11 = c * c * cov_camera[..., 1, 1] + 2 * c * d * cov_camera[..., 1, 2] + d * d * cov_camera[..., 2, 2]
+
+        # low-pass filter
+        cov_2d_00 = cov_2d_00 + 0.3
+        cov_2d_11 = cov_2d_11 + 0.3
+        cov_2d_det = cov_2d_00 * cov_2d_11 - cov_2d_01 * cov_2d_01
+
+        # project through camera intrinsics
+        normalized_z = tz + 1e-6
+        means_2d = torch.stack([
+            (fx * tx + cx * tz) / normalized_z,
+            (fy * ty + cy * tz) / normalized_z,
+        ], dim=-1)  # [C, n, 2]
+
+        # the radius from the larger eigenvalue
+        mid = 0.5 * (cov_2d_00 + cov_2d_11)
+        sqrt_diff = torch.sqrt(torch.clamp_min(mid * mid - cov_2d_det, 0.1))
+        radius = torch.ceil(3. * torch.sqrt(mid + sqrt_diff)).int()  # [C, n]
+
+        # touched tiles, inclusive min, exclusive max
+        rect_min = ((means_2d - radius[..., None]) / block_width).int()
+        rect_max = ((means_2d + radius[..., None]) / block_width).int() + 1
+        rect_min = torch.minimum(torch.clamp_min(rect_min, 0), tile_grid)
+        rect_max = torch.minimum(torch.clamp_min(rect_max, 0), tile_grid)
+        rect_diff = rect_max - rect_min
+        touched_tile_count = rect_diff[..., 0] * rect_diff[..., 1]
+
+        mask = (tz >= min_depth) & (touched_tile_count > 0) & (cov_2d_det > 0)
+        means_2d_list.append(torch.where(mask[..., None], means_2d, 0))
+        depths_list.append(torch.where(mask, tz, 0))
+        radii_list.append(torch.where(mask, radius, 0))
+        mask_list.append(mask)
+
+    if len(mask_list) == 0:
+        n_cameras = world_to_camera.shape[0]
+        return (
+            torch.zeros((n_cameras, 0, 2), dtype=dtype, device=device),
+            torch.zeros((n_cameras, 0), dtype=dtype, device=device),
+            torch.zeros((n_cameras, 0), dtype=torch.int, device=device),
+            torch.zeros((n_cameras, 0), dtype=torch.bool, device=device),
+        )
+
+    return torch.concat(means_2d_list, dim=1), torch.concat(depths_list, dim=1), torch.concat(radii_list, dim=1), torch.concat(mask_list, dim=1)
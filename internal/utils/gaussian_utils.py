@@ -292,73 +292,70 @@ class GaussianTransformUtils:
         return xyz, rotation
 
     @staticmethod
-    def transform_shs(features, rotation_matrix):
+    def get_e3nn_sh_rotation_matrices(sh_degree: int, rotation_matrix):
         """
         https://github.com/graphdeco-inria/gaussian-splatting/issues/176#issuecomment-2147223570
-        """
 
-        try:
-            from e3nn import o3
-            import einops
-            from einops import einsum
-        except:
-            print("Please run `pip install e3nn einops` to enable SHs rotation")
-            return features
+        Args:
+            rotation_matrix: [..., 3, 3]
 
-        if features.shape[1] == 1:
-            return features
-
-        features = features.clone()
+        Returns:
+            [..., (sh_degree + 1) ** 2 - 1, (sh_degree + 1) ** 2 - 1], the block-diagonal Wigner-D matrices
+        """
 
-        shs_feat = features[:, 1:, :]
+        from e3nn import o3
 
-        ## rotate shs
-        P = torch.tensor([[0, 0, 1], [1, 0, 0], [0, 1, 0]], dtype=shs_feat.dtype, device=shs_feat.device)  # switch axes: yzx -> xyz
+        P = torch.tensor([[0, 0, 1], [1, 0, 0], [0, 1, 0]], dtype=rotation_matrix.dtype, device=rotation_matrix.device)  # switch axes: yzx -> xyz
         inversed_P = torch.tensor([
             [0, 1, 0],
             [0, 0, 1],
             [1, 0, 0],
-        ], dtype=shs_feat.dtype, device=shs_feat.device)
+        ], dtype=rotation_matrix.dtype, device=rotation_matrix.device)
         permuted_rotation_matrix = inversed_P @ rotation_matrix @ P
         rot_angles = o3._rotation.matrix_to_angles(permuted_rotation_matrix.cpu())
 
-        # Construction coefficient
-        D_1 = o3.wigner_D(1, rot_angles[0], - rot_angles[1], rot_angles[2]).to(device=shs_feat.device)
-        D_2 = o3.wigner_D(2, rot_angles[0], - rot_angles[1], rot_angles[2]).to(device=shs_feat.device)
-        D_3 = o3.wigner_D(3, rot_angles[0], - rot_angles[1], rot_angles[2]).to(device=shs_feat.device)
-
-        # rotation of the shs features
-        one_degree_shs = shs_feat[:, 0:3]
-        one_degree_shs = einops.rearrange(one_degree_shs, 'n shs_num rgb -> n rgb shs_num')
-        one_degree_shs = einsum(
-            D_1,
-            one_degree_shs,
-            "... i j, ... j -> ... i",
-        )
-        one_degree_shs = einops.rearrange(one_degree_shs, 'n rgb shs_num -> n shs_num rgb')
-        shs_feat[:, 0:3] = one_degree_shs
-
-        if shs_feat.shape[1] >= 4:
-            two_degree_shs = shs_feat[:, 3:8]
-            two_degree_shs = einops.rearrange(two_degree_shs, 'n shs_num rgb -> n rgb shs_num')
-            two_degree_shs = einsum(
-                D_2,
-                two_degree_shs,
-                "... i j, ... j -> ... i",
-            )
-            two_degree_shs = einops.rearrange(two_degree_shs, 'n rgb shs_num -> n shs_num rgb')
-            shs_feat[:, 3:8] = two_degree_shs
-
-            if shs_feat.shape[1] >= 9:
-                three_degree_shs = shs_feat[:, 8:15]
-                three_degree_shs = einops.rearrange(three_degree_shs, 'n shs_num rgb -> n rgb shs_num')
-                three_degree_shs = einsum(
-                    D_3,
-                    three_degree_shs,
-                    "... i j, ... j -> ... i",
-                )
-                three_degree_shs = einops.rearrange(three_degree_shs, 'n rgb shs_num -> n shs_num rgb')
-                shs_feat[:, 8:15] = three_degree_shs
+        n_coeffs = (sh_degree + 1) ** 2 - 1
+        sh_rotation_matrices = torch.zeros(rotation_matrix.shape[:-2] + (n_coeffs, n_coeffs), dtype=rotation_matrix.dtype)
+        for l in range(1, sh_degree + 1):
+            sh_rotation_matrices[..., l ** 2 - 1:(l + 1) ** 2 - 1, l ** 2 - 1:(l + 1) ** 2 - 1] = o3.wigner_D(l, rot_angles[0], - rot_angles[1], rot_angles[2])
+
+        return sh_rotation_matrices.to(device=rotation_matrix.device)
+
+    @classmethod
+    def get_sh_rotation_matrices(cls, sh_degree: int, rotation_matrix, use_e3nn: bool = True):
+        """
+        Args:
+            rotation_matrix: [3, 3], or [N, 3, 3]
+            use_e3nn: build the Wigner-D matrices by e3nn, otherwise by `internal.utils.sh_utils.get_sh_rotation_matrices()`, which requires no extra dependency
+        """
+
+        if use_e3nn is True:
+            try:
+                return cls.get_e3nn_sh_rotation_matrices(sh_degree, rotation_matrix)
+            except ImportError:
+                print("e3nn not found, fallback to the built-in SHs rotation")
+
+        from internal.utils.sh_utils import get_sh_rotation_matrices
+        return get_sh_rotation_matrices(sh_degree, rotation_matrix)
+
+    @classmethod
+    def transform_shs(cls, features, rotation_matrix, use_e3nn: bool = True):
+        """
+        Args:
+            features: [N, (sh_degree + 1) ** 2, 3]
+            rotation_matrix: [3, 3] shared by all the Gaussians, or [N, 3, 3]
+        """
+
+        if features.shape[1] == 1:
+            return features
+
+        from internal.utils.sh_utils import rotate_sh
+
+        sh_degree = GaussianPlyUtils.detect_sh_degree_from_shs_rest(features[:, 1:, :])
+        sh_rotation_matrices = cls.get_sh_rotation_matrices(sh_degree, rotation_matrix, use_e3nn=use_e3nn)
+
+        features = features.clone()
+        features[:, 1:, :] = rotate_sh(features[:, 1:, :], sh_rotation_matrices)
 
         return features
 
@@ -2,6 +2,7 @@
 Codes are copied from https://github.com/hbb1/2d-gaussian-splatting
 """
 
+import os
 from typing import Iterable
 import torch
 import numpy as np
@@ -14,9 +15,28 @@ from tqdm.auto import tqdm
 class GS2DMeshUtils:
     @classmethod
     @torch.no_grad()
-    def render_views(cls, model, renderer, cameras: Iterable, bg_color: torch.Tensor):
-        rgbmaps = []
-        depthmaps = []
+    def render_views(
+            cls,
+            model,
+            renderer,
+            cameras: Iterable,
+            bg_color: torch.Tensor,
+            max_in_memory_bytes: int = -1,
+            spill_dir: str = None,
+    ):
+        """
+        Args:
+            max_in_memory_bytes: the maps exceeding this budget are spilled to disk and read back by memory mapping, -1 means unlimited
+        """
+
+        if max_in_memory_bytes < 0:
+            rgbmaps = []
+            depthmaps = []
+        else:
+            from internal.utils.map_store import SpillableMapStore
+            # split the budget by the number of channels
+            rgbmaps = SpillableMapStore(max_in_memory_bytes * 3 // 4, None if spill_dir is None else os.path.join(spill_dir, "rgb"))
+            depthmaps = SpillableMapStore(max_in_memory_bytes // 4, None if spill_dir is None else os.path.join(spill_dir, "depth"))
 
         for i, viewpoint_cam in tqdm(enumerate(cameras), total=len(cameras), desc="Rendering RGB and depth maps"):
             render_pkg = renderer(viewpoint_cam, model, bg_color)
@@ -141,11 +161,62 @@ class GS2DMeshUtils:
 
         return combined
 
+    @staticmethod
+    def sparse_marching_cubes_with_contraction(
+        sdf,
+        resolution=512,
+        bounding_box_min=(-1.0, -1.0, -1.0),
+        bounding_box_max=(1.0, 1.0, 1.0),
+        level=0,
+        inv_contraction=None,
+        max_range=32.0,
+        block_size: int = 64,
+        n_processes: int = 0,
+    ):
+        """
+        The same as `marching_cubes_with_contraction()`, but the SDF is evaluated at full resolution only in the blocks bracketing the level,
+        see `internal.utils.sparse_marching_cubes` for details.
+        """
+
+        from internal.utils.sparse_marching_cubes import sparse_marching_cubes
+
+        vertices, faces = sparse_marching_cubes(
+            sdf,
+            resolution=resolution,
+            bounding_box_min=bounding_box_min,
+            bounding_box_max=bounding_box_max,
+            level=level,
+            block_size=block_size,
+            n_processes=n_processes,
+            device=torch.device("cuda"),
+        )
+        combined = trimesh.Trimesh(vertices, faces)
+
+        # inverse contraction and clipping the points range
+        if inv_contraction is not None:
+            combined.vertices = inv_contraction(torch.from_numpy(combined.vertices).float().cuda()).cpu().numpy()
+            combined.vertices = np.clip(combined.vertices, -max_range, max_range)
+
+        return combined
+
     @classmethod
     @torch.no_grad()
-    def extract_mesh_unbounded(cls, maps, bound, cameras: Iterable, model, resolution: int = 1024):
+    def extract_mesh_unbounded(
+            cls,
+            maps,
+            bound,
+            cameras: Iterable,
+            model,
+            resolution: int = 1024,
+            sparse: bool = False,
+            n_processes: int = 0,
+    ):
         """
         Experimental features, extracting meshes from unbounded scenes, not fully test across datasets. 
+
+        sparse: evaluate the TSDF at full resolution only near the surface, instead of the whole grid
+        n_processes: the number of processes running marching cubes when `sparse=True`
+
         return o3d.mesh
         """
         def contract(x):
@@ -225,14 +296,25 @@ class GS2DMeshUtils:
         R = np.quantile(R, q=0.95)
         R = min(R + 0.01, 1.9)
 
-        mesh = cls.marching_cubes_with_contraction(
-            sdf=sdf_function,
-            bounding_box_min=(-R, -R, -R),
-            bounding_box_max=(R, R, R),
-            level=0,
-            resolution=N,
-            inv_contraction=inv_contraction,
-        )
+        if sparse:
+            mesh = cls.sparse_marching_cubes_with_contraction(
+                sdf=sdf_function,
+                bounding_box_min=(-R, -R, -R),
+                bounding_box_max=(R, R, R),
+                level=0,
+                resolution=N,
+                inv_contraction=inv_contraction,
+                n_processes=n_processes,
+            )
+        else:
+            mesh = cls.marching_cubes_with_contraction(
+                sdf=sdf_function,
+                bounding_box_min=(-R, -R, -R),
+                bounding_box_max=(R, R, R),
+                level=0,
+                resolution=N,
+                inv_contraction=inv_contraction,
+            )
 
         # coloring the mesh
         torch.cuda.empty_cache()
@@ -327,6 +409,49 @@ class GS2DMeshUtils:
         mesh = volume.extract_triangle_mesh()
         return mesh
 
+    @classmethod
+    @torch.no_grad()
+    def extract_mesh_bounded_sparse(
+        cls,
+        maps,
+        cameras,
+        voxel_size=0.004,
+        sdf_trunc=0.02,
+        depth_trunc=3,
+        batch_size: int = 8,
+        device=None,
+    ):
+        """
+        The same as `extract_mesh_bounded()`, but integrate the cameras in batches into a sparse voxel-hashing grid,
+        see `internal.utils.tsdf_fusion.SparseTSDFVolume`.
+
+        return o3d.mesh
+        """
+        from internal.utils.tsdf_fusion import SparseTSDFVolume
+
+        print("Running sparse tsdf volume integration ...")
+        print(f'voxel_size: {voxel_size}')
+        print(f'sdf_trunc: {sdf_trunc}')
+        print(f'depth_truc: {depth_trunc}')
+
+        rgbmaps, depthmaps = maps
+
+        volume = SparseTSDFVolume(
+            voxel_size=voxel_size,
+            sdf_trunc=sdf_trunc,
+            depth_trunc=depth_trunc,
+            device=device,
+        )
+        volume.integrate(rgbmaps, depthmaps, cameras, batch_size=batch_size)
+        print("{} blocks allocated, {:.2f} MB".format(volume.n_blocks, volume.nbytes / 1024 / 1024))
+
+        vertices, faces, colors = volume.extract_mesh()
+        mesh = o3d.geometry.TriangleMesh()
+        mesh.vertices = o3d.utility.Vector3dVector(vertices)
+        mesh.triangles = o3d.utility.Vector3iVector(faces.astype(np.int32))
+        mesh.vertex_colors = o3d.utility.Vector3dVector(np.clip(colors, 0., 1.))
+        return mesh
+
 
 def post_process_mesh(mesh, cluster_to_keep=1000):
     """
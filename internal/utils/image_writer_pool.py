@@ -0,0 +1,105 @@
+"""
+Write images in a process pool, so that the PNG encoding is not serialized by the GIL.
+
+The pixels are converted to `uint8` in the caller, then passed to the workers through shared memory instead of being pickled.
+The number of images in flight is bounded, `submit()` blocks once it is reached, so the memory used by the pending images is capped.
+"""
+
+import os
+import threading
+import traceback
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+from concurrent.futures import ProcessPoolExecutor
+from typing import Tuple
+import numpy as np
+
+
+def to_uint8_image(image: "torch.Tensor") -> "torch.Tensor":
+    """
+    The same conversion as `torchvision.utils.save_image()`.
+
+    Args:
+        image: [C, H, W], in [0, 1], C is 1 or 3
+
+    Returns:
+        [H, W, 3], uint8, on the same device as `image`
+    """
+
+    import torch
+
+    if image.shape[0] == 1:
+        image = image.repeat(3, 1, 1)
+    return image.mul(255).add_(0.5).clamp_(0, 255).permute(1, 2, 0).to(torch.uint8)
+
+
+def _write_image(shared_memory_name: str, shape: Tuple[int, ...], path: str):
+    from PIL import Image
+
+    shared_memory = SharedMemory(name=shared_memory_name)
+    try:
+        image = np.ndarray(shape, dtype=np.uint8, buffer=shared_memory.buf)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        Image.fromarray(image).save(path)
+        del image
+    finally:
+        shared_memory.close()
+
+
+class ImageWriterPool:
+    def __init__(self, n_processes: int, max_in_flight: int = 16):
+        """
+        Args:
+            n_processes: the number of writer processes
+            max_in_flight: the maximum number of the images submitted but not written yet
+        """
+
+        # `spawn` avoids forking the training process, which has CUDA contexts and many threads,
+        # the workers only import numpy and PIL
+        self.executor = ProcessPoolExecutor(max_workers=n_processes, mp_context=multiprocessing.get_context("spawn"))
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+        self.max_in_flight = max_in_flight
+
+    def submit(self, image: "torch.Tensor", path: str):
+        """
+        Args:
+            image: [H, W, 3], uint8, see `to_uint8_image()`
+            path: the output path of the PNG
+        """
+
+        self.in_flight.acquire()
+        try:
+            image = image.cpu().numpy()
+            shared_memory = SharedMemory(create=True, size=max(image.nbytes, 1))
+        except:
+            self.in_flight.release()
+            raise
+
+        try:
+            np.ndarray(image.shape, dtype=np.uint8, buffer=shared_memory.buf)[:] = image
+            future = self.executor.submit(_write_image, shared_memory.name, image.shape, path)
+        except:
+            self._release(shared_memory)
+            raise
+        future.add_done_callback(lambda f: self._on_done(f, shared_memory))
+
+    def _release(self, shared_memory: SharedMemory):
+        shared_memory.close()
+        shared_memory.unlink()
+        self.in_flight.release()
+
+    def _on_done(self, future, shared_memory: SharedMemory):
+        self._release(shared_memory)
+        if future.cancelled():
+            return
+        exception = future.exception()
+        if exception is not None:
+            traceback.print_exception(type(exception), exception, exception.__traceback__)
+
+    def close(self, cancel: bool = False):
+        """
+        Args:
+            cancel: drop the images not being written yet
+        """
+
+        self.executor.shutdown(wait=True, cancel_futures=cancel)
@@ -0,0 +1,463 @@
+"""
+The k-nearest neighbor graph of a point cloud, based on a voxel hash, in pure PyTorch, runs on both CPU and GPU.
+
+The points are hashed by their voxel coordinates and sorted by the hashes.
+The candidates of a query are the points in the cube of `(2r + 1)^3` voxels around it,
+its k nearest ones among them are exact if the k-th distance is not larger than the distance to the boundary of the cube,
+otherwise the cube is enlarged, and the queries still not resolved by the largest cube fall back to the brute-force search.
+The queries are processed in chunks, whose number of candidates is bounded.
+
+The graph is keyed by a fingerprint of the points, and can be updated incrementally after pruning or appending points.
+"""
+
+from typing import Optional, Tuple, Dict, Any
+import torch
+from internal.utils.fingerprint import get_tensors_fingerprint
+
+_HASH_PRIMES = (73856093, 19349663, 83492791)
+
+
+def _hash_coordinates(coordinates: torch.Tensor) -> torch.Tensor:
+    # the collisions only add extra candidates, whose distances are calculated exactly
+    return (coordinates[..., 0] * _HASH_PRIMES[0]) ^ (coordinates[..., 1] * _HASH_PRIMES[1]) ^ (coordinates[..., 2] * _HASH_PRIMES[2])
+
+
+class VoxelHash:
+    def __init__(self, points: torch.Tensor, voxel_size: float):
+        """
+        Args:
+            points: [N, 3]
+            voxel_size: the edge length of the voxels
+        """
+
+        self.points = points
+        self.voxel_size = voxel_size
+
+        keys = _hash_coordinates(self.get_voxel_coordinates(points))
+        sorted_keys, self.order = torch.sort(keys)
+        self.voxel_keys, self.voxel_counts = torch.unique_consecutive(sorted_keys, return_counts=True)
+        self.voxel_starts = torch.cumsum(self.voxel_counts, dim=0) - self.voxel_counts
+
+    def get_voxel_coordinates(self, points: torch.Tensor) -> torch.Tensor:
+        return torch.floor(points / self.voxel_size).long()
+
+    def count_candidates(self, queries: torch.Tensor, radius: int) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        Returns:
+            starts: [Q, O], the start of the points of the neighbor voxels in `order`
+            counts: [Q, O], the number of the points of the neighbor voxels, 0 if the voxel is empty or a duplicated hash
+            margins: [Q], the distance from the query to the boundary of the cube
+        """
+
+        device = queries.device
+        steps = torch.arange(-radius, radius + 1, device=device)
+        offsets = torch.stack(torch.meshgrid(steps, steps, steps, indexing="ij"), dim=-1).reshape(-1, 3)  # [O, 3]
+
+        query_coordinates = self.get_voxel_coordinates(queries)  # [Q, 3]
+        keys = _hash_coordinates(query_coordinates[:, None, :] + offsets[None, :, :])  # [Q, O]
+        # avoid counting a hash twice
+        keys, _ = torch.sort(keys, dim=-1)
+        is_duplicated = torch.zeros_like(keys, dtype=torch.bool)
+        is_duplicated[:, 1:] = keys[:, 1:] == keys[:, :-1]
+
+        positions = torch.searchsorted(self.voxel_keys, keys).clamp_(max=self.voxel_keys.shape[0] - 1)
+        found = torch.logical_and(self.voxel_keys[positions] == keys, ~is_duplicated)
+        counts = torch.where(found, self.voxel_counts[positions], 0)
+        starts = self.voxel_starts[positions]
+
+        cube_min = (query_coordinates - radius).to(queries.dtype) * self.voxel_size
+        cube_max = (query_coordinates + radius + 1).to(queries.dtype) * self.voxel_size
+        margins = torch.minimum(queries - cube_min, cube_max - queries).amin(dim=-1)
+
+        return starts, counts, margins
+
+
+def _select_top_k(
+        distances: torch.Tensor,
+        indices: torch.Tensor,
+        groups: torch.Tensor,
+        n_groups: int,
+        k: int,
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    The k smallest distances of each group.
+
+    Args:
+        distances: [M]
+        indices: [M]
+        groups: [M], the group of each candidate, in ascending order
+
+    Returns:
+        distances: [n_groups, k], `inf` if not enough candidates
+        indices: [n_groups, k], -1 if not enough candidates
+        n_found: [n_groups]
+    """
+
+    device = distances.device
+    # sort by distances, then by groups stably, so that the candidates of a group are sorted by their distances
+    order = torch.argsort(distances, stable=True)
+    order = order[torch.argsort(groups[order], stable=True)]
+    groups = groups[order]
+
+    group_sizes = torch.bincount(groups, minlength=n_groups)
+    group_starts = torch.cumsum(group_sizes, dim=0) - group_sizes
+    ranks = torch.arange(groups.shape[0], device=device) - group_starts[groups]
+    selected = ranks < k
+
+    top_k_distances = torch.full((n_groups, k), torch.inf, dtype=distances.dtype, device=device)
+    top_k_indices = torch.full((n_groups, k), -1, dtype=torch.long, device=device)
+    top_k_distances[groups[selected], ranks[selected]] = distances[order[selected]]
+    top_k_indices[groups[selected], ranks[selected]] = indices[order[selected]]
+
+    return top_k_distances, top_k_indices, torch.clamp(group_sizes, max=k)
+
+
+def brute_force_knn(
+        queries: torch.Tensor,
+        points: torch.Tensor,
+        k: int,
+        max_pairs: int = 1 << 24,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Returns:
+        distances: [Q, k], squared, in ascending order
+        indices: [Q, k]
+    """
+
+    k = min(k, points.shape[0])
+    chunk_size = max(max_pairs // max(points.shape[0], 1), 1)
+    distance_list, index_list = [], []
+    for start in range(0, queries.shape[0], chunk_size):
+        distances = ((queries[start:start + chunk_size, None, :] - points[None, :, :]) ** 2).sum(dim=-1)
+        distances, indices = torch.topk(distances, k, dim=-1, largest=False, sorted=True)
+        distance_list.append(distances)
+        index_list.append(indices)
+    if len(distance_list) == 0:
+        return queries.new_zeros((0, k)), torch.zeros((0, k), dtype=torch.long, device=queries.device)
+    return torch.concat(distance_list), torch.concat(index_list)
+
+
+def estimate_voxel_size(points: torch.Tensor, k: int, n_samples: int = 1024, seed: int = 0) -> float:
+    """The median distance to the k-th nearest neighbor of some sampled points, the k-NN of most points can be resolved by the 3x3x3 voxels"""
+
+    generator = torch.Generator().manual_seed(seed)
+    samples = torch.randperm(points.shape[0], generator=generator)[:n_samples].to(points.device)
+    distances, _ = brute_force_knn(points[samples], points, k)
+    voxel_size = distances[:, -1].median().sqrt().item()
+    if voxel_size > 0:
+        return voxel_size
+    # too many duplicated points
+    extent = (points.amax(dim=0) - points.amin(dim=0)).amax().item()
+    return max(extent / max(points.shape[0], 1) ** (1. / 3.), 1e-6)
+
+
+def voxel_hash_knn(
+        queries: torch.Tensor,
+        index: VoxelHash,
+        k: int,
+        max_distances: Optional[torch.Tensor] = None,
+        chunk_size: int = 16384,
+        max_candidates: int = 1 << 24,
+        max_search_radius: int = 4,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Args:
+        queries: [Q, 3]
+        index: the points to search
+        max_distances: [Q], optional, only the neighbors not farther than them are required
+
+    Returns:
+        distances: [Q, k], squared, in ascending order, `inf` if not found
+        indices: [Q, k], -1 if not found
+    """
+
+    device = queries.device
+    n_queries = queries.shape[0]
+    distances = torch.full((n_queries, k), torch.inf, dtype=queries.dtype, device=device)
+    indices = torch.full((n_queries, k), -1, dtype=torch.long, device=device)
+
+    pending = torch.arange(n_queries, device=device)
+    radius = 1
+    while pending.shape[0] > 0 and radius <= max_search_radius:
+        unresolved = []
+        chunks = list(torch.split(pending, chunk_size))
+        while len(chunks) > 0:
+            chunk = chunks.pop()
+            chunk_queries = queries[chunk]
+            starts, counts, margins = index.count_candidates(chunk_queries, radius)
+            n_candidates = counts.sum()
+            if n_candidates > max_candidates and chunk.shape[0] > 1:
+                chunks += list(torch.split(chunk, (chunk.shape[0] + 1) // 2))
+                continue
+
+            # expand the voxels to the points
+            counts = counts.reshape(-1)
+            voxel_queries = torch.arange(chunk.shape[0], device=device).repeat_interleave(starts.shape[1])
+            candidate_queries = voxel_queries.repeat_interleave(counts)
+            candidate_offsets = torch.arange(candidate_queries.shape[0], device=device) - (torch.cumsum(counts, dim=0) - counts).repeat_interleave(counts)
+            candidates = index.order[starts.reshape(-1).repeat_interleave(counts) + candidate_offsets]
+            candidate_distances = ((index.points[candidates] - chunk_queries[candidate_queries]) ** 2).sum(dim=-1)
+
+            chunk_distances, chunk_indices, n_found = _select_top_k(candidate_distances, candidates, candidate_queries, chunk.shape[0], k)
+
+            # no points outside the cube can be nearer than the k-th one
+            squared_margins = margins ** 2
+            resolved = torch.logical_and(n_found == k, chunk_distances[:, -1] <= squared_margins)
+            if max_distances is not None:
+                resolved = torch.logical_or(resolved, max_distances[chunk] ** 2 <= squared_margins)
+            distances[chunk[resolved]] = chunk_distances[resolved]
+            indices[chunk[resolved]] = chunk_indices[resolved]
+            unresolved.append(chunk[~resolved])
+
+        pending = torch.concat(unresolved) if len(unresolved) > 0 else pending[:0]
+        radius *= 2
+
+    if pending.shape[0] > 0:
+        # the isolated ones
+        pending_distances, pending_indices = brute_force_knn(queries[pending], index.points, k, max_pairs=max_candidates)
+        distances[pending, :pending_distances.shape[1]] = pending_distances
+        indices[pending, :pending_indices.shape[1]] = pending_indices
+
+    return distances, indices
+
+
+class _GatherMean(torch.autograd.Function):
+    @staticmethod
+    def forward(ctx, features: torch.Tensor, neighbors: torch.Tensor, columns: Optional[torch.Tensor], chunk_size: int):
+        ctx.save_for_backward(neighbors, columns)
+        ctx.chunk_size = chunk_size
+        ctx.n_features = features.shape[0]
+
+        outputs = features.new_empty((neighbors.shape[0], features.shape[1]))
+        for start in range(0, neighbors.shape[0], chunk_size):
+            chunk_neighbors = neighbors[start:start + chunk_size]
+            if columns is not None:
+                chunk_neighbors = chunk_neighbors[:, columns]
+            outputs[start:start + chunk_size] = features[chunk_neighbors, :].mean(dim=1)
+        return outputs
+
+    @staticmethod
+    def backward(ctx, grad_outputs: torch.Tensor):
+        neighbors, columns = ctx.saved_tensors
+        n_neighbors = neighbors.shape[1] if columns is None else columns.shape[0]
+
+        grad_features = grad_outputs.new_zeros((ctx.n_features, grad_outputs.shape[1]))
+        for start in range(0, neighbors.shape[0], ctx.chunk_size):
+            chunk_neighbors = neighbors[start:start + ctx.chunk_size]
+            if columns is not None:
+                chunk_neighbors = chunk_neighbors[:, columns]
+            chunk_grads = (grad_outputs[start:start + ctx.chunk_size] / n_neighbors).repeat_interleave(n_neighbors, dim=0)
+            grad_features.index_add_(0, chunk_neighbors.reshape(-1), chunk_grads)
+        return grad_features, None, None, None
+
+
+def gather_mean(features: torch.Tensor, neighbors: torch.Tensor, columns: Optional[torch.Tensor] = None, chunk_size: int = 65536) -> torch.Tensor:
+    """
+    `features[neighbors[:, columns]].mean(dim=1)`, without materializing the [N, K, C] gathered features.
+
+    Args:
+        features: [N, C]
+        neighbors: [M, K]
+        columns: optional, the neighbors used
+    """
+
+    if columns is not None:
+        columns = columns.to(neighbors.device)
+    return _GatherMean.apply(features, neighbors, columns, chunk_size)
+
+
+def smooth_features(features: torch.Tensor, neighbors: torch.Tensor, dropout: float, chunk_size: int = 65536) -> torch.Tensor:
+    """The mean of the features of the neighbors, a random part of the neighbors are dropped if `0 < dropout < 1`"""
+
+    k = neighbors.shape[1]
+    columns = None
+    if 0 < dropout < 1:
+        # discard some points randomly
+        columns = torch.randperm(k)[:int(k * dropout)]
+    return gather_mean(features, neighbors, columns, chunk_size=chunk_size)
+
+
+class KNNGraph:
+    def __init__(
+            self,
+            k: int,
+            voxel_size: Optional[float] = None,
+            chunk_size: int = 16384,
+            max_candidates: int = 1 << 24,
+            max_search_radius: int = 4,
+    ):
+        """
+        Args:
+            k: the number of the neighbors, including the point itself
+            voxel_size: estimated from the points if it is None
+            chunk_size: the number of the queries processed at a time
+            max_candidates: the maximum number of the candidates of a chunk, which bounds the memory
+            max_search_radius: the queries not resolved by the cube of this radius (in voxels) fall back to the brute-force search
+        """
+
+        self.k = k
+        self.voxel_size = voxel_size
+        self.chunk_size = chunk_size
+        self.max_candidates = max_candidates
+        self.max_search_radius = max_search_radius
+
+        self.neighbors: Optional[torch.Tensor] = None  # [N, k]
+        self.kth_distances: Optional[torch.Tensor] = None  # [N], squared
+        self.fingerprint: Optional[str] = None
+
+        # avoid recalculating the fingerprint of the same unmodified tensor
+        self._points_identity = None
+
+    @staticmethod
+    def _get_identity(points: torch.Tensor):
+        return points.data_ptr(), points._version, tuple(points.shape), points.device
+
+    def get_fingerprint(self, points: torch.Tensor) -> str:
+        identity = self._get_identity(points)
+        if self.fingerprint is not None and identity == self._points_identity:
+            return self.fingerprint
+        return get_tensors_fingerprint([points])
+
+    def _query(self, queries: torch.Tensor, index: VoxelHash, k: int, max_distances: Optional[torch.Tensor] = None):
+        return voxel_hash_knn(
+            queries,
+            index,
+            k,
+            max_distances=max_distances,
+            chunk_size=self.chunk_size,
+            max_candidates=self.max_candidates,
+            max_search_radius=self.max_search_radius,
+        )
+
+    def _get_index(self, points: torch.Tensor) -> VoxelHash:
+        if self.voxel_size is None:
+            self.voxel_size = estimate_voxel_size(points, self.k)
+        return VoxelHash(points, self.voxel_size)
+
+    def _set(self, points: torch.Tensor, neighbors: torch.Tensor, kth_distances: torch.Tensor, fingerprint: Optional[str] = None):
+        self.neighbors = neighbors
+        self.kth_distances = kth_distances
+        self.fingerprint = self.get_fingerprint(points) if fingerprint is None else fingerprint
+        self._points_identity = self._get_identity(points)
+
+    @torch.no_grad()
+    def build(self, points: torch.Tensor) -> torch.Tensor:
+        if points.shape[0] < self.k:
+            raise ValueError("{} points are less than k={}".format(points.shape[0], self.k))
+        points = points.detach()
+        distances, neighbors = self._query(points, self._get_index(points), self.k)
+        self._set(points, neighbors, distances[:, -1])
+        return neighbors
+
+    @torch.no_grad()
+    def get(self, points: torch.Tensor) -> torch.Tensor:
+        """
+        Returns:
+            [N, k], the indices of the neighbors in ascending order of the distances, the first one is the point itself
+        """
+
+        points = points.detach()
+        if self.neighbors is not None and self.neighbors.shape[0] == points.shape[0]:
+            fingerprint = self.get_fingerprint(points)
+            # the ones loaded from the legacy checkpoints do not have fingerprints
+            if self.fingerprint is None or fingerprint == self.fingerprint:
+                kth_distances = self.kth_distances
+                if kth_distances is None:
+                    kth_distances = ((points[self.neighbors[:, -1].to(points.device)] - points) ** 2).sum(dim=-1)
+                self._set(points, self.neighbors.to(points.device), kth_distances.to(points.device), fingerprint)
+                return self.neighbors
+        return self.build(points)
+
+    def _update_rows(self, points: torch.Tensor, index: VoxelHash, rows: torch.Tensor):
+        if rows.shape[0] == 0:
+            return
+        distances, neighbors = self._query(points[rows], index, self.k)
+        self.neighbors[rows] = neighbors
+        self.kth_distances[rows] = distances[:, -1]
+
+    @torch.no_grad()
+    def prune(self, valid_mask: torch.Tensor, points: torch.Tensor) -> torch.Tensor:
+        """
+        Args:
+            valid_mask: [N_old], `True` to keep
+            points: [N_new, 3], the remaining ones
+
+        Returns:
+            the neighbors of the remaining points
+        """
+
+        points = points.detach()
+        if self.neighbors is None:
+            return self.build(points)
+        if points.shape[0] < self.k:
+            raise ValueError("{} points are less than k={}".format(points.shape[0], self.k))
+
+        valid_mask = valid_mask.to(self.neighbors.device)
+        old_to_new = torch.full((valid_mask.shape[0],), -1, dtype=torch.long, device=valid_mask.device)
+        old_to_new[valid_mask] = torch.arange(points.shape[0], device=valid_mask.device)
+
+        self.neighbors = old_to_new[self.neighbors[valid_mask]]
+        self.kth_distances = self.kth_distances[valid_mask]
+        # only the ones whose neighbors are pruned change
+        affected = (self.neighbors < 0).any(dim=-1).nonzero().squeeze(-1)
+        self._update_rows(points, self._get_index(points), affected)
+        self._set(points, self.neighbors, self.kth_distances)
+        return self.neighbors
+
+    @torch.no_grad()
+    def append(self, points: torch.Tensor) -> torch.Tensor:
+        """
+        Args:
+            points: [N_old + N_new, 3], the first `N_old` ones are the ones the graph built on
+
+        Returns:
+            the neighbors of all the points
+        """
+
+        points = points.detach()
+        if self.neighbors is None:
+            return self.build(points)
+        n_old = self.neighbors.shape[0]
+        new_points = points[n_old:]
+        if new_points.shape[0] == 0:
+            return self.neighbors
+
+        index = self._get_index(points)
+        new_distances, new_neighbors = self._query(new_points, index, self.k)
+
+        # the old ones having a new point nearer than their k-th neighbor
+        distances_to_new, _ = self._query(
+            points[:n_old],
+            self._get_index(new_points),
+            1,
+            max_distances=self.kth_distances.sqrt(),
+        )
+        affected = (distances_to_new[:, 0] < self.kth_distances).nonzero().squeeze(-1)
+
+        self.neighbors = torch.concat([self.neighbors, new_neighbors], dim=0)
+        self.kth_distances = torch.concat([self.kth_distances, new_distances[:, -1]], dim=0)
+        self._update_rows(points, index, affected)
+        self._set(points, self.neighbors, self.kth_distances)
+        return self.neighbors
+
+    def state_dict(self) -> Optional[Dict[str, Any]]:
+        if self.neighbors is None:
+            return None
+        return {
+            # the same keys as the previous `feature_smooth_map`
+            "K": self.k,
+            "m": self.neighbors,
+            "kth_distances": self.kth_distances,
+            "fingerprint": self.fingerprint,
+            "voxel_size": self.voxel_size,
+        }
+
+    def load_state_dict(self, state_dict: Optional[Dict[str, Any]]):
+        if state_dict is None:
+            return
+        self.k = state_dict["K"]
+        self.neighbors = state_dict["m"]
+        self.kth_distances = state_dict.get("kth_distances", None)
+        self.fingerprint = state_dict.get("fingerprint", None)
+        self.voxel_size = state_dict.get("voxel_size", self.voxel_size)
+        self._points_identity = None
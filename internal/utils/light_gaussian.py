@@ -1,55 +1,203 @@
-from typing import Iterable, Tuple
+import hashlib
+from dataclasses import dataclass
+from typing import Iterable, Tuple, Callable, Optional, List, Dict, Any
 import torch
-from internal.renderers.gsplat_hit_pixel_count_renderer import GSplatHitPixelCountRenderer
+from internal.utils.fingerprint import get_tensors_fingerprint
 
 
-def get_count_and_score(
-        gaussian_model,
-        cameras: Iterable,
-        anti_aliased: bool,
-) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
-    device = gaussian_model.get_xyz.device
-    num_gaussians = gaussian_model.get_xyz.shape[0]
-
-    # initialize accumulation tensors
-    count_total = torch.zeros(
-        num_gaussians,
-        dtype=torch.int,
-        device=device,
-    )
-    opacity_score_total = torch.zeros(
-        num_gaussians,
-        dtype=torch.float,
-        device=device,
-    )
-    alpha_score_total = torch.zeros(
-        num_gaussians,
-        dtype=torch.float,
-        device=device,
-    )
-    visibility_score_total = torch.zeros(
-        num_gaussians,
-        dtype=torch.float,
-        device=device,
-    )
-
-    # count for each training camera
+def gsplat_hit_pixel_count(gaussian_model, cameras: List, anti_aliased: bool, out: torch.Tensor):
+    """
+    The default hit counter of `ImportanceScoreEngine`, the kernel of gsplat processes one camera at a time,
+    so the cameras of a batch are counted one by one, and added to `out` in place.
+    """
+
+    from internal.renderers.gsplat_hit_pixel_count_renderer import GSplatHitPixelCountRenderer
+
+    means = gaussian_model.get_xyz
+    opacities = gaussian_model.get_opacity
+    scales = gaussian_model.get_scaling
+    rotations = gaussian_model.get_rotation
     for camera in cameras:
         count, opacity_score, alpha_score, visibility_score = GSplatHitPixelCountRenderer.hit_pixel_count(
-            means3D=gaussian_model.get_xyz,
-            opacities=gaussian_model.get_opacity,
-            scales=gaussian_model.get_scaling,
-            rotations=gaussian_model.get_rotation,
-            viewpoint_camera=camera.to_device(device),
+            means3D=means,
+            opacities=opacities,
+            scales=scales,
+            rotations=rotations,
+            viewpoint_camera=camera,
             anti_aliased=anti_aliased,
         )
-        # add to total
-        count_total += count
-        opacity_score_total += opacity_score
-        alpha_score_total += alpha_score
-        visibility_score_total += visibility_score
+        out[:, 0] += count
+        out[:, 1] += opacity_score
+        out[:, 2] += alpha_score
+        out[:, 3] += visibility_score
+
+
+def get_gaussian_fingerprint(gaussian_model) -> str:
+    """Identify a set of Gaussians by the properties the hit counting depends on"""
+
+    return get_tensors_fingerprint([
+        gaussian_model.get_xyz,
+        gaussian_model.get_opacity,
+        gaussian_model.get_scaling,
+        gaussian_model.get_rotation,
+    ])
+
+
+def get_camera_set_hash(cameras: Iterable) -> str:
+    h = hashlib.sha1()
+    for camera in cameras:
+        for name in ["R", "T", "fx", "fy", "cx", "cy", "width", "height", "distortion_params"]:
+            value = getattr(camera, name)
+            if isinstance(value, torch.Tensor):
+                h.update(value.detach().cpu().contiguous().numpy().tobytes())
+    return h.hexdigest()
+
+
+@dataclass
+class ImportanceScores:
+    scores: torch.Tensor
+    """[N, 4], float64: count, opacity score, alpha score, visibility score"""
+
+    gaussian_fingerprint: str
+
+    camera_set_hash: str
+
+    anti_aliased: bool
+
+    @property
+    def count(self) -> torch.Tensor:
+        return self.scores[:, 0].int()
+
+    @property
+    def opacity_score(self) -> torch.Tensor:
+        return self.scores[:, 1].float()
+
+    @property
+    def alpha_score(self) -> torch.Tensor:
+        return self.scores[:, 2].float()
+
+    @property
+    def visibility_score(self) -> torch.Tensor:
+        return self.scores[:, 3].float()
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {
+            "scores": self.scores,
+            "gaussian_fingerprint": self.gaussian_fingerprint,
+            "camera_set_hash": self.camera_set_hash,
+            "anti_aliased": self.anti_aliased,
+        }
+
 
-    return count_total, opacity_score_total, alpha_score_total, visibility_score_total
+class ImportanceScoreEngine:
+    def __init__(
+            self,
+            anti_aliased: bool,
+            camera_batch_size: int = 16,
+            hit_counter: Callable[[Any, List, bool, torch.Tensor], None] = gsplat_hit_pixel_count,
+    ):
+        """
+        Args:
+            camera_batch_size: the number of the cameras moved to the device and passed to `hit_counter` at a time
+            hit_counter: add the counts and the scores of a batch of cameras to the [N, 4] buffer, see `gsplat_hit_pixel_count()`
+        """
+
+        self.anti_aliased = anti_aliased
+        self.camera_batch_size = camera_batch_size
+        self.hit_counter = hit_counter
+
+        self.cache: Optional[ImportanceScores] = None
+
+    @torch.no_grad()
+    def compute(self, gaussian_model, cameras: Iterable) -> ImportanceScores:
+        device = gaussian_model.get_xyz.device
+        cameras = list(cameras)
+
+        # all the counts and the scores are accumulated in a single buffer,
+        # float64 keeps the counts exact, which can exceed the precision of float32 for large Gaussians
+        scores = torch.zeros((gaussian_model.get_xyz.shape[0], 4), dtype=torch.float64, device=device)
+        for start in range(0, len(cameras), self.camera_batch_size):
+            batch = [camera.to_device(device) for camera in cameras[start:start + self.camera_batch_size]]
+            self.hit_counter(gaussian_model, batch, self.anti_aliased, scores)
+
+        return ImportanceScores(
+            scores=scores,
+            gaussian_fingerprint=get_gaussian_fingerprint(gaussian_model),
+            camera_set_hash=get_camera_set_hash(cameras),
+            anti_aliased=self.anti_aliased,
+        )
+
+    def get_scores(self, gaussian_model, cameras: Iterable) -> ImportanceScores:
+        """Return the cached scores if they are calculated on the same Gaussians and cameras, otherwise recompute them"""
+
+        cameras = list(cameras)
+        if self.cache is not None \
+                and self.cache.anti_aliased == self.anti_aliased \
+                and self.cache.camera_set_hash == get_camera_set_hash(cameras) \
+                and self.cache.gaussian_fingerprint == get_gaussian_fingerprint(gaussian_model):
+            # may be restored from a checkpoint on another device
+            self.cache.scores = self.cache.scores.to(gaussian_model.get_xyz.device)
+            return self.cache
+
+        self.cache = self.compute(gaussian_model, cameras)
+        return self.cache
+
+    def prune(self, valid_mask: torch.Tensor, gaussian_model):
+        """
+        Keep the cached scores of the remaining Gaussians after pruning, instead of recomputing them.
+
+        The change of the transmittance caused by the removed Gaussians is ignored,
+        the same as pruning by the scores calculated before pruning.
+
+        Args:
+            valid_mask: `True` to keep, the same one used to prune `gaussian_model`
+            gaussian_model: the pruned one
+        """
+
+        if self.cache is None:
+            return
+        self.cache = ImportanceScores(
+            scores=self.cache.scores[valid_mask.to(self.cache.scores.device)],
+            gaussian_fingerprint=get_gaussian_fingerprint(gaussian_model),
+            camera_set_hash=self.cache.camera_set_hash,
+            anti_aliased=self.cache.anti_aliased,
+        )
+
+    def state_dict(self, gaussian_model=None) -> Optional[Dict[str, Any]]:
+        """
+        Args:
+            gaussian_model: the cache is dropped if it is not calculated on this one, since it can never be reused
+
+        Returns:
+            `None` if nothing is cached, the scores are stored in float32 to halve the size
+        """
+
+        if self.cache is None:
+            return None
+        if gaussian_model is not None and self.cache.gaussian_fingerprint != get_gaussian_fingerprint(gaussian_model):
+            self.cache = None
+            return None
+        state_dict = self.cache.state_dict()
+        state_dict["scores"] = state_dict["scores"].float()
+        return state_dict
+
+    def load_state_dict(self, state_dict: Optional[Dict[str, Any]]):
+        if state_dict is None:
+            self.cache = None
+            return
+        state_dict = dict(state_dict)
+        state_dict["scores"] = state_dict["scores"].double()
+        self.cache = ImportanceScores(**state_dict)
+
+
+def get_count_and_score(
+        gaussian_model,
+        cameras: Iterable,
+        anti_aliased: bool,
+        camera_batch_size: int = 16,
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+    scores = ImportanceScoreEngine(anti_aliased=anti_aliased, camera_batch_size=camera_batch_size).compute(gaussian_model, cameras)
+    return scores.count, scores.opacity_score, scores.alpha_score, scores.visibility_score
 
 
 def calculate_v_imp_score(scales, importance_scores, v_pow):
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+from typing import List, Union
+import numpy as np
+import torch
+
+
+class SpillableMapStore:
+    """
+    A list of tensors kept in host memory until the budget is exceeded,
+    the following ones are spilled to `.npy` files and read back by memory mapping.
+    """
+
+    def __init__(self, max_in_memory_bytes: int = -1, spill_dir: str = None):
+        """
+        Args:
+            max_in_memory_bytes: -1 means unlimited, 0 means spill all
+            spill_dir: where to save the spilled ones, default is a temporary directory removed by `close()`
+        """
+
+        self.max_in_memory_bytes = max_in_memory_bytes
+        self.spill_dir = spill_dir
+        self._is_temporary_spill_dir = False
+
+        self.items: List[Union[torch.Tensor, str]] = []
+        self.in_memory_bytes = 0
+        self.n_spilled = 0
+
+    def _get_spill_dir(self) -> str:
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix="spilled_maps_")
+            self._is_temporary_spill_dir = True
+        os.makedirs(self.spill_dir, exist_ok=True)
+        return self.spill_dir
+
+    def append(self, value: torch.Tensor):
+        value = value.detach().cpu()
+        n_bytes = value.numel() * value.element_size()
+        if self.max_in_memory_bytes < 0 or self.in_memory_bytes + n_bytes <= self.max_in_memory_bytes:
+            self.items.append(value)
+            self.in_memory_bytes += n_bytes
+            return
+
+        path = os.path.join(self._get_spill_dir(), "{:06d}.npy".format(len(self.items)))
+        np.save(path, value.numpy())
+        self.items.append(path)
+        self.n_spilled += 1
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index: int) -> torch.Tensor:
+        item = self.items[index]
+        if isinstance(item, str):
+            # copy-on-write memory map, the file is paged in lazily and never modified
+            return torch.from_numpy(np.load(item, mmap_mode="c"))
+        return item
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        self.items.clear()
+        self.in_memory_bytes = 0
+        if self._is_temporary_spill_dir and self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+            self._is_temporary_spill_dir = False
+
+    def __del__(self):
+        self.close()
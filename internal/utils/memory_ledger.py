@@ -0,0 +1,107 @@
+"""
+Account the memory of the training by component, from the metadata of the tensors, without touching their data.
+
+The components are:
+    gaussians/{property}: the Gaussian parameters
+    optimizer/{param group}: the states of the optimizers, e.g. the Adam moments
+    density/{buffer}: the statistics buffers of the density controller
+    dataloader/cached_images: the images cached by `CacheDataLoader`
+    renderer/outputs: the tensors returned by the renderer, the ones saved by autograd are not visible here
+"""
+
+import dataclasses
+from typing import Any, Dict, Iterable, Optional, Set
+import torch
+
+
+def tensor_nbytes(tensor: torch.Tensor) -> int:
+    return tensor.numel() * tensor.element_size()
+
+
+def nested_tensor_nbytes(obj: Any, visited: Optional[Set[int]] = None) -> int:
+    """The total size of the tensors in nested dicts, lists, tuples and dataclasses, each tensor is counted once"""
+
+    if visited is None:
+        visited = set()
+    if isinstance(obj, torch.Tensor):
+        if id(obj) in visited:
+            return 0
+        visited.add(id(obj))
+        return tensor_nbytes(obj)
+    if isinstance(obj, dict):
+        return sum(nested_tensor_nbytes(i, visited) for i in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(nested_tensor_nbytes(i, visited) for i in obj)
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return sum(nested_tensor_nbytes(getattr(obj, i.name), visited) for i in dataclasses.fields(obj))
+    return 0
+
+
+def get_gaussian_nbytes(gaussian_model) -> Dict[str, int]:
+    return {name: tensor_nbytes(value) for name, value in gaussian_model.properties.items()}
+
+
+def get_optimizer_state_nbytes(optimizers: Iterable) -> Dict[str, int]:
+    """
+    Returns:
+        {param group name: the size of the states of its parameters}, the unnamed groups are `{optimizer index}_{group index}`
+    """
+
+    nbytes = {}
+    for optimizer_idx, optimizer in enumerate(optimizers):
+        if optimizer is None:
+            continue
+        # unwrap `LightningOptimizer`
+        optimizer = getattr(optimizer, "optimizer", optimizer)
+        for group_idx, group in enumerate(optimizer.param_groups):
+            name = group.get("name", "{}_{}".format(optimizer_idx, group_idx))
+            nbytes[name] = nbytes.get(name, 0) + sum(
+                nested_tensor_nbytes(optimizer.state[param]) if param in optimizer.state else 0
+                for param in group["params"]
+            )
+    return nbytes
+
+
+def get_buffer_nbytes(module: torch.nn.Module) -> Dict[str, int]:
+    return {name: tensor_nbytes(buffer) for name, buffer in module.named_buffers()}
+
+
+def get_cached_image_nbytes(dataloader) -> int:
+    """Only the images cached persistently, i.e. `max_cache_num < 0`, are visible"""
+
+    cached = getattr(dataloader, "cached", None)
+    if cached is None:
+        return 0
+    return nested_tensor_nbytes(cached)
+
+
+def get_nbytes_per_gaussian(gaussian_model, optimizers: Iterable, density_controller: Optional[torch.nn.Module] = None) -> float:
+    """The memory growing with the number of Gaussians: the parameters, their optimizer states and the density statistics"""
+
+    n_gaussians = gaussian_model.n_gaussians
+    if n_gaussians == 0:
+        return 0.
+    nbytes = sum(get_gaussian_nbytes(gaussian_model).values()) + sum(get_optimizer_state_nbytes(optimizers).values())
+    if density_controller is not None:
+        nbytes += sum(get_buffer_nbytes(density_controller).values())
+    return nbytes / n_gaussians
+
+
+def get_memory_ledger(pl_module, outputs: Optional[Dict] = None) -> Dict[str, int]:
+    """
+    Returns:
+        {component: bytes}, and their sum `total`
+    """
+
+    ledger = {}
+    for name, nbytes in get_gaussian_nbytes(pl_module.gaussian_model).items():
+        ledger["gaussians/{}".format(name)] = nbytes
+    for name, nbytes in get_optimizer_state_nbytes(pl_module.gaussian_optimizers).items():
+        ledger["optimizer/{}".format(name)] = nbytes
+    for name, nbytes in get_buffer_nbytes(pl_module.density_controller).items():
+        ledger["density/{}".format(name)] = nbytes
+    ledger["dataloader/cached_images"] = get_cached_image_nbytes(getattr(pl_module.trainer, "train_dataloader", None))
+    ledger["renderer/outputs"] = 0 if outputs is None else nested_tensor_nbytes(outputs)
+    ledger["total"] = sum(ledger.values())
+
+    return ledger
@@ -0,0 +1,91 @@
+"""
+Log the training metrics without synchronizing the host with the device on every step.
+
+The metrics are summed on their device, and every `flush_interval` steps the means are copied to a pinned host buffer by a non-blocking copy.
+The copied values are collected once the copy has completed, which is usually a few kernels later, so the host never waits for the device.
+"""
+
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+import torch
+
+
+class MetricAccumulator:
+    def __init__(self, flush_interval: int = 100):
+        self.flush_interval = flush_interval
+
+        self.sums: Dict[str, Any] = {}
+        self.counts: Dict[str, int] = {}
+        self.n_flushes = 0
+
+        # [step, names of the tensor values, host buffer, copy completion event, the values on the host already]
+        self._pending: Deque[Tuple[int, List[str], Optional[torch.Tensor], Optional[torch.cuda.Event], Dict[str, float]]] = deque()
+
+    def add(self, metrics: Dict[str, Any]):
+        for name, value in metrics.items():
+            if isinstance(value, torch.Tensor):
+                value = value.detach().to(torch.float64)
+            if name in self.sums:
+                self.sums[name] = self.sums[name] + value
+            else:
+                self.sums[name] = value
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def flush(self, step: int):
+        """Start copying the means since the previous flush to the host"""
+
+        if len(self.sums) == 0:
+            return
+
+        tensor_names = [name for name, value in self.sums.items() if isinstance(value, torch.Tensor)]
+        host_values = {name: value / self.counts[name] for name, value in self.sums.items() if not isinstance(value, torch.Tensor)}
+
+        buffer = None
+        event = None
+        if len(tensor_names) > 0:
+            means = torch.stack([self.sums[name].reshape(()) / self.counts[name] for name in tensor_names])
+            if means.device.type == "cuda":
+                buffer = torch.empty(means.shape, dtype=means.dtype, pin_memory=True)
+                buffer.copy_(means, non_blocking=True)
+                event = torch.cuda.Event()
+                event.record()
+            else:
+                buffer = means.cpu()
+
+        self._pending.append((step, tensor_names, buffer, event, host_values))
+        self.sums = {}
+        self.counts = {}
+        self.n_flushes += 1
+
+    def collect(self, block: bool = False) -> List[Tuple[int, Dict[str, float]]]:
+        """
+        Args:
+            block: wait for the copies, should only be used when the training finished
+
+        Returns:
+            [(step, {name: mean})], the completed flushes in order
+        """
+
+        results = []
+        while len(self._pending) > 0:
+            step, tensor_names, buffer, event, host_values = self._pending[0]
+            if event is not None:
+                if block:
+                    event.synchronize()
+                elif not event.query():
+                    break
+            self._pending.popleft()
+
+            values = dict(host_values)
+            if buffer is not None:
+                values.update(zip(tensor_names, buffer.tolist()))
+            results.append((step, values))
+        return results
+
+    def step(self, step: int, metrics: Dict[str, Any]) -> List[Tuple[int, Dict[str, float]]]:
+        """Add the metrics of a step, flush them on every `flush_interval` steps, then collect the completed flushes"""
+
+        self.add(metrics)
+        if step % self.flush_interval == 0:
+            self.flush(step)
+        return self.collect()
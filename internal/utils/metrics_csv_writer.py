@@ -0,0 +1,53 @@
+"""
+Write the validation metrics of each image to a CSV file once they are available,
+only the metric values are kept for calculating the means, instead of the tensors of all the images.
+"""
+
+import os
+import csv
+from typing import Dict, List, Optional
+import torch
+
+
+class MetricsCSVWriter:
+    def __init__(self, path: str):
+        self.path = path
+
+        self.file = None
+        self.writer = None
+        self.fields: Optional[List[str]] = None
+        self.values: Dict[str, List[float]] = {}
+        self.dtypes: Dict[str, torch.dtype] = {}
+
+    def write(self, image_name: str, metrics: Dict[str, torch.Tensor]):
+        if self.file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.file = open(self.path, "w")
+            self.writer = csv.writer(self.file)
+            self.fields = list(metrics.keys())
+            self.values = {i: [] for i in self.fields}
+            self.dtypes = {i: metrics[i].dtype for i in self.fields}
+            self.writer.writerow(["name"] + self.fields)
+
+        row = [image_name]
+        for name in self.fields:
+            value = metrics[name].item()
+            self.values[name].append(value)
+            row.append("{:.8f}".format(value))
+        self.writer.writerow(row)
+
+    def close(self):
+        """Write the means, nothing is written if there is not any row"""
+
+        if self.file is None:
+            return
+
+        self.writer.writerow([""] + ["" for _ in range(len(self.fields))])
+        mean_metrics = ["MEAN"]
+        for name in self.fields:
+            # reduce in the original dtype, the same as averaging the stacked tensors
+            mean_metrics.append("{:.8f}".format(torch.tensor(self.values[name], dtype=self.dtypes[name]).mean().item()))
+        self.writer.writerow(mean_metrics)
+
+        self.file.close()
+        self.file = None
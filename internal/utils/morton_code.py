@@ -0,0 +1,87 @@
+from typing import Optional
+import torch
+
+MAX_BITS_PER_AXIS = 21
+
+
+def split_by_3(x: torch.Tensor) -> torch.Tensor:
+    """
+    Insert two zero bits between each of the lowest 21 bits
+
+    Args:
+        x: int64
+    """
+
+    x = x & 0x1fffff
+    x = (x | (x << 32)) & 0x1f00000000ffff
+    x = (x | (x << 16)) & 0x1f0000ff0000ff
+    x = (x | (x << 8)) & 0x100f00f00f00f00f
+    x = (x | (x << 4)) & 0x10c30c30c30c30c3
+    x = (x | (x << 2)) & 0x1249249249249249
+    return x
+
+
+def quantize(
+        points: torch.Tensor,
+        bounding_box_min: Optional[torch.Tensor] = None,
+        bounding_box_max: Optional[torch.Tensor] = None,
+        n_bits: int = MAX_BITS_PER_AXIS,
+) -> torch.Tensor:
+    """
+    Args:
+        points: [N, 3]
+        bounding_box_min: [3], default is the minimum of `points`, points outside the box will be clamped
+        bounding_box_max: [3], default is the maximum of `points`
+        n_bits: the number of bits per axis
+
+    Returns:
+        [N, 3], int64, in [0, 2^n_bits - 1]
+    """
+
+    assert 0 < n_bits <= MAX_BITS_PER_AXIS
+
+    if bounding_box_min is None:
+        bounding_box_min = torch.min(points, dim=0).values
+    if bounding_box_max is None:
+        bounding_box_max = torch.max(points, dim=0).values
+
+    max_value = (1 << n_bits) - 1
+    extent = torch.clamp_min(bounding_box_max - bounding_box_min, 1e-12)
+    normalized = (points - bounding_box_min) / extent
+    return torch.clamp(normalized * max_value, min=0, max=max_value).to(torch.long)
+
+
+def get_morton_codes(
+        points: torch.Tensor,
+        bounding_box_min: Optional[torch.Tensor] = None,
+        bounding_box_max: Optional[torch.Tensor] = None,
+        n_bits: int = MAX_BITS_PER_AXIS,
+) -> torch.Tensor:
+    """
+    Args:
+        points: [N, 3]
+        bounding_box_min, bounding_box_max, n_bits: see `quantize()`
+
+    Returns:
+        [N], int64, the Z-order codes consist of `3 * n_bits` bits
+    """
+
+    if points.shape[0] == 0:
+        return torch.zeros((0,), dtype=torch.long, device=points.device)
+
+    quantized = quantize(points.detach(), bounding_box_min, bounding_box_max, n_bits)
+    return (split_by_3(quantized[:, 0]) << 2) | (split_by_3(quantized[:, 1]) << 1) | split_by_3(quantized[:, 2])
+
+
+def get_morton_order(
+        points: torch.Tensor,
+        bounding_box_min: Optional[torch.Tensor] = None,
+        bounding_box_max: Optional[torch.Tensor] = None,
+        n_bits: int = MAX_BITS_PER_AXIS,
+) -> torch.Tensor:
+    """
+    Returns:
+        [N], the indices that sort `points` along the Z-order curve
+    """
+
+    return torch.argsort(get_morton_codes(points, bounding_box_min, bounding_box_max, n_bits), stable=True)
@@ -0,0 +1,415 @@
+"""
+Train partitions concurrently on the devices of a single machine, without SLURM.
+
+The partitions are launched as subprocesses, whose `CUDA_VISIBLE_DEVICES` is pinned to the assigned device.
+They are dispatched in the longest-processing-time-first order:
+every time a device slot becomes free, the longest pending partition fitting into the free memory of a device is launched on it.
+
+The state of every partition is written to a JSON status file on every change,
+and the elapsed time and the peak device memory of the previous runs recorded in it are used as the estimations.
+"""
+
+import os
+import json
+import time
+import subprocess
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+
+@dataclass
+class PartitionTask:
+    name: str
+
+    command: List[str]
+
+    n_images: int = 0
+
+    n_points: int = 0
+    """The number of the initial points, 0 if unknown"""
+
+    max_steps: int = -1
+
+    memory_mb: Optional[float] = None
+    """The memory required, estimated by `ResourceEstimator` if it is None"""
+
+    cost: Optional[float] = None
+    """The processing time, in any unit, estimated by `ResourceEstimator` if it is None"""
+
+    trained_step_file: Optional[str] = None
+    """Skip the task if the step recorded in this file reaches `max_steps`, and write `max_steps` to it on success"""
+
+    log_file: Optional[str] = None
+    """Redirect the outputs of the subprocess to this file"""
+
+    before_launch: Optional[Callable[["PartitionTask"], None]] = None
+
+
+@dataclass
+class ResourceEstimator:
+    base_memory_mb: float = 2048.
+
+    memory_mb_per_image: float = 4.
+    """The cached images"""
+
+    memory_mb_per_point: float = 1e-3
+    """The initial points, including the growth of the densification"""
+
+    previous_elapsed: Dict[str, float] = field(default_factory=dict)
+    """The elapsed seconds of the previous runs, key by the task names"""
+
+    memory_mb: Dict[str, float] = field(default_factory=dict)
+    """The memory measured in the previous runs, key by the task names, see `load_previous_memory_mb()`"""
+
+    def estimate_memory_mb(self, task: PartitionTask) -> float:
+        if task.memory_mb is not None:
+            return task.memory_mb
+        if task.name in self.memory_mb:
+            return self.memory_mb[task.name]
+        return self.base_memory_mb + self.memory_mb_per_image * task.n_images + self.memory_mb_per_point * task.n_points
+
+    def estimate_cost(self, task: PartitionTask) -> float:
+        if task.cost is not None:
+            return task.cost
+        if task.name in self.previous_elapsed:
+            return self.previous_elapsed[task.name]
+        # the max steps are scaled by the number of the images, see `utils/auto_hyper_parameter.py`,
+        # and the time of each step grows with the number of the Gaussians
+        n_steps = task.max_steps if task.max_steps > 0 else task.n_images
+        return max(n_steps, 1) * (1. + task.n_points * 1e-6)
+
+    @staticmethod
+    def load_previous_succeeded(status_path: str, key: str) -> Dict[str, float]:
+        if status_path is None or os.path.exists(status_path) is False:
+            return {}
+        with open(status_path, "r") as f:
+            status = json.load(f)
+        return {
+            name: partition[key]
+            for name, partition in status.get("partitions", {}).items()
+            if partition.get("state") == "succeeded" and partition.get(key) is not None
+        }
+
+    @classmethod
+    def load_previous_elapsed(cls, status_path: str) -> Dict[str, float]:
+        return cls.load_previous_succeeded(status_path, "elapsed")
+
+    @classmethod
+    def load_previous_memory_mb(cls, status_path: str) -> Dict[str, float]:
+        return cls.load_previous_succeeded(status_path, "peak_memory_mb")
+
+
+def plan_longest_processing_time_first(costs: Dict[str, float], n_devices: int) -> List[List[str]]:
+    """
+    The static LPT assignment: the tasks are assigned in descending order of their costs,
+    each one to the device with the least total cost so far.
+
+    Returns:
+        the task names of each device
+    """
+
+    assignments = [[] for _ in range(n_devices)]
+    loads = [0. for _ in range(n_devices)]
+    for name in sorted(costs.keys(), key=lambda i: costs[i], reverse=True):
+        device_idx = min(range(n_devices), key=lambda i: loads[i])
+        assignments[device_idx].append(name)
+        loads[device_idx] += costs[name]
+    return assignments
+
+
+def query_gpu_memory_mb() -> Dict[int, float]:
+    """
+    Returns:
+        the device memory (MB) used by each process, key by the pids, empty if `nvidia-smi` is unavailable
+    """
+
+    try:
+        output = subprocess.run(
+            ["nvidia-smi", "--query-compute-apps=pid,used_memory", "--format=csv,noheader,nounits"],
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+            text=True,
+            timeout=10,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.SubprocessError):
+        return {}
+
+    memory_mb = {}
+    for line in output.splitlines():
+        try:
+            pid, used_memory_mb = [i.strip() for i in line.split(",")]
+            pid, used_memory_mb = int(pid), float(used_memory_mb)
+        except ValueError:
+            # e.g. "[N/A]"
+            continue
+        # a process may use multiple devices
+        memory_mb[pid] = memory_mb.get(pid, 0.) + used_memory_mb
+    return memory_mb
+
+
+def read_trained_steps(path: Optional[str]) -> int:
+    if path is None:
+        return -1
+    try:
+        with open(path, "r") as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return -1
+
+
+class LocalPartitionScheduler:
+    def __init__(
+            self,
+            devices: List[str],
+            slots_per_device: int = 1,
+            device_memory_mb: float = -1.,
+            max_retries: int = 2,
+            retry_delay: float = 30.,
+            retry_backoff: float = 2.,
+            retry_memory_growth: float = 1.5,
+            status_path: Optional[str] = None,
+            estimator: Optional[ResourceEstimator] = None,
+            poll_interval: float = 1.,
+            memory_query: Optional[Callable[[], Dict[int, float]]] = query_gpu_memory_mb,
+            print_func: Callable[[str], None] = print,
+    ):
+        """
+        Args:
+            devices: the values of `CUDA_VISIBLE_DEVICES` of the slots, e.g. ["0", "1"]
+            slots_per_device: the maximum number of the partitions running on a device concurrently
+            device_memory_mb: the memory of each device, non-positive value disables the memory check
+            max_retries: the maximum number of the retries of a failed partition
+            retry_delay: the seconds waiting before the first retry, multiplied by `retry_backoff` after every failure
+            retry_memory_growth: a failed partition may run out of memory, so its memory estimation is multiplied by this
+            status_path: the path of the JSON status file
+            estimator: estimate the memory and the processing time of the partitions
+            poll_interval: the seconds between checking the states of the subprocesses
+            memory_query: returns the device memory used by each pid, polled to record the peak memory of the partitions, `None` to disable
+        """
+
+        assert len(devices) > 0
+        assert slots_per_device > 0
+
+        self.devices = devices
+        self.slots_per_device = slots_per_device
+        self.device_memory_mb = device_memory_mb
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.retry_backoff = retry_backoff
+        self.retry_memory_growth = retry_memory_growth
+        self.status_path = status_path
+        if estimator is None:
+            estimator = ResourceEstimator(
+                previous_elapsed=ResourceEstimator.load_previous_elapsed(status_path),
+                memory_mb=ResourceEstimator.load_previous_memory_mb(status_path),
+            )
+        self.estimator = estimator
+        self.poll_interval = poll_interval
+        self.memory_query = memory_query
+        self.print_func = print_func
+
+        self.status: Dict[str, Dict] = {}
+
+    def launch(self, task: PartitionTask, device: str) -> subprocess.Popen:
+        env = os.environ.copy()
+        env["CUDA_VISIBLE_DEVICES"] = device
+
+        stdout = subprocess.DEVNULL
+        if task.log_file is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(task.log_file)), exist_ok=True)
+            stdout = open(task.log_file, "a")
+        try:
+            return subprocess.Popen(task.command, stdin=subprocess.DEVNULL, stdout=stdout, stderr=subprocess.STDOUT, env=env)
+        finally:
+            if task.log_file is not None:
+                # the subprocess holds its own handle
+                stdout.close()
+
+    def write_status(self):
+        if self.status_path is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.status_path)), exist_ok=True)
+        tmp_path = "{}.tmp".format(self.status_path)
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "updated_at": time.time(),
+                "devices": self.devices,
+                "slots_per_device": self.slots_per_device,
+                "partitions": self.status,
+            }, f, indent=2)
+        os.replace(tmp_path, self.status_path)
+
+    def _update_peak_memory(self, running: Dict[str, List]):
+        if self.memory_query is None or all(len(i) == 0 for i in running.values()):
+            return
+        memory_mb = self.memory_query()
+        for items in running.values():
+            for task, process, _, _, _ in items:
+                used_memory_mb = memory_mb.get(process.pid)
+                if used_memory_mb is None:
+                    continue
+                task_status = self.status[task.name]
+                task_status["peak_memory_mb"] = max(task_status["peak_memory_mb"] or 0., used_memory_mb)
+
+    def _find_device(self, memory_mb: float, running: Dict[str, List], loads: Dict[str, float]) -> Optional[str]:
+        candidates = []
+        for device in self.devices:
+            if len(running[device]) >= self.slots_per_device:
+                continue
+            if self.device_memory_mb > 0:
+                used_memory_mb = sum(i[2] for i in running[device])
+                # a task larger than the whole device runs alone
+                if used_memory_mb + memory_mb > self.device_memory_mb and len(running[device]) > 0:
+                    continue
+            candidates.append(device)
+        if len(candidates) == 0:
+            return None
+        return min(candidates, key=lambda i: loads[i])
+
+    def run(self, tasks: List[PartitionTask]) -> Dict[str, Dict]:
+        """
+        Returns:
+            the status of every task, key by the task names
+        """
+
+        self.status = {}
+        pending = []
+        for task in tasks:
+            memory_mb = self.estimator.estimate_memory_mb(task)
+            cost = self.estimator.estimate_cost(task)
+            self.status[task.name] = {
+                "state": "pending",
+                "device": None,
+                "attempts": 0,
+                "return_codes": [],
+                "memory_mb": memory_mb,
+                "cost": cost,
+                "n_images": task.n_images,
+                "n_points": task.n_points,
+                "max_steps": task.max_steps,
+                "started_at": None,
+                "finished_at": None,
+                "elapsed": None,
+                "peak_memory_mb": None,
+                "log_file": task.log_file,
+            }
+            if task.max_steps >= 0 and read_trained_steps(task.trained_step_file) >= task.max_steps:
+                self.status[task.name]["state"] = "trained"
+                self.print_func("Skip trained partition '{}'".format(task.name))
+                continue
+            if self.device_memory_mb > 0 and memory_mb > self.device_memory_mb:
+                self.print_func("[WARNING]partition '{}' requires {:.0f}MB, larger than the device memory".format(task.name, memory_mb))
+            # [task, memory, cost, ready at]
+            pending.append([task, memory_mb, cost, 0.])
+        # longest processing time first
+        pending.sort(key=lambda i: i[2], reverse=True)
+        self.write_status()
+
+        # [device] = [[task, process, memory, cost, started at], ...]
+        running: Dict[str, List] = {device: [] for device in self.devices}
+        try:
+            while len(pending) > 0 or any(len(i) > 0 for i in running.values()):
+                status_changed = False
+                self._update_peak_memory(running)
+
+                # check the running ones
+                for device in self.devices:
+                    still_running = []
+                    for item in running[device]:
+                        task, process, memory_mb, cost, started_at = item
+                        return_code = process.poll()
+                        if return_code is None:
+                            still_running.append(item)
+                            continue
+                        status_changed = True
+                        self._on_finished(task, return_code, time.monotonic() - started_at, memory_mb, cost, pending)
+                    running[device] = still_running
+
+                # launch the pending ones
+                now = time.monotonic()
+                loads = {device: sum(i[3] for i in running[device]) for device in self.devices}
+                for item in list(pending):
+                    task, memory_mb, cost, ready_at = item
+                    if ready_at > now:
+                        continue
+                    device = self._find_device(memory_mb, running, loads)
+                    if device is None:
+                        continue
+                    pending.remove(item)
+                    status_changed = True
+
+                    task_status = self.status[task.name]
+                    task_status.update({
+                        "state": "running",
+                        "device": device,
+                        "attempts": task_status["attempts"] + 1,
+                        "memory_mb": memory_mb,
+                        "started_at": time.time(),
+                        "finished_at": None,
+                        "peak_memory_mb": None,
+                    })
+                    self.print_func("Launch partition '{}' on device {}, attempt {}".format(task.name, device, task_status["attempts"]))
+                    try:
+                        if task.before_launch is not None:
+                            task.before_launch(task)
+                        process = self.launch(task, device)
+                    except KeyboardInterrupt as e:
+                        raise e
+                    except Exception as e:
+                        self.print_func("Failed to launch partition '{}': {}".format(task.name, e))
+                        self._on_finished(task, -1, 0., memory_mb, cost, pending)
+                        continue
+                    running[device].append([task, process, memory_mb, cost, time.monotonic()])
+                    loads[device] += cost
+
+                if status_changed:
+                    self.write_status()
+                time.sleep(self.poll_interval)
+        finally:
+            # nothing is running unless interrupted, e.g. by Ctrl+C, then do not leave the launched trainings orphaned
+            self._terminate(running)
+        return self.status
+
+    def _terminate(self, running: Dict[str, List]):
+        for items in running.values():
+            for task, process, _, _, started_at in items:
+                if process.poll() is None:
+                    self.print_func("Terminate partition '{}'".format(task.name))
+                    process.terminate()
+                    process.wait()
+                task_status = self.status[task.name]
+                task_status["state"] = "interrupted"
+                task_status["return_codes"].append(process.returncode)
+                task_status["finished_at"] = time.time()
+                task_status["elapsed"] = time.monotonic() - started_at
+            items.clear()
+        self.write_status()
+
+    def _on_finished(self, task: PartitionTask, return_code: int, elapsed: float, memory_mb: float, cost: float, pending: List):
+        task_status = self.status[task.name]
+        task_status["return_codes"].append(return_code)
+        task_status["finished_at"] = time.time()
+        task_status["elapsed"] = elapsed
+
+        if return_code == 0:
+            task_status["state"] = "succeeded"
+            if task.trained_step_file is not None:
+                with open(task.trained_step_file, "w") as f:
+                    f.write("{}".format(task.max_steps))
+            self.print_func("Partition '{}' finished in {:.1f}s".format(task.name, elapsed))
+            return
+
+        if task_status["attempts"] > self.max_retries:
+            task_status["state"] = "failed"
+            self.print_func("Partition '{}' failed with code {}, give up after {} attempts".format(task.name, return_code, task_status["attempts"]))
+            return
+
+        delay = self.retry_delay * self.retry_backoff ** (task_status["attempts"] - 1)
+        memory_mb = memory_mb * self.retry_memory_growth
+        if self.device_memory_mb > 0:
+            memory_mb = min(memory_mb, self.device_memory_mb)
+        task_status["state"] = "waiting_retry"
+        self.print_func("Partition '{}' failed with code {}, retry in {:.1f}s".format(task.name, return_code, delay))
+        pending.append([task, memory_mb, cost, time.monotonic() + delay])
+        pending.sort(key=lambda i: i[2], reverse=True)
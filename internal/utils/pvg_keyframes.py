@@ -0,0 +1,263 @@
+"""
+Bake a Periodic Vibration Gaussian model into keyframes for the playback.
+
+At a timestamp, the opacities of most of the Gaussians are scaled to almost zero by their marginal opacities (`get_marginal_t()`),
+but the means (`get_mean_SHM()`) and the marginal opacities of all of them are evaluated, projected and sorted at every render.
+
+The time range is sampled in keyframes, and each interval between two adjacent keyframes keeps only the Gaussians
+whose effective opacity `opacity * marginal_t` exceeds the threshold at any time inside it.
+Each keyframe stores the means and their time derivatives of the Gaussians kept by its adjacent intervals,
+the means between the bracketing keyframes are obtained by the cubic Hermite interpolation,
+and the marginal opacities are evaluated exactly for the kept ones.
+"""
+
+import bisect
+from dataclasses import dataclass
+from typing import Optional, Tuple, Dict, Any, List
+import torch
+from internal.utils.fingerprint import get_tensors_fingerprint
+
+
+def get_pvg_fingerprint(gaussian_model) -> str:
+    """Identify a model by the properties the baked means and marginal opacities depend on"""
+
+    return get_tensors_fingerprint([
+        gaussian_model.get_means(),
+        gaussian_model.get_velocity(),
+        gaussian_model.get_t(),
+        gaussian_model.get_scale_t(),
+    ])
+
+
+@dataclass
+class PVGKeyframes:
+    timestamps: torch.Tensor
+    """[N_keyframes], in ascending order"""
+
+    n_gaussians: int
+    """The number of the Gaussians of the baked model"""
+
+    opacity_threshold: float
+
+    keyframe_offsets: torch.Tensor
+    """[N_keyframes + 1], the rows of keyframe `i` are `[keyframe_offsets[i], keyframe_offsets[i + 1])`"""
+
+    indices: torch.Tensor
+    """[N_rows], the index of the Gaussian of each row"""
+
+    means: torch.Tensor
+    """[N_rows, 3], `get_mean_SHM()` at the timestamp of the keyframe"""
+
+    mean_derivatives: torch.Tensor
+    """[N_rows, 3], `get_mean_SHM_derivative()` at the timestamp of the keyframe"""
+
+    life_peaks: torch.Tensor
+    """[N_rows], `get_t()`"""
+
+    life_spans: torch.Tensor
+    """[N_rows], `get_scale_t()`"""
+
+    interval_offsets: torch.Tensor
+    """[N_keyframes], the Gaussians of the interval `i` are `interval_rows[interval_offsets[i]:interval_offsets[i + 1]]`"""
+
+    interval_rows: torch.Tensor
+    """[N_interval_gaussians, 2], their rows in the keyframe `i` and `i + 1`"""
+
+    fingerprint: Optional[str] = None
+    """`get_pvg_fingerprint()` of the baked model"""
+
+    def __post_init__(self):
+        # avoid synchronizing with the device when locating the intervals
+        self._timestamp_list: List[float] = self.timestamps.tolist()
+        self._interval_offset_list: List[int] = self.interval_offsets.tolist()
+        # avoid recalculating the fingerprint of the same unmodified tensors
+        self._matched_identity = None
+
+    @staticmethod
+    def _get_identity(gaussian_model):
+        return tuple(
+            (i.data_ptr(), i._version, tuple(i.shape))
+            for i in [gaussian_model.get_means(), gaussian_model.get_velocity(), gaussian_model.get_t(), gaussian_model.gaussians["scale_t"]]
+        )
+
+    @torch.no_grad()
+    def is_baked_from(self, gaussian_model) -> bool:
+        """Whether the model is the baked one, not transformed or edited after baking"""
+
+        if self.fingerprint is None or gaussian_model.get_xyz.shape[0] != self.n_gaussians:
+            return False
+        identity = self._get_identity(gaussian_model)
+        if identity == self._matched_identity:
+            return True
+        if get_pvg_fingerprint(gaussian_model) != self.fingerprint:
+            return False
+        self._matched_identity = identity
+        return True
+
+    @property
+    def n_keyframes(self) -> int:
+        return len(self._timestamp_list)
+
+    @property
+    def time_range(self) -> Tuple[float, float]:
+        return self._timestamp_list[0], self._timestamp_list[-1]
+
+    def get_interval_index(self, timestamp: float) -> Optional[int]:
+        """Returns `None` if the timestamp is out of the baked range"""
+
+        if timestamp < self._timestamp_list[0] or timestamp > self._timestamp_list[-1]:
+            return None
+        return min(bisect.bisect_right(self._timestamp_list, timestamp) - 1, self.n_keyframes - 2)
+
+    def get_interval_gaussian_indices(self, interval_index: int) -> torch.Tensor:
+        start, end = self._interval_offset_list[interval_index], self._interval_offset_list[interval_index + 1]
+        return self.indices[self.interval_rows[start:end, 0]]
+
+    def interpolate(self, timestamp: float) -> Optional[Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]:
+        """
+        Returns:
+            `None` if the timestamp is out of the baked range, otherwise:
+            indices: [N], the Gaussians whose effective opacities may exceed the threshold
+            means: [N, 3], approximated `get_mean_SHM()` of them
+            marginal_t: [N, 1], `get_marginal_t()` of them
+        """
+
+        interval_index = self.get_interval_index(timestamp)
+        if interval_index is None:
+            return None
+
+        start, end = self._interval_offset_list[interval_index], self._interval_offset_list[interval_index + 1]
+        rows = self.interval_rows[start:end]
+        rows_0, rows_1 = rows[:, 0], rows[:, 1]
+
+        t0 = self._timestamp_list[interval_index]
+        h = self._timestamp_list[interval_index + 1] - t0
+        u = (timestamp - t0) / h
+
+        # cubic Hermite basis
+        u2 = u * u
+        u3 = u2 * u
+        h00 = 2 * u3 - 3 * u2 + 1
+        h10 = u3 - 2 * u2 + u
+        h01 = -2 * u3 + 3 * u2
+        h11 = u3 - u2
+
+        means = h00 * self.means[rows_0] + (h10 * h) * self.mean_derivatives[rows_0] + \
+                h01 * self.means[rows_1] + (h11 * h) * self.mean_derivatives[rows_1]
+        marginal_t = torch.exp(-0.5 * (self.life_peaks[rows_0] - timestamp) ** 2 / self.life_spans[rows_0] ** 2)
+
+        return self.indices[rows_0], means, marginal_t.unsqueeze(-1)
+
+    def to(self, device) -> "PVGKeyframes":
+        return PVGKeyframes(**{
+            k: v.to(device) if isinstance(v, torch.Tensor) else v
+            for k, v in self.state_dict().items()
+        })
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {
+            "timestamps": self.timestamps,
+            "n_gaussians": self.n_gaussians,
+            "opacity_threshold": self.opacity_threshold,
+            "keyframe_offsets": self.keyframe_offsets,
+            "indices": self.indices,
+            "means": self.means,
+            "mean_derivatives": self.mean_derivatives,
+            "life_peaks": self.life_peaks,
+            "life_spans": self.life_spans,
+            "interval_offsets": self.interval_offsets,
+            "interval_rows": self.interval_rows,
+            "fingerprint": self.fingerprint,
+        }
+
+    @classmethod
+    def from_state_dict(cls, state_dict: Dict[str, Any]) -> "PVGKeyframes":
+        return cls(**state_dict)
+
+    def save(self, path: str):
+        torch.save(self.state_dict(), path)
+
+    @classmethod
+    def load(cls, path: str, map_location=None) -> "PVGKeyframes":
+        return cls.from_state_dict(torch.load(path, map_location=map_location))
+
+
+@torch.no_grad()
+def bake_pvg_keyframes(
+        gaussian_model,
+        n_keyframes: int,
+        opacity_threshold: float = 1. / 255.,
+        time_range: Optional[Tuple[float, float]] = None,
+) -> PVGKeyframes:
+    """
+    Args:
+        gaussian_model: a `PeriodicVibrationGaussianModel`
+        n_keyframes: the number of the keyframes sampled uniformly in the time range
+        opacity_threshold: the Gaussians whose effective opacities never exceed it inside an interval are dropped from the interval
+        time_range: the time range of the model, i.e. the camera timestamps plus the `time_offset` of the renderer, default to `time_duration` of the model
+    """
+
+    assert n_keyframes >= 2, "at least 2 keyframes are required"
+    if time_range is None:
+        time_range = gaussian_model.config.time_duration
+    timestamps = torch.linspace(time_range[0], time_range[1], n_keyframes, dtype=torch.float64).tolist()
+
+    opacities = gaussian_model.get_opacities()[:, 0]
+    life_peaks = gaussian_model.get_t()[:, 0]
+    life_spans = gaussian_model.get_scale_t()[:, 0]
+
+    def get_marginal_t(timestamp: float) -> torch.Tensor:
+        return torch.exp(-0.5 * (life_peaks - timestamp) ** 2 / life_spans ** 2)
+
+    # the Gaussians of each interval
+    interval_gaussians = []
+    previous_marginal_t = get_marginal_t(timestamps[0])
+    for i in range(n_keyframes - 1):
+        next_marginal_t = get_marginal_t(timestamps[i + 1])
+        # the marginal opacity reaches its maximum 1 at the life peak, and decreases monotonically on both sides
+        peak_inside = torch.logical_and(life_peaks >= timestamps[i], life_peaks <= timestamps[i + 1])
+        max_marginal_t = torch.where(peak_inside, 1., torch.maximum(previous_marginal_t, next_marginal_t))
+        interval_gaussians.append(torch.nonzero(opacities * max_marginal_t > opacity_threshold).squeeze(-1))
+        previous_marginal_t = next_marginal_t
+
+    # the Gaussians of each keyframe are the union of the ones of its adjacent intervals
+    keyframe_gaussians = []
+    for i in range(n_keyframes):
+        adjacent = interval_gaussians[max(i - 1, 0):i + 1]
+        keyframe_gaussians.append(torch.unique(torch.concat(adjacent)))  # sorted
+    keyframe_sizes = torch.tensor([i.shape[0] for i in keyframe_gaussians], dtype=torch.long)
+    keyframe_offsets = torch.concat([torch.zeros((1,), dtype=torch.long), torch.cumsum(keyframe_sizes, dim=0)])
+    keyframe_offset_list = keyframe_offsets.tolist()
+
+    means = []
+    mean_derivatives = []
+    for timestamp, gaussians in zip(timestamps, keyframe_gaussians):
+        means.append(gaussian_model.get_mean_SHM(timestamp)[gaussians])
+        mean_derivatives.append(gaussian_model.get_mean_SHM_derivative(timestamp)[gaussians])
+    indices = torch.concat(keyframe_gaussians)
+
+    # locate the Gaussians of the intervals in the bracketing keyframes
+    interval_rows = []
+    for i, gaussians in enumerate(interval_gaussians):
+        interval_rows.append(torch.stack([
+            keyframe_offset_list[i] + torch.searchsorted(keyframe_gaussians[i], gaussians),
+            keyframe_offset_list[i + 1] + torch.searchsorted(keyframe_gaussians[i + 1], gaussians),
+        ], dim=-1))
+    interval_sizes = torch.tensor([i.shape[0] for i in interval_gaussians], dtype=torch.long)
+    interval_offsets = torch.concat([torch.zeros((1,), dtype=torch.long), torch.cumsum(interval_sizes, dim=0)])
+
+    device = opacities.device
+    return PVGKeyframes(
+        timestamps=torch.tensor(timestamps, dtype=torch.float64),
+        n_gaussians=opacities.shape[0],
+        opacity_threshold=opacity_threshold,
+        keyframe_offsets=keyframe_offsets,
+        indices=indices,
+        means=torch.concat(means),
+        mean_derivatives=torch.concat(mean_derivatives),
+        life_peaks=life_peaks[indices],
+        life_spans=life_spans[indices],
+        interval_offsets=interval_offsets,
+        interval_rows=torch.concat(interval_rows).to(device),
+        fingerprint=get_pvg_fingerprint(gaussian_model),
+    )
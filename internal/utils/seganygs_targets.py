@@ -0,0 +1,170 @@
+"""
+The training targets of SegAnyGS, see `SegAnySplatting.mask_preprocess()`.
+
+Originally, the Scale-Aware Pixel Identity Vector of each sampled scale is built in a Python loop over the masks,
+and the correlations are calculated by an einsum per scale.
+Here the vectors of all the scales are derived from a single "next smaller mask" tensor by broadcasting,
+and the correlations are calculated by one batched matmul.
+"""
+
+from typing import Callable, Tuple
+import torch
+
+
+def get_next_smaller_mask_indices(masks: torch.Tensor) -> torch.Tensor:
+    """
+    Args:
+        masks: [N_masks, N_pixels], bool, sorted by the scales in descending order
+
+    Returns:
+        [N_masks, N_pixels], int64, the index of the first mask after `i` covering the pixel, `N_masks` if there is not any
+    """
+
+    n_masks = masks.shape[0]
+    mask_indices = torch.arange(n_masks, device=masks.device)[:, None]
+    # the index of the mask itself if the pixel is covered by it
+    indices = torch.where(masks, mask_indices, n_masks)
+    # reverse cumulative minimum: the first covering mask at or after `i`
+    indices = torch.flip(torch.cummin(torch.flip(indices, dims=[0]), dim=0).values, dims=[0])
+    # shift by one: after `i`
+    return torch.concat([indices[1:], torch.full_like(indices[:1], n_masks)], dim=0)
+
+
+def get_pixel_identity_vectors(masks: torch.Tensor, scale_indices: torch.Tensor) -> torch.Tensor:
+    """
+    V(s, p) of the paper: at the scale of the mask `si`,
+    a pixel belongs to the smallest one of the masks [0, si] covering it, and all the masks smaller than `si`.
+
+    Args:
+        masks: [N_masks, N_pixels], bool, sorted by the scales in descending order
+        scale_indices: [N_scales], the scale is between the ones of the mask `si` and `si + 1`, -1 means larger than all the masks
+
+    Returns:
+        [N_scales, N_masks, N_pixels], bool
+    """
+
+    # mask `j` is kept, unless any mask in (j, si] covers the pixel too, i.e. the next covering one is after `si`
+    next_smaller_mask_indices = get_next_smaller_mask_indices(masks)
+    return torch.logical_and(masks.unsqueeze(0), next_smaller_mask_indices.unsqueeze(0) > scale_indices[:, None, None])
+
+
+def get_correlations(pixel_identity_vectors: torch.Tensor) -> torch.Tensor:
+    """
+    Args:
+        pixel_identity_vectors: [N_scales, N_masks, N_pixels], bool
+
+    Returns:
+        [N_scales, N_pixels, N_pixels], float, 1 if the pair of pixels shares any common masks at the scale
+    """
+
+    # the values are the numbers of the common masks, only whether they are zero matters,
+    # so half precision is sufficient on GPU, where it is also faster
+    dtype = torch.float16 if pixel_identity_vectors.is_cuda else torch.float
+    vectors = pixel_identity_vectors.to(dtype)
+    correlations = torch.bmm(vectors.transpose(1, 2), vectors)
+    return (correlations > 0).float()
+
+
+def mask_preprocess(
+        sam_masks: torch.Tensor,
+        mask_scales: torch.Tensor,
+        upper_bound_scale: float,
+        q_trans: Callable[[torch.Tensor], torch.Tensor],
+        ray_sample_rate: float,
+        num_sampled_rays: int,
+        num_sampled_scales: int = 8,
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    Returns:
+        sampled_ray: [H, W], bool
+        per_pixel_weight: [N_sampled_rays, N_sampled_rays]
+        gt_corrs: [N_sampled_scales + 2, N_sampled_rays, N_sampled_rays]
+        sampled_scales: [N_sampled_scales + 2], transformed by `q_trans`
+    """
+
+    with torch.no_grad():
+        # build Scale-Aware Pixel Identity Vector mentioned in the paper
+
+        # sort scales
+        mask_scales, sort_indices = torch.sort(mask_scales, descending=True)
+        # reorder masks according to the sorted scales
+        sam_masks = sam_masks.float()[sort_indices, :, :]
+
+        # pick `num_sampled_scales` scales randomly
+        sampled_scale_index = torch.randperm(len(mask_scales))[:num_sampled_scales]
+
+        tmp = torch.zeros(num_sampled_scales + 2)
+        tmp[1:len(sampled_scale_index) + 1] = sampled_scale_index
+        tmp[-1] = len(mask_scales) - 1
+        tmp[0] = -1  # attach a bigger scale
+        sampled_scale_index = tmp.long()  # = [-1, the indices of num_sampled_scales..., N_scales - 1]
+
+        sampled_scales = mask_scales[sampled_scale_index]
+
+        second_big_scale = mask_scales[mask_scales < upper_bound_scale].max()
+
+        # pick some pixels to sample
+        ray_sample_rate = ray_sample_rate if ray_sample_rate > 0 else num_sampled_rays / (sam_masks.shape[-1] * sam_masks.shape[-2])
+
+        sampled_ray = torch.rand(sam_masks.shape[-2], sam_masks.shape[-1]).to(sam_masks.device) < ray_sample_rate
+        non_mask_region = sam_masks.sum(dim=0) == 0
+
+        # do not sample pixels that not being masked by any masks
+        sampled_ray = torch.logical_and(sampled_ray, ~non_mask_region)
+
+        # Appendix A.1: Re-weighting
+
+        # H W
+        # foreach mask, set the value of the masked pixel to the `number of total mask pixels`
+        per_pixel_mask_size = sam_masks * sam_masks.sum(-1).sum(-1)[:, None, None]  # [N_masks, H, W]
+
+        # `per_pixel_mask_size.sum(dim=0)` is the total number of the masked pixels of all masks, in [H, W]
+        # `sam_masks.sum(dim=0)` is the total masked times of each pixel, in [H, W]
+        # `per_pixel_mean_mask_size` is the average number of masked pixels, in [H, W]
+        per_pixel_mean_mask_size = per_pixel_mask_size.sum(dim=0) / (sam_masks.sum(dim=0) + 1e-9)
+
+        # pick those pixels selected to be sampled
+        per_pixel_mean_mask_size = per_pixel_mean_mask_size[sampled_ray]  # [N_sampled_rays]
+
+        # [1, N_sampled_rays] * [N_sampled_rays, 1] = [N_sampled_rays, N_sampled_rays]
+        # the mean mask size multiplication results of all pixel paris
+        pixel_to_pixel_mask_size = per_pixel_mean_mask_size.unsqueeze(0) * per_pixel_mean_mask_size.unsqueeze(1)
+        # weights min-max normalization
+        ptp_max_size = pixel_to_pixel_mask_size.max()
+        pixel_to_pixel_mask_size[pixel_to_pixel_mask_size == 0] = 1e10
+        per_pixel_weight = torch.clamp(ptp_max_size / pixel_to_pixel_mask_size, 1.0, None)  # smaller one has bigger weight
+        # first normalize the weight to [0, 1], then enlarge to [1, 10]
+        per_pixel_weight = (per_pixel_weight - per_pixel_weight.min()) / (per_pixel_weight.max() - per_pixel_weight.min()) * 9. + 1.
+
+        sam_masks_sampled_ray = sam_masks[:, sampled_ray].bool()  # [N_masks, N_sampled_rays]
+
+        # set the first value of `sampled_scales` to a scale bigger than upper one a bit, which will be treated as the `upper_bound` one below
+        sampled_scales[0] = upper_bound_scale + upper_bound_scale * torch.rand(1)[0]
+        # draw the random numbers one by one, in the same order as the original loop over the scales
+        jitters = torch.stack([torch.rand(1)[0] for _ in range(sampled_scale_index.shape[0])]).to(sampled_scales.device)
+
+        upper_bound = sampled_scales >= upper_bound_scale
+        is_last = sampled_scale_index == len(mask_scales) - 1
+        # make them a little smaller:
+        #   the upper bound ones: according to the diff to the second_big_scale;
+        #   the last one: according to the diff to zero;
+        #   others: according to the diff to the later one.
+        next_scales = mask_scales[torch.clamp(sampled_scale_index + 1, max=len(mask_scales) - 1)]
+        lower_scales = torch.where(
+            upper_bound,
+            second_big_scale,
+            torch.where(is_last, torch.zeros_like(next_scales), next_scales),
+        )
+        sampled_scales = sampled_scales - (sampled_scales - lower_scales) * jitters
+
+        # the upper bound ones contain all the masks, the same as the one larger than all the masks
+        effective_scale_index = torch.where(upper_bound, -1, sampled_scale_index.to(upper_bound.device))
+        gt_vecs = get_pixel_identity_vectors(sam_masks_sampled_ray, effective_scale_index.to(sam_masks_sampled_ray.device))
+
+        # N_scale S S
+        gt_corrs = get_correlations(gt_vecs)  # [N_sample_scales, N_sampled_rays, N_sampled_rays], marks indicating whether pixel paris have common masks
+        # map the distribution of scales to Gaussian distribution
+        sampled_scales = q_trans(sampled_scales).squeeze()
+        sampled_scales = sampled_scales.squeeze()  # [N_sampled_scales]
+
+    return sampled_ray, per_pixel_weight, gt_corrs, sampled_scales
@@ -6,6 +6,7 @@ import numpy as np
 import torch
 from tqdm.auto import tqdm
 from internal.utils import colmap
+from internal.utils.colmap_track_table import ImageTable, TrackTable
 
 
 @dataclass
@@ -218,7 +219,10 @@ def save(
     filter_out_image_comap_idx_set = {i: True for i in filter_out_image_comap_idx}
 
     # save
-    def do_save(update_3d_points: bool = True):
+    def do_save(update_3d_points: bool = True, columnar: bool = True):
+        if columnar:
+            return do_save_columnar(update_3d_points)
+
         # build new dicts
         new_colmap_images = {}
         colmap_point_data = None
@@ -246,11 +250,7 @@ def save(
             else:
                 new_colmap_images[i] = image
 
-        os.makedirs(output_path, exist_ok=True)
-
-        for i in ["images.bin", "cameras.bin", "points3D.bin"]:
-            if os.path.exists(os.path.join(output_path, i)):
-                os.unlink(os.path.join(output_path, i))
+        prepare_output_dir()
 
         print("Saving `images.bin`...")
         colmap.write_images_binary(new_colmap_images, os.path.join(output_path, "images.bin"))
@@ -258,12 +258,52 @@ def save(
             print("Saving `points3D.bin`...")
             colmap.write_points3D_binary(colmap_point_data, os.path.join(output_path, "points3D.bin"))
         else:
-            print("Copying `points3D.bin`...")
-            shutil.copyfile(os.path.join(colmap_images.path, "points3D.bin"), os.path.join(output_path, "points3D.bin"))
-        print("Copying `cameras.bin`...")
-        shutil.copyfile(os.path.join(colmap_images.path, "cameras.bin"), os.path.join(output_path, "cameras.bin"))
+            copy_points3D()
+        copy_cameras()
         
         return output_path
+
+    def do_save_columnar(update_3d_points: bool):
+        """
+        Drop the observations of all the removed images at once on the flat track arrays,
+        instead of updating the 3D points one by one.
+        The outputs are identical to the ones of the per-record path above.
+        """
+
+        image_table = ImageTable.read(os.path.join(colmap_images.path, "images.bin"))
+        track_table = None
+        if update_3d_points:
+            track_table = TrackTable.read(os.path.join(colmap_images.path, "points3D.bin"))
+
+        prepare_output_dir()
+
+        print("Saving `images.bin`...")
+        image_table.remove_images(filter_out_image_comap_idx).write(os.path.join(output_path, "images.bin"))
+        if update_3d_points:
+            new_track_table = track_table.remove_images(filter_out_image_comap_idx)
+            print("Saving `points3D.bin`, {} of {} points preserved...".format(new_track_table.n_points, track_table.n_points))
+            new_track_table.write(os.path.join(output_path, "points3D.bin"))
+        else:
+            copy_points3D()
+        copy_cameras()
+
+        return output_path
+
+    def prepare_output_dir():
+        os.makedirs(output_path, exist_ok=True)
+
+        for i in ["images.bin", "cameras.bin", "points3D.bin"]:
+            if os.path.exists(os.path.join(output_path, i)):
+                os.unlink(os.path.join(output_path, i))
+
+    def copy_points3D():
+        print("Copying `points3D.bin`...")
+        shutil.copyfile(os.path.join(colmap_images.path, "points3D.bin"), os.path.join(output_path, "points3D.bin"))
+
+    def copy_cameras():
+        print("Copying `cameras.bin`...")
+        shutil.copyfile(os.path.join(colmap_images.path, "cameras.bin"), os.path.join(output_path, "cameras.bin"))
+
     return do_save
 
 
@@ -129,3 +129,141 @@ def RGB2SH(rgb):
 
 def SH2RGB(sh):
     return sh * C0 + 0.5
+
+
+def eval_sh_basis(deg, dirs):
+    """
+    Evaluate the real SH basis used by `eval_sh()`,
+    `eval_sh(deg, sh, dirs)` equals to `(eval_sh_basis(deg, dirs)[..., None, :] * sh).sum(-1)`.
+    Args:
+        deg: int SH deg. Currently, 0-4 supported
+        dirs: unit directions [..., 3]
+    Returns:
+        [..., (deg + 1) ** 2]
+    """
+    assert deg <= 4 and deg >= 0
+
+    x, y, z = dirs[..., 0], dirs[..., 1], dirs[..., 2]
+    basis = [torch.full_like(x, C0)]
+    if deg > 0:
+        basis += [-C1 * y, C1 * z, -C1 * x]
+
+        if deg > 1:
+            xx, yy, zz = x * x, y * y, z * z
+            xy, yz, xz = x * y, y * z, x * z
+            basis += [
+                C2[0] * xy,
+                C2[1] * yz,
+                C2[2] * (2.0 * zz - xx - yy),
+                C2[3] * xz,
+                C2[4] * (xx - yy),
+            ]
+
+            if deg > 2:
+                basis += [
+                    C3[0] * y * (3 * xx - yy),
+                    C3[1] * xy * z,
+                    C3[2] * y * (4 * zz - xx - yy),
+                    C3[3] * z * (2 * zz - 3 * xx - 3 * yy),
+                    C3[4] * x * (4 * zz - xx - yy),
+                    C3[5] * z * (xx - yy),
+                    C3[6] * x * (xx - 3 * yy),
+                ]
+
+                if deg > 3:
+                    basis += [
+                        C4[0] * xy * (xx - yy),
+                        C4[1] * yz * (3 * xx - yy),
+                        C4[2] * xy * (7 * zz - 1),
+                        C4[3] * yz * (7 * zz - 3),
+                        C4[4] * (zz * (35 * zz - 30) + 3),
+                        C4[5] * xz * (7 * zz - 3),
+                        C4[6] * (xx - yy) * (7 * zz - 1),
+                        C4[7] * xz * (xx - 3 * yy),
+                        C4[8] * (xx * (xx - 3 * yy) - yy * (3 * xx - yy)),
+                    ]
+    return torch.stack(basis, dim=-1)
+
+
+def eval_sh_batched(deg, sh, dirs):
+    """
+    Evaluate the SHs of N Gaussians along the view directions of multiple cameras at once,
+    the basis is computed once per direction and shared by all the channels.
+    Args:
+        deg: int SH deg. Currently, 0-4 supported
+        sh: SH coeffs [N, C, >= (deg + 1) ** 2]
+        dirs: unit directions [..., N, 3], e.g. [n_cameras, N, 3]
+    Returns:
+        [..., N, C]
+    """
+    coeff = (deg + 1) ** 2
+    assert sh.shape[-1] >= coeff
+
+    basis = eval_sh_basis(deg, dirs)  # [..., N, K]
+    return torch.einsum("...nk,nck->...nc", basis, sh[..., :coeff])
+
+
+def get_fibonacci_sphere_directions(n: int, dtype=torch.float64):
+    i = torch.arange(n, dtype=dtype) + 0.5
+    z = 1. - 2. * i / n
+    r = torch.sqrt(1. - z * z)
+    phi = i * (torch.pi * (3. - 5. ** 0.5))
+    return torch.stack([r * torch.cos(phi), r * torch.sin(phi), z], dim=-1)
+
+
+_SH_ROTATION_SAMPLE_DIRECTIONS = get_fibonacci_sphere_directions(64)
+_SH_ROTATION_INVERSE_BASIS = {}
+
+
+def _get_inverse_basis(l: int):
+    if l not in _SH_ROTATION_INVERSE_BASIS:
+        basis = eval_sh_basis(l, _SH_ROTATION_SAMPLE_DIRECTIONS)[:, l ** 2:(l + 1) ** 2]  # [M, 2l + 1]
+        _SH_ROTATION_INVERSE_BASIS[l] = torch.linalg.pinv(basis)  # [2l + 1, M]
+    return _SH_ROTATION_INVERSE_BASIS[l]
+
+
+def get_sh_rotation_matrices(deg, rotation_matrices):
+    """
+    Build the block-diagonal matrices rotating the SH coefficients of degree 1 to `deg`, no e3nn is required.
+
+    A rotation maps each SH band onto itself, so the block of band l is solved exactly by evaluating the band on a fixed direction set S:
+        Y_l(S) @ D_l = Y_l(S @ R), i.e. the rotated function at direction d equals the original one at R^T d.
+    Args:
+        deg: int SH deg. Currently, 0-4 supported
+        rotation_matrices: [..., 3, 3]
+    Returns:
+        [..., (deg + 1) ** 2 - 1, (deg + 1) ** 2 - 1], applied to the coefficients without the DC one, `shs_rest` in `[..., (deg + 1) ** 2 - 1, C]` layout
+    """
+    assert deg <= 4 and deg >= 0
+
+    batch_shape = rotation_matrices.shape[:-2]
+    n_coeffs = (deg + 1) ** 2 - 1
+    sh_rotation_matrices = torch.zeros(
+        batch_shape + (n_coeffs, n_coeffs),
+        dtype=torch.float64,
+        device=rotation_matrices.device,
+    )
+    if deg == 0:
+        return sh_rotation_matrices.to(rotation_matrices.dtype)
+
+    directions = _SH_ROTATION_SAMPLE_DIRECTIONS.to(rotation_matrices.device)
+    rotated_basis = eval_sh_basis(deg, torch.matmul(directions, rotation_matrices.to(torch.float64)))  # [..., M, K]
+    for l in range(1, deg + 1):
+        inverse_basis = _get_inverse_basis(l).to(rotation_matrices.device)
+        sh_rotation_matrices[..., l ** 2 - 1:(l + 1) ** 2 - 1, l ** 2 - 1:(l + 1) ** 2 - 1] = torch.matmul(
+            inverse_basis,
+            rotated_basis[..., l ** 2:(l + 1) ** 2],
+        )
+
+    return sh_rotation_matrices.to(rotation_matrices.dtype)
+
+
+def rotate_sh(shs_rest, sh_rotation_matrices):
+    """
+    Args:
+        shs_rest: [N, (deg + 1) ** 2 - 1, C]
+        sh_rotation_matrices: [(deg + 1) ** 2 - 1, (deg + 1) ** 2 - 1] shared by all, or [N, ...] one per Gaussian, from `get_sh_rotation_matrices()`
+    Returns:
+        [N, (deg + 1) ** 2 - 1, C]
+    """
+    return torch.matmul(sh_rotation_matrices.to(shs_rest), shs_rest)
@@ -0,0 +1,235 @@
+"""
+Extract the iso-surface of an SDF by marching cubes, evaluating the SDF at full resolution only inside the blocks the surface passes through.
+
+The sample lattice is the same as running `skimage.measure.marching_cubes()` on the dense grid:
+`resolution` samples per axis, spanning the bounding box inclusively.
+The cells are split into cubic blocks, adjacent blocks share their boundary samples,
+so the vertices on the block borders are identical and can be merged exactly.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Tuple, Union, List
+import numpy as np
+import torch
+from skimage import measure
+
+
+def get_lattice_points(
+        indices: Tuple[np.ndarray, np.ndarray, np.ndarray],
+        bounding_box_min: np.ndarray,
+        spacing: np.ndarray,
+) -> torch.Tensor:
+    """
+    Args:
+        indices: the sample indices along each axis
+
+    Returns:
+        [len(x) * len(y) * len(z), 3], float, in `ij` indexing order
+    """
+
+    axes = [torch.from_numpy(bounding_box_min[i] + indices[i] * spacing[i]) for i in range(3)]
+    return torch.stack(torch.meshgrid(*axes, indexing="ij"), dim=-1).reshape(-1, 3).float()
+
+
+@torch.no_grad()
+def evaluate_sdf(
+        sdf: Callable[[torch.Tensor], torch.Tensor],
+        points: torch.Tensor,
+        device,
+        max_points_per_batch: int,
+) -> np.ndarray:
+    values = []
+    for batch in torch.split(points, max_points_per_batch, dim=0):
+        values.append(sdf(batch.to(device)).reshape(-1).float().cpu())
+    if len(values) == 0:
+        return np.zeros((0,), dtype=np.float32)
+    return torch.concat(values, dim=0).numpy()
+
+
+def get_block_ranges(
+        coarse_values: np.ndarray,
+        coarse_indices: np.ndarray,
+        block_starts: np.ndarray,
+        block_ends: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The minimum and maximum of the coarse samples inside each block, boundaries included.
+
+    Returns:
+        [N_blocks, N_blocks, N_blocks] each
+    """
+
+    starts = np.searchsorted(coarse_indices, block_starts, side="left")
+    ends = np.searchsorted(coarse_indices, block_ends, side="right")
+
+    minimums, maximums = coarse_values, coarse_values
+    # reduce one axis at a time
+    for axis in range(3):
+        minimums = np.stack([
+            np.min(np.take(minimums, np.arange(s, e), axis=axis), axis=axis)
+            for s, e in zip(starts, ends)
+        ], axis=axis)
+        maximums = np.stack([
+            np.max(np.take(maximums, np.arange(s, e), axis=axis), axis=axis)
+            for s, e in zip(starts, ends)
+        ], axis=axis)
+
+    return minimums, maximums
+
+
+def dilate(mask: np.ndarray, n: int) -> np.ndarray:
+    if n <= 0:
+        return mask
+    dilated = torch.from_numpy(mask).float()[None, None]
+    for _ in range(n):
+        dilated = torch.nn.functional.max_pool3d(dilated, kernel_size=3, stride=1, padding=1)
+    return dilated[0, 0].numpy() > 0
+
+
+def marching_cubes_block(values: np.ndarray, level: float) -> Tuple[np.ndarray, np.ndarray]:
+    verts, faces, _, _ = measure.marching_cubes(volume=values, level=level)
+    return verts, faces
+
+
+def merge_block_meshes(meshes: List[Tuple[np.ndarray, np.ndarray, np.ndarray]], return_index: bool = False):
+    """
+    Args:
+        meshes: (block_start, vertices in block sample index space, faces) of each block
+        return_index: also return the indices of the merged vertices in the concatenation of the blocks' vertices,
+            used to gather the per-vertex attributes
+
+    Returns:
+        vertices in global sample index space, faces[, index]
+    """
+
+    if len(meshes) == 0:
+        empty = np.zeros((0, 3), dtype=np.float64), np.zeros((0, 3), dtype=np.int64)
+        if return_index:
+            return *empty, np.zeros((0,), dtype=np.int64)
+        return empty
+
+    vertices = []
+    faces = []
+    n_vertices = 0
+    for block_start, block_vertices, block_faces in meshes:
+        vertices.append(block_vertices.astype(np.float64) + block_start)
+        faces.append(block_faces.astype(np.int64) + n_vertices)
+        n_vertices += block_vertices.shape[0]
+    vertices = np.concatenate(vertices, axis=0)
+    faces = np.concatenate(faces, axis=0)
+
+    # the vertices on the shared borders are computed from the same samples, so they are identical
+    vertices, index, inverse_indices = np.unique(vertices, axis=0, return_index=True, return_inverse=True)
+    faces = inverse_indices.reshape(-1)[faces]
+
+    # drop the degenerated ones
+    is_valid = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])
+    if return_index:
+        return vertices, faces[is_valid], index
+    return vertices, faces[is_valid]
+
+
+def sparse_marching_cubes(
+        sdf: Callable[[torch.Tensor], torch.Tensor],
+        resolution: int,
+        bounding_box_min: Union[Tuple[float, float, float], np.ndarray] = (-1., -1., -1.),
+        bounding_box_max: Union[Tuple[float, float, float], np.ndarray] = (1., 1., 1.),
+        level: float = 0.,
+        block_size: int = 64,
+        coarse_stride: int = 4,
+        n_dilation_blocks: int = 1,
+        n_processes: int = 0,
+        device=None,
+        max_points_per_batch: int = 256 ** 3,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Args:
+        sdf: maps the points [N, 3] to the values [N]
+        resolution: the number of samples along each axis
+        block_size: the number of cells along each axis of a block
+        coarse_stride: the spacing of the coarse occupancy grid, in samples.
+            The surfaces thinner than it may be missed if they are not close to any other ones.
+        n_dilation_blocks: the blocks around the ones bracketing the level are evaluated too
+        n_processes: the number of processes running marching cubes, 0 means in the current one
+        device: where to evaluate the SDF
+
+    Returns:
+        vertices: [V, 3], float64
+        faces: [F, 3], int64
+    """
+
+    assert coarse_stride <= block_size, "every block must contain some coarse samples"
+
+    bounding_box_min = np.asarray(bounding_box_min, dtype=np.float64)
+    bounding_box_max = np.asarray(bounding_box_max, dtype=np.float64)
+    spacing = (bounding_box_max - bounding_box_min) / (resolution - 1)
+
+    # blocks, [start, end] in sample indices
+    n_cells = resolution - 1
+    block_starts = np.arange(0, n_cells, block_size)
+    block_ends = np.minimum(block_starts + block_size, n_cells)
+
+    # coarse occupancy
+    coarse_indices = np.unique(np.concatenate([np.arange(0, resolution, coarse_stride), [resolution - 1]]))
+    coarse_values = evaluate_sdf(
+        sdf,
+        get_lattice_points((coarse_indices, coarse_indices, coarse_indices), bounding_box_min, spacing),
+        device,
+        max_points_per_batch,
+    ).reshape(len(coarse_indices), len(coarse_indices), len(coarse_indices))
+    block_minimums, block_maximums = get_block_ranges(coarse_values, coarse_indices, block_starts, block_ends)
+    is_candidate = dilate((block_minimums <= level) & (block_maximums >= level), n_dilation_blocks)
+    candidates = np.argwhere(is_candidate)
+
+    executor = ProcessPoolExecutor(max_workers=n_processes) if n_processes > 0 else None
+    try:
+        futures = []
+        meshes = []
+
+        def submit(block_start: np.ndarray, values: np.ndarray):
+            # skip the ones not bracketing the level at full resolution
+            if values.min() > level or values.max() < level:
+                return
+            if executor is None:
+                meshes.append((block_start, *marching_cubes_block(values, level)))
+            else:
+                futures.append((block_start, executor.submit(marching_cubes_block, values, level)))
+
+        # evaluate several blocks at a time, marching cubes run in the pool meanwhile
+        pending_blocks = []
+        pending_points = []
+        n_pending_points = 0
+
+        def flush():
+            nonlocal pending_blocks, pending_points, n_pending_points
+            if len(pending_blocks) == 0:
+                return
+            values = evaluate_sdf(sdf, torch.concat(pending_points, dim=0), device, max_points_per_batch)
+            offset = 0
+            for block_start, shape in pending_blocks:
+                n = shape[0] * shape[1] * shape[2]
+                submit(block_start, values[offset:offset + n].reshape(shape))
+                offset += n
+            pending_blocks, pending_points, n_pending_points = [], [], 0
+
+        for block_index in candidates:
+            starts = block_starts[block_index]
+            ends = block_ends[block_index]
+            indices = tuple(np.arange(starts[i], ends[i] + 1) for i in range(3))
+            points = get_lattice_points(indices, bounding_box_min, spacing)
+
+            pending_blocks.append((starts, tuple(len(i) for i in indices)))
+            pending_points.append(points)
+            n_pending_points += points.shape[0]
+            if n_pending_points >= max_points_per_batch:
+                flush()
+        flush()
+
+        for block_start, future in futures:
+            meshes.append((block_start, *future.result()))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    vertices, faces = merge_block_meshes(meshes)
+    return vertices * spacing + bounding_box_min, faces
@@ -0,0 +1,155 @@
+"""
+Per-phase timing of the training steps.
+
+The phases are wrapped in named scopes by `profile_scope()`, which does nothing unless a `StepProfiler` is activated,
+e.g. by the callback `internal.callbacks.ProfileTrainingSteps`.
+The scopes are nestable, the name of a nested one is prefixed by its parent's, e.g. `after_backward/densify`.
+
+On CUDA devices, the scopes are timed by CUDA events, which are recorded asynchronously and resolved once they have completed,
+so profiling never forces a device synchronization inside a step.
+On CPU, the wall-clock time is used.
+"""
+
+import json
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from typing import Deque, Dict, List, Optional, Sequence
+import torch
+
+
+class StepProfiler:
+    def __init__(
+            self,
+            window_size: int = 100,
+            use_cuda_events: bool = True,
+            max_trace_events: int = 1_000_000,
+    ) -> None:
+        """
+        Args:
+            window_size: the percentiles are calculated over the latest `window_size` records of each scope
+            use_cuda_events: time the scopes by CUDA events when CUDA is available
+            max_trace_events: the number of the latest records kept for the Chrome trace
+        """
+
+        self.window_size = window_size
+        self.use_cuda_events = use_cuda_events and torch.cuda.is_available()
+
+        self.step = 0
+        self.durations: Dict[str, Deque[float]] = {}
+        self.trace_events: Deque[dict] = deque(maxlen=max_trace_events)
+
+        self._name_stack: List[str] = []
+        # [name, step, cpu start (ns), cpu duration (ns), start event, end event], waiting for the events
+        self._pending: List[list] = []
+        self._origin_ns = time.perf_counter_ns()
+
+    def begin_step(self, step: int):
+        self.step = step
+
+    def end_step(self):
+        """Collect the records whose CUDA events have completed, without blocking"""
+
+        self.resolve(block=False)
+
+    @contextmanager
+    def scope(self, name: str):
+        self._name_stack.append(name)
+        full_name = "/".join(self._name_stack)
+
+        start_event = end_event = None
+        if self.use_cuda_events:
+            start_event = torch.cuda.Event(enable_timing=True)
+            end_event = torch.cuda.Event(enable_timing=True)
+            start_event.record()
+        started_at = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            cpu_duration = time.perf_counter_ns() - started_at
+            self._name_stack.pop()
+            if end_event is None:
+                self._add(full_name, self.step, started_at, cpu_duration, cpu_duration / 1e6)
+            else:
+                end_event.record()
+                self._pending.append([full_name, self.step, started_at, cpu_duration, start_event, end_event])
+
+    def resolve(self, block: bool = False):
+        """
+        Args:
+            block: wait for the pending CUDA events, should be used after the training only
+        """
+
+        if len(self._pending) == 0:
+            return
+
+        pending = []
+        for record in self._pending:
+            name, step, started_at, cpu_duration, start_event, end_event = record
+            if block:
+                end_event.synchronize()
+            elif not end_event.query():
+                pending.append(record)
+                continue
+            self._add(name, step, started_at, cpu_duration, start_event.elapsed_time(end_event))
+        self._pending = pending
+
+    def _add(self, name: str, step: int, started_at: int, cpu_duration: int, duration_ms: float):
+        durations = self.durations.get(name, None)
+        if durations is None:
+            durations = deque(maxlen=self.window_size)
+            self.durations[name] = durations
+        durations.append(duration_ms)
+
+        # the device time is placed at the CPU launch time on the timeline
+        self.trace_events.append({
+            "name": name,
+            "ph": "X",
+            "ts": (started_at - self._origin_ns) / 1e3,
+            "dur": duration_ms * 1e3,
+            "pid": 0,
+            "tid": name.count("/"),
+            "args": {"step": step, "cpu_ms": cpu_duration / 1e6},
+        })
+
+    def get_summary(self, percentiles: Sequence[float] = (50, 90, 99), prefix: str = "profiler/") -> Dict[str, float]:
+        """
+        Returns:
+            {"{prefix}{name}/p{percentile}_ms": ..., "{prefix}{name}/mean_ms": ...}
+        """
+
+        summary = {}
+        for name, durations in self.durations.items():
+            if len(durations) == 0:
+                continue
+            values = torch.tensor(list(durations), dtype=torch.float64)
+            quantiles = torch.quantile(values, torch.tensor(percentiles, dtype=torch.float64) / 100.).tolist()
+            for percentile, value in zip(percentiles, quantiles):
+                summary["{}{}/p{:g}_ms".format(prefix, name, percentile)] = value
+            summary["{}{}/mean_ms".format(prefix, name)] = values.mean().item()
+        return summary
+
+    def export_chrome_trace(self, path: str):
+        """Write the records in the Chrome trace event format, which can be opened by `chrome://tracing` or Perfetto"""
+
+        with open(path, "w") as f:
+            json.dump({"traceEvents": list(self.trace_events), "displayTimeUnit": "ms"}, f)
+
+
+_active_profiler: Optional[StepProfiler] = None
+_null_scope = nullcontext()
+
+
+def set_active_profiler(profiler: Optional[StepProfiler]):
+    global _active_profiler
+    _active_profiler = profiler
+
+
+def get_active_profiler() -> Optional[StepProfiler]:
+    return _active_profiler
+
+
+def profile_scope(name: str):
+    if _active_profiler is None:
+        return _null_scope
+    return _active_profiler.scope(name)
@@ -0,0 +1,129 @@
+from typing import Optional, Tuple
+import torch
+
+
+class StreamingTopK:
+    """
+    Maintain the `k` largest values, and their column indices, of each row of a `[N_rows, N_columns]` matrix
+    whose columns are provided one by one or chunk by chunk, so that the dense matrix is never materialized.
+    The memory consumption is `O(N_rows * (k + buffer_size))` instead of `O(N_rows * N_columns)`.
+
+    Usage:
+        top_k = StreamingTopK(n_gaussians, k=32)
+        for camera_idx, camera in enumerate(cameras):
+            top_k.add_column(get_score(camera), camera_idx)
+        values, indices = top_k.get()
+    """
+
+    def __init__(
+            self,
+            n_rows: int,
+            k: int,
+            device=None,
+            dtype: torch.dtype = torch.float,
+            index_dtype: torch.dtype = torch.int32,
+            buffer_size: int = 16,
+            row_chunk_size: int = 4 * 1024 * 1024,
+    ):
+        """
+        Args:
+            n_rows: the number of rows, e.g. the number of Gaussians
+            k: the number of the largest values retained for each row
+            device: where the accumulator lives
+            dtype: the dtype of the values
+            index_dtype: the dtype used to store column indices
+            buffer_size: the number of columns buffered by `add_column()` before merging them into the top-k
+            row_chunk_size: the number of rows merged at once, smaller it to reduce the peak memory
+        """
+
+        self.n_rows = n_rows
+        self.k = k
+        self.device = device
+        self.dtype = dtype
+        self.index_dtype = index_dtype
+        self.buffer_size = buffer_size
+        self.row_chunk_size = row_chunk_size
+
+        self.values = torch.full((n_rows, k), -torch.inf, dtype=dtype, device=device)
+        self.indices = torch.full((n_rows, k), -1, dtype=index_dtype, device=device)
+        # the sum of every row, used to find the rows that are all zeros
+        self.sum = torch.zeros((n_rows,), dtype=dtype, device=device)
+        self.n_columns = 0
+
+        self._buffered_values = []
+        self._buffered_indices = []
+
+    @torch.no_grad()
+    def update(self, values: torch.Tensor, column_indices: Optional[torch.Tensor] = None):
+        """
+        Merge a chunk of columns into the top-k
+
+        Args:
+            values: [N_rows, C]
+            column_indices: [C], default is the columns following the previous ones
+        """
+
+        n_new_columns = values.shape[1]
+        if column_indices is None:
+            column_indices = torch.arange(self.n_columns, self.n_columns + n_new_columns)
+        column_indices = column_indices.to(device=self.device, dtype=self.index_dtype)
+        self.n_columns += n_new_columns
+
+        for row_start in range(0, self.n_rows, self.row_chunk_size):
+            row_end = min(row_start + self.row_chunk_size, self.n_rows)
+            new_values = values[row_start:row_end].to(device=self.device, dtype=self.dtype)
+            self.sum[row_start:row_end] += torch.sum(new_values, dim=-1)
+
+            candidate_values = torch.concat([self.values[row_start:row_end], new_values], dim=-1)
+            candidate_indices = torch.concat([
+                self.indices[row_start:row_end],
+                column_indices.unsqueeze(0).expand(row_end - row_start, -1),
+            ], dim=-1)
+
+            top_k = torch.topk(candidate_values, k=self.k, dim=-1)
+            self.values[row_start:row_end] = top_k.values
+            self.indices[row_start:row_end] = torch.gather(candidate_indices, -1, top_k.indices)
+
+    def add_column(self, values: torch.Tensor, column_index: int = None):
+        """
+        Args:
+            values: [N_rows]
+            column_index: default is the one following the previous column
+        """
+
+        if column_index is None:
+            column_index = self.n_columns + len(self._buffered_indices)
+        self._buffered_values.append(values.to(device=self.device, dtype=self.dtype))
+        self._buffered_indices.append(column_index)
+
+        if len(self._buffered_values) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if len(self._buffered_values) == 0:
+            return
+        values = torch.stack(self._buffered_values, dim=-1)
+        column_indices = torch.tensor(self._buffered_indices, dtype=torch.long)
+        self._buffered_values.clear()
+        self._buffered_indices.clear()
+        self.update(values, column_indices)
+
+    def prune(self, mask: torch.Tensor):
+        """Retain the rows selected by `mask`"""
+
+        self.flush()
+        mask = mask.to(device=self.values.device)
+        self.values = self.values[mask]
+        self.indices = self.indices[mask]
+        self.sum = self.sum[mask]
+        self.n_rows = self.values.shape[0]
+
+    def get(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Returns:
+            values: [N_rows, k], in descending order
+            indices: [N_rows, k], int64, the column indices of `values`; -1 if fewer than `k` columns are provided
+        """
+
+        self.flush()
+        return self.values, self.indices.long()
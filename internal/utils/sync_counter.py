@@ -0,0 +1,76 @@
+"""
+Find the calls synchronizing the host with the device, e.g. `.item()` on a CUDA tensor.
+
+Only the Python-level calls are visible, the ones inside the C++ operators, e.g. indexing by a boolean mask, are not counted.
+The calls made by PyTorch itself are not counted either, so that only the call sites of the project and its dependencies are reported.
+"""
+
+import os
+import sys
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+import torch
+
+SYNCHRONIZING_METHODS = ["item", "tolist", "numpy", "cpu", "__bool__", "__int__", "__float__"]
+# these ones do not read from the device if the tensor is on CPU already
+DEVICE_ONLY_METHODS = {"cpu"}
+
+_TORCH_DIR = os.path.dirname(torch.__file__) + os.sep
+
+
+class SyncCounter:
+    def __init__(self, include_cpu: bool = False):
+        """
+        Args:
+            include_cpu: count the calls on CPU tensors too, as if they were on the accelerator, used to lint on CPU-only machines
+        """
+
+        self.include_cpu = include_cpu
+
+        self.step = 0
+        # {step: ["{method} at {filename}:{lineno}"]}
+        self.calls: Dict[int, List[str]] = {}
+
+        self._originals: Dict[str, Callable] = {}
+
+    def begin_step(self, step: int):
+        self.step = step
+
+    def get_counts(self) -> Dict[int, int]:
+        return {step: len(calls) for step, calls in self.calls.items()}
+
+    def get_call_sites(self, step: Optional[int] = None) -> Counter:
+        if step is not None:
+            return Counter(self.calls.get(step, []))
+        return Counter(call for calls in self.calls.values() for call in calls)
+
+    def _wrap(self, name: str, original: Callable):
+        counter = self
+
+        def wrapper(tensor, *args, **kwargs):
+            if tensor.device.type != "cpu" or (counter.include_cpu and name not in DEVICE_ONLY_METHODS):
+                frame = sys._getframe(1)
+                if not frame.f_code.co_filename.startswith(_TORCH_DIR):
+                    counter.calls.setdefault(counter.step, []).append("{} at {}:{}".format(name, frame.f_code.co_filename, frame.f_lineno))
+            return original(tensor, *args, **kwargs)
+
+        return wrapper
+
+    def start(self):
+        assert len(self._originals) == 0, "already started"
+        for name in SYNCHRONIZING_METHODS:
+            original = getattr(torch.Tensor, name)
+            self._originals[name] = original
+            setattr(torch.Tensor, name, self._wrap(name, original))
+
+    def stop(self):
+        for name, original in self._originals.items():
+            setattr(torch.Tensor, name, original)
+        self._originals = {}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
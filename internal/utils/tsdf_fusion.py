@@ -0,0 +1,398 @@
+import math
+from typing import Tuple, Sequence
+import numpy as np
+import torch
+from tqdm.auto import tqdm
+from skimage import measure
+
+from internal.utils.sparse_marching_cubes import merge_block_meshes
+
+
+class SparseTSDFVolume:
+    """
+    TSDF fusion on a sparse voxel-hashing grid, only the blocks of voxels near the observed surfaces are allocated.
+
+    The voxel `g` (global integer coordinates) is located at `g * voxel_size`,
+    the block `b` contains the voxels `b * block_resolution + [0, block_resolution)` along each axis.
+    The blocks are stored in the order of allocation, in the buffers whose capacity is doubled on growth,
+    so the existing blocks are not moved when allocating new ones.
+    They are looked up by binary search on a separate index of the keys kept sorted, into which only the new keys are merged.
+
+    The cameras are integrated in batches: every observation has unit weight,
+    so summing the contributions of a batch before updating gives the same running average as integrating them one by one.
+    """
+
+    KEY_BITS = 21
+    KEY_OFFSET = 1 << (KEY_BITS - 1)
+
+    def __init__(
+            self,
+            voxel_size: float,
+            sdf_trunc: float,
+            depth_trunc: float = -1.,
+            block_resolution: int = 8,
+            device=None,
+            max_elements_per_chunk: int = 1 << 24,
+    ):
+        """
+        Args:
+            depth_trunc: ignore the depths larger than it, -1 means no limit
+            max_elements_per_chunk: the upper bound of `n_cameras * n_voxels` processed at once
+        """
+
+        self.voxel_size = voxel_size
+        self.sdf_trunc = sdf_trunc
+        self.depth_trunc = depth_trunc
+        self.block_resolution = block_resolution
+        self.device = torch.device("cpu") if device is None else torch.device(device)
+        self.max_elements_per_chunk = max_elements_per_chunk
+
+        n_voxels_per_block = block_resolution ** 3
+        self._n_blocks = 0
+        # the buffers of the blocks, the first `n_blocks` rows are allocated
+        self._block_keys = torch.zeros((0,), dtype=torch.long, device=self.device)
+        self._tsdf = torch.zeros((0, n_voxels_per_block), dtype=torch.float, device=self.device)
+        self._weights = torch.zeros((0, n_voxels_per_block), dtype=torch.float, device=self.device)
+        self._colors = torch.zeros((0, n_voxels_per_block, 3), dtype=torch.float, device=self.device)
+        # the index: the keys in ascending order, and the rows of them in the buffers
+        self.sorted_keys = torch.zeros((0,), dtype=torch.long, device=self.device)
+        self.sorted_block_indices = torch.zeros((0,), dtype=torch.long, device=self.device)
+
+        local_coordinates = torch.arange(block_resolution, device=self.device)
+        self.local_voxel_coordinates = torch.stack(torch.meshgrid(
+            local_coordinates,
+            local_coordinates,
+            local_coordinates,
+            indexing="ij",
+        ), dim=-1).reshape(-1, 3)  # [r^3, 3]
+
+    @property
+    def n_blocks(self) -> int:
+        return self._n_blocks
+
+    @property
+    def capacity(self) -> int:
+        return self._block_keys.shape[0]
+
+    @property
+    def block_keys(self) -> torch.Tensor:
+        """[N_blocks], in the order of allocation"""
+        return self._block_keys[:self._n_blocks]
+
+    @property
+    def tsdf(self) -> torch.Tensor:
+        """[N_blocks, r^3]"""
+        return self._tsdf[:self._n_blocks]
+
+    @property
+    def weights(self) -> torch.Tensor:
+        """[N_blocks, r^3]"""
+        return self._weights[:self._n_blocks]
+
+    @property
+    def colors(self) -> torch.Tensor:
+        """[N_blocks, r^3, 3]"""
+        return self._colors[:self._n_blocks]
+
+    @property
+    def nbytes(self) -> int:
+        """Including the unallocated capacity"""
+        return sum(i.numel() * i.element_size() for i in [
+            self._block_keys,
+            self._tsdf,
+            self._weights,
+            self._colors,
+            self.sorted_keys,
+            self.sorted_block_indices,
+        ])
+
+    @classmethod
+    def encode_keys(cls, block_coordinates: torch.Tensor) -> torch.Tensor:
+        coordinates = block_coordinates + cls.KEY_OFFSET
+        return (coordinates[..., 0] << (2 * cls.KEY_BITS)) | (coordinates[..., 1] << cls.KEY_BITS) | coordinates[..., 2]
+
+    @classmethod
+    def decode_keys(cls, keys: torch.Tensor) -> torch.Tensor:
+        mask = (1 << cls.KEY_BITS) - 1
+        return torch.stack([
+            (keys >> (2 * cls.KEY_BITS)) & mask,
+            (keys >> cls.KEY_BITS) & mask,
+            keys & mask,
+        ], dim=-1) - cls.KEY_OFFSET
+
+    def find_blocks(self, keys: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Returns:
+            block indices, whether found
+        """
+
+        if self.n_blocks == 0:
+            return torch.zeros_like(keys), torch.zeros_like(keys, dtype=torch.bool)
+        positions = torch.clamp_max(torch.searchsorted(self.sorted_keys, keys), self.n_blocks - 1)
+        return self.sorted_block_indices[positions], self.sorted_keys[positions] == keys
+
+    def reserve(self, n_blocks: int):
+        """Grow the capacity to at least `n_blocks` by doubling, the new rows are filled with the values of the unobserved voxels"""
+
+        if n_blocks <= self.capacity:
+            return
+        capacity = max(n_blocks, 2 * self.capacity)
+
+        def grow(buffer: torch.Tensor, fill_value) -> torch.Tensor:
+            new_buffer = torch.full((capacity,) + buffer.shape[1:], fill_value, dtype=buffer.dtype, device=self.device)
+            new_buffer[:self._n_blocks] = buffer[:self._n_blocks]
+            return new_buffer
+
+        self._block_keys = grow(self._block_keys, 0)
+        self._tsdf = grow(self._tsdf, 1.)
+        self._weights = grow(self._weights, 0.)
+        self._colors = grow(self._colors, 0.)
+
+    def allocate(self, keys: torch.Tensor):
+        keys = torch.unique(keys)
+        _, is_found = self.find_blocks(keys)
+        new_keys = keys[~is_found]  # sorted
+        n_new = new_keys.shape[0]
+        if n_new == 0:
+            return
+
+        # append the new blocks to the buffers
+        n_blocks = self._n_blocks
+        n_total = n_blocks + n_new
+        self.reserve(n_total)
+        self._block_keys[n_blocks:n_total] = new_keys
+
+        # merge the new keys into the index, the position of a new key is its insertion point plus the number of the new keys before it
+        new_positions = torch.searchsorted(self.sorted_keys, new_keys) + torch.arange(n_new, device=self.device)
+        is_new = torch.zeros((n_total,), dtype=torch.bool, device=self.device)
+        is_new[new_positions] = True
+        sorted_keys = torch.empty((n_total,), dtype=torch.long, device=self.device)
+        sorted_keys[new_positions] = new_keys
+        sorted_keys[~is_new] = self.sorted_keys
+        sorted_block_indices = torch.empty((n_total,), dtype=torch.long, device=self.device)
+        sorted_block_indices[new_positions] = torch.arange(n_blocks, n_total, device=self.device)
+        sorted_block_indices[~is_new] = self.sorted_block_indices
+
+        self.sorted_keys = sorted_keys
+        self.sorted_block_indices = sorted_block_indices
+        self._n_blocks = n_total
+
+    @staticmethod
+    def get_intrinsics(camera) -> Tuple[float, float, float, float]:
+        return camera.fx.item(), camera.fy.item(), camera.cx.item(), camera.cy.item()
+
+    def backproject(self, depth: torch.Tensor, camera) -> torch.Tensor:
+        """
+        Args:
+            depth: [H, W]
+
+        Returns:
+            [N_valid_pixels, 3], in world space
+        """
+
+        fx, fy, cx, cy = self.get_intrinsics(camera)
+        height, width = depth.shape
+        v, u = torch.meshgrid(
+            torch.arange(height, device=self.device, dtype=torch.float),
+            torch.arange(width, device=self.device, dtype=torch.float),
+            indexing="ij",
+        )
+        is_valid = self.is_depth_valid(depth)
+        z = depth[is_valid]
+        points_in_camera = torch.stack([(u[is_valid] - cx) / fx * z, (v[is_valid] - cy) / fy * z, z], dim=-1)
+
+        world_to_camera = camera.world_to_camera.to(device=self.device, dtype=torch.float)  # transposed
+        return torch.matmul(points_in_camera - world_to_camera[3, :3], world_to_camera[:3, :3].T)
+
+    def is_depth_valid(self, depth: torch.Tensor) -> torch.Tensor:
+        is_valid = depth > 0
+        if self.depth_trunc > 0:
+            is_valid = is_valid & (depth <= self.depth_trunc)
+        return is_valid
+
+    def get_touched_block_keys(self, depth: torch.Tensor, camera) -> torch.Tensor:
+        """The blocks within `sdf_trunc` to the back-projected depth map"""
+
+        points = self.backproject(depth, camera)
+        block_extent = self.voxel_size * self.block_resolution
+        block_coordinates = torch.unique(torch.floor(points / block_extent).long(), dim=0)
+
+        n = math.ceil(self.sdf_trunc / block_extent)
+        offset_range = torch.arange(-n, n + 1, device=self.device)
+        offsets = torch.stack(torch.meshgrid(offset_range, offset_range, offset_range, indexing="ij"), dim=-1).reshape(-1, 3)
+
+        return torch.unique(self.encode_keys((block_coordinates[:, None, :] + offsets[None, :, :]).reshape(-1, 3)))
+
+    @torch.no_grad()
+    def integrate_batch(self, rgbs: Sequence[torch.Tensor], depths: Sequence[torch.Tensor], cameras: Sequence):
+        """
+        Args:
+            rgbs: [3, H, W] each
+            depths: [1, H, W] each
+        """
+
+        n_cameras = len(cameras)
+        depths = [i.to(device=self.device, dtype=torch.float).reshape(i.shape[-2:]) for i in depths]
+        rgbs = [i.to(device=self.device, dtype=torch.float) for i in rgbs]
+
+        # allocate the blocks near the surfaces
+        touched_keys = torch.unique(torch.concat([self.get_touched_block_keys(depths[i], cameras[i]) for i in range(n_cameras)]))
+        if touched_keys.shape[0] == 0:
+            return
+        self.allocate(touched_keys)
+        block_indices, _ = self.find_blocks(touched_keys)
+
+        # pad the maps to the same size, the padded pixels are invalid since their depths are 0
+        max_height = max(i.shape[0] for i in depths)
+        max_width = max(i.shape[1] for i in depths)
+        padded_depths = torch.zeros((n_cameras, max_height, max_width), device=self.device)
+        padded_rgbs = torch.zeros((n_cameras, max_height, max_width, 3), device=self.device)
+        for i in range(n_cameras):
+            padded_depths[i, :depths[i].shape[0], :depths[i].shape[1]] = depths[i]
+            padded_rgbs[i, :depths[i].shape[0], :depths[i].shape[1]] = rgbs[i].permute(1, 2, 0)
+
+        world_to_camera = torch.stack([i.world_to_camera for i in cameras]).to(device=self.device, dtype=torch.float)  # [C, 4, 4]
+        intrinsics = torch.tensor([self.get_intrinsics(i) for i in cameras], dtype=torch.float, device=self.device)  # [C, 4]
+        fx, fy, cx, cy = [intrinsics[:, i, None] for i in range(4)]
+        widths = torch.tensor([i.shape[1] for i in depths], device=self.device)[:, None]
+        heights = torch.tensor([i.shape[0] for i in depths], device=self.device)[:, None]
+        camera_indices = torch.arange(n_cameras, device=self.device)[:, None]
+
+        n_voxels_per_block = self.block_resolution ** 3
+        n_blocks_per_chunk = max(self.max_elements_per_chunk // (n_cameras * n_voxels_per_block), 1)
+        for chunk in torch.split(block_indices, n_blocks_per_chunk):
+            # [V, 3]
+            voxel_coordinates = self.decode_keys(self.block_keys[chunk])[:, None, :] * self.block_resolution + self.local_voxel_coordinates[None]
+            voxel_positions = voxel_coordinates.reshape(-1, 3).float() * self.voxel_size
+
+            # [C, V]
+            points_in_camera = torch.matmul(voxel_positions, world_to_camera[:, :3, :3]) + world_to_camera[:, None, 3, :3]
+            z = points_in_camera[..., 2]
+            safe_z = torch.where(z > 0, z, 1.)
+            u = torch.round(fx * points_in_camera[..., 0] / safe_z + cx).long()
+            v = torch.round(fy * points_in_camera[..., 1] / safe_z + cy).long()
+            is_valid = (z > 0) & (u >= 0) & (u < widths) & (v >= 0) & (v < heights)
+            u = torch.where(is_valid, u, 0)
+            v = torch.where(is_valid, v, 0)
+
+            depth = padded_depths[camera_indices, v, u]
+            sdf = depth - z
+            is_valid = is_valid & self.is_depth_valid(depth) & (sdf >= -self.sdf_trunc)
+            tsdf = torch.clamp_max(sdf / self.sdf_trunc, 1.) * is_valid
+            color = padded_rgbs[camera_indices, v, u] * is_valid[..., None]
+
+            # sum over the cameras, then update the running average
+            n_observations = is_valid.sum(dim=0).reshape(-1, n_voxels_per_block).float()
+            tsdf_sum = tsdf.sum(dim=0).reshape(-1, n_voxels_per_block)
+            color_sum = color.sum(dim=0).reshape(-1, n_voxels_per_block, 3)
+
+            weights = self.weights[chunk]
+            new_weights = weights + n_observations
+            safe_new_weights = torch.clamp_min(new_weights, 1.)
+            is_updated = n_observations > 0
+            self.tsdf[chunk] = torch.where(is_updated, (self.tsdf[chunk] * weights + tsdf_sum) / safe_new_weights, self.tsdf[chunk])
+            self.colors[chunk] = torch.where(is_updated[..., None], (self.colors[chunk] * weights[..., None] + color_sum) / safe_new_weights[..., None], self.colors[chunk])
+            self.weights[chunk] = new_weights
+
+    def integrate(self, rgbs: Sequence[torch.Tensor], depths: Sequence[torch.Tensor], cameras: Sequence, batch_size: int = 8):
+        """
+        Only `batch_size` maps are loaded at a time,
+        so the maps can be a `SpillableMapStore` larger than the memory.
+        """
+
+        with tqdm(range(0, len(cameras), batch_size), desc="TSDF integration progress") as t:
+            for start in t:
+                end = min(start + batch_size, len(cameras))
+                self.integrate_batch(
+                    [rgbs[i] for i in range(start, end)],
+                    [depths[i] for i in range(start, end)],
+                    [cameras[i] for i in range(start, end)],
+                )
+                t.set_postfix_str("{} blocks".format(self.n_blocks), refresh=False)
+
+    def lookup(self, voxel_coordinates: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        Args:
+            voxel_coordinates: [N, 3], global
+
+        Returns:
+            tsdf [N], weights [N], colors [N, 3], the unallocated ones have zero weights
+        """
+
+        if self.n_blocks == 0:
+            return (
+                torch.ones((voxel_coordinates.shape[0],), device=self.device),
+                torch.zeros((voxel_coordinates.shape[0],), device=self.device),
+                torch.zeros((voxel_coordinates.shape[0], 3), device=self.device),
+            )
+
+        block_coordinates = torch.div(voxel_coordinates, self.block_resolution, rounding_mode="floor")
+        local_coordinates = voxel_coordinates - block_coordinates * self.block_resolution
+        local_indices = (local_coordinates[:, 0] * self.block_resolution + local_coordinates[:, 1]) * self.block_resolution + local_coordinates[:, 2]
+        block_indices, is_found = self.find_blocks(self.encode_keys(block_coordinates))
+
+        tsdf = torch.where(is_found, self.tsdf[block_indices, local_indices], 1.)
+        weights = torch.where(is_found, self.weights[block_indices, local_indices], 0.)
+        colors = torch.where(is_found[:, None], self.colors[block_indices, local_indices], 0.)
+        return tsdf, weights, colors
+
+    @torch.no_grad()
+    def extract_mesh(self, n_blocks_per_chunk: int = 1024) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Run marching cubes block by block, the cubes with any unobserved corner are skipped.
+
+        Returns:
+            vertices [V, 3], faces [F, 3], vertex colors [V, 3]
+        """
+
+        r = self.block_resolution
+        sample_coordinates = torch.arange(r + 1, device=self.device)
+        # including the first layer of the next blocks
+        local_sample_coordinates = torch.stack(torch.meshgrid(
+            sample_coordinates,
+            sample_coordinates,
+            sample_coordinates,
+            indexing="ij",
+        ), dim=-1).reshape(-1, 3)
+
+        meshes = []
+        vertex_colors = []
+        for chunk in torch.split(torch.arange(self.n_blocks, device=self.device), n_blocks_per_chunk):
+            block_origins = self.decode_keys(self.block_keys[chunk]) * r  # [K, 3]
+            tsdf, weights, colors = self.lookup((block_origins[:, None, :] + local_sample_coordinates[None]).reshape(-1, 3))
+            tsdf = tsdf.reshape(-1, r + 1, r + 1, r + 1).cpu().numpy()
+            is_observed = (weights > 0).reshape(-1, r + 1, r + 1, r + 1).cpu().numpy()
+            colors = colors.reshape(-1, r + 1, r + 1, r + 1, 3).cpu().numpy()
+            block_origins = block_origins.cpu().numpy()
+
+            for i in range(tsdf.shape[0]):
+                values = np.where(is_observed[i], tsdf[i], 1.)
+                if values.min() > 0. or values.max() < 0.:
+                    continue
+                verts, faces, _, _ = measure.marching_cubes(values, level=0.)
+
+                # every vertex lies on an edge, both ends must be observed
+                lower = np.floor(verts).astype(np.int64)
+                upper = np.minimum(np.ceil(verts).astype(np.int64), r)
+                is_vertex_valid = is_observed[i][tuple(lower.T)] & is_observed[i][tuple(upper.T)]
+                faces = faces[np.all(is_vertex_valid[faces], axis=-1)]
+                if faces.shape[0] == 0:
+                    continue
+
+                t = np.sum(verts - lower, axis=-1, keepdims=True)
+                block_vertex_colors = (1. - t) * colors[i][tuple(lower.T)] + t * colors[i][tuple(upper.T)]
+
+                meshes.append((block_origins[i], verts, faces))
+                vertex_colors.append(block_vertex_colors)
+
+        vertices, faces, index = merge_block_meshes(meshes, return_index=True)
+        if len(vertex_colors) > 0:
+            vertex_colors = np.concatenate(vertex_colors, axis=0)[index]
+        else:
+            vertex_colors = np.zeros((0, 3))
+
+        # remove the unreferenced vertices
+        referenced, faces = np.unique(faces, return_inverse=True)
+        faces = faces.reshape(-1, 3)
+
+        return vertices[referenced] * self.voxel_size, faces, vertex_colors[referenced]
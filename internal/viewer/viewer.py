@@ -48,6 +48,7 @@ class Viewer:
             vanilla_seganygs: bool = False,
             vanilla_mip: bool = False,
             vanilla_pvg: bool = False,
+            pvg_keyframes: str = None,
     ):
         self.device = torch.device("cuda")
 
@@ -229,6 +230,9 @@ class Viewer:
             renderer = self._load_seganygs(seganygs)
             turn_off_edit_and_video_render_panel()
 
+        if pvg_keyframes is not None:
+            renderer.load_keyframes(pvg_keyframes)
+
         # create renderer
         self.viewer_renderer = ViewerRenderer(
             model,
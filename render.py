@@ -227,6 +227,8 @@ if __name__ == "__main__":
                         help="increase this to speedup rendering, but more memory will be consumed")
     parser.add_argument("--disable-transform", action="store_true", default=False)
     parser.add_argument("--vanilla_gs2d", action="store_true", default=False)
+    parser.add_argument("--pvg-keyframes", "--pvg_keyframes", type=str, default=None,
+                        help="Path to the keyframes of a Periodic Vibration Gaussian model baked by `utils/bake_pvg_keyframes.py`")
     args = parser.parse_args()
 
     device = torch.device("cuda")
@@ -251,6 +253,8 @@ if __name__ == "__main__":
         renderer_override=renderer_override,
         device=device,
     )
+    if args.pvg_keyframes is not None:
+        renderer.renderer.load_keyframes(args.pvg_keyframes)
 
     # load cameras
     cameras = parse_camera_poses(camera_path)
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+import torch
+from internal.utils.adaptive_sh_utils import AdaptiveSHGaussians, get_effective_sh_degrees
+
+
+class AdaptiveSHUtilsTestCase(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.generator = torch.Generator()
+        self.generator.manual_seed(42)
+
+    def get_dummy_properties(self, n: int = 4096):
+        shs_rest = torch.rand((n, 15, 3), generator=self.generator)
+        # make the i-th Gaussian's effective degree be `i % 4`
+        degrees = torch.arange(n) % 4
+        for degree in range(3):
+            shs_rest[degrees == degree, (degree + 1) ** 2 - 1:] = 0.
+
+        return {
+            "means": torch.rand((n, 3), generator=self.generator),
+            "shs_dc": torch.rand((n, 1, 3), generator=self.generator),
+            "shs_rest": shs_rest,
+            "opacities": torch.rand((n, 1), generator=self.generator),
+            "scales": torch.rand((n, 3), generator=self.generator),
+            "rotations": torch.rand((n, 4), generator=self.generator),
+        }, degrees
+
+    def test_effective_sh_degrees(self):
+        properties, degrees = self.get_dummy_properties()
+        self.assertTrue(torch.all(torch.eq(get_effective_sh_degrees(properties["shs_rest"], 1e-8), degrees)))
+        # all bands are dropped
+        self.assertTrue(torch.all(torch.eq(get_effective_sh_degrees(properties["shs_rest"], 1e8), 0)))
+
+    def test_round_trip(self):
+        properties, degrees = self.get_dummy_properties()
+        adaptive_shs, sorted_indices = AdaptiveSHGaussians.from_properties(properties, energy_threshold=1e-8)
+
+        self.assertEqual(adaptive_shs.sh_degree, 3)
+        self.assertEqual(adaptive_shs.bucket_sizes.tolist(), [1024] * 4)
+        self.assertEqual(adaptive_shs.get_n_sh_coefficients(), 1024 * (0 + 3 + 8 + 15))
+        for degree, bucket in enumerate(adaptive_shs.shs_rest_buckets):
+            self.assertEqual(bucket.shape, (1024, (degree + 1) ** 2 - 1, 3))
+            self.assertTrue(torch.all(torch.eq(degrees[sorted_indices][adaptive_shs.get_bucket_slice(degree)], degree)))
+
+        # nothing is lost since the dropped coefficients are zeros
+        expanded = adaptive_shs.get_properties()
+        for name, value in properties.items():
+            self.assertTrue(torch.all(torch.eq(expanded[name], value[sorted_indices])), msg=name)
+        self.assertTrue(torch.all(torch.eq(
+            adaptive_shs.get_shs(),
+            torch.concat([properties["shs_dc"], properties["shs_rest"]], dim=1)[sorted_indices],
+        )))
+        self.assertEqual(adaptive_shs.get_shs(sh_degree=1).shape, (4096, 4, 3))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "adaptive_sh.pt")
+            adaptive_shs.save(path)
+            loaded = AdaptiveSHGaussians.load(path)
+        self.assertTrue(torch.all(torch.eq(loaded.bucket_offsets, adaptive_shs.bucket_offsets)))
+        self.assertTrue(torch.all(torch.eq(loaded.get_shs(), adaptive_shs.get_shs())))
+
+        model = loaded.to_model()
+        self.assertEqual(model.n_gaussians, 4096)
+        self.assertTrue(torch.all(torch.eq(model.get_shs(), adaptive_shs.get_shs())))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import torch
+from internal.cameras.cameras import Cameras
+from internal.utils.gaussian_projection import project_gaussians, project_gaussians_batched
+from synthetic_cameras import cameras_looking_at
+
+
+class BatchedGaussianProjectionTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.generator = torch.Generator()
+        self.generator.manual_seed(42)
+
+        n = 2048
+        self.means = torch.randn((n, 3), generator=self.generator) * 2.
+        self.scales = torch.exp(torch.rand((n, 3), generator=self.generator) * 3. - 5.)
+        self.rotations = torch.nn.functional.normalize(torch.randn((n, 4), generator=self.generator), dim=-1)
+
+    def create_cameras(self, n_cameras: int) -> Cameras:
+        # around the Gaussians, some of them are inside the point cloud
+        positions = torch.nn.functional.normalize(torch.randn((n_cameras, 3), generator=self.generator), dim=-1)
+        positions = positions * (torch.rand((n_cameras, 1), generator=self.generator) * 6. + 1.)
+        targets = torch.randn((n_cameras, 3), generator=self.generator) * 0.5
+        width = torch.randint(64, 160, (n_cameras,), generator=self.generator, dtype=torch.int)
+        height = torch.randint(64, 160, (n_cameras,), generator=self.generator, dtype=torch.int)
+        focal = torch.rand((n_cameras,), generator=self.generator) * 100. + 50.
+        return cameras_looking_at(
+            positions,
+            targets,
+            width=width,
+            height=height,
+            fx=focal,
+            fy=focal * 1.1,
+            cx=width / 2 + 3.,
+            cy=height / 2 - 2.,
+        )
+
+    def project_one_by_one(self, cameras: Cameras):
+        outputs = []
+        for camera in cameras:
+            xys, depths, radii, _, _, _, _, mask, _, _ = project_gaussians(
+                means_3d=self.means,
+                scales=self.scales,
+                scale_modifier=1.,
+                quaternions=self.rotations,
+                world_to_camera=camera.world_to_camera,
+                fx=camera.fx,
+                fy=camera.fy,
+                cx=camera.cx,
+                cy=camera.cy,
+                img_height=camera.height,
+                img_width=camera.width,
+                block_width=16,
+            )
+            outputs.append((xys, depths, radii, mask))
+        return [torch.stack(i, dim=0) for i in zip(*outputs)]
+
+    def test_equivalence(self):
+        cameras = self.create_cameras(16)
+        expected_means_2d, expected_depths, expected_radii, expected_mask = self.project_one_by_one(cameras)
+
+        means_2d, depths, radii, mask = project_gaussians_batched(self.means, self.scales, 1., self.rotations, cameras)
+        self.assertEqual(means_2d.shape, (16, self.means.shape[0], 2))
+        self.assertEqual(radii.dtype, torch.int)
+
+        # masks may differ for a few Gaussians lying on the boundaries, due to rounding
+        mismatches = (mask != expected_mask).sum().item()
+        self.assertLessEqual(mismatches, 1e-3 * mask.numel())
+        self.assertGreater(mask.sum().item(), 0)
+        self.assertLess(mask.sum().item(), mask.numel())
+
+        both = mask & expected_mask
+        self.assertTrue(torch.allclose(means_2d[both], expected_means_2d[both], rtol=1e-4, atol=1e-3))
+        self.assertTrue(torch.allclose(depths[both], expected_depths[both], rtol=1e-5, atol=1e-5))
+        self.assertLessEqual((radii[both] - expected_radii[both]).abs().max().item(), 1)
+        self.assertTrue(torch.all(radii[~mask] == 0))
+        self.assertTrue(torch.all(depths[~mask] == 0))
+
+    def test_chunking(self):
+        cameras = self.create_cameras(5)
+        outputs = project_gaussians_batched(self.means, self.scales, 1., self.rotations, cameras)
+        chunked_outputs = project_gaussians_batched(self.means, self.scales, 1., self.rotations, cameras, chunk_size=300)
+        for i, j in zip(outputs, chunked_outputs):
+            self.assertEqual(i.shape, j.shape)
+            self.assertTrue(torch.allclose(i.float(), j.float(), atol=1e-5))
+
+    def test_empty(self):
+        cameras = self.create_cameras(3)
+        means_2d, depths, radii, mask = project_gaussians_batched(
+            self.means[:0], self.scales[:0], 1., self.rotations[:0], cameras, chunk_size=128,
+        )
+        self.assertEqual(means_2d.shape, (3, 0, 2))
+        self.assertEqual(mask.shape, (3, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
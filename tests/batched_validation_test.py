@@ -0,0 +1,161 @@
+import os
+import unittest
+import tempfile
+import torch
+from torchmetrics.image import PeakSignalNoiseRatio
+from internal.metrics.vanilla_metrics import VanillaMetrics, VanillaMetricsImpl
+from internal.utils.ssim import ssim
+from internal.utils.metrics_csv_writer import MetricsCSVWriter
+from cpu_training_loop import validate, create_cameras
+
+
+class FakeLPIPSNet(torch.nn.Module):
+    def forward(self, img1, img2, normalize: bool = False):
+        return ((img1 - img2) ** 2).mean(dim=(1, 2, 3), keepdim=True)
+
+
+class FakeLPIPS:
+    """`LearnedPerceptualImagePatchSimilarity` downloads its weights on creation"""
+
+    def __init__(self):
+        self.net = FakeLPIPSNet()
+
+    def __call__(self, img1, img2):
+        return self.net(img1, img2, normalize=True).mean()
+
+
+class BatchedValidationTest(unittest.TestCase):
+    @staticmethod
+    def read_outputs(output_path: str):
+        images = {}
+        image_dir = os.path.join(output_path, "val", "epoch=0-step=0")
+        for i in sorted(os.listdir(image_dir)):
+            with open(os.path.join(image_dir, i), "rb") as f:
+                images[i] = f.read()
+        with open(os.path.join(output_path, "metrics", "val-step=0.csv")) as f:
+            metrics = f.read()
+        return images, metrics
+
+    def test_validate(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            kwargs = {"save_val_output": True, "save_val_metrics": True}
+            _, _, logger = validate(os.path.join(temp_dir, "per_image"), **kwargs)
+            module, _, batched_logger = validate(
+                os.path.join(temp_dir, "batched"),
+                val_render_batch_size=3,
+                val_output_processes=2,
+                max_in_flight_val_outputs=2,
+                **kwargs,
+            )
+
+            images, metrics = self.read_outputs(os.path.join(temp_dir, "per_image"))
+            batched_images, batched_metrics = self.read_outputs(os.path.join(temp_dir, "batched"))
+
+        self.assertEqual(list(images.keys()), ["000.png", "001.png", "002.png", "003.png"])
+        self.assertEqual(images, batched_images)
+        self.assertEqual(metrics, batched_metrics)
+        self.assertEqual(len(metrics.splitlines()), 7)
+        self.assertTrue(metrics.splitlines()[-1].startswith("MEAN,"))
+
+        # all the batches, including the last incomplete one, are logged in the validation steps
+        for name in ["val/loss", "val/psnr"]:
+            self.assertEqual(len(logger.get_metric(name)), 1)
+            self.assertAlmostEqual(logger.get_metric(name)[0][1], batched_logger.get_metric(name)[0][1], places=5)
+        self.assertEqual(module.pending_val_batches, [])
+        self.assertIsNone(module.image_writer_pool)
+        self.assertIsNone(module.val_metrics_writer)
+
+    @staticmethod
+    def create_metric(metric_cls=VanillaMetricsImpl):
+        metric = metric_cls(VanillaMetrics())
+        metric.psnr = PeakSignalNoiseRatio()
+        metric.no_state_dict_models["lpips"] = FakeLPIPS()
+        metric.lambda_dssim = metric.config.lambda_dssim
+        metric.rgb_diff_loss_fn = metric._l1_loss
+        metric.ssim = ssim
+        return metric
+
+    @staticmethod
+    def create_batches():
+        generator = torch.Generator().manual_seed(0)
+        cameras = create_cameras(3, 16, 12)
+        batches = []
+        outputs = []
+        for i in range(3):
+            gt_image = torch.rand((3, 12, 16), generator=generator) * (i + 1)
+            batches.append((cameras[i], (str(i), gt_image, None), None))
+            outputs.append({"render": torch.rand((3, 12, 16), generator=generator) * 1.2 - 0.1})
+        return batches, outputs
+
+    def test_vanilla_metrics(self):
+        metric = self.create_metric()
+        batches, outputs = self.create_batches()
+
+        metrics_list, prog_bar = metric.get_batch_validate_metrics(None, None, batches, outputs)
+        self.assertEqual(len(metrics_list), 3)
+        for batch, batch_outputs, metrics in zip(batches, outputs, metrics_list):
+            expected_metrics, expected_prog_bar = metric.get_validate_metrics(None, None, batch, batch_outputs)
+            self.assertEqual(prog_bar, expected_prog_bar)
+            self.assertEqual(set(metrics.keys()), set(expected_metrics.keys()))
+            for name in expected_metrics:
+                torch.testing.assert_close(metrics[name], expected_metrics[name], atol=1e-5, rtol=1e-5, msg=name)
+
+        # fallback to per-image metrics
+        masked_pixels = torch.zeros((3, 12, 16), dtype=torch.bool)
+        masked_pixels[:, :4] = True
+        batches[1] = (batches[1][0], (batches[1][1][0], batches[1][1][1], masked_pixels), None)
+        metrics_list, _ = metric.get_batch_validate_metrics(None, None, batches, outputs)
+        expected_metrics, _ = metric.get_validate_metrics(None, None, batches[1], outputs[1])
+        torch.testing.assert_close(metrics_list[1]["loss"], expected_metrics["loss"])
+
+    def test_subclass_metrics(self):
+        class ExtraValidateMetricsImpl(VanillaMetricsImpl):
+            def get_validate_metrics(self, pl_module, gaussian_model, batch, outputs):
+                metrics, prog_bar = super().get_validate_metrics(pl_module, gaussian_model, batch, outputs)
+                metrics["mean"] = outputs["render"].mean()
+                prog_bar["mean"] = False
+                return metrics, prog_bar
+
+        class ExtraBasicMetricsImpl(VanillaMetricsImpl):
+            def _get_basic_metrics(self, pl_module, gaussian_model, batch, outputs):
+                metrics, prog_bar = super()._get_basic_metrics(pl_module, gaussian_model, batch, outputs)
+                metrics["loss"] = metrics["loss"] + outputs["render"].mean()
+                metrics["mean"] = outputs["render"].mean()
+                prog_bar["mean"] = False
+                return metrics, prog_bar
+
+        batches, outputs = self.create_batches()
+        for metric_cls in [ExtraValidateMetricsImpl, ExtraBasicMetricsImpl]:
+            metric = self.create_metric(metric_cls)
+            # the metrics added by the subclasses are not dropped by the batched path
+            metrics_list, prog_bar = metric.get_batch_validate_metrics(None, None, batches, outputs)
+            self.assertFalse(prog_bar["mean"])
+            for batch, batch_outputs, metrics in zip(batches, outputs, metrics_list):
+                expected_metrics, _ = metric.get_validate_metrics(None, None, batch, batch_outputs)
+                self.assertEqual(set(metrics.keys()), set(expected_metrics.keys()))
+                for name in expected_metrics:
+                    torch.testing.assert_close(metrics[name], expected_metrics[name], msg=name)
+
+    def test_metrics_csv_writer(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "metrics", "val.csv")
+            writer = MetricsCSVWriter(path)
+            writer.close()
+            self.assertFalse(os.path.exists(path))
+
+            writer = MetricsCSVWriter(path)
+            writer.write("a", {"psnr": torch.tensor(1.), "ssim": torch.tensor(0.5)})
+            writer.write("b", {"psnr": torch.tensor(2.), "ssim": torch.tensor(0.25)})
+            writer.close()
+            with open(path) as f:
+                self.assertEqual(f.read().splitlines(), [
+                    "name,psnr,ssim",
+                    "a,1.00000000,0.50000000",
+                    "b,2.00000000,0.25000000",
+                    ",,",
+                    "MEAN,1.50000000,0.37500000",
+                ])
+
+
+if __name__ == '__main__':
+    unittest.main()
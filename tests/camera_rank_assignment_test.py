@@ -0,0 +1,128 @@
+import unittest
+import torch
+from internal.cameras.cameras import Cameras
+from internal.dataset import CacheDataLoader
+from internal.utils.camera_rank_assignment import RankBoundingVolumes, CameraRankAssigner, get_frustum_gaussian_counts
+from synthetic_cameras import cameras_looking_at
+
+
+class CameraRankAssignmentTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.generator = torch.Generator()
+        self.generator.manual_seed(42)
+
+        # 4 clusters, each one owned by a rank
+        self.world_size = 4
+        self.cluster_centers = torch.tensor([
+            [20., 0., 20.],
+            [-20., 0., 20.],
+            [-20., 0., -20.],
+            [20., 0., -20.],
+        ])
+        self.points_of_ranks = [
+            center + torch.randn((1000 + 100 * rank, 3), generator=self.generator)
+            for rank, center in enumerate(self.cluster_centers)
+        ]
+        self.volumes = RankBoundingVolumes.from_points(self.points_of_ranks, resolution=16)
+
+    def create_cluster_cameras(self, cluster_ids: list) -> Cameras:
+        targets = self.cluster_centers[cluster_ids]
+        # look outward, so only one cluster is visible
+        positions = targets * 0.6 + torch.randn(targets.shape, generator=self.generator) * 0.5
+        return cameras_looking_at(positions, targets, width=100, height=100, fx=200.)
+
+    def test_bounding_volumes(self):
+        self.assertEqual(self.volumes.world_size, self.world_size)
+        self.assertEqual(self.volumes.counts.shape, (self.world_size, 16, 16, 16))
+        for rank, points in enumerate(self.points_of_ranks):
+            self.assertEqual(self.volumes.counts[rank].sum().item(), points.shape[0])
+        self.assertEqual(self.volumes.get_voxel_centers().shape, (16 ** 3, 3))
+
+    def test_frustum_counts(self):
+        cluster_ids = [0, 1, 2, 3, 0, 1]
+        cameras = self.create_cluster_cameras(cluster_ids)
+        frustum_counts = get_frustum_gaussian_counts(cameras, self.volumes)
+        self.assertEqual(frustum_counts.shape, (len(cluster_ids), self.world_size))
+        self.assertEqual(torch.argmax(frustum_counts, dim=-1).tolist(), cluster_ids)
+        # other clusters are invisible
+        for camera_idx, cluster_id in enumerate(cluster_ids):
+            self.assertGreater(frustum_counts[camera_idx, cluster_id].item(), 0.5 * self.points_of_ranks[cluster_id].shape[0])
+            self.assertEqual(frustum_counts[camera_idx].sum().item(), frustum_counts[camera_idx, cluster_id].item())
+
+    def test_aligned_assignment(self):
+        cluster_ids = torch.randperm(12, generator=self.generator) % 4
+        cameras = self.create_cluster_cameras(cluster_ids.tolist())
+
+        assigner = CameraRankAssigner(cameras, world_size=self.world_size, seed=1)
+        # contiguous before the volumes provided
+        self.assertEqual(assigner.assign(), [list(range(i * 3, i * 3 + 3)) for i in range(self.world_size)])
+
+        assigner.update(self.volumes)
+        assignment = assigner.assign(epoch=0)
+        for rank, rank_indices in enumerate(assignment):
+            self.assertEqual(len(rank_indices), assigner.n_steps_per_epoch)
+            self.assertTrue(torch.all(cluster_ids[rank_indices] == rank))
+
+        # no Gaussian need to be transferred
+        self.assertEqual(assigner.get_communication_volume(assignment).sum().item(), 0)
+        self.assertGreater(assigner.get_communication_volume(assigner.get_contiguous_assignment()).sum().item(), 0)
+
+        # deterministic
+        self.assertEqual(assignment, assigner.assign(epoch=0))
+        self.assertEqual(assigner.get_indices(2, epoch=5), assigner.assign(epoch=5)[2])
+
+    def test_cache_data_loader(self):
+        cluster_ids = torch.randperm(12, generator=self.generator) % 4
+        cameras = self.create_cluster_cameras(cluster_ids.tolist())
+        assigner = CameraRankAssigner(cameras, world_size=self.world_size, seed=1)
+        assigner.update(self.volumes)
+        # each image is its index
+        dataset = list(range(12))
+
+        for max_cache_num in [-1, 0, 2]:
+            for shuffle in [True, False]:
+                dataloader = CacheDataLoader(
+                    dataset,
+                    max_cache_num=max_cache_num,
+                    shuffle=shuffle,
+                    seed=42,
+                    distributed=True,
+                    world_size=self.world_size,
+                    global_rank=1,
+                    camera_assigner=assigner,
+                )
+                for epoch in range(2):
+                    yielded = list(dataloader)
+                    self.assertEqual(sorted(yielded), sorted(assigner.get_indices(1, epoch=epoch)), (max_cache_num, shuffle))
+                    self.assertTrue(torch.all(cluster_ids[yielded] == 1))
+
+    def test_balanced_assignment(self):
+        # most of the cameras prefer rank 0
+        cluster_ids = [0] * 9 + [1, 2]
+        cameras = self.create_cluster_cameras(cluster_ids)
+
+        assigner = CameraRankAssigner(cameras, world_size=self.world_size)
+        assigner.update(self.volumes)
+        for epoch in range(3):
+            assignment = assigner.assign(epoch=epoch)
+            # balanced
+            self.assertEqual([len(i) for i in assignment], [3] * self.world_size)
+            # every image is covered in an epoch
+            self.assertEqual(set(sum(assignment, [])), set(range(len(cluster_ids))))
+            # the ones preferring other ranks are assigned to them
+            self.assertIn(9, assignment[1])
+            self.assertIn(10, assignment[2])
+
+    def test_fewer_cameras_than_ranks(self):
+        cameras = self.create_cluster_cameras([0, 1])
+        assigner = CameraRankAssigner(cameras, world_size=self.world_size)
+        assigner.update(self.volumes)
+        assignment = assigner.assign()
+        self.assertEqual([len(i) for i in assignment], [1] * self.world_size)
+        self.assertEqual(set(sum(assignment, [])), {0, 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import os
+import unittest
+import tempfile
+import numpy as np
+from internal.utils import colmap
+from internal.utils.colmap_track_table import TrackTable, ImageTable
+from internal.utils.sfm_outlier_detection import ColmapImages, save
+
+
+def create_sparse_model(path: str, n_images: int = 12, n_points: int = 300, seed: int = 42):
+    rng = np.random.default_rng(seed)
+    image_ids = rng.permutation(n_images) * 3 + 1
+    point_ids = rng.permutation(n_points) * 7 + 2
+
+    # tracks
+    observations = {image_id: [] for image_id in image_ids}
+    tracks = {}
+    for point_id in point_ids[5:-1]:
+        track_length = rng.integers(1, 5)
+        track_image_ids = rng.choice(image_ids, size=track_length, replace=False)
+        tracks[point_id] = []
+        for image_id in track_image_ids:
+            tracks[point_id].append((image_id, len(observations[image_id])))
+            observations[image_id].append(point_id)
+    # some points are observed only by the first image
+    for point_id in point_ids[:5]:
+        tracks[point_id] = [(image_ids[0], len(observations[image_ids[0]]))]
+        observations[image_ids[0]].append(point_id)
+    # an empty track
+    tracks[point_ids[-1]] = []
+
+    images = {}
+    for image_id in image_ids:
+        # a few 2D points without 3D points
+        point3D_ids = np.asarray(observations[image_id] + [-1] * 3, dtype=np.int64)
+        images[image_id] = colmap.Image(
+            id=int(image_id),
+            qvec=rng.normal(size=4),
+            tvec=rng.normal(size=3),
+            camera_id=1,
+            name="{:04d}.jpg".format(image_id),
+            xys=rng.uniform(0, 1000, size=(point3D_ids.shape[0], 2)),
+            point3D_ids=point3D_ids,
+        )
+
+    points = {}
+    for point_id in point_ids:
+        points[point_id] = colmap.Point3D(
+            id=int(point_id),
+            xyz=rng.normal(size=3),
+            rgb=rng.integers(0, 256, size=3),
+            error=np.array(rng.uniform()),
+            image_ids=np.asarray([i[0] for i in tracks[point_id]], dtype=np.int64),
+            point2D_idxs=np.asarray([i[1] for i in tracks[point_id]], dtype=np.int64),
+        )
+
+    cameras = {1: colmap.Camera(id=1, model="PINHOLE", width=1000, height=800, params=np.array([500., 500., 500., 400.]))}
+
+    os.makedirs(path, exist_ok=True)
+    colmap.write_cameras_binary(cameras, os.path.join(path, "cameras.bin"))
+    colmap.write_images_binary(images, os.path.join(path, "images.bin"))
+    colmap.write_points3D_binary(points, os.path.join(path, "points3D.bin"))
+
+    return image_ids
+
+
+class ColmapTrackTableTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.model_path = os.path.join(self.temp_dir.name, "sparse")
+        self.image_ids = create_sparse_model(self.model_path)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        super().tearDown()
+
+    def read_bytes(self, *path):
+        with open(os.path.join(*path), "rb") as f:
+            return f.read()
+
+    def create_colmap_images(self) -> ColmapImages:
+        colmap_image_data = colmap.read_images_binary(os.path.join(self.model_path, "images.bin"))
+        return ColmapImages(
+            self.model_path,
+            colmap_image_data,
+            id=np.asarray(list(colmap_image_data.keys())),
+            image_name=np.asarray([i.name for i in colmap_image_data.values()]),
+            w2c=None,
+            point_ref_counters=None,
+            n_points=None,
+            c2w_in_gps=None,
+        )
+
+    def test_read(self):
+        track_table = TrackTable.read(os.path.join(self.model_path, "points3D.bin"))
+        points = colmap.read_points3D_binary(os.path.join(self.model_path, "points3D.bin"))
+
+        self.assertEqual(track_table.n_points, len(points))
+        self.assertEqual(track_table.n_observations, sum(i.image_ids.shape[0] for i in points.values()))
+        for idx, point in enumerate(points.values()):
+            self.assertEqual(track_table.point_ids[idx], point.id)
+            self.assertTrue(np.array_equal(track_table.headers["xyz"][idx], point.xyz))
+            start, end = track_table.track_offsets[idx], track_table.track_offsets[idx + 1]
+            self.assertTrue(np.array_equal(track_table.image_ids[start:end], point.image_ids))
+            self.assertTrue(np.array_equal(track_table.point2D_idxs[start:end], point.point2D_idxs))
+
+        image_table = ImageTable.read(os.path.join(self.model_path, "images.bin"))
+        self.assertTrue(np.array_equal(image_table.image_ids, self.image_ids))
+
+    def test_roundtrip(self):
+        output_path = os.path.join(self.temp_dir.name, "output")
+        os.makedirs(output_path)
+        TrackTable.read(os.path.join(self.model_path, "points3D.bin")).remove_images([]).write(os.path.join(output_path, "points3D.bin"))
+        ImageTable.read(os.path.join(self.model_path, "images.bin")).remove_images([]).write(os.path.join(output_path, "images.bin"))
+
+        for i in ["images.bin", "points3D.bin"]:
+            self.assertEqual(self.read_bytes(output_path, i), self.read_bytes(self.model_path, i), i)
+
+    def test_identical_to_per_record_path(self):
+        colmap_images = self.create_colmap_images()
+        # the first one observes some points exclusively
+        mask = np.isin(colmap_images.id, [self.image_ids[0], self.image_ids[3], self.image_ids[7]])
+
+        for update_3d_points in [True, False]:
+            per_record_output = os.path.join(self.temp_dir.name, "per_record-{}".format(update_3d_points))
+            columnar_output = os.path.join(self.temp_dir.name, "columnar-{}".format(update_3d_points))
+            save(self.create_colmap_images(), [mask], per_record_output)(update_3d_points=update_3d_points, columnar=False)
+            save(self.create_colmap_images(), [mask], columnar_output)(update_3d_points=update_3d_points)
+
+            for i in ["images.bin", "points3D.bin", "cameras.bin"]:
+                self.assertEqual(self.read_bytes(columnar_output, i), self.read_bytes(per_record_output, i), i)
+
+        # orphaned points are removed, the originally empty one is preserved
+        points = colmap.read_points3D_binary(os.path.join(self.model_path, "points3D.bin"))
+        new_points = colmap.read_points3D_binary(os.path.join(self.temp_dir.name, "columnar-True", "points3D.bin"))
+        self.assertLessEqual(len(new_points), len(points) - 5)
+        self.assertTrue(any(i.image_ids.shape[0] == 0 for i in new_points.values()))
+        removed_image_ids = colmap_images.id[mask]
+        for point in new_points.values():
+            self.assertFalse(np.any(np.isin(point.image_ids, removed_image_ids)))
+        new_images = colmap.read_images_binary(os.path.join(self.temp_dir.name, "columnar-True", "images.bin"))
+        self.assertEqual(len(new_images), len(self.image_ids) - 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
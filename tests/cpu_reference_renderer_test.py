@@ -0,0 +1,155 @@
+import unittest
+import torch
+from internal.models.vanilla_gaussian import VanillaGaussian
+from internal.density_controllers.vanilla_density_controller import VanillaDensityController
+from internal.renderers.cpu_reference_renderer import CPUReferenceRenderer
+from synthetic_cameras import cameras_looking_at
+
+
+def create_camera(width: int = 70, height: int = 50, focal: float = 60.):
+    # at the origin, looking at +z, so the world-to-camera transform is the identity
+    return cameras_looking_at(torch.zeros((1, 3)), torch.tensor([0., 0., 1.]), width, height, focal)[0]
+
+
+class CPUReferenceRendererTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.generator = torch.Generator()
+        self.generator.manual_seed(42)
+
+    def create_model(self, n: int = 256):
+        model = VanillaGaussian(sh_degree=1).instantiate()
+        means = torch.rand((n, 3), generator=self.generator) * 2. - 1.
+        means[:, 2] += 3.
+        model.setup_from_tensors({
+            "means": means,
+            "shs_dc": torch.rand((n, 1, 3), generator=self.generator),
+            "shs_rest": torch.rand((n, 3, 3), generator=self.generator) * 0.1,
+            "opacities": torch.randn((n, 1), generator=self.generator),
+            "scales": torch.rand((n, 3), generator=self.generator) * 2. - 4.,
+            "rotations": torch.randn((n, 4), generator=self.generator),
+        })
+        return model
+
+    @staticmethod
+    def dense_composite(renderer: CPUReferenceRenderer, model, camera, bg_color):
+        """Evaluate every Gaussian on every pixel of the tiles it touches, sorted by depth globally"""
+
+        from internal.utils.gaussian_projection import project_gaussians
+        from internal.utils.sh_utils import eval_sh
+
+        width, height = camera.width.item(), camera.height.item()
+        xys, depths, radii, conics, comp, _, _, _, rect_min, rect_max = project_gaussians(
+            model.get_xyz, model.get_scaling, 1., model.get_rotation, camera.world_to_camera,
+            camera.fx, camera.fy, camera.cx, camera.cy, camera.height, camera.width, renderer.block_size,
+        )
+        viewdirs = torch.nn.functional.normalize(model.get_xyz - camera.camera_center, dim=-1)
+        rgbs = torch.clamp(eval_sh(model.active_sh_degree, model.get_features.transpose(1, 2), viewdirs) + 0.5, min=0.)
+        opacities = model.get_opacity[:, 0] * comp
+
+        image = torch.zeros((height, width, 3))
+        for y in range(height):
+            for x in range(width):
+                T = 1.
+                color = torch.zeros((3,))
+                tile = torch.tensor([x // renderer.block_size, y // renderer.block_size])
+                for i in torch.argsort(depths, stable=True).tolist():
+                    if radii[i] <= 0 or torch.any(tile < rect_min[i]) or torch.any(tile >= rect_max[i]):
+                        continue
+                    dx, dy = xys[i, 0] - (x + 0.5), xys[i, 1] - (y + 0.5)
+                    power = -0.5 * (conics[i, 0] * dx * dx + conics[i, 2] * dy * dy) - conics[i, 1] * dx * dy
+                    if power > 0:
+                        continue
+                    alpha = min(0.99, (opacities[i] * torch.exp(power)).item())
+                    if alpha < 1. / 255.:
+                        continue
+                    next_T = T * (1 - alpha)
+                    if next_T <= renderer.transmittance_threshold:
+                        break
+                    color += alpha * T * rgbs[i]
+                    T = next_T
+                image[y, x] = color + T * bg_color
+        return image.permute(2, 0, 1)
+
+    def test_single_gaussian(self):
+        camera = create_camera()
+        model = VanillaGaussian(sh_degree=0).instantiate()
+        model.setup_from_tensors({
+            "means": torch.tensor([[0., 0., 2.]]),
+            "shs_dc": torch.zeros((1, 1, 3)),  # rgb = 0.5
+            "shs_rest": torch.zeros((1, 0, 3)),
+            "opacities": torch.tensor([[2.]]),
+            "scales": torch.log(torch.full((1, 3), 0.1)),
+            "rotations": torch.tensor([[1., 0., 0., 0.]]),
+        })
+        bg_color = torch.tensor([0., 0., 1.])
+
+        with torch.no_grad():
+            outputs = CPUReferenceRenderer(anti_aliased=False)(camera, model, bg_color)
+        self.assertEqual(outputs["render"].shape, (3, 50, 70))
+        self.assertEqual(outputs["alpha"].shape, (1, 50, 70))
+
+        # the one at the center, the offset to the projected mean is (0.5, 0.5)
+        sigma2 = (60. * 0.1 / 2.) ** 2 + 0.3
+        alpha = torch.sigmoid(torch.tensor(2.)) * torch.exp(torch.tensor(-0.5 * 0.5 / sigma2))
+        pixel = outputs["render"][:, 25, 35]
+        self.assertTrue(torch.allclose(pixel, torch.tensor([0.5, 0.5, 0.5]) * alpha + (1 - alpha) * bg_color, atol=1e-5))
+        self.assertAlmostEqual(outputs["alpha"][0, 25, 35].item(), alpha.item(), places=5)
+        self.assertAlmostEqual(outputs["exp_depth"][0, 25, 35].item(), 2., places=4)
+        # corners are background
+        self.assertTrue(torch.equal(outputs["render"][:, 0, 0], bg_color))
+        self.assertEqual(outputs["alpha"][0, 0, 0].item(), 0.)
+
+    def test_match_dense_composite(self):
+        camera = create_camera(width=37, height=21)
+        model = self.create_model(n=32)
+        bg_color = torch.tensor([0.2, 0.3, 0.4])
+        renderer = CPUReferenceRenderer(block_size=8)
+
+        with torch.no_grad():
+            outputs = renderer(camera, model, bg_color)
+            expected = self.dense_composite(renderer, model, camera, bg_color)
+        self.assertTrue(torch.allclose(outputs["render"], expected, atol=1e-5))
+
+    def test_chunk_size_invariance(self):
+        camera = create_camera()
+        model = self.create_model()
+        bg_color = torch.tensor([0., 0., 0.])
+        extra_features = torch.rand((model.n_gaussians, 5), generator=self.generator)
+
+        with torch.no_grad():
+            outputs = CPUReferenceRenderer()(camera, model, bg_color, extra_features=extra_features)
+            chunked_outputs = CPUReferenceRenderer(max_elements_per_chunk=1)(camera, model, bg_color, extra_features=extra_features)
+
+        self.assertEqual(outputs["extra_features"].shape, (5, 50, 70))
+        for key in ["render", "alpha", "acc_depth", "exp_depth", "extra_features"]:
+            self.assertTrue(torch.allclose(outputs[key], chunked_outputs[key], atol=1e-6), key)
+
+    def test_backward(self):
+        camera = create_camera()
+        model = self.create_model()
+        density_controller = VanillaDensityController().instantiate()
+        density_controller._init_state(model.n_gaussians, torch.device("cpu"))
+
+        outputs = CPUReferenceRenderer()(camera, model, torch.tensor([0., 0., 0.]))
+        outputs["viewspace_points"].retain_grad()
+        loss = outputs["render"].mean() + outputs["exp_depth"].mean()
+        loss.backward()
+
+        for name in model.get_property_names():
+            grad = model.get_property(name).grad
+            self.assertIsNotNone(grad, name)
+            self.assertTrue(torch.all(torch.isfinite(grad)), name)
+            self.assertGreater(grad.abs().sum().item(), 0., name)
+
+        # the outputs can be consumed by the density controller
+        density_controller.update_states(outputs)
+        visibility_filter = outputs["visibility_filter"]
+        self.assertTrue(torch.any(visibility_filter))
+        self.assertTrue(torch.all(density_controller.denom[visibility_filter] == 1))
+        self.assertGreater(density_controller.xyz_gradient_accum[visibility_filter].sum().item(), 0.)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,217 @@
+"""
+Run `GaussianSplatting` with a real Lightning trainer on CPU,
+with `CPUReferenceRenderer` as the stand-in of the CUDA rasterizers, and a synthetic scene.
+"""
+
+import math
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple, Union
+import torch
+from lightning.pytorch import LightningDataModule, Trainer
+from lightning.pytorch.loggers import Logger
+from internal.configs.light_gaussian import LightGaussian
+from internal.density_controllers.vanilla_density_controller import VanillaDensityController
+from internal.gaussian_splatting import GaussianSplatting
+from internal.metrics.metric import Metric, MetricImpl
+from internal.models.vanilla_gaussian import VanillaGaussian, OptimizationConfig
+from internal.optimizers import Adam
+from internal.renderers.cpu_reference_renderer import CPUReferenceRenderer
+from internal.schedulers import ExponentialDecayScheduler
+from synthetic_cameras import create_cameras
+
+
+class SyntheticDataModule(LightningDataModule):
+    """Random colored points inside a unit cube, observed by the cameras on a circle"""
+
+    def __init__(self, n_images: int = 4, width: int = 32, height: int = 24, n_points: int = 512, seed: int = 42):
+        super().__init__()
+
+        generator = torch.Generator().manual_seed(seed)
+        self.point_cloud = SimpleNamespace(
+            xyz=(torch.rand((n_points, 3), generator=generator) * 2. - 1.).numpy(),
+            rgb=(torch.rand((n_points, 3), generator=generator) * 255.).numpy(),
+        )
+        cameras = create_cameras(n_images, width, height)
+        self.dataparser_outputs = SimpleNamespace(
+            camera_extent=1.,
+            train_set=SimpleNamespace(cameras=cameras, image_names=["{:03d}".format(i) for i in range(n_images)]),
+            appearance_group_ids=None,
+        )
+        self.prune_extent = 1.
+
+        self.images = []
+        for i in range(n_images):
+            gt_image = torch.rand((3, height, width), generator=generator)
+            self.images.append((cameras[i], ("{:03d}".format(i), gt_image, None), None))
+
+    def set_device(self, device):
+        pass
+
+    def train_dataloader(self):
+        return torch.utils.data.DataLoader(self.images, batch_size=None, collate_fn=_identity)
+
+    def val_dataloader(self):
+        return torch.utils.data.DataLoader(self.images, batch_size=None, collate_fn=_identity)
+
+    def test_dataloader(self):
+        return self.val_dataloader()
+
+
+def _identity(batch):
+    return batch
+
+
+class L1Metric(Metric):
+    def instantiate(self, *args, **kwargs) -> MetricImpl:
+        return L1MetricImpl(self)
+
+
+class L1MetricImpl(MetricImpl):
+    def get_train_metrics(self, pl_module, gaussian_model, step: int, batch, outputs):
+        _, (_, gt_image, _), _ = batch
+        return {"loss": torch.abs(outputs["render"] - gt_image).mean()}, {"loss": True}
+
+    def get_validate_metrics(self, pl_module, gaussian_model, batch, outputs):
+        _, (_, gt_image, _), _ = batch
+        mse = torch.mean((outputs["render"] - gt_image) ** 2)
+        return {
+            "loss": torch.abs(outputs["render"] - gt_image).mean(),
+            "psnr": -10. * torch.log10(mse),
+        }, {"loss": True, "psnr": True}
+
+
+class CPUGaussianSplatting(GaussianSplatting):
+    def setup(self, stage: str):
+        # `setup_from_pcd()` initializes the scales by the CUDA `simple_knn`
+        point_cloud = self.trainer.datamodule.point_cloud
+        n = point_cloud.xyz.shape[0]
+        generator = torch.Generator().manual_seed(0)
+        sh_degree = self.gaussian_model.config.sh_degree
+        self.gaussian_model.setup_from_tensors({
+            "means": torch.tensor(point_cloud.xyz, dtype=torch.float),
+            "shs_dc": (torch.tensor(point_cloud.rgb, dtype=torch.float) / 255. - 0.5)[:, None, :] / 0.28209479177387814,
+            "shs_rest": torch.zeros((n, (sh_degree + 1) ** 2 - 1, 3)),
+            "opacities": torch.full((n, 1), -2.),
+            "scales": torch.full((n, 3), math.log(0.1)) + torch.randn((n, 3), generator=generator) * 0.1,
+            "rotations": torch.randn((n, 4), generator=generator),
+        })
+
+        self.renderer.setup(stage=stage, lightning_module=self)
+        self.metric.setup(stage=stage, pl_module=self)
+        self.density_controller.setup(stage=stage, pl_module=self)
+        self.log_image = None
+
+
+class InMemoryLogger(Logger):
+    def __init__(self):
+        super().__init__()
+        self.logged: List[Tuple[Optional[int], Dict[str, float]]] = []
+
+    @property
+    def name(self):
+        return "memory"
+
+    @property
+    def version(self):
+        return 0
+
+    def log_hyperparams(self, params: Any, *args: Any, **kwargs: Any) -> None:
+        pass
+
+    def log_metrics(self, metrics: Dict[str, float], step: Optional[int] = None) -> None:
+        self.logged.append((step, dict(metrics)))
+
+    def get_metric(self, name: str) -> List[Tuple[Optional[int], float]]:
+        return [(step, metrics[name]) for step, metrics in self.logged if name in metrics]
+
+
+def create_module(
+        output_path: str,
+        max_steps: int,
+        density: Optional[VanillaDensityController] = None,
+        metric: Optional[Metric] = None,
+        **kwargs,
+) -> CPUGaussianSplatting:
+    return CPUGaussianSplatting(
+        light_gaussian=LightGaussian(),
+        save_iterations=[],
+        # the default optimizer and scheduler are in the format of jsonargparse
+        gaussian=VanillaGaussian(sh_degree=1, optimization=OptimizationConfig(
+            means_lr_scheduler=ExponentialDecayScheduler(lr_final=1.6e-6, max_steps=max_steps),
+            optimizer=Adam(),
+        )),
+        output_path=output_path,
+        renderer=CPUReferenceRenderer(),
+        metric=L1Metric() if metric is None else metric,
+        density=VanillaDensityController() if density is None else density,
+        **kwargs,
+    )
+
+
+def create_trainer(
+        output_path: str,
+        max_steps: int,
+        logger: Logger,
+        callbacks: Optional[list] = None,
+        limit_val_batches: Union[int, float] = 0,
+) -> Trainer:
+    """
+    Args:
+        limit_val_batches: the validation is disabled by default, `1.` to validate all the batches
+    """
+
+    return Trainer(
+        accelerator="cpu",
+        devices=1,
+        max_steps=max_steps,
+        logger=logger,
+        callbacks=callbacks,
+        default_root_dir=output_path,
+        enable_checkpointing=False,
+        enable_progress_bar=False,
+        enable_model_summary=False,
+        log_every_n_steps=1,
+        limit_val_batches=limit_val_batches,
+        num_sanity_val_steps=0,
+    )
+
+
+def fit(
+        output_path: str,
+        max_steps: int,
+        density: Optional[VanillaDensityController] = None,
+        callbacks: Optional[list] = None,
+        datamodule: Optional[SyntheticDataModule] = None,
+        metric: Optional[Metric] = None,
+        **kwargs,
+):
+    """
+    Returns:
+        the module, the trainer and the logger
+    """
+
+    module = create_module(output_path, max_steps, density=density, metric=metric, **kwargs)
+    logger = InMemoryLogger()
+    trainer = create_trainer(output_path, max_steps, logger, callbacks)
+    trainer.fit(module, datamodule=SyntheticDataModule() if datamodule is None else datamodule)
+    return module, trainer, logger
+
+
+def validate(
+        output_path: str,
+        datamodule: Optional[SyntheticDataModule] = None,
+        metric: Optional[Metric] = None,
+        **kwargs,
+):
+    """
+    Run the validation of an untrained model, whose Gaussians are initialized by `CPUGaussianSplatting.setup()`.
+
+    Returns:
+        the module, the trainer and the logger
+    """
+
+    module = create_module(output_path, 1, metric=metric, **kwargs)
+    logger = InMemoryLogger()
+    trainer = create_trainer(output_path, 1, logger, limit_val_batches=1.)
+    trainer.validate(module, datamodule=SyntheticDataModule() if datamodule is None else datamodule)
+    return module, trainer, logger
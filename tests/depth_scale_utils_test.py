@@ -0,0 +1,161 @@
+import os
+import sys
+import json
+import unittest
+import tempfile
+import subprocess
+import numpy as np
+import cv2
+from internal.utils import colmap
+from internal.utils.depth_scale_utils import get_depth_scales, sample_depth_map, segmented_median, segmented_mean, qvecs_to_rotation_matrices
+
+
+def create_dataset(path: str, n_images: int = 8, n_points: int = 600, seed: int = 42):
+    rng = np.random.default_rng(seed)
+    width, height = 64, 48
+    focal = 50.
+
+    point_ids = rng.permutation(n_points) * 2 + 1
+    xyzs = np.stack([rng.uniform(-2., 2., n_points), rng.uniform(-1.5, 1.5, n_points), rng.uniform(2., 6., n_points)], axis=-1)
+    errors = rng.uniform(0., 2., n_points)
+
+    images = {}
+    tracks = {point_id: ([], []) for point_id in point_ids}
+    os.makedirs(os.path.join(path, "estimated_depths"))
+    for image_idx in range(n_images):
+        image_id = image_idx + 1
+        qvec = np.array([1., *rng.normal(scale=0.05, size=3)])
+        qvec /= np.linalg.norm(qvec)
+        tvec = rng.normal(scale=0.2, size=3)
+        R = colmap.qvec2rotmat(qvec)
+        points_in_camera = xyzs @ R.T + tvec
+        xys = points_in_camera[:, :2] / points_in_camera[:, 2:] * focal + np.array([width / 2, height / 2])
+
+        # some are outside the image, the last one observes only a few points
+        observed = np.nonzero((xys[:, 0] > -4) & (xys[:, 0] < width + 4) & (xys[:, 1] > -4) & (xys[:, 1] < height + 4))[0]
+        if image_idx == n_images - 1:
+            observed = observed[:8]
+        point3D_ids = np.concatenate([point_ids[observed], [-1, -1, 999999]])
+        point_xys = np.concatenate([xys[observed], rng.uniform(0, 48, size=(3, 2))])
+        for point2D_idx, point_idx in enumerate(observed):
+            tracks[point_ids[point_idx]][0].append(image_id)
+            tracks[point_ids[point_idx]][1].append(point2D_idx)
+
+        name = "{:03d}.jpg".format(image_id)
+        images[image_id] = colmap.Image(
+            id=image_id,
+            qvec=qvec,
+            tvec=tvec,
+            camera_id=1,
+            name=name,
+            xys=point_xys,
+            point3D_ids=point3D_ids,
+        )
+
+        # a half resolution inverse depth map, related to the real one by an affine transform with noise
+        v, u = np.meshgrid(np.arange(height // 2), np.arange(width // 2), indexing="ij")
+        depth_map = 1. / (3. + 0.05 * u + 0.03 * v + rng.uniform(0, 0.3, size=u.shape))
+        depth_map = (depth_map * rng.uniform(0.5, 2.) + rng.uniform(-0.1, 0.1)).astype(np.float32)
+        np.save(os.path.join(path, "estimated_depths", "{}.npy".format(name)), depth_map)
+
+    points = {}
+    for point_idx, point_id in enumerate(point_ids):
+        points[point_id] = colmap.Point3D(
+            id=int(point_id),
+            xyz=xyzs[point_idx],
+            rgb=np.array([128, 128, 128]),
+            error=np.array(errors[point_idx]),
+            image_ids=np.asarray(tracks[point_id][0], dtype=np.int64),
+            point2D_idxs=np.asarray(tracks[point_id][1], dtype=np.int64),
+        )
+
+    sparse_dir = os.path.join(path, "sparse")
+    os.makedirs(sparse_dir)
+    colmap.write_cameras_binary(
+        {1: colmap.Camera(id=1, model="PINHOLE", width=width, height=height, params=np.array([focal, focal, width / 2, height / 2]))},
+        os.path.join(sparse_dir, "cameras.bin"),
+    )
+    colmap.write_images_binary(images, os.path.join(sparse_dir, "images.bin"))
+    colmap.write_points3D_binary(points, os.path.join(sparse_dir, "points3D.bin"))
+
+
+class DepthScaleUtilsTest(unittest.TestCase):
+    def test_segmented_reductions(self):
+        rng = np.random.default_rng(0)
+        segment_ids = rng.integers(0, 6, size=200)
+        segment_ids[segment_ids == 3] = 2  # an empty segment
+        values = rng.normal(size=200)
+
+        medians = segmented_median(values, segment_ids, 6)
+        means = segmented_mean(values, segment_ids, 6)
+        for i in range(6):
+            if i == 3:
+                self.assertTrue(np.isnan(medians[i]))
+                continue
+            self.assertEqual(medians[i], np.median(values[segment_ids == i]))
+            self.assertAlmostEqual(means[i], np.mean(values[segment_ids == i]), places=12)
+
+    def test_rotation_matrices(self):
+        qvecs = np.random.default_rng(0).normal(size=(16, 4))
+        qvecs /= np.linalg.norm(qvecs, axis=-1, keepdims=True)
+        expected = np.stack([colmap.qvec2rotmat(i) for i in qvecs])
+        self.assertTrue(np.allclose(qvecs_to_rotation_matrices(qvecs), expected))
+
+    def test_sample_depth_map(self):
+        rng = np.random.default_rng(0)
+        depth_map = rng.uniform(size=(97, 131)).astype(np.float32)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "depth.npy")
+            np.save(path, depth_map)
+
+            # clustered rows, including the ones near the borders and the integers
+            xys = np.concatenate([
+                rng.uniform(0, 262, size=(300, 2)) * np.array([1., 0.1]),
+                rng.uniform(0, 262, size=(300, 2)) * np.array([1., 0.05]) + np.array([0., 180.]),
+                np.array([[0., 0.], [261.99, 193.99], [10., 193.98], [20., 40.], [30., 41.999], [40., 42.001]]),
+            ])
+            inverse_depths = rng.uniform(0.1, 1., size=xys.shape[0])
+            valid, samples = sample_depth_map(path, xys, inverse_depths, 262, 194)
+
+        maps = (xys * 0.5).astype(np.float32)[valid]
+        expected = cv2.remap(depth_map, maps[..., 0], maps[..., 1], interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)[..., 0]
+        self.assertTrue(np.all(valid))
+        self.assertTrue(np.array_equal(samples, expected))
+
+    def test_match_per_image_script(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            create_dataset(temp_dir)
+
+            depth_scales = get_depth_scales(os.path.join(temp_dir, "sparse"), os.path.join(temp_dir, "estimated_depths"), n_processes=0)
+            self.assertEqual(get_depth_scales(
+                os.path.join(temp_dir, "sparse"),
+                os.path.join(temp_dir, "estimated_depths"),
+                n_processes=2,
+                chunk_size=3,
+            ), depth_scales)
+
+            script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "utils", "get_depth_scales.py")
+            outputs = {}
+            for name, extra_args in [("batched", []), ("per_image", ["--per-image"])]:
+                outputs[name] = os.path.join(temp_dir, "{}.json".format(name))
+                subprocess.check_call([sys.executable, script, temp_dir, "-o", outputs[name]] + extra_args)
+            with open(outputs["batched"], "r") as f:
+                batched = json.load(f)
+            with open(outputs["per_image"], "r") as f:
+                per_image = json.load(f)
+
+        self.assertEqual(list(batched.keys()), list(per_image.keys()))
+        self.assertEqual(batched, json.loads(json.dumps(depth_scales)))
+        n_estimated = 0
+        for name, expected in per_image.items():
+            for key in ["scale", "offset"]:
+                self.assertAlmostEqual(batched[name][key], expected[key], places=5, msg="{}.{}".format(name, key))
+            n_estimated += expected["scale"] != 0
+        # the last one does not have enough points
+        self.assertEqual(per_image["008.jpg"], {"scale": 0, "offset": 0})
+        self.assertEqual(batched["008.jpg"], {"scale": 0, "offset": 0})
+        self.assertEqual(n_estimated, 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,261 @@
+import os
+import tempfile
+import unittest
+import torch
+import torch.distributed
+import torch.multiprocessing
+from internal.utils.morton_code import get_morton_codes, split_by_3
+from internal.utils.distributed_gaussian_utils import DistributedGaussianUtils
+
+PROPERTY_SHAPES = {
+    "means": (3,),
+    "scales": (3,),
+    "opacities": (1,),
+    "shs_rest": (15, 3),
+    "no_state": (),
+}
+
+
+def get_rank_properties(rank: int):
+    generator = torch.Generator()
+    generator.manual_seed(rank)
+    n = 1000 + 317 * rank
+    properties = {
+        name: torch.rand((n, *shape), generator=generator)
+        for name, shape in PROPERTY_SHAPES.items()
+    }
+    # make the Gaussians of each rank spread all over the scene
+    properties["means"] = (properties["means"] - 0.5) * 16
+    # a unique id of each Gaussian, not optimizable
+    properties["ids"] = torch.arange(n, dtype=torch.long) + sum([1000 + 317 * i for i in range(rank)])
+    properties["flags"] = properties["no_state"] > 0.5
+    properties["half"] = properties["scales"].to(torch.float16)
+    return properties
+
+
+class DummyModel:
+    def __init__(self, properties):
+        self.properties = properties
+
+    def get_property_names(self):
+        return list(self.properties.keys())
+
+    def get_property(self, name):
+        return self.properties[name]
+
+    @property
+    def get_xyz(self):
+        return self.properties["means"]
+
+
+def get_optimizers(properties):
+    optimizers = []
+    for names in [["means"], ["scales", "opacities", "shs_rest", "no_state"]]:
+        params = [torch.nn.Parameter(properties[name]) for name in names]
+        optimizer = torch.optim.Adam([{"name": name, "params": [param]} for name, param in zip(names, params)])
+        for name, param in zip(names, params):
+            if name == "no_state":
+                continue
+            # make the moments derivable from the parameters, so whether they follow the parameters can be validated
+            optimizer.state[param] = {
+                "step": torch.tensor(100, dtype=torch.float),
+                "exp_avg": param.detach() + 1.,
+                "exp_avg_sq": param.detach() * 2.,
+            }
+        for name, param in zip(names, params):
+            properties[name] = param
+        optimizers.append(optimizer)
+    return optimizers
+
+
+def redistribute_worker(rank: int, world_size: int, init_file: str, output_dir: str, strategy: str, packed: bool):
+    torch.distributed.init_process_group(
+        "gloo",
+        init_method="file://{}".format(init_file),
+        rank=rank,
+        world_size=world_size,
+    )
+    try:
+        properties = get_rank_properties(rank)
+        optimizers = get_optimizers(properties)
+        model = DummyModel(properties)
+
+        n_bucket_bits = 12
+        bounding_box = DistributedGaussianUtils.get_global_bounding_box(model.get_xyz)
+        if strategy == "spatial":
+            destination = DistributedGaussianUtils.get_spatial_destination(
+                model.get_xyz,
+                world_size=world_size,
+                bounding_box=bounding_box,
+                n_bucket_bits=n_bucket_bits,
+            )
+        else:
+            generator = torch.Generator()
+            generator.manual_seed(rank)
+            destination = torch.randint(0, world_size, (model.get_xyz.shape[0],), generator=generator)
+
+        _, number_of_gaussians_to_receive = DistributedGaussianUtils.get_number_of_gaussians_to_receive(destination, world_size)
+        DistributedGaussianUtils.optimizer_all2all(
+            destination,
+            number_of_gaussians_to_receive,
+            model,
+            optimizers,
+            world_size,
+            packed=packed,
+        )
+
+        states = {}
+        for optimizer in optimizers:
+            for group in optimizer.param_groups:
+                param = group["params"][0]
+                # the parameter of the optimizer must be the one held by the model
+                assert param is model.get_property(group["name"])
+                state = optimizer.state.get(param, None)
+                if state is not None:
+                    states[group["name"]] = {"exp_avg": state["exp_avg"], "exp_avg_sq": state["exp_avg_sq"]}
+
+        torch.save({
+            "properties": {name: value.detach() for name, value in model.properties.items()},
+            "states": states,
+            "bucket_ids": DistributedGaussianUtils.get_bucket_ids(model.get_xyz, bounding_box, n_bucket_bits),
+        }, os.path.join(output_dir, "{}.pt".format(rank)))
+    finally:
+        torch.distributed.destroy_process_group()
+
+
+class DistributedGaussianUtilsTest(unittest.TestCase):
+    def run_redistribution(self, world_size: int, strategy: str, packed: bool = True):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            torch.multiprocessing.spawn(
+                redistribute_worker,
+                args=(world_size, os.path.join(tmp_dir, "init"), tmp_dir, strategy, packed),
+                nprocs=world_size,
+                join=True,
+            )
+            return [torch.load(os.path.join(tmp_dir, "{}.pt".format(rank))) for rank in range(world_size)]
+
+    def validate_redistribution(self, world_size: int, results):
+        original_properties = [get_rank_properties(rank) for rank in range(world_size)]
+        original_properties = {
+            name: torch.concat([i[name] for i in original_properties], dim=0)
+            for name in original_properties[0]
+        }
+        n_gaussians = original_properties["ids"].shape[0]
+
+        # no Gaussian lost or duplicated
+        ids = torch.concat([i["properties"]["ids"] for i in results], dim=0)
+        self.assertEqual(ids.shape[0], n_gaussians)
+        self.assertTrue(torch.equal(torch.sort(ids).values, torch.arange(n_gaussians)))
+
+        for result in results:
+            rank_ids = result["properties"]["ids"]
+            for name, value in result["properties"].items():
+                # the properties of a Gaussian are moved together
+                self.assertTrue(torch.equal(value, original_properties[name][rank_ids]), name)
+            for name, state in result["states"].items():
+                # the moments follow their Gaussians
+                self.assertTrue(torch.equal(state["exp_avg"], result["properties"][name] + 1.), name)
+                self.assertTrue(torch.equal(state["exp_avg_sq"], result["properties"][name] * 2.), name)
+
+    def test_random_redistribution(self):
+        world_size = 3
+        results = self.run_redistribution(world_size, "random")
+        self.validate_redistribution(world_size, results)
+
+    def test_packed_all2all(self):
+        world_size = 3
+        packed_results = self.run_redistribution(world_size, "random", packed=True)
+        per_field_results = self.run_redistribution(world_size, "random", packed=False)
+        self.validate_redistribution(world_size, per_field_results)
+
+        # bit-identical
+        for packed_result, per_field_result in zip(packed_results, per_field_results):
+            self.assertEqual(list(packed_result["properties"].keys()), list(per_field_result["properties"].keys()))
+            for name, value in packed_result["properties"].items():
+                self.assertEqual(value.dtype, per_field_result["properties"][name].dtype)
+                self.assertTrue(torch.equal(value, per_field_result["properties"][name]), name)
+            self.assertEqual(list(packed_result["states"].keys()), list(per_field_result["states"].keys()))
+            for name, state in packed_result["states"].items():
+                for state_name, value in state.items():
+                    self.assertTrue(torch.equal(value, per_field_result["states"][name][state_name]), state_name)
+
+    def test_pack_gaussian_states(self):
+        properties = get_rank_properties(1)
+        properties["empty"] = torch.empty((properties["means"].shape[0], 0, 3))
+        tensors = list(properties.values())
+
+        buffer, header = DistributedGaussianUtils.pack_gaussian_states(tensors)
+        self.assertEqual(buffer.dtype, torch.uint8)
+        self.assertEqual(buffer.shape, (tensors[0].shape[0], header.n_bytes_per_gaussian))
+
+        unpacked = DistributedGaussianUtils.unpack_gaussian_states(buffer, header)
+        self.assertEqual(len(unpacked), len(tensors))
+        for tensor, unpacked_tensor in zip(tensors, unpacked):
+            self.assertEqual(tensor.dtype, unpacked_tensor.dtype)
+            self.assertTrue(torch.equal(tensor, unpacked_tensor))
+
+        # a row holds all the states of a Gaussian
+        unpacked = DistributedGaussianUtils.unpack_gaussian_states(buffer[10:20], header)
+        for tensor, unpacked_tensor in zip(tensors, unpacked):
+            self.assertTrue(torch.equal(tensor[10:20], unpacked_tensor))
+
+        # a rank holding no Gaussians
+        empty_tensors = [i[:0] for i in tensors]
+        buffer, empty_header = DistributedGaussianUtils.pack_gaussian_states(empty_tensors)
+        self.assertEqual(buffer.shape, (0, header.n_bytes_per_gaussian))
+        self.assertEqual(empty_header.n_bytes_per_gaussian, header.n_bytes_per_gaussian)
+        unpacked = DistributedGaussianUtils.unpack_gaussian_states(buffer, empty_header)
+        for tensor, unpacked_tensor in zip(empty_tensors, unpacked):
+            self.assertEqual(tensor.dtype, unpacked_tensor.dtype)
+            self.assertEqual(tensor.shape, unpacked_tensor.shape)
+
+    def test_spatial_redistribution(self):
+        world_size = 4
+        results = self.run_redistribution(world_size, "spatial")
+        self.validate_redistribution(world_size, results)
+
+        # each rank owns a contiguous slab of the Morton curve
+        for rank in range(world_size - 1):
+            self.assertLessEqual(results[rank]["bucket_ids"].max(), results[rank + 1]["bucket_ids"].min())
+
+        # balanced
+        n_gaussians = torch.tensor([i["properties"]["ids"].shape[0] for i in results], dtype=torch.float)
+        self.assertLess((n_gaussians.max() / n_gaussians.min()).item(), 1.1)
+
+    def test_get_bucket_ranks(self):
+        bucket_costs = torch.tensor([1., 1., 1., 1., 0., 0., 1., 1.], dtype=torch.float64)
+        bucket_ranks = DistributedGaussianUtils.get_bucket_ranks(bucket_costs, 3)
+        self.assertTrue(torch.all(bucket_ranks[1:] >= bucket_ranks[:-1]))
+        self.assertEqual(bucket_ranks.max().item(), 2)
+        self.assertEqual(torch.bincount(bucket_ranks, weights=bucket_costs).tolist(), [2., 2., 2.])
+
+        # a heavy bucket
+        bucket_costs = torch.tensor([0.1, 10., 0.1, 0.1], dtype=torch.float64)
+        bucket_ranks = DistributedGaussianUtils.get_bucket_ranks(bucket_costs, 2)
+        self.assertTrue(torch.all(bucket_ranks[1:] >= bucket_ranks[:-1]))
+
+    def test_morton_codes(self):
+        self.assertEqual(split_by_3(torch.tensor([0b1011])).item(), 0b1000001001)
+        self.assertEqual(split_by_3(torch.tensor([(1 << 21) - 1])).item(), 0x1249249249249249)
+
+        points = torch.tensor([
+            [0., 0., 0.],
+            [0., 0., 1.],
+            [0., 1., 0.],
+            [1., 0., 0.],
+            [1., 1., 1.],
+        ])
+        codes = get_morton_codes(points, n_bits=1)
+        self.assertEqual(codes.tolist(), [0, 1, 2, 4, 7])
+
+        # nearby points share the leading bits
+        generator = torch.Generator()
+        generator.manual_seed(42)
+        points = torch.rand((1024, 3), generator=generator)
+        codes = get_morton_codes(points, torch.zeros((3,)), torch.ones((3,)))
+        octant = (points >= 0.5).to(torch.long)
+        self.assertTrue(torch.equal(codes >> 60, (octant[:, 0] << 2) | (octant[:, 1] << 1) | octant[:, 2]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""
+A stand-in of `GaussianSplatting` for the tests of the components operating on the Gaussians and their training states,
+without a Lightning trainer.
+"""
+
+from types import SimpleNamespace
+from typing import Optional
+import torch
+from internal.models.vanilla_gaussian import VanillaGaussian
+from internal.density_controllers.vanilla_density_controller import VanillaDensityController
+
+
+def create_gaussian_module(
+        means: torch.Tensor,
+        scales: torch.Tensor,
+        generator: torch.Generator,
+        density: Optional[VanillaDensityController] = None,
+        n_optimizer_steps: int = 1,
+) -> SimpleNamespace:
+    """
+    Args:
+        means: [N, 3]
+        scales: [N, 3], before activation
+        generator: the other properties, the optimizer states and the density controller states are random
+        density: default to `VanillaDensityController()`
+        n_optimizer_steps: take some steps to make the optimizer states non-trivial
+
+    Returns:
+        a namespace contains `gaussian_model`, `gaussian_optimizers`, `density_controller` and `trainer`
+    """
+
+    n = means.shape[0]
+    model = VanillaGaussian(sh_degree=1).instantiate()
+    model.setup_from_tensors({
+        "means": means,
+        "shs_dc": torch.rand((n, 1, 3), generator=generator),
+        "shs_rest": torch.rand((n, 3, 3), generator=generator),
+        "opacities": torch.randn((n, 1), generator=generator),
+        "scales": scales,
+        "rotations": torch.randn((n, 4), generator=generator),
+    })
+
+    optimizers = []
+    for names in [["means"], ["shs_dc", "shs_rest", "opacities", "scales", "rotations"]]:
+        optimizers.append(torch.optim.Adam([
+            {"name": name, "params": [model.get_property(name)], "lr": 1e-3}
+            for name in names
+        ]))
+    for _ in range(n_optimizer_steps):
+        for name in model.get_property_names():
+            model.get_property(name).grad = torch.randn(model.get_property(name).shape, generator=generator)
+        for optimizer in optimizers:
+            optimizer.step()
+
+    if density is None:
+        density = VanillaDensityController()
+    density_controller = density.instantiate()
+    density_controller.cameras_extent = 1.
+    density_controller.prune_extent = 1.
+    density_controller._init_state(n, torch.device("cpu"))
+    density_controller.max_radii2D.copy_(torch.rand((n,), generator=generator) * 100)
+    density_controller.xyz_gradient_accum.copy_(torch.rand((n, 1), generator=generator))
+    density_controller.denom.copy_(torch.randint(0, 100, (n, 1), generator=generator))
+
+    return SimpleNamespace(
+        gaussian_model=model,
+        gaussian_optimizers=optimizers,
+        density_controller=density_controller,
+        trainer=SimpleNamespace(train_dataloader=None),
+    )
@@ -0,0 +1,122 @@
+import unittest
+import torch
+from internal.callbacks import ReorderGaussians
+from internal.density_controllers.density_controller import DensityControllerImpl
+from internal.utils.gaussian_projection import project_gaussians
+from internal.utils.morton_code import get_morton_codes
+from gaussian_module import create_gaussian_module
+
+
+class GaussianReorderTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.generator = torch.Generator()
+        self.generator.manual_seed(42)
+
+    def create_module(self, n: int = 4096):
+        means = torch.rand((n, 3), generator=self.generator) * 4. - 2.
+        means[:, 2] += 4.  # in front of the camera
+        return create_gaussian_module(
+            means=means,
+            scales=torch.rand((n, 3), generator=self.generator) * 2. - 5.,
+            generator=self.generator,
+            n_optimizer_steps=3,
+        )
+
+    def project(self, model):
+        return project_gaussians(
+            means_3d=model.get_means(),
+            scales=model.get_scales(),
+            scale_modifier=1.,
+            quaternions=model.get_rotations(),
+            world_to_camera=torch.eye(4),
+            fx=torch.tensor(256.),
+            fy=torch.tensor(256.),
+            cx=torch.tensor(128.),
+            cy=torch.tensor(128.),
+            img_height=torch.tensor(256),
+            img_width=torch.tensor(256),
+            block_width=16,
+        )
+
+    @staticmethod
+    def get_states(module):
+        states = {}
+        for optimizer in module.gaussian_optimizers:
+            for group in optimizer.param_groups:
+                state = optimizer.state[group["params"][0]]
+                states[group["name"]] = (state["exp_avg"].clone(), state["exp_avg_sq"].clone())
+        return states
+
+    def test_reorder(self):
+        module = self.create_module()
+        model = module.gaussian_model
+        n = model.n_gaussians
+
+        original_properties = {name: value.detach().clone() for name, value in model.properties.items()}
+        original_states = self.get_states(module)
+        original_buffers = {name: buffer.clone() for name, buffer in module.density_controller.named_buffers()}
+        with torch.no_grad():
+            original_projection = self.project(model)
+
+        indices = ReorderGaussians.reorder(module)
+
+        # is a permutation
+        self.assertTrue(torch.equal(torch.sort(indices).values, torch.arange(n)))
+        # sorted along the Morton curve
+        morton_codes = get_morton_codes(model.get_means())
+        self.assertTrue(torch.all(morton_codes[1:] >= morton_codes[:-1]))
+
+        # properties, optimizer states and density statistics are permuted together
+        for name, value in model.properties.items():
+            self.assertTrue(torch.equal(value, original_properties[name][indices]), name)
+            self.assertIsInstance(value, torch.nn.Parameter)
+        for optimizer in module.gaussian_optimizers:
+            for group in optimizer.param_groups:
+                self.assertIs(group["params"][0], model.get_property(group["name"]))
+        for name, (exp_avg, exp_avg_sq) in self.get_states(module).items():
+            self.assertTrue(torch.equal(exp_avg, original_states[name][0][indices]), name)
+            self.assertTrue(torch.equal(exp_avg_sq, original_states[name][1][indices]), name)
+        for name, buffer in module.density_controller.named_buffers():
+            self.assertTrue(torch.equal(buffer, original_buffers[name][indices]), name)
+
+        # the projection results are the same up to permutation
+        with torch.no_grad():
+            projection = self.project(model)
+        for original, reordered in zip(original_projection, projection):
+            self.assertEqual(original.shape[0], n)
+            self.assertTrue(torch.allclose(original[indices].float(), reordered.float(), rtol=1e-6, atol=1e-6))
+
+        # the next optimizer step is identical up to permutation
+        self.generator.manual_seed(42)
+        reference_module = self.create_module()  # the same as the original one
+        grads = {
+            name: torch.randn(value.shape, generator=self.generator)
+            for name, value in reference_module.gaussian_model.properties.items()
+        }
+        for name, value in reference_module.gaussian_model.properties.items():
+            value.grad = grads[name]
+            model.get_property(name).grad = grads[name][indices]
+        for optimizer in reference_module.gaussian_optimizers + module.gaussian_optimizers:
+            optimizer.step()
+        for name, value in model.properties.items():
+            self.assertTrue(torch.equal(value, reference_module.gaussian_model.get_property(name)[indices]), name)
+
+    def test_default_reorder_states(self):
+        density_controller = DensityControllerImpl(None)
+        density_controller.register_buffer("accum", torch.arange(16).reshape(8, 2))
+        density_controller.register_buffer("table", torch.arange(5))
+        density_controller.register_buffer("scalar", torch.tensor(1))
+        indices = torch.randperm(8, generator=self.generator)
+
+        density_controller.reorder_states(indices)
+
+        # only the per-Gaussian ones are permuted
+        self.assertTrue(torch.equal(density_controller.accum, torch.arange(16).reshape(8, 2)[indices]))
+        self.assertIn("accum", dict(density_controller.named_buffers()))
+        self.assertTrue(torch.equal(density_controller.table, torch.arange(5)))
+        self.assertTrue(torch.equal(density_controller.scalar, torch.tensor(1)))
+
+if __name__ == '__main__':
+    unittest.main()
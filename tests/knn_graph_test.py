@@ -0,0 +1,110 @@
+import io
+import unittest
+import torch
+from internal.utils.knn_graph import KNNGraph, VoxelHash, voxel_hash_knn, brute_force_knn, gather_mean
+
+
+class KNNGraphTest(unittest.TestCase):
+    @staticmethod
+    def create_points(generator, n: int = 3000):
+        """Some clusters of different densities, plus some isolated ones"""
+
+        clusters = [
+            torch.randn((n // 2, 3), generator=generator) * 0.05,
+            torch.rand((n // 2 - 20, 3), generator=generator) * 2. + 1.,
+            torch.randn((20, 3), generator=generator) * 30.,
+        ]
+        return torch.concat(clusters, dim=0)
+
+    def assert_exact(self, points: torch.Tensor, neighbors: torch.Tensor, k: int):
+        expected_distances, _ = brute_force_knn(points, points, k)
+        distances = ((points[neighbors] - points[:, None, :]) ** 2).sum(dim=-1)
+        # the indices may differ when the distances tie
+        torch.testing.assert_close(distances, expected_distances)
+        self.assertTrue(torch.equal(neighbors[:, 0], torch.arange(points.shape[0])))
+        # no duplicated neighbors
+        self.assertTrue((torch.sort(neighbors, dim=-1).values.diff(dim=-1) > 0).all())
+
+    def test_query(self):
+        generator = torch.Generator().manual_seed(0)
+        points = self.create_points(generator)
+        for k, voxel_size, max_candidates in [(16, None, 1 << 24), (5, 0.01, 4096), (1, 0.5, 1 << 24)]:
+            graph = KNNGraph(k, voxel_size=voxel_size, chunk_size=512, max_candidates=max_candidates)
+            self.assert_exact(points, graph.build(points), k)
+            self.assertEqual(graph.neighbors.shape, (points.shape[0], k))
+
+        # queries not in the points, with the maximum distances
+        queries = torch.rand((500, 3), generator=generator) * 4. - 1.
+        max_distances = torch.full((500,), 0.1)
+        distances, indices = voxel_hash_knn(queries, VoxelHash(points, 0.05), 1, max_distances=max_distances)
+        expected_distances, expected_indices = brute_force_knn(queries, points, 1)
+        found = expected_distances[:, 0] <= 0.01
+        self.assertTrue(found.any())
+        torch.testing.assert_close(distances[found], expected_distances[found])
+
+    def test_cached(self):
+        generator = torch.Generator().manual_seed(1)
+        points = self.create_points(generator)
+        graph = KNNGraph(8)
+        neighbors = graph.get(points)
+        self.assertIs(graph.get(points), neighbors)
+        # the same values in another tensor
+        self.assertIs(graph.get(points.clone()), neighbors)
+
+        # restored from a checkpoint
+        buffer = io.BytesIO()
+        torch.save(graph.state_dict(), buffer)
+        buffer.seek(0)
+        restored = KNNGraph(8)
+        restored.load_state_dict(torch.load(buffer))
+        self.assertTrue(torch.equal(restored.get(points), neighbors))
+
+        # the legacy one
+        legacy = KNNGraph(8)
+        legacy.load_state_dict({"K": 8, "m": neighbors})
+        self.assertIs(legacy.get(points), neighbors)
+
+        # invalidated by the changes
+        points[0] += 0.5
+        self.assertIsNot(graph.get(points), neighbors)
+        self.assert_exact(points, graph.neighbors, 8)
+
+    def test_incremental(self):
+        generator = torch.Generator().manual_seed(2)
+        points = self.create_points(generator)
+        graph = KNNGraph(8)
+        graph.build(points)
+
+        valid_mask = torch.rand((points.shape[0],), generator=generator) > 0.3
+        points = points[valid_mask]
+        neighbors = graph.prune(valid_mask, points)
+        self.assert_exact(points, neighbors, 8)
+        self.assertIs(graph.get(points), neighbors)
+
+        points = torch.concat([points, points[:500] + torch.randn((500, 3), generator=generator) * 0.01], dim=0)
+        neighbors = graph.append(points)
+        self.assert_exact(points, neighbors, 8)
+        self.assertIs(graph.get(points), neighbors)
+
+    def test_gather_mean(self):
+        generator = torch.Generator().manual_seed(3)
+        features = torch.randn((200, 6), generator=generator, dtype=torch.double, requires_grad=True)
+        neighbors = torch.randint(0, 200, (200, 8), generator=generator)
+        columns = torch.tensor([5, 1, 2])
+
+        for selected in [None, columns]:
+            selected_neighbors = neighbors if selected is None else neighbors[:, selected]
+            outputs = gather_mean(features, neighbors, selected, chunk_size=64)
+            expected = features[selected_neighbors].mean(dim=1)
+            self.assertTrue(torch.equal(outputs, expected))
+
+            grad_outputs = torch.randn_like(outputs)
+            grad, = torch.autograd.grad(outputs, features, grad_outputs)
+            expected_grad, = torch.autograd.grad(expected, features, grad_outputs)
+            torch.testing.assert_close(grad, expected_grad)
+
+        torch.autograd.gradcheck(lambda i: gather_mean(i, neighbors, columns, chunk_size=64), (features,))
+
+
+if __name__ == '__main__':
+    unittest.main()
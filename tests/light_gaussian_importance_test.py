@@ -0,0 +1,119 @@
+import io
+import math
+import unittest
+import torch
+from internal.models.vanilla_gaussian import VanillaGaussian
+from internal.utils.light_gaussian import ImportanceScoreEngine
+from cpu_training_loop import create_cameras
+
+
+class StandInHitCounter:
+    """Count the pixels covered by the projected circles, each Gaussian is counted independently of the others"""
+
+    def __init__(self):
+        self.n_cameras = 0
+        self.n_calls = 0
+
+    def __call__(self, gaussian_model, cameras, anti_aliased: bool, out: torch.Tensor):
+        self.n_calls += 1
+        means = gaussian_model.get_xyz
+        opacities = gaussian_model.get_opacity.squeeze(-1)
+        radii = gaussian_model.get_scaling.amax(dim=-1) * 3.
+        for camera in cameras:
+            self.n_cameras += 1
+            points = means @ camera.R.T + camera.T
+            depths = points[:, 2]
+            x = camera.fx * points[:, 0] / depths + camera.cx
+            y = camera.fy * points[:, 1] / depths + camera.cy
+            visible = (depths > 0.01) & (x >= 0) & (x < camera.width) & (y >= 0) & (y < camera.height)
+            count = torch.ceil(math.pi * (camera.fx * radii / depths) ** 2) * visible
+            alphas = opacities * (0.5 if anti_aliased else 1.)
+            out[:, 0] += count
+            out[:, 1] += count * alphas
+            out[:, 2] += count * alphas * 0.5
+            out[:, 3] += visible
+
+
+class LightGaussianImportanceTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+
+        generator = torch.Generator().manual_seed(42)
+        n = 2048
+        self.gaussian_model = VanillaGaussian(sh_degree=0).instantiate()
+        self.gaussian_model.setup_from_tensors({
+            "means": torch.rand((n, 3), generator=generator) * 2. - 1.,
+            "shs_dc": torch.rand((n, 1, 3), generator=generator),
+            "shs_rest": torch.zeros((n, 0, 3)),
+            "opacities": torch.randn((n, 1), generator=generator),
+            "scales": torch.log(torch.rand((n, 3), generator=generator) * 0.05 + 0.001),
+            "rotations": torch.randn((n, 4), generator=generator),
+        })
+        self.cameras = create_cameras(7, 64, 48)
+
+    def create_engine(self, camera_batch_size: int = 3):
+        return ImportanceScoreEngine(anti_aliased=True, camera_batch_size=camera_batch_size, hit_counter=StandInHitCounter())
+
+    def test_batched(self):
+        per_camera = self.create_engine(camera_batch_size=1)
+        batched = self.create_engine(camera_batch_size=3)
+
+        per_camera_scores = per_camera.compute(self.gaussian_model, self.cameras)
+        batched_scores = batched.compute(self.gaussian_model, self.cameras)
+
+        self.assertEqual(per_camera.hit_counter.n_calls, 7)
+        self.assertEqual(batched.hit_counter.n_calls, 3)
+        self.assertEqual(batched.hit_counter.n_cameras, 7)
+        self.assertEqual(batched_scores.scores.shape, (2048, 4))
+        torch.testing.assert_close(batched_scores.scores, per_camera_scores.scores)
+        self.assertGreater(batched_scores.visibility_score.sum().item(), 0.)
+        self.assertEqual(batched_scores.count.dtype, torch.int)
+        self.assertEqual(batched_scores.opacity_score.dtype, torch.float)
+
+    def test_cached_and_incremental(self):
+        engine = self.create_engine()
+
+        fresh = engine.get_scores(self.gaussian_model, self.cameras)
+        self.assertEqual(engine.hit_counter.n_cameras, 7)
+
+        # cached
+        cached = engine.get_scores(self.gaussian_model, self.cameras)
+        self.assertIs(cached, fresh)
+        self.assertEqual(engine.hit_counter.n_cameras, 7)
+
+        # restored from a checkpoint
+        buffer = io.BytesIO()
+        torch.save(engine.state_dict(), buffer)
+        buffer.seek(0)
+        restored = self.create_engine()
+        restored.load_state_dict(torch.load(buffer))
+        torch.testing.assert_close(restored.get_scores(self.gaussian_model, self.cameras).scores, fresh.scores)
+        self.assertEqual(restored.hit_counter.n_cameras, 0)
+        self.assertEqual(engine.state_dict(self.gaussian_model)["scores"].dtype, torch.float32)
+        self.assertEqual(restored.cache.scores.dtype, torch.float64)
+
+        # incremental after pruning
+        valid_mask = fresh.opacity_score > fresh.opacity_score.median()
+        self.gaussian_model.properties = {k: v[valid_mask] for k, v in self.gaussian_model.properties.items()}
+        engine.prune(valid_mask, self.gaussian_model)
+        incremental = engine.get_scores(self.gaussian_model, self.cameras)
+        self.assertEqual(engine.hit_counter.n_cameras, 7)
+        self.assertEqual(incremental.scores.shape[0], valid_mask.sum().item())
+        torch.testing.assert_close(incremental.scores, self.create_engine().compute(self.gaussian_model, self.cameras).scores)
+
+        # invalidated by the changes of the Gaussians, the cameras or the anti-aliasing
+        self.gaussian_model.means = self.gaussian_model.means + 0.01
+        # the stale ones are not saved
+        self.assertIsNotNone(engine.state_dict())
+        self.assertIsNone(engine.state_dict(self.gaussian_model))
+        engine.get_scores(self.gaussian_model, self.cameras)
+        self.assertEqual(engine.hit_counter.n_cameras, 14)
+        engine.get_scores(self.gaussian_model, create_cameras(7, 64, 48, distance=5.))
+        self.assertEqual(engine.hit_counter.n_cameras, 21)
+        engine.anti_aliased = False
+        engine.get_scores(self.gaussian_model, create_cameras(7, 64, 48, distance=5.))
+        self.assertEqual(engine.hit_counter.n_cameras, 28)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import math
+import unittest
+import tempfile
+from types import SimpleNamespace
+import torch
+from internal.density_controllers.vanilla_density_controller import VanillaDensityController
+from internal.utils.memory_ledger import get_memory_ledger, get_nbytes_per_gaussian
+from cpu_training_loop import fit
+from gaussian_module import create_gaussian_module
+
+MB = 1024 * 1024
+
+
+class MemoryLedgerTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.generator = torch.Generator()
+        self.generator.manual_seed(42)
+
+    def create_module(self, n: int = 1024, scale: float = 0.005, **kwargs):
+        return create_gaussian_module(
+            means=torch.rand((n, 3), generator=self.generator),
+            scales=torch.full((n, 3), math.log(scale)),
+            generator=self.generator,
+            density=VanillaDensityController(densify_grad_threshold=0., percent_dense=0.01, **kwargs),
+        )
+
+    def test_accounting(self):
+        n = 1000
+        module = self.create_module(n)
+        image = torch.rand((3, 20, 30))
+        mask = torch.zeros((20, 30), dtype=torch.bool)
+        # the same tensor is only counted once
+        module.trainer.train_dataloader = SimpleNamespace(cached=[
+            (None, ("a", image, mask), None),
+            (None, ("b", image, None), {"depth": torch.zeros((20, 30), dtype=torch.float16)}),
+        ])
+        outputs = {
+            "render": torch.rand((3, 20, 30)),
+            "radii": torch.zeros((n,), dtype=torch.int32),
+            "nested": [torch.zeros((n, 2))],
+            "not_a_tensor": 1,
+        }
+
+        ledger = get_memory_ledger(module, outputs)
+
+        property_sizes = {
+            "means": 3,
+            "shs_dc": 3,
+            "shs_rest": 9,
+            "opacities": 1,
+            "scales": 3,
+            "rotations": 4,
+        }
+        expected = {}
+        for name, size in property_sizes.items():
+            expected["gaussians/{}".format(name)] = n * size * 4
+            # exp_avg, exp_avg_sq and a float32 scalar step
+            expected["optimizer/{}".format(name)] = 2 * n * size * 4 + 4
+        expected["density/max_radii2D"] = n * 4
+        expected["density/xyz_gradient_accum"] = n * 4
+        expected["density/denom"] = n * 4
+        expected["dataloader/cached_images"] = 3 * 20 * 30 * 4 + 20 * 30 + 20 * 30 * 2
+        expected["renderer/outputs"] = 3 * 20 * 30 * 4 + n * 4 + n * 2 * 4
+        expected["total"] = sum(expected.values())
+        self.assertEqual(ledger, expected)
+
+        self.assertAlmostEqual(get_nbytes_per_gaussian(module.gaussian_model, module.gaussian_optimizers, module.density_controller), (23 * 3 + 3) * 4 + 24 / n)
+
+    def test_clone_within_count_budget(self):
+        n = 1024
+        module = self.create_module(n, max_n_gaussians=n + 100)
+        model = module.gaussian_model
+        means = model.get_means().detach().clone()
+        grads = torch.rand((n, 1), generator=self.generator)
+
+        module.density_controller._densify_and_clone(grads, model, module.gaussian_optimizers)
+
+        self.assertEqual(model.n_gaussians, n + 100)
+        # the ones having the largest gradients are cloned
+        expected_indices = torch.sort(torch.topk(grads[:, 0], 100).indices).values
+        self.assertTrue(torch.equal(model.get_means()[n:], means[expected_indices]))
+        self.assertEqual(module.density_controller.denom.shape[0], n + 100)
+        for optimizer in module.gaussian_optimizers:
+            for group in optimizer.param_groups:
+                self.assertEqual(optimizer.state[group["params"][0]]["exp_avg"].shape[0], n + 100)
+
+    def test_split_within_count_budget(self):
+        n = 1024
+        module = self.create_module(n, scale=0.05, max_n_gaussians=n + 100)
+        model = module.gaussian_model
+        means = model.get_means().detach().clone()
+        grads = torch.rand((n, 1), generator=self.generator)
+
+        module.density_controller._densify_and_split(grads, model, module.gaussian_optimizers)
+
+        # each split one is replaced by 2 new ones
+        self.assertEqual(model.n_gaussians, n + 100)
+        is_split = torch.zeros((n,), dtype=torch.bool)
+        is_split[torch.topk(grads[:, 0], 100).indices] = True
+        self.assertTrue(torch.equal(model.get_means()[:n - 100], means[~is_split]))
+
+    def test_densify_within_memory_budget(self):
+        n = 1024
+        module = self.create_module(n)
+        nbytes_per_gaussian = get_nbytes_per_gaussian(module.gaussian_model, module.gaussian_optimizers, module.density_controller)
+        max_memory_mb = (n + 50.5) * nbytes_per_gaussian / MB
+        module = self.create_module(n, max_memory_mb=max_memory_mb)
+        module.density_controller.xyz_gradient_accum.copy_(torch.rand((n, 1), generator=self.generator))
+        module.density_controller.denom.fill_(1.)
+
+        module.density_controller._densify_and_prune(None, module.gaussian_model, module.gaussian_optimizers)
+
+        ledger = get_memory_ledger(module)
+        self.assertLessEqual(ledger["total"], max_memory_mb * MB)
+        self.assertGreaterEqual(module.gaussian_model.n_gaussians, n + 49)
+
+    def test_unlimited(self):
+        n = 256
+        module = self.create_module(n)
+        module.density_controller._densify_and_clone(torch.rand((n, 1), generator=self.generator), module.gaussian_model, module.gaussian_optimizers)
+        self.assertEqual(module.gaussian_model.n_gaussians, 2 * n)
+
+    def test_training_loop(self):
+        max_n_gaussians = 600
+        with tempfile.TemporaryDirectory() as temp_dir:
+            module, trainer, logger = fit(
+                temp_dir,
+                max_steps=10,
+                density=VanillaDensityController(
+                    densify_from_iter=1,
+                    densification_interval=2,
+                    densify_grad_threshold=0.,
+                    max_n_gaussians=max_n_gaussians,
+                    log_memory=True,
+                ),
+            )
+
+        # logged at each densification
+        logged = logger.get_metric("memory/gaussians/means_mb")
+        self.assertEqual([step for step, _ in logged], [1, 3, 5, 7, 9])
+        for _, means_mb in logged:
+            self.assertLessEqual(round(means_mb * MB / 12), max_n_gaussians)
+        for step, total_mb in logger.get_metric("memory/total_mb"):
+            self.assertGreater(total_mb, 0.)
+        self.assertLessEqual(module.gaussian_model.n_gaussians, max_n_gaussians)
+        self.assertGreater(module.gaussian_model.n_gaussians, 512)
+
+
+if __name__ == '__main__':
+    unittest.main()
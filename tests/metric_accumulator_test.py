@@ -0,0 +1,113 @@
+import unittest
+import tempfile
+import torch
+from internal.callbacks import CountSyncCalls
+from internal.utils.metric_accumulator import MetricAccumulator
+from internal.utils.sync_counter import SyncCounter
+from cpu_training_loop import fit, L1Metric, L1MetricImpl
+
+
+class RecordingL1Metric(L1Metric):
+    def instantiate(self, *args, **kwargs):
+        return RecordingL1MetricImpl(self)
+
+
+class RecordingL1MetricImpl(L1MetricImpl):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.recorded = []
+
+    def get_train_metrics(self, pl_module, gaussian_model, step: int, batch, outputs):
+        metrics, prog_bar = super().get_train_metrics(pl_module, gaussian_model, step, batch, outputs)
+        # a value on the host
+        metrics["n_gaussians"] = float(gaussian_model.n_gaussians)
+        prog_bar["n_gaussians"] = False
+        self.recorded.append((step, metrics["loss"].detach().clone()))
+        return metrics, prog_bar
+
+
+class MetricAccumulatorTest(unittest.TestCase):
+    def test_accumulate(self):
+        accumulator = MetricAccumulator(flush_interval=3)
+
+        flushed = []
+        for step in range(1, 8):
+            flushed += accumulator.step(step, {"a": torch.tensor(float(step)), "b": 2. * step})
+        self.assertEqual(flushed, [(3, {"a": 2., "b": 4.}), (6, {"a": 5., "b": 10.})])
+        self.assertEqual(accumulator.n_flushes, 2)
+
+        # the remaining one
+        accumulator.flush(7)
+        self.assertEqual(accumulator.collect(block=True), [(7, {"a": 7., "b": 14.})])
+        self.assertEqual(accumulator.n_flushes, 3)
+        # nothing to flush
+        accumulator.flush(7)
+        self.assertEqual(accumulator.collect(block=True), [])
+        self.assertEqual(accumulator.n_flushes, 3)
+
+    def test_sync_counter(self):
+        original_item = torch.Tensor.item
+        t = torch.ones((1,))
+
+        with SyncCounter() as counter:
+            t.item()
+        self.assertEqual(counter.get_counts(), {})
+
+        with SyncCounter(include_cpu=True) as counter:
+            counter.begin_step(1)
+            t.item()
+            bool(t)
+            t.cpu()  # not a synchronization for a CPU tensor
+            counter.begin_step(2)
+            t.tolist()
+        self.assertIs(torch.Tensor.item, original_item)
+        self.assertEqual(counter.get_counts(), {1: 2, 2: 1})
+        self.assertTrue(all(__file__ in call for call in counter.calls[1]))
+        self.assertEqual([call.split(" ")[0] for call in counter.calls[1]], ["item", "__bool__"])
+
+        # stopped
+        t.item()
+        self.assertEqual(counter.get_counts(), {1: 2, 2: 1})
+
+    @staticmethod
+    def get_metric_logging_calls(counter, step: int):
+        return [call for call in counter.calls.get(step, []) if "lightning" in call or "metric_accumulator.py" in call]
+
+    def test_training_loop(self):
+        max_steps = 10
+        with tempfile.TemporaryDirectory() as temp_dir:
+            sync_free_counter = CountSyncCalls(include_cpu=True)
+            module, _, logger = fit(
+                temp_dir,
+                max_steps=max_steps,
+                metric=RecordingL1Metric(),
+                callbacks=[sync_free_counter],
+                metrics_flush_interval=4,
+            )
+            per_step_counter = CountSyncCalls(include_cpu=True)
+            fit(temp_dir, max_steps=max_steps, callbacks=[per_step_counter])
+
+        # the logged values are the means of the per-step ones since the previous flush
+        self.assertEqual([step for step, _ in module.metric.recorded], list(range(1, max_steps + 1)))
+        losses = torch.stack([loss for _, loss in module.metric.recorded]).to(torch.float64)
+        logged = logger.get_metric("train/loss")
+        self.assertEqual([step for step, _ in logged], [4, 8, 10])
+        for (_, value), (start, end) in zip(logged, [(0, 4), (4, 8), (8, 10)]):
+            self.assertAlmostEqual(value, losses[start:end].mean().item(), places=6)
+        self.assertEqual(logger.get_metric("train/n_gaussians"), [(4, 512.), (8, 512.), (10, 512.)])
+        # the last one is flushed on train end
+        self.assertEqual(module.metric_accumulator.n_flushes, 3)
+
+        # no synchronization for logging except on the flushing steps
+        for step in range(1, max_steps + 1):
+            calls = self.get_metric_logging_calls(sync_free_counter.counter, step)
+            if step % 4 == 0:
+                self.assertGreater(len(calls), 0, step)
+            else:
+                self.assertEqual(calls, [], step)
+            # logging every step synchronizes on every step
+            self.assertGreater(len(self.get_metric_logging_calls(per_step_counter.counter, step)), 0, step)
+
+
+if __name__ == '__main__':
+    unittest.main()
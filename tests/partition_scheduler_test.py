@@ -0,0 +1,237 @@
+import os
+import sys
+import json
+import unittest
+import tempfile
+from internal.utils.partition_scheduler import (
+    LocalPartitionScheduler,
+    PartitionTask,
+    ResourceEstimator,
+    plan_longest_processing_time_first,
+)
+
+FAKE_TRAINING = """
+import os
+import sys
+import json
+import time
+
+log_path, name, n_failures, duration = sys.argv[1], sys.argv[2], int(sys.argv[3]), float(sys.argv[4])
+
+attempt_path = "{}.{}.attempts".format(log_path, name)
+attempt = 0
+if os.path.exists(attempt_path):
+    with open(attempt_path) as f:
+        attempt = int(f.read())
+with open(attempt_path, "w") as f:
+    f.write(str(attempt + 1))
+
+def log(event):
+    with open(log_path, "a") as f:
+        f.write(json.dumps({"name": name, "device": os.environ["CUDA_VISIBLE_DEVICES"], "pid": os.getpid(), "event": event, "time": time.time()}) + "\\n")
+
+log("start")
+time.sleep(duration)
+log("end")
+sys.exit(1 if attempt < n_failures else 0)
+"""
+
+
+class PartitionSchedulerTest(unittest.TestCase):
+    def test_plan(self):
+        self.assertEqual(
+            plan_longest_processing_time_first({"a": 7., "b": 5., "c": 4., "d": 3., "e": 3.}, 2),
+            [["a", "d"], ["b", "c", "e"]],
+        )
+        self.assertEqual(plan_longest_processing_time_first({"a": 1.}, 3), [["a"], [], []])
+
+    def test_estimator(self):
+        estimator = ResourceEstimator(base_memory_mb=100., memory_mb_per_image=2., memory_mb_per_point=0.5, previous_elapsed={"b": 3.}, memory_mb={"b": 7.})
+        a = PartitionTask("a", [], n_images=10, n_points=4, max_steps=100)
+        b = PartitionTask("b", [], n_images=10, n_points=4, max_steps=100)
+        self.assertEqual(estimator.estimate_memory_mb(a), 122.)
+        self.assertEqual(estimator.estimate_memory_mb(b), 7.)
+        self.assertGreater(estimator.estimate_cost(a), 100.)
+        self.assertEqual(estimator.estimate_cost(b), 3.)
+
+    @staticmethod
+    def read_events(log_path: str):
+        with open(log_path) as f:
+            return [json.loads(i) for i in f.read().splitlines()]
+
+    @staticmethod
+    def get_intervals(events):
+        starts = {}
+        intervals = []
+        for event in events:
+            key = event["name"]
+            if event["event"] == "start":
+                starts[key] = event
+            else:
+                start = starts.pop(key)
+                intervals.append((key, start["device"], start["time"], event["time"]))
+        return intervals
+
+    def create_tasks(self, temp_dir: str, log_path: str):
+        script_path = os.path.join(temp_dir, "fake_training.py")
+        with open(script_path, "w") as f:
+            f.write(FAKE_TRAINING)
+
+        def create_task(name: str, memory_mb: float, cost: float, n_failures: int = 0):
+            return PartitionTask(
+                name=name,
+                command=[sys.executable, script_path, log_path, name, str(n_failures), "0.3"],
+                max_steps=100,
+                memory_mb=memory_mb,
+                cost=cost,
+                trained_step_file=os.path.join(temp_dir, "{}-trained".format(name)),
+                log_file=os.path.join(temp_dir, "outputs", "{}.txt".format(name)),
+            )
+
+        return [
+            create_task("flaky", 40., 2., n_failures=1),
+            create_task("a", 40., 4.),
+            create_task("broken", 40., 1., n_failures=100),
+            create_task("big", 80., 5.),
+            create_task("b", 40., 3.),
+        ]
+
+    def create_scheduler(self, status_path: str, messages: list, log_path: str):
+        def memory_query():
+            # pretend the running ones use 10MB per character of their names
+            if os.path.exists(log_path) is False:
+                return {}
+            return {i["pid"]: 10. * len(i["name"]) for i in self.read_events(log_path)}
+
+        return LocalPartitionScheduler(
+            devices=["0", "1"],
+            slots_per_device=2,
+            device_memory_mb=100.,
+            max_retries=1,
+            retry_delay=0.2,
+            status_path=status_path,
+            poll_interval=0.02,
+            memory_query=memory_query,
+            print_func=messages.append,
+        )
+
+    def test_run(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            log_path = os.path.join(temp_dir, "events.jsonl")
+            status_path = os.path.join(temp_dir, "status.json")
+
+            messages = []
+            status = self.create_scheduler(status_path, messages, log_path).run(self.create_tasks(temp_dir, log_path))
+            events = self.read_events(log_path)
+            with open(status_path) as f:
+                saved_status = json.load(f)
+
+            # longest processing time first, "flaky" and "broken" can not fit into the free memory
+            launches = [i.split("'")[1] for i in messages if i.startswith("Launch")]
+            self.assertEqual(launches[:3], ["big", "a", "b"])
+
+            self.assertEqual({name: i["state"] for name, i in status.items()}, {
+                "flaky": "succeeded",
+                "a": "succeeded",
+                "broken": "failed",
+                "big": "succeeded",
+                "b": "succeeded",
+            })
+            self.assertEqual(status["flaky"]["return_codes"], [1, 0])
+            self.assertEqual(status["broken"]["return_codes"], [1, 1])
+            self.assertEqual(status["a"]["attempts"], 1)
+            # the memory estimation grows after a failure
+            self.assertEqual(status["flaky"]["memory_mb"], 60.)
+            self.assertEqual(saved_status["partitions"], status)
+            # the peak memory is recorded
+            self.assertEqual(status["a"]["peak_memory_mb"], 10.)
+            self.assertEqual(status["flaky"]["peak_memory_mb"], 50.)
+            for name in ["flaky", "a", "big", "b"]:
+                with open(os.path.join(temp_dir, "{}-trained".format(name))) as f:
+                    self.assertEqual(f.read(), "100")
+            self.assertFalse(os.path.exists(os.path.join(temp_dir, "broken-trained")))
+            self.assertTrue(os.path.exists(os.path.join(temp_dir, "outputs", "a.txt")))
+
+            # pinned devices, the slots and the memory are respected
+            intervals = self.get_intervals(events)
+            self.assertEqual(len(intervals), 7)
+            for name, device, start, end in intervals:
+                concurrent = [i for i in intervals if i[1] == device and i[2] < end and start < i[3]]
+                self.assertLessEqual(len(concurrent), 2)
+                if name == "big":
+                    self.assertEqual(concurrent, [(name, device, start, end)])
+            self.assertEqual(status["big"]["device"], [i[1] for i in intervals if i[0] == "big"][0])
+
+            # retry with the delay
+            flaky = [i for i in intervals if i[0] == "flaky"]
+            self.assertGreaterEqual(flaky[1][2] - flaky[0][3], 0.2)
+
+            # resume, only the failed one is retrained
+            messages = []
+            scheduler = self.create_scheduler(status_path, messages, log_path)
+            self.assertEqual(set(scheduler.estimator.previous_elapsed.keys()), {"flaky", "a", "big", "b"})
+            self.assertEqual(scheduler.estimator.memory_mb, {"flaky": 50., "a": 10., "big": 30., "b": 10.})
+            status = scheduler.run(self.create_tasks(temp_dir, log_path))
+            new_events = self.read_events(log_path)[len(events):]
+
+        self.assertEqual({i["name"] for i in new_events}, {"broken"})
+        self.assertEqual({name: i["state"] for name, i in status.items()}, {
+            "flaky": "trained",
+            "a": "trained",
+            "broken": "failed",
+            "big": "trained",
+            "b": "trained",
+        })
+
+
+    def test_interrupt(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            log_path = os.path.join(temp_dir, "events.jsonl")
+            status_path = os.path.join(temp_dir, "status.json")
+            script_path = os.path.join(temp_dir, "fake_training.py")
+            with open(script_path, "w") as f:
+                f.write(FAKE_TRAINING)
+            tasks = [
+                PartitionTask(name=name, command=[sys.executable, script_path, log_path, name, "0", "30"], max_steps=100, cost=cost)
+                for name, cost in [("a", 3.), ("b", 2.), ("c", 1.)]
+            ]
+
+            def memory_query():
+                # interrupt once both the launched ones are started
+                if os.path.exists(log_path) and len(self.read_events(log_path)) == 2:
+                    raise KeyboardInterrupt()
+                return {}
+
+            messages = []
+            scheduler = LocalPartitionScheduler(
+                devices=["0"],
+                slots_per_device=2,
+                status_path=status_path,
+                poll_interval=0.02,
+                memory_query=memory_query,
+                print_func=messages.append,
+            )
+            with self.assertRaises(KeyboardInterrupt):
+                scheduler.run(tasks)
+
+            events = self.read_events(log_path)
+            with open(status_path) as f:
+                saved_status = json.load(f)["partitions"]
+
+        # the launched ones are terminated before the scheduler exits
+        self.assertEqual([i["event"] for i in events], ["start", "start"])
+        for event in events:
+            with self.assertRaises(ProcessLookupError):
+                os.kill(event["pid"], 0)
+        self.assertEqual({name: i["state"] for name, i in saved_status.items()}, {
+            "a": "interrupted",
+            "b": "interrupted",
+            "c": "pending",
+        })
+        self.assertEqual(saved_status, scheduler.status)
+        self.assertEqual(len(saved_status["a"]["return_codes"]), 1)
+        self.assertIsNotNone(saved_status["a"]["finished_at"])
+
+
+if __name__ == '__main__':
+    unittest.main()
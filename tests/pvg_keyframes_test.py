@@ -0,0 +1,121 @@
+import os
+import time
+import tempfile
+import unittest
+import torch
+from internal.models.periodic_vibration_gaussian import PeriodicVibrationGaussian
+from internal.utils.pvg_keyframes import PVGKeyframes, bake_pvg_keyframes
+
+
+class PVGKeyframesTest(unittest.TestCase):
+    @staticmethod
+    def create_model(n: int, seed: int = 0):
+        """Short-lived Gaussians spreading over the time range, like the dynamic objects of a driving sequence"""
+
+        generator = torch.Generator().manual_seed(seed)
+        model = PeriodicVibrationGaussian(sh_degree=0).instantiate()
+        model.setup_from_tensors({
+            "means": torch.rand((n, 3), generator=generator) * 2. - 1.,
+            "shs_dc": torch.rand((n, 1, 3), generator=generator),
+            "shs_rest": torch.zeros((n, 0, 3)),
+            "opacities": torch.randn((n, 1), generator=generator),
+            "scales": torch.log(torch.rand((n, 3), generator=generator) * 0.05 + 0.001),
+            "rotations": torch.randn((n, 4), generator=generator),
+            "t": torch.rand((n, 1), generator=generator) * 1.2 - 0.6,
+            "scale_t": torch.log(torch.rand((n, 1), generator=generator) * 0.02 + 0.005),
+            "velocity": torch.randn((n, 3), generator=generator),
+        })
+        return model
+
+    def test_error_bound(self):
+        model = self.create_model(4096)
+        keyframes = bake_pvg_keyframes(model, n_keyframes=100, opacity_threshold=0.01)
+        self.assertEqual(keyframes.n_keyframes, 100)
+        self.assertEqual(keyframes.time_range, (-0.5, 0.5))
+
+        opacities = model.get_opacities()
+        for timestamp in torch.linspace(-0.5, 0.5, 397).tolist() + [0.5, 0.00001]:
+            indices, means, marginal_t = keyframes.interpolate(timestamp)
+            exact_means = model.get_mean_SHM(timestamp)
+            exact_marginal_t = model.get_marginal_t(timestamp)
+
+            # no visible ones are dropped
+            effective_opacities = (opacities * exact_marginal_t)[:, 0]
+            kept = torch.zeros_like(effective_opacities, dtype=torch.bool)
+            kept[indices] = True
+            self.assertFalse((effective_opacities[~kept] > keyframes.opacity_threshold).any(), timestamp)
+            self.assertLess(kept.sum().item(), 4096 // 4)
+
+            torch.testing.assert_close(marginal_t, exact_marginal_t[indices])
+            # the means are interpolated
+            self.assertLess((means - exact_means[indices]).abs().max().item(), 1e-4, timestamp)
+
+        self.assertIsNone(keyframes.interpolate(-0.51))
+        self.assertIsNone(keyframes.interpolate(0.51))
+
+    def test_serialization(self):
+        model = self.create_model(1024, seed=1)
+        keyframes = bake_pvg_keyframes(model, n_keyframes=16)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "keyframes.pt")
+            keyframes.save(path)
+            loaded = PVGKeyframes.load(path)
+
+        self.assertEqual(loaded.n_gaussians, 1024)
+        self.assertEqual(loaded.n_keyframes, 16)
+        for timestamp in [-0.5, -0.123, 0.3, 0.5]:
+            for baked, expected in zip(loaded.interpolate(timestamp), keyframes.interpolate(timestamp)):
+                self.assertTrue(torch.equal(baked, expected))
+
+    def test_is_baked_from(self):
+        model = self.create_model(1024, seed=3)
+        keyframes = bake_pvg_keyframes(model, n_keyframes=16)
+        self.assertTrue(keyframes.is_baked_from(model))
+        self.assertTrue(keyframes.is_baked_from(model))
+
+        # transformed, the number of the Gaussians is unchanged
+        with torch.no_grad():
+            model.get_means().add_(torch.tensor([0.1, 0., 0.]))
+        self.assertFalse(keyframes.is_baked_from(model))
+        with torch.no_grad():
+            model.get_means().sub_(torch.tensor([0.1, 0., 0.]))
+            model.get_velocity().mul_(-1.)
+        self.assertFalse(keyframes.is_baked_from(model))
+
+        self.assertFalse(keyframes.is_baked_from(self.create_model(512, seed=3)))
+
+    def test_speedup(self):
+        model = self.create_model(200_000, seed=2)
+        # as the viewer and `render.py` do
+        model.pre_activate_all_properties()
+        keyframes = bake_pvg_keyframes(model, n_keyframes=200)
+        timestamps = torch.linspace(-0.49, 0.49, 50).tolist()
+
+        def exact(timestamp: float):
+            means = model.get_mean_SHM(timestamp)
+            opacities = model.get_opacities() * model.get_marginal_t(timestamp)
+            return means, opacities, model.get_scales(), model.get_rotations()
+
+        def baked(timestamp: float):
+            indices, means, marginal_t = keyframes.interpolate(timestamp)
+            opacities = model.get_opacities()[indices] * marginal_t
+            return means, opacities, model.get_scales()[indices], model.get_rotations()[indices]
+
+        def measure(fn) -> float:
+            best = float("inf")
+            for _ in range(3):
+                started_at = time.perf_counter()
+                for timestamp in timestamps:
+                    fn(timestamp)
+                best = min(best, time.perf_counter() - started_at)
+            return best
+
+        with torch.no_grad():
+            exact_time = measure(exact)
+            baked_time = measure(baked)
+        print("exact: {:.3f}s, baked: {:.3f}s, speedup: {:.1f}x".format(exact_time, baked_time, exact_time / baked_time))
+        self.assertLess(baked_time, exact_time)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import unittest
+import torch
+from internal.utils.seganygs_targets import get_pixel_identity_vectors, get_correlations, mask_preprocess
+
+
+def reference_mask_preprocess(sam_masks, mask_scales, upper_bound_scale, q_trans, ray_sample_rate, num_sampled_rays):
+    """The original `SegAnySplatting.mask_preprocess()`, runs on CPU"""
+
+    with torch.no_grad():
+        mask_scales, sort_indices = torch.sort(mask_scales, descending=True)
+        sam_masks = sam_masks.float()[sort_indices, :, :]
+
+        num_sampled_scales = 8
+        sampled_scale_index = torch.randperm(len(mask_scales))[:num_sampled_scales]
+
+        tmp = torch.zeros(num_sampled_scales + 2)
+        tmp[1:len(sampled_scale_index) + 1] = sampled_scale_index
+        tmp[-1] = len(mask_scales) - 1
+        tmp[0] = -1
+        sampled_scale_index = tmp.long()
+
+        sampled_scales = mask_scales[sampled_scale_index]
+
+        second_big_scale = mask_scales[mask_scales < upper_bound_scale].max()
+
+        ray_sample_rate = ray_sample_rate if ray_sample_rate > 0 else num_sampled_rays / (sam_masks.shape[-1] * sam_masks.shape[-2])
+
+        sampled_ray = torch.rand(sam_masks.shape[-2], sam_masks.shape[-1]) < ray_sample_rate
+        non_mask_region = sam_masks.sum(dim=0) == 0
+        sampled_ray = torch.logical_and(sampled_ray, ~non_mask_region)
+
+        per_pixel_mask_size = sam_masks * sam_masks.sum(-1).sum(-1)[:, None, None]
+        per_pixel_mean_mask_size = per_pixel_mask_size.sum(dim=0) / (sam_masks.sum(dim=0) + 1e-9)
+        per_pixel_mean_mask_size = per_pixel_mean_mask_size[sampled_ray]
+        pixel_to_pixel_mask_size = per_pixel_mean_mask_size.unsqueeze(0) * per_pixel_mean_mask_size.unsqueeze(1)
+        ptp_max_size = pixel_to_pixel_mask_size.max()
+        pixel_to_pixel_mask_size[pixel_to_pixel_mask_size == 0] = 1e10
+        per_pixel_weight = torch.clamp(ptp_max_size / pixel_to_pixel_mask_size, 1.0, None)
+        per_pixel_weight = (per_pixel_weight - per_pixel_weight.min()) / (per_pixel_weight.max() - per_pixel_weight.min()) * 9. + 1.
+
+        sam_masks_sampled_ray = sam_masks[:, sampled_ray]
+
+        gt_corrs = []
+
+        sampled_scales[0] = upper_bound_scale + upper_bound_scale * torch.rand(1)[0]
+        for idx, si in enumerate(sampled_scale_index):
+            upper_bound = sampled_scales[idx] >= upper_bound_scale
+
+            if si != len(mask_scales) - 1 and not upper_bound:
+                sampled_scales[idx] -= (sampled_scales[idx] - mask_scales[si + 1]) * torch.rand(1)[0]
+            elif upper_bound:
+                sampled_scales[idx] -= (sampled_scales[idx] - second_big_scale) * torch.rand(1)[0]
+            else:
+                sampled_scales[idx] -= sampled_scales[idx] * torch.rand(1)[0]
+
+            if not upper_bound:
+                gt_vec = torch.zeros_like(sam_masks_sampled_ray)
+                gt_vec[:si + 1, :] = sam_masks_sampled_ray[:si + 1, :]
+                for j in range(si, -1, -1):
+                    gt_vec[j, :] = torch.logical_and(
+                        torch.logical_not(gt_vec[j + 1:, :].any(dim=0)), gt_vec[j, :]
+                    )
+                gt_vec[si + 1:, :] = sam_masks_sampled_ray[si + 1:, :]
+            else:
+                gt_vec = sam_masks_sampled_ray
+
+            gt_corr = torch.einsum('nh,nj->hj', gt_vec, gt_vec)
+            gt_corr[gt_corr != 0] = 1
+            gt_corrs.append(gt_corr)
+
+        gt_corrs = torch.stack(gt_corrs, dim=0)
+        sampled_scales = q_trans(sampled_scales).squeeze()
+        sampled_scales = sampled_scales.squeeze()
+
+    return sampled_ray, per_pixel_weight, gt_corrs, sampled_scales
+
+
+class SegAnyGSTargetsTest(unittest.TestCase):
+    @staticmethod
+    def create_masks(n_masks: int, height: int, width: int, generator):
+        """Random rectangles, the scales are their sizes"""
+
+        masks = torch.zeros((n_masks, height, width), dtype=torch.bool)
+        scales = torch.zeros((n_masks,))
+        for i in range(n_masks):
+            h = torch.randint(2, height + 1, (1,), generator=generator).item()
+            w = torch.randint(2, width + 1, (1,), generator=generator).item()
+            top = torch.randint(0, height - h + 1, (1,), generator=generator).item()
+            left = torch.randint(0, width - w + 1, (1,), generator=generator).item()
+            masks[i, top:top + h, left:left + w] = True
+            scales[i] = (h * w) ** 0.5 * 0.01
+        return masks, scales
+
+    def test_pixel_identity_vectors(self):
+        generator = torch.Generator().manual_seed(0)
+        masks = torch.rand((9, 200), generator=generator) < 0.4
+        scale_indices = torch.arange(-1, 9)
+
+        vectors = get_pixel_identity_vectors(masks, scale_indices)
+        self.assertEqual(vectors.shape, (10, 9, 200))
+        for idx, si in enumerate(scale_indices.tolist()):
+            expected = masks.clone()
+            for j in range(si + 1):
+                # keep only the smallest one among the masks [0, si]
+                expected[j] = torch.logical_and(masks[j], ~masks[j + 1:si + 1].any(dim=0))
+            self.assertTrue(torch.equal(vectors[idx], expected), si)
+
+        correlations = get_correlations(vectors)
+        expected_correlations = torch.einsum("snh,snj->shj", vectors.float(), vectors.float())
+        self.assertTrue(torch.equal(correlations, (expected_correlations != 0).float()))
+
+    def test_match_original(self):
+        for seed, n_masks, upper_bound_scale_offset in [(0, 12, 0.), (1, 5, 0.), (2, 24, 0.5), (3, 3, 0.)]:
+            generator = torch.Generator().manual_seed(seed)
+            masks, scales = self.create_masks(n_masks, 30, 40, generator)
+            # the largest one equals to the upper bound if the offset is 0
+            upper_bound_scale = scales.max().item() + upper_bound_scale_offset
+            kwargs = {
+                "sam_masks": masks,
+                "mask_scales": scales,
+                "upper_bound_scale": upper_bound_scale,
+                "q_trans": lambda i: i * 2.,
+                "ray_sample_rate": 0,
+                "num_sampled_rays": 300,
+            }
+
+            torch.manual_seed(seed)
+            expected = reference_mask_preprocess(**kwargs)
+            torch.manual_seed(seed)
+            outputs = mask_preprocess(**kwargs)
+
+            for name, output, expected_output in zip(["sampled_ray", "per_pixel_weight", "gt_corrs", "sampled_scales"], outputs, expected):
+                self.assertEqual(output.dtype, expected_output.dtype, name)
+                self.assertTrue(torch.equal(output, expected_output), "{} of seed {}".format(name, seed))
+            self.assertEqual(outputs[2].shape[0], 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+import torch
+from internal.utils.sh_utils import eval_sh, eval_sh_basis, eval_sh_batched, get_sh_rotation_matrices, rotate_sh
+from internal.utils.gaussian_utils import GaussianTransformUtils
+
+
+def random_rotation_matrices(n: int, generator: torch.Generator):
+    q = torch.nn.functional.normalize(torch.randn((n, 4), generator=generator, dtype=torch.float64), dim=-1)
+    w, x, y, z = q.unbind(-1)
+    return torch.stack([
+        1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y),
+        2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x),
+        2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y),
+    ], dim=-1).reshape(n, 3, 3)
+
+
+class SHUtilsTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.generator = torch.Generator()
+        self.generator.manual_seed(42)
+
+    def random_directions(self, *shape):
+        return torch.nn.functional.normalize(torch.randn(shape + (3,), generator=self.generator, dtype=torch.float64), dim=-1)
+
+    def test_eval_sh_basis(self):
+        dirs = self.random_directions(128)
+        for deg in range(5):
+            n_coeffs = (deg + 1) ** 2
+            basis = eval_sh_basis(deg, dirs)
+            self.assertEqual(basis.shape, (128, n_coeffs))
+            # evaluate the identity coefficients
+            expected = eval_sh(deg, torch.eye(n_coeffs, dtype=torch.float64).expand(128, -1, -1), dirs)
+            self.assertTrue(torch.allclose(basis, expected))
+
+    def test_eval_sh_batched(self):
+        n_cameras, n = 5, 300
+        sh = torch.randn((n, 3, 16), generator=self.generator, dtype=torch.float64)
+        dirs = self.random_directions(n_cameras, n)
+        for deg in range(4):
+            results = eval_sh_batched(deg, sh, dirs)
+            self.assertEqual(results.shape, (n_cameras, n, 3))
+            for camera_idx in range(n_cameras):
+                self.assertTrue(torch.allclose(results[camera_idx], eval_sh(deg, sh, dirs[camera_idx])))
+
+    def test_sh_rotation(self):
+        rotation_matrices = random_rotation_matrices(8, self.generator)
+        dirs = self.random_directions(256)
+        for deg in range(1, 5):
+            n_coeffs = (deg + 1) ** 2
+            shs = torch.randn((256, n_coeffs, 3), generator=self.generator, dtype=torch.float64)
+            sh_rotation_matrices = get_sh_rotation_matrices(deg, rotation_matrices)
+            self.assertEqual(sh_rotation_matrices.shape, (8, n_coeffs - 1, n_coeffs - 1))
+
+            for rotation_matrix, sh_rotation_matrix in zip(rotation_matrices, sh_rotation_matrices):
+                rotated_shs = torch.concat([shs[:, :1], rotate_sh(shs[:, 1:], sh_rotation_matrix)], dim=1)
+                # the rotated function at direction d equals the original one at R^T d
+                self.assertTrue(torch.allclose(
+                    eval_sh(deg, rotated_shs.transpose(1, 2), dirs),
+                    eval_sh(deg, shs.transpose(1, 2), dirs @ rotation_matrix),
+                    atol=1e-8,
+                ), deg)
+                # orthogonal
+                self.assertTrue(torch.allclose(sh_rotation_matrix @ sh_rotation_matrix.T, torch.eye(n_coeffs - 1, dtype=torch.float64), atol=1e-8))
+
+            # composition
+            self.assertTrue(torch.allclose(
+                get_sh_rotation_matrices(deg, rotation_matrices[0] @ rotation_matrices[1]),
+                sh_rotation_matrices[0] @ sh_rotation_matrices[1],
+                atol=1e-8,
+            ))
+
+            # one rotation per Gaussian
+            per_gaussian_rotation_matrices = rotation_matrices[torch.arange(256) % 8]
+            rotated_shs_rest = rotate_sh(shs[:, 1:], get_sh_rotation_matrices(deg, per_gaussian_rotation_matrices))
+            for i in range(8):
+                self.assertTrue(torch.allclose(
+                    rotated_shs_rest[i::8],
+                    rotate_sh(shs[i::8, 1:], sh_rotation_matrices[i]),
+                ))
+
+    def test_transform_shs(self):
+        rotation_matrix = random_rotation_matrices(1, self.generator)[0].float()
+        features = torch.randn((512, 16, 3), generator=self.generator)
+
+        transformed = GaussianTransformUtils.transform_shs(features, rotation_matrix, use_e3nn=False)
+        self.assertTrue(torch.equal(transformed[:, 0], features[:, 0]))
+        dirs = self.random_directions(512).float()
+        self.assertTrue(torch.allclose(
+            eval_sh(3, transformed.transpose(1, 2), dirs),
+            eval_sh(3, features.transpose(1, 2), dirs @ rotation_matrix),
+            atol=1e-4,
+        ))
+
+        try:
+            import e3nn
+        except ImportError:
+            self.skipTest("e3nn not installed")
+        e3nn_transformed = GaussianTransformUtils.transform_shs(features, rotation_matrix, use_e3nn=True)
+        self.assertTrue(torch.allclose(e3nn_transformed, transformed, atol=1e-4))
+
+
+if __name__ == '__main__':
+    unittest.main()
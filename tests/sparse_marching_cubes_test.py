@@ -0,0 +1,79 @@
+import unittest
+import numpy as np
+import torch
+import trimesh
+from skimage import measure
+from internal.utils.sparse_marching_cubes import sparse_marching_cubes, get_lattice_points
+
+
+def sphere_sdf(points: torch.Tensor):
+    return torch.linalg.norm(points - torch.tensor([0.1, -0.05, 0.02]), dim=-1) - 0.6
+
+
+def torus_sdf(points: torch.Tensor):
+    major_radius, minor_radius = 0.5, 0.2
+    q = torch.stack([torch.linalg.norm(points[:, [0, 2]], dim=-1) - major_radius, points[:, 1]], dim=-1)
+    return torch.linalg.norm(q, dim=-1) - minor_radius
+
+
+class SparseMarchingCubesTest(unittest.TestCase):
+    @staticmethod
+    def dense_marching_cubes(sdf, resolution: int):
+        indices = np.arange(resolution)
+        bounding_box_min = np.array([-1., -1., -1.])
+        spacing = np.full((3,), 2. / (resolution - 1))
+        values = sdf(get_lattice_points((indices, indices, indices), bounding_box_min, spacing)).numpy()
+        vertices, faces, _, _ = measure.marching_cubes(values.reshape(resolution, resolution, resolution), level=0.)
+        return vertices * spacing + bounding_box_min, faces
+
+    def assert_equivalent(self, sdf, resolution: int, **kwargs):
+        vertices, faces = sparse_marching_cubes(sdf, resolution, **kwargs)
+        dense_vertices, dense_faces = self.dense_marching_cubes(sdf, resolution)
+
+        mesh = trimesh.Trimesh(vertices, faces, process=False)
+        self.assertTrue(mesh.is_watertight)
+        # no duplicated vertices on the block borders
+        self.assertEqual(np.unique(np.round(vertices, 6), axis=0).shape[0], vertices.shape[0])
+
+        # the same surface as the dense one
+        self.assertEqual(vertices.shape, dense_vertices.shape)
+        self.assertEqual(faces.shape, dense_faces.shape)
+        sorted_vertices = vertices[np.lexsort(vertices.T[::-1])]
+        sorted_dense_vertices = dense_vertices[np.lexsort(dense_vertices.T[::-1])]
+        self.assertTrue(np.allclose(sorted_vertices, sorted_dense_vertices, atol=1e-5))
+        self.assertAlmostEqual(mesh.area, trimesh.Trimesh(dense_vertices, dense_faces).area, places=4)
+
+        return mesh
+
+    def test_sphere(self):
+        mesh = self.assert_equivalent(sphere_sdf, 97, block_size=16)
+        self.assertAlmostEqual(abs(mesh.volume), 4. / 3. * np.pi * 0.6 ** 3, delta=0.01)
+
+    def test_torus(self):
+        mesh = self.assert_equivalent(torus_sdf, 81, block_size=8, coarse_stride=4)
+        self.assertEqual(mesh.euler_number, 0)
+
+    def test_process_pool(self):
+        vertices, faces = sparse_marching_cubes(torus_sdf, 65, block_size=16)
+        pool_vertices, pool_faces = sparse_marching_cubes(torus_sdf, 65, block_size=16, n_processes=2)
+        self.assertTrue(np.array_equal(vertices, pool_vertices))
+        self.assertTrue(np.array_equal(faces, pool_faces))
+
+    def test_sparse_evaluation(self):
+        n_evaluated = [0]
+
+        def counted_sdf(points):
+            n_evaluated[0] += points.shape[0]
+            return torch.linalg.norm(points, dim=-1) - 0.3
+
+        sparse_marching_cubes(counted_sdf, 129, block_size=8)
+        self.assertLess(n_evaluated[0], 0.25 * 129 ** 3)
+
+    def test_empty(self):
+        vertices, faces = sparse_marching_cubes(lambda x: torch.ones_like(x[:, 0]), 33, block_size=8)
+        self.assertEqual(vertices.shape, (0, 3))
+        self.assertEqual(faces.shape, (0, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
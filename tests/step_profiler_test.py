@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import unittest
+import tempfile
+from internal.callbacks import ProfileTrainingSteps
+from internal.density_controllers.vanilla_density_controller import VanillaDensityController
+from internal.utils.step_profiler import StepProfiler, profile_scope, set_active_profiler, get_active_profiler
+from cpu_training_loop import fit
+
+TRAINING_STEP_PHASES = [
+    "renderer_before_training_step",
+    "forward",
+    "metrics",
+    "before_backward",
+    "backward",
+    "after_backward",
+    "after_backward_hooks",
+    "optimizers",
+    "schedulers",
+]
+
+
+class StepProfilerTest(unittest.TestCase):
+    def test_scopes(self):
+        profiler = StepProfiler(window_size=4, use_cuda_events=False)
+
+        # no-op without active profiler
+        with profile_scope("outer"):
+            pass
+        self.assertEqual(len(profiler.durations), 0)
+
+        set_active_profiler(profiler)
+        try:
+            for step in range(1, 7):
+                profiler.begin_step(step)
+                with profile_scope("outer"):
+                    with profile_scope("inner"):
+                        time.sleep(0.001)
+                profiler.end_step()
+        finally:
+            set_active_profiler(None)
+        self.assertIsNone(get_active_profiler())
+
+        self.assertEqual(set(profiler.durations.keys()), {"outer", "outer/inner"})
+        # only the latest `window_size` records are kept for the percentiles
+        self.assertEqual(len(profiler.durations["outer"]), 4)
+        self.assertEqual(len(profiler.trace_events), 12)
+        for i in profiler.durations["outer/inner"]:
+            self.assertGreaterEqual(i, 1.)
+
+        summary = profiler.get_summary(percentiles=(50, 90))
+        self.assertEqual(set(summary.keys()), {
+            "profiler/{}/{}".format(name, statistic)
+            for name in ["outer", "outer/inner"]
+            for statistic in ["p50_ms", "p90_ms", "mean_ms"]
+        })
+        self.assertLessEqual(summary["profiler/outer/p50_ms"], summary["profiler/outer/p90_ms"])
+        self.assertGreaterEqual(summary["profiler/outer/p50_ms"], summary["profiler/outer/inner/p50_ms"])
+
+        # the inner one is enclosed by the outer one on the timeline
+        outer, inner = sorted([i for i in profiler.trace_events if i["args"]["step"] == 6], key=lambda i: i["name"])
+        self.assertLessEqual(outer["ts"], inner["ts"])
+        self.assertGreaterEqual(outer["ts"] + outer["dur"], inner["ts"] + inner["dur"])
+
+    def test_training_loop(self):
+        max_steps = 12
+        with tempfile.TemporaryDirectory() as temp_dir:
+            trace_path = os.path.join(temp_dir, "trace.json")
+            callback = ProfileTrainingSteps(log_interval=4, trace_path=trace_path)
+            module, trainer, logger = fit(
+                temp_dir,
+                max_steps=max_steps,
+                density=VanillaDensityController(
+                    densify_from_iter=2,
+                    densification_interval=3,
+                    opacity_reset_interval=6,
+                    densify_grad_threshold=0.,
+                ),
+                callbacks=[callback],
+            )
+            with open(trace_path, "r") as f:
+                trace = json.load(f)
+
+        self.assertEqual(trainer.global_step, max_steps)
+        self.assertIsNone(get_active_profiler())
+
+        # every phase of every step is recorded
+        events_by_name = {}
+        for event in trace["traceEvents"]:
+            self.assertEqual(event["ph"], "X")
+            self.assertGreaterEqual(event["dur"], 0.)
+            events_by_name.setdefault(event["name"], []).append(event["args"]["step"])
+        for phase in TRAINING_STEP_PHASES:
+            self.assertEqual(events_by_name[phase], list(range(1, max_steps + 1)), phase)
+        self.assertNotIn("save", events_by_name)
+
+        # the density controller actions, at their own steps
+        self.assertEqual(events_by_name["after_backward/densify"], [3, 6, 9, 12])
+        self.assertEqual(events_by_name["after_backward/prune"], [3, 6, 9, 12])
+        self.assertEqual(events_by_name["after_backward/opacity_reset"], [6, 12])
+
+        # the percentiles are logged every `log_interval` steps
+        for phase in TRAINING_STEP_PHASES + ["after_backward/densify"]:
+            logged = logger.get_metric("profiler/{}/p50_ms".format(phase))
+            self.assertEqual([step for step, _ in logged], [4, 8, 12], phase)
+            for _, value in logged:
+                self.assertGreaterEqual(value, 0.)
+        forward_p90 = logger.get_metric("profiler/forward/p90_ms")
+        forward_p50 = logger.get_metric("profiler/forward/p50_ms")
+        for (_, p50), (_, p90) in zip(forward_p50, forward_p90):
+            self.assertLessEqual(p50, p90)
+
+
+if __name__ == '__main__':
+    unittest.main()
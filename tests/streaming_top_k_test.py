@@ -0,0 +1,63 @@
+import unittest
+import torch
+from internal.utils.streaming_top_k import StreamingTopK
+
+
+class StreamingTopKTestCase(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.generator = torch.Generator()
+        self.generator.manual_seed(42)
+
+    def test_streaming_top_k(self):
+        n_rows, n_columns, k = 4096, 100, 8
+        # make some rows all zeros
+        dense = torch.rand((n_rows, n_columns), generator=self.generator) * (torch.rand((n_rows, 1), generator=self.generator) > 0.1)
+        expected = torch.topk(dense, k=k, dim=-1)
+
+        for buffer_size, row_chunk_size in [(1, n_rows), (16, 1000), (n_columns, 4096)]:
+            top_k = StreamingTopK(n_rows, k=k, buffer_size=buffer_size, row_chunk_size=row_chunk_size)
+            for column_idx in range(n_columns):
+                top_k.add_column(dense[:, column_idx])
+            values, indices = top_k.get()
+
+            self.assertEqual(top_k.n_columns, n_columns)
+            self.assertTrue(torch.allclose(top_k.sum, dense.sum(dim=-1)))
+            self.assertTrue(torch.all(torch.eq(values, expected.values)))
+            # indices may be different when values are tied, so compare the values they point to
+            self.assertTrue(torch.all(torch.eq(torch.gather(dense, -1, indices), expected.values)))
+
+            # prune
+            mask = ~torch.isclose(top_k.sum, torch.tensor(0.))
+            top_k.prune(mask)
+            values, indices = top_k.get()
+            self.assertEqual(values.shape, (mask.sum().item(), k))
+            self.assertTrue(torch.all(torch.eq(values, expected.values[mask])))
+            self.assertTrue(torch.all(torch.eq(torch.gather(dense[mask], -1, indices), expected.values[mask])))
+
+    def test_chunked_update_with_column_indices(self):
+        n_rows, n_columns, k = 1024, 64, 4
+        dense = torch.rand((n_rows, n_columns), generator=self.generator)
+
+        # feed the columns in a shuffled order
+        permutation = torch.randperm(n_columns, generator=self.generator)
+        top_k = StreamingTopK(n_rows, k=k)
+        for chunk in torch.split(permutation, 10):
+            top_k.update(dense[:, chunk], chunk)
+        values, indices = top_k.get()
+
+        self.assertTrue(torch.all(torch.eq(values, torch.topk(dense, k=k, dim=-1).values)))
+        self.assertTrue(torch.all(torch.eq(torch.gather(dense, -1, indices), values)))
+
+    def test_fewer_columns_than_k(self):
+        top_k = StreamingTopK(16, k=4)
+        top_k.add_column(torch.ones((16,)))
+        values, indices = top_k.get()
+        self.assertTrue(torch.all(torch.eq(values[:, 0], 1.)))
+        self.assertTrue(torch.all(torch.eq(indices[:, 0], 0)))
+        self.assertTrue(torch.all(torch.eq(indices[:, 1:], -1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
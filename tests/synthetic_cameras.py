@@ -0,0 +1,105 @@
+"""
+Camera factories shared by the tests, in the world-to-camera convention of the datasets: x right, y down, z forward.
+"""
+
+import math
+from typing import Optional, Tuple, Union
+import torch
+from internal.cameras.cameras import Cameras
+
+
+def look_at(
+        positions: torch.Tensor,
+        targets: torch.Tensor,
+        up: Tuple[float, float, float] = (0., -1., 0.),
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Args:
+        positions: [..., 3], the camera centers
+        targets: [..., 3]
+        up: the world up direction, must not be parallel to the viewing directions
+
+    Returns:
+        R: [..., 3, 3], world-to-camera
+        T: [..., 3]
+    """
+
+    positions, targets = torch.broadcast_tensors(positions, targets)
+    forward = torch.nn.functional.normalize(targets - positions, dim=-1)
+    right = torch.nn.functional.normalize(torch.linalg.cross(forward, torch.tensor(up).expand_as(forward)), dim=-1)
+    down = torch.linalg.cross(forward, right)
+    R = torch.stack([right, down, forward], dim=-2)
+    return R, -(R @ positions.unsqueeze(-1)).squeeze(-1)
+
+
+def cameras_looking_at(
+        positions: torch.Tensor,
+        targets: torch.Tensor,
+        width: Union[int, torch.Tensor],
+        height: Union[int, torch.Tensor],
+        fx: Union[float, torch.Tensor],
+        fy: Union[float, torch.Tensor, None] = None,
+        cx: Union[float, torch.Tensor, None] = None,
+        cy: Union[float, torch.Tensor, None] = None,
+) -> Cameras:
+    """
+    Args:
+        positions: [N, 3]
+        targets: [N, 3] or [3]
+        width, height, fx, fy, cx, cy: a scalar shared by all the cameras, or [N]. `fy` default to `fx`, the principal point default to the image center
+
+    Returns:
+        N pinhole cameras without distortion
+    """
+
+    n = positions.shape[0]
+    R, T = look_at(positions, targets)
+
+    def expand(value, dtype):
+        return torch.as_tensor(value, dtype=dtype).expand(n).clone()
+
+    width = expand(width, torch.int)
+    height = expand(height, torch.int)
+    fx = expand(fx, torch.float)
+    return Cameras(
+        R=R,
+        T=T,
+        fx=fx,
+        fy=fx.clone() if fy is None else expand(fy, torch.float),
+        cx=width / 2 if cx is None else expand(cx, torch.float),
+        cy=height / 2 if cy is None else expand(cy, torch.float),
+        width=width,
+        height=height,
+        appearance_id=torch.arange(n),
+        normalized_appearance_id=torch.linspace(0., 1., n),
+        distortion_params=None,
+        camera_type=torch.zeros((n,), dtype=torch.int),
+    )
+
+
+def create_cameras(
+        n: int,
+        width: int,
+        height: int,
+        distance: float = 4.,
+        heights: Union[float, torch.Tensor] = -0.5,
+        focal: Optional[float] = None,
+) -> Cameras:
+    """
+    The cameras evenly distributed on a circle around the y-axis, looking at the origin
+
+    Args:
+        n: the number of cameras
+        width, height: the image size
+        distance: the radius of the circle
+        heights: the y-coordinates of the cameras, a scalar or [N]
+        focal: default to `1.2 * width`
+    """
+
+    angles = torch.arange(n, dtype=torch.float) * (2 * math.pi / n)
+    positions = torch.stack([
+        distance * torch.sin(angles),
+        torch.as_tensor(heights, dtype=torch.float).expand(n),
+        -distance * torch.cos(angles),
+    ], dim=-1)
+    return cameras_looking_at(positions, torch.zeros((3,)), width, height, width * 1.2 if focal is None else focal)
@@ -0,0 +1,159 @@
+import os
+import unittest
+import numpy as np
+import torch
+from internal.utils.map_store import SpillableMapStore
+from internal.utils.tsdf_fusion import SparseTSDFVolume
+from synthetic_cameras import create_cameras
+
+
+def render_sphere_depth(camera, radius: float) -> torch.Tensor:
+    """The z-depth of the sphere centered at the origin, 0 means no hit"""
+
+    height, width = camera.height.item(), camera.width.item()
+    v, u = torch.meshgrid(torch.arange(height, dtype=torch.float), torch.arange(width, dtype=torch.float), indexing="ij")
+    directions = torch.stack([(u - camera.cx) / camera.fx, (v - camera.cy) / camera.fy, torch.ones_like(u)], dim=-1)  # z = 1
+    world_to_camera = camera.world_to_camera  # transposed
+    world_directions = directions @ world_to_camera[:3, :3].T
+    origin = camera.camera_center
+
+    # |o + s * d|^2 = r^2
+    a = torch.sum(world_directions ** 2, dim=-1)
+    b = 2 * torch.sum(world_directions * origin, dim=-1)
+    c = torch.sum(origin ** 2) - radius ** 2
+    discriminant = b * b - 4 * a * c
+    s = (-b - torch.sqrt(torch.clamp_min(discriminant, 0.))) / (2 * a)
+    return torch.where(discriminant > 0, s, 0.)[None]
+
+
+class TSDFFusionTest(unittest.TestCase):
+    radius = 0.5
+    voxel_size = 0.02
+
+    def create_maps(self, n_cameras: int = 12):
+        cameras = create_cameras(n_cameras, 128, 128, distance=1.6, heights=torch.linspace(-0.8, 0.8, n_cameras), focal=128.)
+        depths = [render_sphere_depth(camera, self.radius) for camera in cameras]
+        rgbs = [torch.tensor([0.2, 0.4, 0.6])[:, None, None].expand(3, 128, 128) for _ in cameras]
+        return cameras, rgbs, depths
+
+    def create_volume(self, **kwargs):
+        return SparseTSDFVolume(voxel_size=self.voxel_size, sdf_trunc=3 * self.voxel_size, **kwargs)
+
+    def test_sphere(self):
+        cameras, rgbs, depths = self.create_maps()
+        volume = self.create_volume()
+        volume.integrate(rgbs, depths, cameras, batch_size=5)
+
+        # only the blocks near the surface are allocated
+        block_coordinates = volume.decode_keys(volume.block_keys)
+        n_dense_blocks = torch.prod(block_coordinates.max(dim=0).values - block_coordinates.min(dim=0).values + 1).item()
+        self.assertLess(volume.n_blocks, n_dense_blocks)
+        # the center is never allocated
+        self.assertEqual(volume.lookup(torch.zeros((1, 3), dtype=torch.long))[1].item(), 0.)
+
+        vertices, faces, colors = volume.extract_mesh()
+        self.assertGreater(faces.shape[0], 1000)
+        distances = np.linalg.norm(vertices, axis=-1) - self.radius
+        # the depth maps are sampled at the nearest pixel, the silhouettes are less accurate
+        self.assertLess(np.abs(distances).mean(), 0.25 * self.voxel_size)
+        self.assertLess(np.abs(distances).max(), 2 * self.voxel_size)
+        self.assertTrue(np.allclose(colors, np.array([[0.2, 0.4, 0.6]]), atol=1e-5))
+        # every vertex is referenced
+        self.assertEqual(np.unique(faces).shape[0], vertices.shape[0])
+
+    def test_batch_size_invariance(self):
+        cameras, rgbs, depths = self.create_maps(7)
+
+        volumes = []
+        for batch_size in [1, 3, 7]:
+            volume = self.create_volume(max_elements_per_chunk=4096)
+            volume.integrate(rgbs, depths, cameras, batch_size=batch_size)
+            volumes.append(volume)
+
+        # the blocks are stored in the order of allocation, which depends on the batches
+        def sort_by_keys(volume):
+            order = torch.argsort(volume.block_keys)
+            return volume.block_keys[order], volume.weights[order], volume.tsdf[order], volume.colors[order]
+
+        expected_keys, expected_weights, expected_tsdf, expected_colors = sort_by_keys(volumes[0])
+        for volume in volumes[1:]:
+            block_keys, weights, tsdf, colors = sort_by_keys(volume)
+            self.assertTrue(torch.equal(block_keys, expected_keys))
+            self.assertTrue(torch.equal(weights, expected_weights))
+            self.assertTrue(torch.allclose(tsdf, expected_tsdf, atol=1e-6))
+            self.assertTrue(torch.allclose(colors, expected_colors, atol=1e-6))
+
+    def test_spilled_maps(self):
+        cameras, rgbs, depths = self.create_maps(6)
+        depth_bytes = depths[0].numel() * depths[0].element_size()
+
+        depth_store = SpillableMapStore(max_in_memory_bytes=2 * depth_bytes)
+        rgb_store = SpillableMapStore(max_in_memory_bytes=0)
+        try:
+            for rgb, depth in zip(rgbs, depths):
+                rgb_store.append(rgb)
+                depth_store.append(depth)
+            self.assertEqual(len(depth_store), 6)
+            self.assertEqual(depth_store.n_spilled, 4)
+            self.assertEqual(rgb_store.n_spilled, 6)
+            for i in range(6):
+                self.assertTrue(torch.equal(depth_store[i], depths[i]))
+                self.assertTrue(torch.equal(rgb_store[i], rgbs[i]))
+
+            volume = self.create_volume()
+            volume.integrate(rgb_store, depth_store, cameras, batch_size=4)
+            reference = self.create_volume()
+            reference.integrate(rgbs, depths, cameras, batch_size=4)
+            self.assertTrue(torch.equal(volume.tsdf, reference.tsdf))
+        finally:
+            spill_dir = rgb_store.spill_dir
+            rgb_store.close()
+            depth_store.close()
+        self.assertFalse(os.path.exists(spill_dir))
+
+    def test_allocate(self):
+        volume = self.create_volume(block_resolution=2)
+        generator = torch.Generator().manual_seed(42)
+        all_keys = torch.randperm(1000, generator=generator)[:300] * 7
+        expected = {}
+        for keys in torch.split(all_keys, [1, 2, 47, 250]):
+            volume.allocate(torch.concat([keys, keys[:1]]))
+            self.assertGreaterEqual(volume.capacity, volume.n_blocks)
+            self.assertTrue(torch.all(volume.sorted_keys[1:] > volume.sorted_keys[:-1]))
+
+            # the new blocks are unobserved
+            block_indices, is_found = volume.find_blocks(keys)
+            self.assertTrue(is_found.all())
+            self.assertTrue(torch.all(volume.tsdf[block_indices] == 1.))
+            self.assertTrue(torch.all(volume.weights[block_indices] == 0.))
+            volume.weights[block_indices] = keys[:, None].float()
+            # the existing blocks are not moved or reset
+            for key in keys.tolist():
+                expected[key] = float(key)
+            block_indices, is_found = volume.find_blocks(torch.tensor(list(expected.keys())))
+            self.assertTrue(is_found.all())
+            self.assertTrue(torch.equal(volume.weights[block_indices, 0], torch.tensor(list(expected.values()))))
+
+        self.assertEqual(volume.n_blocks, 300)
+        self.assertTrue(torch.equal(volume.sorted_keys, torch.sort(all_keys).values))
+        self.assertFalse(volume.find_blocks(torch.tensor([1, 7001]))[1].any())
+
+    def test_empty(self):
+        volume = self.create_volume()
+        cameras = create_cameras(2, 128, 128, distance=1.6)
+        volume.integrate([torch.zeros((3, 128, 128))] * 2, [torch.zeros((1, 128, 128))] * 2, cameras)
+        self.assertEqual(volume.n_blocks, 0)
+        vertices, faces, colors = volume.extract_mesh()
+        self.assertEqual(vertices.shape, (0, 3))
+        self.assertEqual(faces.shape, (0, 3))
+        self.assertEqual(colors.shape, (0, 3))
+
+    def test_key_encoding(self):
+        coordinates = torch.tensor([[0, 0, 0], [-1, 2, -3], [1000, -1000, 5], [-(1 << 20), (1 << 20) - 1, 0]])
+        keys = SparseTSDFVolume.encode_keys(coordinates)
+        self.assertTrue(torch.equal(SparseTSDFVolume.decode_keys(keys), coordinates))
+        self.assertEqual(torch.unique(keys).shape[0], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import add_pypath
+import os
+import argparse
+import torch
+from internal.utils.gaussian_model_loader import GaussianModelLoader, VanillaPVGModelLoader
+from internal.utils.pvg_keyframes import bake_pvg_keyframes
+
+parser = argparse.ArgumentParser()
+parser.add_argument("input", help="Path to a Periodic Vibration Gaussian model output directory or checkpoint file")
+parser.add_argument("--output", "-o", required=False, default=None)
+parser.add_argument("--n-keyframes", "-n", type=int, default=128)
+parser.add_argument("--opacity-threshold", type=float, default=1. / 255.,
+                    help="Gaussians whose effective opacities never exceed it between two keyframes are not rendered there")
+parser.add_argument("--time-range", type=float, nargs=2, default=None,
+                    help="Default to the `time_duration` of the model")
+parser.add_argument("--vanilla_pvg", "--vanilla-pvg", action="store_true", default=False,
+                    help="Load a model trained by the official implementation")
+args = parser.parse_args()
+
+device = torch.device("cuda")
+
+print("Loading model...")
+if args.vanilla_pvg is True:
+    model, renderer = VanillaPVGModelLoader.search_and_load(args.input, device)
+    default_output = os.path.join(args.input, "keyframes.pt")
+else:
+    load_file = GaussianModelLoader.search_load_file(args.input)
+    model, renderer = GaussianModelLoader.search_and_load(load_file, device)
+    default_output = load_file[:load_file.rfind(".")] + ".keyframes.pt"
+assert hasattr(model, "get_mean_SHM"), "Not a Periodic Vibration Gaussian model"
+
+if args.output is None:
+    args.output = default_output
+assert os.path.exists(args.output) is False, f"Output file already exists, please remove it first: '{args.output}'"
+
+print("Baking...")
+keyframes = bake_pvg_keyframes(
+    model,
+    n_keyframes=args.n_keyframes,
+    opacity_threshold=args.opacity_threshold,
+    time_range=args.time_range,
+)
+n_interval_gaussians = keyframes.interval_offsets.diff().float()
+print("{} Gaussians, {:.1f} on average are kept per interval (max {})".format(
+    keyframes.n_gaussians,
+    n_interval_gaussians.mean().item(),
+    int(n_interval_gaussians.max().item()),
+))
+
+keyframes.save(args.output)
+print(f"Saved to '{args.output}', pass it to the viewer or `render.py` by `--pvg-keyframes`")
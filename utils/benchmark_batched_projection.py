@@ -0,0 +1,82 @@
+"""
+Compare projecting Gaussians to many cameras one by one with `project_gaussians()` and at once with `project_gaussians_batched()`.
+"""
+
+import add_pypath
+import time
+import argparse
+import torch
+from internal.cameras.cameras import Cameras
+from internal.utils.gaussian_projection import project_gaussians, project_gaussians_batched
+
+
+def create_cameras(n_cameras: int) -> Cameras:
+    angles = torch.rand((n_cameras,)) * 2 * torch.pi
+    positions = torch.stack([torch.cos(angles), torch.zeros_like(angles), torch.sin(angles)], dim=-1) * 5.
+    forward = torch.nn.functional.normalize(-positions, dim=-1)
+    down = torch.tensor([0., 1., 0.]).expand_as(forward)
+    right = torch.nn.functional.normalize(torch.cross(down, forward, dim=-1), dim=-1)
+    down = torch.cross(forward, right, dim=-1)
+    R = torch.stack([right, down, forward], dim=1)
+    T = -torch.bmm(R, positions.unsqueeze(-1)).squeeze(-1)
+    width = torch.full((n_cameras,), 1600, dtype=torch.int)
+    height = torch.full((n_cameras,), 1200, dtype=torch.int)
+    return Cameras(
+        R=R,
+        T=T,
+        fx=torch.full((n_cameras,), 1200.),
+        fy=torch.full((n_cameras,), 1200.),
+        cx=width / 2,
+        cy=height / 2,
+        width=width,
+        height=height,
+        appearance_id=torch.zeros_like(width),
+        normalized_appearance_id=torch.zeros_like(width, dtype=torch.float),
+        distortion_params=None,
+        camera_type=torch.zeros_like(width),
+    )
+
+
+def timeit(fn, device, steps: int):
+    fn()  # warmup
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    started_at = time.perf_counter()
+    for _ in range(steps):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - started_at) / steps * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=100_000)
+    parser.add_argument("--n-cameras", type=int, nargs="+", default=[1, 16, 128])
+    parser.add_argument("--chunk-size", type=int, default=65536)
+    parser.add_argument("--steps", type=int, default=3)
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    torch.manual_seed(42)
+    device = torch.device(args.device)
+    means = torch.randn((args.n, 3), device=device)
+    scales = torch.exp(torch.rand((args.n, 3), device=device) * 3. - 6.)
+    rotations = torch.nn.functional.normalize(torch.randn((args.n, 4), device=device), dim=-1)
+
+    print("{:>8} {:>14} {:>14} {:>10}".format("cameras", "one-by-one ms", "batched ms", "speedup"))
+    for n_cameras in args.n_cameras:
+        cameras = create_cameras(n_cameras)
+
+        def one_by_one():
+            for camera in cameras:
+                camera.to_device(device)
+                project_gaussians(means, scales, 1., rotations, camera.world_to_camera, camera.fx, camera.fy, camera.cx, camera.cy, camera.height, camera.width, 16)
+
+        def batched():
+            project_gaussians_batched(means, scales, 1., rotations, cameras, chunk_size=args.chunk_size)
+
+        with torch.no_grad():
+            one_by_one_ms = timeit(one_by_one, device, args.steps)
+            batched_ms = timeit(batched, device, args.steps)
+        print("{:>8} {:>14.2f} {:>14.2f} {:>9.2f}x".format(n_cameras, one_by_one_ms, batched_ms, one_by_one_ms / batched_ms))
@@ -0,0 +1,131 @@
+"""
+Remove some images from a synthetic COLMAP sparse model with the columnar track table,
+and optionally with the per-record path of `sfm_outlier_detection.save()` for comparison.
+"""
+
+import add_pypath
+import os
+import time
+import struct
+import argparse
+import tempfile
+import numpy as np
+from internal.utils import colmap
+from internal.utils.colmap_track_table import TrackTable, ImageTable, POINT3D_HEADER_DTYPE
+from internal.utils.sfm_outlier_detection import ColmapImages, save
+
+
+def create_sparse_model(path: str, n_images: int, n_observations: int, track_length: int, seed: int = 42):
+    rng = np.random.default_rng(seed)
+    n_points = n_observations // track_length
+    n_observations = n_points * track_length
+
+    image_ids = np.arange(1, n_images + 1, dtype=np.int32)
+    observation_image_ids = rng.integers(1, n_images + 1, size=n_observations, dtype=np.int32)
+    observation_point_indices = np.repeat(np.arange(n_points), track_length)
+
+    # the index of each observation among the ones of the same image
+    order = np.argsort(observation_image_ids, kind="stable")
+    n_observations_per_image = np.bincount(observation_image_ids, minlength=n_images + 1)[1:]
+    image_offsets = np.concatenate([[0], np.cumsum(n_observations_per_image)])
+    point2D_idxs = np.empty((n_observations,), dtype=np.int32)
+    point2D_idxs[order] = np.arange(n_observations) - image_offsets[observation_image_ids[order] - 1]
+
+    headers = np.zeros((n_points,), dtype=POINT3D_HEADER_DTYPE)
+    headers["id"] = np.arange(1, n_points + 1)
+    headers["xyz"] = rng.normal(size=(n_points, 3))
+    headers["rgb"] = rng.integers(0, 256, size=(n_points, 3))
+    headers["error"] = rng.uniform(size=n_points)
+    headers["track_length"] = track_length
+    os.makedirs(path, exist_ok=True)
+    TrackTable(
+        headers=headers,
+        track_offsets=np.arange(n_points + 1, dtype=np.int64) * track_length,
+        image_ids=observation_image_ids,
+        point2D_idxs=point2D_idxs,
+    ).write(os.path.join(path, "points3D.bin"))
+
+    points2D = np.empty((n_observations,), dtype=[("xy", "<f8", (2,)), ("point3D_id", "<i8")])
+    points2D["xy"] = rng.uniform(0, 1000, size=(n_observations, 2))
+    points2D["point3D_id"] = headers["id"][observation_point_indices[order]]
+    points2D = memoryview(points2D.tobytes())
+
+    records = [struct.pack("<Q", n_images)]
+    for i, image_id in enumerate(image_ids.tolist()):
+        records.append(struct.pack("<idddddddi", image_id, 1., 0., 0., 0., 0., 0., 0., 1))
+        records.append("{:06d}.jpg".format(image_id).encode("utf-8") + b"\x00")
+        records.append(struct.pack("<Q", n_observations_per_image[i]))
+        records.append(points2D[image_offsets[i] * 24:image_offsets[i + 1] * 24])
+    with open(os.path.join(path, "images.bin"), "wb") as f:
+        f.write(b"".join(records))
+
+    colmap.write_cameras_binary(
+        {1: colmap.Camera(id=1, model="PINHOLE", width=1000, height=1000, params=np.array([500., 500., 500., 500.]))},
+        os.path.join(path, "cameras.bin"),
+    )
+
+    return image_ids
+
+
+def timeit(name: str, fn):
+    started_at = time.perf_counter()
+    result = fn()
+    print("{}: {:.2f}s".format(name, time.perf_counter() - started_at))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-images", type=int, default=100_000)
+    parser.add_argument("--n-observations", type=int, default=50_000_000)
+    parser.add_argument("--track-length", type=int, default=5)
+    parser.add_argument("--removed-fraction", type=float, default=0.05)
+    parser.add_argument("--per-record", action="store_true",
+                        help="also run the per-record path, very slow on large models")
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.output) as temp_dir:
+        model_path = os.path.join(temp_dir, "sparse")
+        image_ids = timeit("generate", lambda: create_sparse_model(model_path, args.n_images, args.n_observations, args.track_length))
+        removed_image_ids = np.random.default_rng(0).choice(image_ids, size=int(len(image_ids) * args.removed_fraction), replace=False)
+
+        image_table = timeit("read images.bin", lambda: ImageTable.read(os.path.join(model_path, "images.bin")))
+        track_table = timeit("read points3D.bin", lambda: TrackTable.read(os.path.join(model_path, "points3D.bin")))
+        new_image_table = timeit("remove from images", lambda: image_table.remove_images(removed_image_ids))
+        new_track_table = timeit("remove from tracks", lambda: track_table.remove_images(removed_image_ids))
+        print("images: {} -> {}, points: {} -> {}, observations: {} -> {}".format(
+            image_table.n_images,
+            new_image_table.n_images,
+            track_table.n_points,
+            new_track_table.n_points,
+            track_table.n_observations,
+            new_track_table.n_observations,
+        ))
+        columnar_output = os.path.join(temp_dir, "columnar")
+        os.makedirs(columnar_output)
+        timeit("write images.bin", lambda: new_image_table.write(os.path.join(columnar_output, "images.bin")))
+        timeit("write points3D.bin", lambda: new_track_table.write(os.path.join(columnar_output, "points3D.bin")))
+        del image_table, track_table, new_image_table, new_track_table
+
+        if args.per_record:
+            colmap_image_data = timeit("per-record read images.bin", lambda: colmap.read_images_binary(os.path.join(model_path, "images.bin")))
+            colmap_images = ColmapImages(
+                model_path,
+                colmap_image_data,
+                id=np.asarray(list(colmap_image_data.keys())),
+                image_name=np.asarray([i.name for i in colmap_image_data.values()]),
+                w2c=None,
+                point_ref_counters=None,
+                n_points=None,
+                c2w_in_gps=None,
+            )
+            mask = np.isin(colmap_images.id, removed_image_ids)
+            per_record_output = os.path.join(temp_dir, "per_record")
+            timeit("per-record save", lambda: save(colmap_images, [mask], per_record_output)(columnar=False))
+            timeit("columnar save", lambda: save(colmap_images, [mask], columnar_output)())
+            for i in ["images.bin", "points3D.bin"]:
+                with open(os.path.join(per_record_output, i), "rb") as f:
+                    per_record_bytes = f.read()
+                with open(os.path.join(columnar_output, i), "rb") as f:
+                    print("{} identical: {}".format(i, f.read() == per_record_bytes))
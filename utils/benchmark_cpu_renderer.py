@@ -0,0 +1,88 @@
+"""
+Measure the throughput of the pure-PyTorch `CPUReferenceRenderer` across image sizes and Gaussian counts.
+"""
+
+import add_pypath
+import time
+import argparse
+import torch
+from internal.cameras.cameras import Cameras
+from internal.models.vanilla_gaussian import VanillaGaussian
+from internal.renderers.cpu_reference_renderer import CPUReferenceRenderer
+
+
+def create_camera(size: int, device):
+    return Cameras(
+        R=torch.eye(3)[None],
+        T=torch.zeros((1, 3)),
+        fx=torch.tensor([size * 1.2]),
+        fy=torch.tensor([size * 1.2]),
+        cx=torch.tensor([size / 2]),
+        cy=torch.tensor([size / 2]),
+        width=torch.tensor([size], dtype=torch.int),
+        height=torch.tensor([size], dtype=torch.int),
+        appearance_id=torch.tensor([0]),
+        normalized_appearance_id=torch.tensor([0.]),
+        distortion_params=None,
+        camera_type=torch.tensor([0]),
+    )[0].to_device(device)
+
+
+def create_model(n: int, sh_degree: int, device):
+    model = VanillaGaussian(sh_degree=sh_degree).instantiate()
+    means = torch.rand((n, 3)) * 2. - 1.
+    means[:, 2] += 3.
+    model.setup_from_tensors({
+        "means": means,
+        "shs_dc": torch.rand((n, 1, 3)),
+        "shs_rest": torch.rand((n, (sh_degree + 1) ** 2 - 1, 3)) * 0.1,
+        "opacities": torch.randn((n, 1)),
+        "scales": torch.rand((n, 3)) * 2. - 5.,
+        "rotations": torch.randn((n, 4)),
+    })
+    return model.to(device)
+
+
+def benchmark(renderer, camera, model, bg_color, steps: int, backward: bool):
+    elapsed = []
+    for _ in range(steps + 1):  # the first one is warmup
+        model.zero_grad(set_to_none=True)
+        started_at = time.perf_counter()
+        with torch.set_grad_enabled(backward):
+            outputs = renderer(camera, model, bg_color)
+            if backward:
+                outputs["render"].mean().backward()
+        elapsed.append(time.perf_counter() - started_at)
+    return sum(elapsed[1:]) / steps * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--image-sizes", type=int, nargs="+", default=[64, 128, 256])
+    parser.add_argument("--n-gaussians", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--sh-degree", type=int, default=3)
+    parser.add_argument("--block-size", type=int, default=16)
+    parser.add_argument("--max-elements-per-chunk", type=int, default=1 << 24)
+    parser.add_argument("--steps", type=int, default=3)
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    torch.manual_seed(42)
+    device = torch.device(args.device)
+    renderer = CPUReferenceRenderer(block_size=args.block_size, max_elements_per_chunk=args.max_elements_per_chunk)
+    bg_color = torch.zeros((3,), device=device)
+
+    print("{:>8} {:>10} {:>14} {:>14} {:>14}".format("size", "gaussians", "forward ms", "fwd+bwd ms", "Mpixel/s"))
+    for n in args.n_gaussians:
+        model = create_model(n, args.sh_degree, device)
+        for size in args.image_sizes:
+            camera = create_camera(size, device)
+            forward_ms = benchmark(renderer, camera, model, bg_color, args.steps, backward=False)
+            backward_ms = benchmark(renderer, camera, model, bg_color, args.steps, backward=True)
+            print("{:>8} {:>10} {:>14.2f} {:>14.2f} {:>14.3f}".format(
+                size,
+                n,
+                forward_ms,
+                backward_ms,
+                size * size / forward_ms / 1000,
+            ))
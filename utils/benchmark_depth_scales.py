@@ -0,0 +1,129 @@
+"""
+Estimate the depth scales of a synthetic dataset with the batched implementation, and optionally with the per-image one.
+"""
+
+import add_pypath
+import os
+import sys
+import time
+import struct
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+from internal.utils import colmap
+from internal.utils.colmap_track_table import TrackTable, POINT3D_HEADER_DTYPE, POINT2D_DTYPE
+from internal.utils.depth_scale_utils import get_depth_scales
+
+
+def create_dataset(path: str, n_images: int, n_observations_per_image: int, track_length: int, width: int, height: int, depth_map_height: int, seed: int = 42):
+    rng = np.random.default_rng(seed)
+    n_observations = n_images * n_observations_per_image
+    n_points = n_observations // track_length
+    n_observations = n_points * track_length
+
+    # all the cameras are at the origin looking at +z, so the projections are the same for every image
+    xyzs = np.stack([rng.uniform(-1., 1., n_points), rng.uniform(-1., 1., n_points), np.ones((n_points,))], axis=-1) * rng.uniform(2., 10., (n_points, 1))
+    focal = width / 2
+    projections = xyzs[:, :2] / xyzs[:, 2:] * focal + np.array([width / 2, height / 2])
+
+    observation_image_indices = rng.integers(0, n_images, size=n_observations)
+    observation_point_indices = np.repeat(np.arange(n_points), track_length)
+    order = np.argsort(observation_image_indices, kind="stable")
+    n_observations_per_image = np.bincount(observation_image_indices, minlength=n_images)
+    image_offsets = np.concatenate([[0], np.cumsum(n_observations_per_image)])
+    point2D_idxs = np.empty((n_observations,), dtype=np.int32)
+    point2D_idxs[order] = np.arange(n_observations) - image_offsets[observation_image_indices[order]]
+
+    sparse_dir = os.path.join(path, "sparse")
+    os.makedirs(sparse_dir)
+    headers = np.zeros((n_points,), dtype=POINT3D_HEADER_DTYPE)
+    headers["id"] = np.arange(1, n_points + 1)
+    headers["xyz"] = xyzs
+    headers["error"] = rng.uniform(0., 2., size=n_points)
+    headers["track_length"] = track_length
+    TrackTable(
+        headers=headers,
+        track_offsets=np.arange(n_points + 1, dtype=np.int64) * track_length,
+        image_ids=(observation_image_indices + 1).astype(np.int32),
+        point2D_idxs=point2D_idxs,
+    ).write(os.path.join(sparse_dir, "points3D.bin"))
+
+    points2D = np.empty((n_observations,), dtype=POINT2D_DTYPE)
+    points2D["xy"] = projections[observation_point_indices[order]]
+    points2D["point3D_id"] = headers["id"][observation_point_indices[order]]
+    points2D = memoryview(points2D.tobytes())
+
+    depth_dir = os.path.join(path, "estimated_depths")
+    os.makedirs(depth_dir)
+    depth_map_width = depth_map_height * width // height
+    depth_map = (1. / np.linspace(2., 10., depth_map_height * depth_map_width)).reshape(depth_map_height, depth_map_width).astype(np.float32)
+
+    records = [struct.pack("<Q", n_images)]
+    for i in range(n_images):
+        name = "{:06d}.jpg".format(i)
+        records.append(struct.pack("<idddddddi", i + 1, 1., 0., 0., 0., 0., 0., 0., 1))
+        records.append(name.encode("utf-8") + b"\x00")
+        records.append(struct.pack("<Q", n_observations_per_image[i]))
+        records.append(points2D[image_offsets[i] * POINT2D_DTYPE.itemsize:image_offsets[i + 1] * POINT2D_DTYPE.itemsize])
+        np.save(os.path.join(depth_dir, "{}.npy".format(name)), depth_map)
+    with open(os.path.join(sparse_dir, "images.bin"), "wb") as f:
+        f.write(b"".join(records))
+
+    colmap.write_cameras_binary(
+        {1: colmap.Camera(id=1, model="PINHOLE", width=width, height=height, params=np.array([focal, focal, width / 2, height / 2]))},
+        os.path.join(sparse_dir, "cameras.bin"),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-images", type=int, default=10_000)
+    parser.add_argument("--n-observations-per-image", type=int, default=2_000)
+    parser.add_argument("--track-length", type=int, default=4)
+    parser.add_argument("--width", type=int, default=1600)
+    parser.add_argument("--height", type=int, default=1200)
+    parser.add_argument("--depth-map-height", type=int, default=192)
+    parser.add_argument("--n-processes", type=int, nargs="+", default=[0, -1])
+    parser.add_argument("--per-image", action="store_true",
+                        help="also run the per-image implementation")
+    parser.add_argument("--output", type=str, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.output) as temp_dir:
+        started_at = time.perf_counter()
+        create_dataset(
+            temp_dir,
+            n_images=args.n_images,
+            n_observations_per_image=args.n_observations_per_image,
+            track_length=args.track_length,
+            width=args.width,
+            height=args.height,
+            depth_map_height=args.depth_map_height,
+        )
+        print("generate: {:.2f}s".format(time.perf_counter() - started_at))
+
+        for n_processes in args.n_processes:
+            started_at = time.perf_counter()
+            depth_scales = get_depth_scales(
+                os.path.join(temp_dir, "sparse"),
+                os.path.join(temp_dir, "estimated_depths"),
+                n_processes=n_processes,
+            )
+            print("batched, n_processes={}: {:.2f}s, {} of {} images estimated".format(
+                n_processes,
+                time.perf_counter() - started_at,
+                sum(i["scale"] != 0 for i in depth_scales.values()),
+                len(depth_scales),
+            ))
+
+        if args.per_image:
+            started_at = time.perf_counter()
+            subprocess.check_call([
+                sys.executable,
+                os.path.join(os.path.dirname(__file__), "get_depth_scales.py"),
+                temp_dir,
+                "--per-image",
+                "-o", os.path.join(temp_dir, "per_image.json"),
+            ])
+            print("per-image: {:.2f}s".format(time.perf_counter() - started_at))
@@ -0,0 +1,116 @@
+"""
+Compare the per-field and the packed All-to-All used to redistribute Gaussians,
+by counting the collective calls and timing them on CPU with the gloo backend.
+"""
+
+import add_pypath
+import os
+import time
+import argparse
+import tempfile
+import torch
+import torch.distributed
+import torch.multiprocessing
+from internal.utils.distributed_gaussian_utils import DistributedGaussianUtils
+
+
+class DummyModel:
+    def __init__(self, properties):
+        self.properties = properties
+
+    def get_property_names(self):
+        return list(self.properties.keys())
+
+    def get_property(self, name):
+        return self.properties[name]
+
+
+def create_gaussians(n: int, sh_degree: int):
+    properties = {
+        "means": torch.randn((n, 3)),
+        "shs_dc": torch.randn((n, 1, 3)),
+        "shs_rest": torch.randn((n, (sh_degree + 1) ** 2 - 1, 3)),
+        "scales": torch.randn((n, 3)),
+        "rotations": torch.randn((n, 4)),
+        "opacities": torch.randn((n, 1)),
+    }
+    optimizers = []
+    for name in list(properties.keys()):
+        param = torch.nn.Parameter(properties[name])
+        optimizer = torch.optim.Adam([{"name": name, "params": [param]}])
+        optimizer.state[param] = {
+            "step": torch.tensor(1, dtype=torch.float),
+            "exp_avg": torch.randn_like(param),
+            "exp_avg_sq": torch.rand_like(param),
+        }
+        properties[name] = param
+        optimizers.append(optimizer)
+    return DummyModel(properties), optimizers
+
+
+def worker(rank: int, world_size: int, init_file: str, args):
+    torch.distributed.init_process_group(
+        "gloo",
+        init_method="file://{}".format(init_file),
+        rank=rank,
+        world_size=world_size,
+    )
+
+    # count the collective calls
+    n_collectives = [0]
+    all_to_all_single = torch.distributed.all_to_all_single
+
+    def counted_all_to_all_single(*args, **kwargs):
+        n_collectives[0] += 1
+        return all_to_all_single(*args, **kwargs)
+
+    torch.distributed.all_to_all_single = counted_all_to_all_single
+
+    try:
+        for packed in [False, True]:
+            torch.manual_seed(rank)
+            model, optimizers = create_gaussians(args.n, args.sh_degree)
+            elapsed = 0.
+            n_collectives[0] = 0
+            for _ in range(args.steps):
+                destination = torch.randint(0, world_size, (model.get_property("means").shape[0],))
+                torch.distributed.barrier()
+                started_at = time.perf_counter()
+                _, number_of_gaussians_to_receive = DistributedGaussianUtils.get_number_of_gaussians_to_receive(destination, world_size)
+                DistributedGaussianUtils.optimizer_all2all(
+                    destination,
+                    number_of_gaussians_to_receive,
+                    model,
+                    optimizers,
+                    world_size,
+                    packed=packed,
+                )
+                elapsed += time.perf_counter() - started_at
+
+            if rank == 0:
+                print("{}: {:.2f} collectives/step, {:.2f} ms/step".format(
+                    "packed" if packed else "per-field",
+                    n_collectives[0] / args.steps,
+                    elapsed / args.steps * 1000,
+                ))
+    finally:
+        torch.distributed.all_to_all_single = all_to_all_single
+        torch.distributed.destroy_process_group()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--world-size", type=int, default=4)
+    parser.add_argument("--n", type=int, default=100_000,
+                        help="The number of Gaussians per rank")
+    parser.add_argument("--sh-degree", type=int, default=3)
+    parser.add_argument("--steps", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        torch.multiprocessing.spawn(
+            worker,
+            args=(args.world_size, os.path.join(tmp_dir, "init"), args),
+            nprocs=args.world_size,
+            join=True,
+        )
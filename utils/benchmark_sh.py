@@ -0,0 +1,82 @@
+"""
+Compare the per-camera `eval_sh()` with `eval_sh_batched()`,
+and the e3nn based SHs rotation with the built-in one.
+"""
+
+import add_pypath
+import time
+import argparse
+import torch
+from internal.utils.sh_utils import eval_sh, eval_sh_batched, get_sh_rotation_matrices, rotate_sh
+from internal.utils.gaussian_utils import GaussianTransformUtils
+
+
+def timeit(fn, device, steps: int):
+    fn()  # warmup
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    started_at = time.perf_counter()
+    for _ in range(steps):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - started_at) / steps * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=100_000)
+    parser.add_argument("--sh-degree", type=int, default=3)
+    parser.add_argument("--n-cameras", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--n-rotations", type=int, default=64)
+    parser.add_argument("--steps", type=int, default=3)
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    torch.manual_seed(42)
+    device = torch.device(args.device)
+    n_coeffs = (args.sh_degree + 1) ** 2
+    features = torch.randn((args.n, n_coeffs, 3), device=device)
+    sh = features.transpose(1, 2)
+
+    print("SHs evaluation")
+    print("{:>8} {:>14} {:>14} {:>10}".format("cameras", "one-by-one ms", "batched ms", "speedup"))
+    for n_cameras in args.n_cameras:
+        dirs = torch.nn.functional.normalize(torch.randn((n_cameras, args.n, 3), device=device), dim=-1)
+
+        def one_by_one():
+            for camera_idx in range(n_cameras):
+                eval_sh(args.sh_degree, sh, dirs[camera_idx])
+
+        def batched():
+            eval_sh_batched(args.sh_degree, sh, dirs)
+
+        with torch.no_grad():
+            one_by_one_ms = timeit(one_by_one, device, args.steps)
+            batched_ms = timeit(batched, device, args.steps)
+        print("{:>8} {:>14.2f} {:>14.2f} {:>9.2f}x".format(n_cameras, one_by_one_ms, batched_ms, one_by_one_ms / batched_ms))
+
+    print("SHs rotation, {} rotations".format(args.n_rotations))
+    rotation_matrices = torch.linalg.qr(torch.randn((args.n_rotations, 3, 3), device=device)).Q
+    rotation_matrices = rotation_matrices * torch.sign(torch.linalg.det(rotation_matrices))[:, None, None]
+
+    def built_in():
+        for rotation_matrix in rotation_matrices:
+            GaussianTransformUtils.transform_shs(features, rotation_matrix, use_e3nn=False)
+
+    def built_in_per_gaussian():
+        rotate_sh(features[:, 1:], get_sh_rotation_matrices(args.sh_degree, rotation_matrices[torch.arange(args.n, device=device) % args.n_rotations]))
+
+    with torch.no_grad():
+        print("built-in: {:.2f} ms".format(timeit(built_in, device, args.steps)))
+        print("built-in, one rotation per Gaussian: {:.2f} ms".format(timeit(built_in_per_gaussian, device, args.steps)))
+        try:
+            import e3nn
+
+            def e3nn_based():
+                for rotation_matrix in rotation_matrices:
+                    GaussianTransformUtils.transform_shs(features, rotation_matrix, use_e3nn=True)
+
+            print("e3nn: {:.2f} ms".format(timeit(e3nn_based, device, args.steps)))
+        except ImportError:
+            print("e3nn not installed")
@@ -0,0 +1,131 @@
+"""
+Measure the time and the peak host memory of the sparse TSDF fusion,
+with the maps kept in memory or spilled to disk, and with different batch sizes.
+
+Each configuration runs in a fresh process, so the peak RSS values do not affect each other.
+"""
+
+import add_pypath
+import time
+import resource
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import torch
+from internal.cameras.cameras import Cameras
+from internal.utils.map_store import SpillableMapStore
+from internal.utils.tsdf_fusion import SparseTSDFVolume
+
+
+def create_cameras(n_cameras: int, size: int, distance: float = 2.) -> Cameras:
+    angles = torch.arange(n_cameras, dtype=torch.float) / n_cameras * 2 * torch.pi
+    heights = torch.linspace(-1., 1., n_cameras)
+    positions = torch.stack([torch.cos(angles) * distance, heights, torch.sin(angles) * distance], dim=-1)
+    forward = torch.nn.functional.normalize(-positions, dim=-1)
+    down = torch.tensor([0., -1., 0.]).expand_as(forward)
+    right = torch.nn.functional.normalize(torch.cross(down, forward, dim=-1), dim=-1)
+    down = torch.cross(forward, right, dim=-1)
+    R = torch.stack([right, down, forward], dim=1)
+    T = -torch.bmm(R, positions.unsqueeze(-1)).squeeze(-1)
+    width = torch.full((n_cameras,), size, dtype=torch.int)
+    return Cameras(
+        R=R,
+        T=T,
+        fx=torch.full((n_cameras,), float(size)),
+        fy=torch.full((n_cameras,), float(size)),
+        cx=width / 2,
+        cy=width / 2,
+        width=width,
+        height=width,
+        appearance_id=torch.zeros_like(width),
+        normalized_appearance_id=torch.zeros_like(width, dtype=torch.float),
+        distortion_params=None,
+        camera_type=torch.zeros_like(width),
+    )
+
+
+def render_sphere(camera, radius: float = 0.5):
+    height, width = camera.height.item(), camera.width.item()
+    v, u = torch.meshgrid(torch.arange(height, dtype=torch.float), torch.arange(width, dtype=torch.float), indexing="ij")
+    directions = torch.stack([(u - camera.cx) / camera.fx, (v - camera.cy) / camera.fy, torch.ones_like(u)], dim=-1)
+    world_directions = directions @ camera.world_to_camera[:3, :3].T
+    origin = camera.camera_center
+
+    a = torch.sum(world_directions ** 2, dim=-1)
+    b = 2 * torch.sum(world_directions * origin, dim=-1)
+    c = torch.sum(origin ** 2) - radius ** 2
+    discriminant = b * b - 4 * a * c
+    depth = torch.where(discriminant > 0, (-b - torch.sqrt(torch.clamp_min(discriminant, 0.))) / (2 * a), 0.)
+    rgb = torch.nn.functional.normalize(world_directions, dim=-1).permute(2, 0, 1) * 0.5 + 0.5
+    return rgb, depth[None]
+
+
+def run(n_cameras: int, size: int, voxel_size: float, max_in_memory_bytes: int, batch_size: int, device: str):
+    cameras = create_cameras(n_cameras, size)
+    rgb_store = SpillableMapStore(max_in_memory_bytes=max_in_memory_bytes * 3 // 4 if max_in_memory_bytes > 0 else max_in_memory_bytes)
+    depth_store = SpillableMapStore(max_in_memory_bytes=max_in_memory_bytes // 4 if max_in_memory_bytes > 0 else max_in_memory_bytes)
+    try:
+        for camera in cameras:
+            rgb, depth = render_sphere(camera)
+            rgb_store.append(rgb)
+            depth_store.append(depth)
+
+        started_at = time.perf_counter()
+        volume = SparseTSDFVolume(voxel_size=voxel_size, sdf_trunc=4 * voxel_size, device=device)
+        volume.integrate(rgb_store, depth_store, cameras, batch_size=batch_size)
+        integrated_at = time.perf_counter()
+        vertices, faces, _ = volume.extract_mesh()
+        extracted_at = time.perf_counter()
+
+        return {
+            "integration_s": integrated_at - started_at,
+            "extraction_s": extracted_at - integrated_at,
+            "n_blocks": volume.n_blocks,
+            "volume_mb": volume.nbytes / 1024 ** 2,
+            "n_spilled": rgb_store.n_spilled + depth_store.n_spilled,
+            "n_faces": faces.shape[0],
+            # KB on Linux
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+    finally:
+        rgb_store.close()
+        depth_store.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-cameras", type=int, default=128)
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--voxel-size", type=float, default=0.005)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--max-in-memory-mb", type=float, nargs="+", default=[-1, 0],
+                        help="-1 means keeping all the maps in memory, 0 means spilling all")
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    print("{:>10} {:>6} {:>10} {:>12} {:>12} {:>8} {:>10} {:>10}".format(
+        "budget MB", "batch", "spilled", "integrate s", "extract s", "blocks", "volume MB", "peak MB",
+    ))
+    mp_context = multiprocessing.get_context("spawn")
+    for max_in_memory_mb in args.max_in_memory_mb:
+        for batch_size in args.batch_sizes:
+            with ProcessPoolExecutor(max_workers=1, mp_context=mp_context) as executor:
+                result = executor.submit(
+                    run,
+                    args.n_cameras,
+                    args.size,
+                    args.voxel_size,
+                    int(max_in_memory_mb * 1024 ** 2) if max_in_memory_mb >= 0 else -1,
+                    batch_size,
+                    args.device,
+                ).result()
+            print("{:>10} {:>6} {:>10} {:>12.2f} {:>12.2f} {:>8} {:>10.1f} {:>10.1f}".format(
+                max_in_memory_mb,
+                batch_size,
+                result["n_spilled"],
+                result["integration_s"],
+                result["extraction_s"],
+                result["n_blocks"],
+                result["volume_mb"],
+                result["peak_rss_mb"],
+            ))
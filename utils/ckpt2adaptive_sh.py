@@ -0,0 +1,36 @@
+import add_pypath
+import os
+import argparse
+import torch
+from internal.utils.adaptive_sh_utils import AdaptiveSHGaussians
+from internal.utils.gaussian_model_loader import GaussianModelLoader
+
+parser = argparse.ArgumentParser()
+parser.add_argument("input")
+parser.add_argument("--output", "-o", required=False, default=None)
+parser.add_argument("--energy-threshold", "-t", type=float, default=1e-3,
+                    help="SH bands with energy less than this value will be dropped")
+args = parser.parse_args()
+
+# search input file
+print("Searching checkpoint file...")
+load_file = GaussianModelLoader.search_load_file(args.input)
+assert load_file.endswith(".ckpt"), f"Not a valid ckpt file can be found in '{args.input}'"
+
+if args.output is None:
+    args.output = load_file[:load_file.rfind(".")] + "-adaptive_sh.pt"
+assert os.path.exists(args.output) is False, f"Output file already exists, please remove it first: '{args.output}'"
+
+print(f"Loading checkpoint '{load_file}'...")
+ckpt = torch.load(load_file, map_location="cpu")
+model = GaussianModelLoader.initialize_model_from_checkpoint(ckpt, device="cpu")
+
+print("Converting...")
+adaptive_shs, _ = AdaptiveSHGaussians.from_model(model, args.energy_threshold)
+print("Gaussians per SH degree: {}".format(adaptive_shs.bucket_sizes.tolist()))
+print("SH rest coefficients: {} -> {}".format(
+    model.shs_rest.shape[0] * model.shs_rest.shape[1],
+    adaptive_shs.get_n_sh_coefficients(),
+))
+adaptive_shs.save(args.output)
+print(f"Saved to '{args.output}'")
@@ -1,33 +1,216 @@
 import add_pypath
+import os
+import time
+import struct
 import argparse
+import tempfile
 import numpy as np
-import lightning
-from internal.utils.gaussian_utils import Gaussian
+from internal.utils.gaussian_utils import GaussianPlyUtils
 from internal.utils.sh_utils import eval_sh
 
+SPLAT_DTYPE = np.dtype([
+    ("x", np.float32),
+    ("y", np.float32),
+    ("z", np.float32),
+    ("s1", np.float32),
+    ("s2", np.float32),
+    ("s3", np.float32),
+    ("red", np.uint8),
+    ("green", np.uint8),
+    ("blue", np.uint8),
+    ("alpha", np.uint8),
+    ("r1", np.uint8),
+    ("r2", np.uint8),
+    ("r3", np.uint8),
+    ("r4", np.uint8),
+])
+
+"""
+Chunked file layout, all values are little-endian:
+    file header: magic(8s) version(u32) n_chunks(u32) n_splats(u64) chunk_size(u32) record_size(u32)
+    for each chunk, ordered by descending importance:
+        chunk header: chunk_idx(u32) n_splats(u32) min_importance(f32) max_importance(f32)
+        `n_splats` records in the `.splat` layout
+The records of a chunk are a valid `.splat` file, so a client can append and render them once the chunk arrives.
+"""
+CHUNKED_MAGIC = b"SPLATCHK"
+CHUNKED_VERSION = 1
+CHUNKED_FILE_HEADER = struct.Struct("<8sIIQII")
+CHUNKED_CHUNK_HEADER = struct.Struct("<IIff")
+
 
 def getArgs():
     parser = argparse.ArgumentParser()
     parser.add_argument("input", help="Path to ckpt or ply file")
     parser.add_argument("--output", "-o", required=False, default=None, help="Path to output splat file")
+    parser.add_argument("--chunk-size", type=int, default=-1,
+                        help="Write an importance ordered chunked file for progressive loading, each chunk contains this number of Gaussians")
+    parser.add_argument("--bake-shs", action="store_true", default=False,
+                        help="Bake the view dependent colors into RGB, instead of using SH DC only")
+    parser.add_argument("--bake-view-direction", type=float, nargs=3, default=[0., 0., 1.],
+                        help="The center of the view direction range, in world space")
+    parser.add_argument("--bake-view-angle", type=float, default=180.,
+                        help="The half angle of the view direction range in degrees, 180 means all directions")
+    parser.add_argument("--bake-n-directions", type=int, default=64)
+    parser.add_argument("--benchmark", action="store_true", default=False,
+                        help="Compare the throughput of the chunked conversion with the monolithic one, no output will be kept")
     args = parser.parse_args()
 
     if args.output is None:
-        args.output = args.input + ".splat"
+        args.output = args.input + (".splatc" if args.chunk_size > 0 else ".splat")
     assert args.input != args.output
 
     return args
 
 
-def main():
-    args = getArgs()
+class PlySource:
+    """Read Gaussians row by row from a memory-mapped ply file"""
+
+    def __init__(self, path: str):
+        from plyfile import PlyData
+        self.vertices = PlyData.read(path, mmap="r").elements[0].data
+
+        names = self.vertices.dtype.names
+        self.f_rest_names = sorted([i for i in names if i.startswith("f_rest_")], key=lambda x: int(x.split("_")[-1]))
+        self.sh_degree = {0: 0, 9: 1, 24: 2, 45: 3}[len(self.f_rest_names)]
+
+    def __len__(self):
+        return self.vertices.shape[0]
+
+    def _stack(self, vertices, names):
+        return np.stack([np.asarray(vertices[i], dtype=np.float32) for i in names], axis=-1)
+
+    def get_importance_properties(self):
+        return self._stack(self.vertices, ["scale_0", "scale_1", "scale_2"]), np.asarray(self.vertices["opacity"], dtype=np.float32)[..., None]
+
+    def get(self, indices) -> GaussianPlyUtils:
+        vertices = self.vertices[indices]
+        n = vertices.shape[0]
+        return GaussianPlyUtils(
+            sh_degrees=self.sh_degree,
+            xyz=self._stack(vertices, ["x", "y", "z"]),
+            opacities=np.asarray(vertices["opacity"], dtype=np.float32)[..., None],
+            features_dc=self._stack(vertices, ["f_dc_0", "f_dc_1", "f_dc_2"])[..., None],
+            features_rest=self._stack(vertices, self.f_rest_names).reshape((n, 3, -1)) if len(self.f_rest_names) > 0 else np.zeros((n, 3, 0), dtype=np.float32),
+            scales=self._stack(vertices, ["scale_0", "scale_1", "scale_2"]),
+            rotations=self._stack(vertices, ["rot_0", "rot_1", "rot_2", "rot_3"]),
+        )
+
+
+class CheckpointSource:
+    """Read Gaussians row by row from a memory-mapped checkpoint"""
+
+    def __init__(self, path: str):
+        from internal.utils.gaussian_model_loader import GaussianModelLoader
+        # only the rows being sliced are read from disk, the optimizer states are never touched
+        ckpt = GaussianModelLoader.load_checkpoint(
+            path,
+            lazy=True,
+            state_dict_prefixes=["gaussian_model."],
+            load_optimizer_states=False,
+        )
+        # tensors in parameter structure, converted to ply format chunk by chunk
+        self.gaussians = GaussianPlyUtils.load_from_state_dict(ckpt["state_dict"])
+        self.sh_degree = self.gaussians.sh_degrees
+
+    def __len__(self):
+        return self.gaussians.xyz.shape[0]
+
+    def get_importance_properties(self):
+        return self.gaussians.scales.float().numpy(), self.gaussians.opacities.float().numpy()
 
-    if args.input.endswith(".ply"):
-        gaussians = Gaussian.load_from_ply(args.input)
+    def get(self, indices) -> GaussianPlyUtils:
+        import torch
+        indices = torch.from_numpy(np.asarray(indices))
+        return GaussianPlyUtils(
+            sh_degrees=self.sh_degree,
+            xyz=self.gaussians.xyz[indices],
+            opacities=self.gaussians.opacities[indices],
+            features_dc=self.gaussians.features_dc[indices],
+            features_rest=self.gaussians.features_rest[indices],
+            scales=self.gaussians.scales[indices],
+            rotations=self.gaussians.rotations[indices],
+        ).to_ply_format()
+
+
+def get_source(path: str):
+    if path.endswith(".ply"):
+        return PlySource(path)
+    return CheckpointSource(path)
+
+
+def get_importance(scales, opacities):
+    return np.exp(scales.sum(axis=-1)) / (1 + np.exp(-opacities.squeeze(-1)))
+
+
+def get_view_directions(center, half_angle: float, n: int):
+    """
+    Sample `n` directions evenly from the cone with axis `center` and `half_angle` in degrees
+    """
+
+    center = np.asarray(center, dtype=np.float64)
+    center = center / np.linalg.norm(center)
+
+    # fibonacci spiral on the spherical cap around +Z
+    min_cos = np.cos(np.deg2rad(np.clip(half_angle, 0., 180.)))
+    i = np.arange(n) + 0.5
+    cos_theta = 1. - (1. - min_cos) * i / n
+    sin_theta = np.sqrt(np.clip(1. - cos_theta ** 2, 0., None))
+    phi = np.pi * (1. + 5. ** 0.5) * i
+    directions = np.stack([sin_theta * np.cos(phi), sin_theta * np.sin(phi), cos_theta], axis=-1)
+
+    # rotate +Z to `center`
+    z = np.array([0., 0., 1.])
+    v = np.cross(z, center)
+    c = np.dot(z, center)
+    if np.linalg.norm(v) < 1e-8:
+        rotation = np.eye(3) if c > 0 else np.diag([1., -1., -1.])
+    else:
+        vx = np.array([[0., -v[2], v[1]], [v[2], 0., -v[0]], [-v[1], v[0], 0.]])
+        rotation = np.eye(3) + vx + vx @ vx * (1. / (1. + c))
+
+    return (directions @ rotation.T).astype(np.float32)
+
+
+def get_rgbs(gaussians: GaussianPlyUtils, view_directions=None):
+    if view_directions is None or gaussians.sh_degrees == 0:
+        return eval_sh(0, gaussians.features_dc, None) + 0.5
+
+    # average the colors over the view directions
+    shs = np.concatenate([gaussians.features_dc, gaussians.features_rest], axis=-1)  # [N, 3, (D+1)^2]
+    rgbs = np.zeros((shs.shape[0], 3), dtype=np.float32)
+    for direction in view_directions:
+        rgbs += np.clip(eval_sh(gaussians.sh_degrees, shs, direction) + 0.5, 0., None)
+    return rgbs / view_directions.shape[0]
+
+
+def to_splat_elements(gaussians: GaussianPlyUtils, view_directions=None):
+    scales_activated = np.exp(gaussians.scales).astype(np.float32)
+    rots = gaussians.rotations
+    rots_processed = ((rots / np.linalg.norm(rots, axis=-1, keepdims=True)) * 128 + 128).clip(0, 255)
+    rgbs = get_rgbs(gaussians, view_directions)
+    alphas = 1. / (1 + np.exp(-gaussians.opacities))
+    rgbas = (np.concatenate([rgbs, alphas], axis=-1) * 255).clip(0, 255)
+
+    elements = np.empty(gaussians.xyz.shape[0], dtype=SPLAT_DTYPE)
+    for idx, name in enumerate(["x", "y", "z"]):
+        elements[name] = gaussians.xyz[:, idx]
+    for idx, name in enumerate(["s1", "s2", "s3"]):
+        elements[name] = scales_activated[:, idx]
+    for idx, name in enumerate(["red", "green", "blue", "alpha"]):
+        elements[name] = rgbas[:, idx]
+    for idx, name in enumerate(["r1", "r2", "r3", "r4"]):
+        elements[name] = rots_processed[:, idx]
+    return elements
+
+
+def convert_monolithic(input: str, output: str):
+    if input.endswith(".ply"):
+        gaussians = GaussianPlyUtils.load_from_ply(input)
     else:
         import torch
-        ckpt = torch.load(args.input)
-        gaussians = Gaussian.load_from_state_dict(ckpt["hyper_parameters"]["gaussian"].sh_degree, ckpt["state_dict"]).to_ply_format()
+        ckpt = torch.load(input, map_location="cpu")
+        gaussians = GaussianPlyUtils.load_from_state_dict(ckpt["state_dict"]).to_ply_format()
 
     # sort
     sorted_indices = np.argsort(-np.exp(gaussians.scales.sum(axis=-1)) / (1 + np.exp(-gaussians.opacities.squeeze(-1))))
@@ -42,32 +225,97 @@ def main():
     rgbs = eval_sh(0, features_dc, None) + 0.5
     alphas = 1. / (1 + np.exp(-opacities_sorted))
     rgbas = (np.concatenate([rgbs, alphas], axis=-1) * 255).clip(0, 255)
-    # define splat file structure
-    dtype = np.dtype([
-        ("x", np.float32),
-        ("y", np.float32),
-        ("z", np.float32),
-        ("s1", np.float32),
-        ("s2", np.float32),
-        ("s3", np.float32),
-        ("red", np.uint8),
-        ("green", np.uint8),
-        ("blue", np.uint8),
-        ("alpha", np.uint8),
-        ("r1", np.uint8),
-        ("r2", np.uint8),
-        ("r3", np.uint8),
-        ("r4", np.uint8),
-    ])
     # rearrange attributes
     attributes = np.concatenate([xyz_sorted, scales_sorted_activated, rgbas, rot_sorted_processed], axis=-1)
-    elements = np.empty(attributes.shape[0], dtype=dtype)
+    elements = np.empty(attributes.shape[0], dtype=SPLAT_DTYPE)
     elements[:] = list(map(tuple, attributes))
     # save
-    with open(args.output, "wb") as f:
+    with open(output, "wb") as f:
         f.write(elements.tobytes())
 
-    print(f"Saved to {args.output}")
+    return elements.shape[0]
+
+
+def convert_chunked(input: str, output: str, chunk_size: int, view_directions=None, with_header: bool = True):
+    """
+    Only the importance of each Gaussian is held for all of them, the others are loaded, converted and written chunk by chunk.
+
+    Args:
+        with_header: False to write a plain `.splat` file in the same order
+    """
+
+    source = get_source(input)
+    n_splats = len(source)
+    if chunk_size <= 0:
+        chunk_size = max(n_splats, 1)
+    n_chunks = (n_splats + chunk_size - 1) // chunk_size
+
+    importance = get_importance(*source.get_importance_properties())
+    sorted_indices = np.argsort(-importance, kind="stable")
+
+    with open(output, "wb") as f:
+        if with_header:
+            f.write(CHUNKED_FILE_HEADER.pack(CHUNKED_MAGIC, CHUNKED_VERSION, n_chunks, n_splats, chunk_size, SPLAT_DTYPE.itemsize))
+        for chunk_idx in range(n_chunks):
+            chunk_indices = sorted_indices[chunk_idx * chunk_size:(chunk_idx + 1) * chunk_size]
+            elements = to_splat_elements(source.get(chunk_indices), view_directions)
+            if with_header:
+                chunk_importance = importance[chunk_indices]
+                f.write(CHUNKED_CHUNK_HEADER.pack(chunk_idx, elements.shape[0], chunk_importance[-1], chunk_importance[0]))
+            f.write(elements.tobytes())
+            del elements
+
+    return n_splats
+
+
+def read_chunked(path: str):
+    """Yield `(chunk_idx, elements)` of a chunked file, mainly for validation"""
+
+    with open(path, "rb") as f:
+        magic, version, n_chunks, n_splats, chunk_size, record_size = CHUNKED_FILE_HEADER.unpack(f.read(CHUNKED_FILE_HEADER.size))
+        assert magic == CHUNKED_MAGIC, "not a chunked splat file"
+        assert version == CHUNKED_VERSION, "unsupported version {}".format(version)
+        assert record_size == SPLAT_DTYPE.itemsize
+        for _ in range(n_chunks):
+            chunk_idx, n, _, _ = CHUNKED_CHUNK_HEADER.unpack(f.read(CHUNKED_CHUNK_HEADER.size))
+            yield chunk_idx, np.frombuffer(f.read(n * record_size), dtype=SPLAT_DTYPE)
+
+
+def benchmark(args):
+    def run(name, fn, *fn_args):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = os.path.join(tmpdir, "output")
+            started_at = time.perf_counter()
+            n = fn(args.input, output, *fn_args)
+            elapsed = time.perf_counter() - started_at
+            print("{}: {:.3f}s, {:.0f} Gaussians/s, {} bytes".format(name, elapsed, n / elapsed, os.path.getsize(output)))
+
+    chunk_size = args.chunk_size if args.chunk_size > 0 else 65536
+    run("monolithic", convert_monolithic)
+    run("chunked(chunk_size={}, without header)".format(chunk_size), convert_chunked, chunk_size, None, False)
+    run("chunked(chunk_size={})".format(chunk_size), convert_chunked, chunk_size)
+
+
+def main():
+    args = getArgs()
+
+    if args.benchmark:
+        benchmark(args)
+        return
+
+    view_directions = None
+    if args.bake_shs:
+        view_directions = get_view_directions(args.bake_view_direction, args.bake_view_angle, args.bake_n_directions)
+
+    n_splats = convert_chunked(
+        args.input,
+        args.output,
+        chunk_size=args.chunk_size,
+        view_directions=view_directions,
+        with_header=args.chunk_size > 0,
+    )
+
+    print(f"Saved {n_splats} Gaussians to {args.output}")
 
 
 if __name__ == "__main__":
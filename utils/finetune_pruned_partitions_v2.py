@@ -27,13 +27,30 @@ class PartitionFinetuning(PartitionTraining):
             "config.yaml",
         ))]
 
-    def get_partition_specific_args(self, partition_idx: int) -> list[str]:
-        return super().get_partition_specific_args(partition_idx) + ["--ckpt_path={}".format(os.path.join(
+    def get_pruned_checkpoint_path(self, partition_idx: int) -> str:
+        return os.path.join(
             self.get_project_output_dir_by_name(self.config.trained_project),
             self.get_partition_id_str(partition_idx),
             "pruned_checkpoints",
             "latest-opacity_pruned-{}.ckpt".format(self.config.prune_percent)
-        ))]
+        )
+
+    def get_partition_specific_args(self, partition_idx: int) -> list[str]:
+        return super().get_partition_specific_args(partition_idx) + ["--ckpt_path={}".format(self.get_pruned_checkpoint_path(partition_idx))]
+
+    def get_partition_point_number(self, partition_idx: int) -> int:
+        # the Gaussians of the pruned checkpoint
+        from internal.utils.gaussian_model_loader import GaussianModelLoader
+
+        checkpoint_path = self.get_pruned_checkpoint_path(partition_idx)
+        if os.path.exists(checkpoint_path) is False:
+            return 0
+        checkpoint = GaussianModelLoader.load_checkpoint(
+            checkpoint_path,
+            state_dict_prefixes=["gaussian_model.gaussians.means"],
+            load_optimizer_states=False,
+        )
+        return checkpoint["state_dict"]["gaussian_model.gaussians.means"].shape[0]
 
 
 def main():
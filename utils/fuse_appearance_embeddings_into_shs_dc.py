@@ -7,6 +7,7 @@ from tqdm.auto import tqdm
 from internal.renderers.gsplat_hit_pixel_count_renderer import GSplatHitPixelCountRenderer
 from internal.utils.sh_utils import RGB2SH
 from internal.utils.gaussian_model_loader import GaussianModelLoader
+from internal.utils.streaming_top_k import StreamingTopK
 
 
 def parse_args():
@@ -20,6 +21,8 @@ def parse_args():
                         help="The number of the cameras used to calculated fused `shs_dc`")
     parser.add_argument("--camera-chunk-size", "-c", type=int, default=8,
                         help="Smaller it to reduce GPU memory consumption")
+    parser.add_argument("--camera-buffer-size", type=int, default=16,
+                        help="The number of cameras' visibility scores buffered before updating the top-k, smaller it to reduce memory consumption")
     parser.add_argument("--mode", type=str, default="color")
     parser.add_argument("--embedding_view_dir_mode", type=str, default="view_direction")
     args = parser.parse_args()
@@ -28,11 +31,22 @@ def parse_args():
 
 
 @torch.no_grad()
-def calculate_gaussian_scores(cameras, gaussian_model, device):
-    hit_count_list = []
-    opacity_score_list = []
-    alpha_score_list = []
-    all_visibility_score = torch.zeros((len(cameras), gaussian_model.get_xyz.shape[0]), dtype=torch.float, device=device)
+def calculate_gaussian_scores(cameras, gaussian_model, device, n_top_k: int = None, camera_buffer_size: int = 16):
+    """
+    Returns:
+        a dense `[N_cameras, N_gaussians]` visibility score matrix if `n_top_k` is None,
+        otherwise a `StreamingTopK` that retains the `n_top_k` largest scores and their camera indices for each Gaussian
+    """
+
+    if n_top_k is None:
+        all_visibility_score = torch.zeros((len(cameras), gaussian_model.get_xyz.shape[0]), dtype=torch.float, device=device)
+    else:
+        all_visibility_score = StreamingTopK(
+            gaussian_model.get_xyz.shape[0],
+            k=n_top_k,
+            device=device,
+            buffer_size=camera_buffer_size,
+        )
 
     scales = gaussian_model.get_scales()
     if scales.shape[-1] == 2:
@@ -48,11 +62,13 @@ def calculate_gaussian_scores(cameras, gaussian_model, device):
             rotations=gaussian_model.get_rotation,
             viewpoint_camera=camera.to_device("cuda"),
         )
-        # hit_count_list.append(hit_count.cpu())
-        # opacity_score_list.append(opacity_score.cpu())
-        # alpha_score_list.append(alpha_score.cpu())
-        all_visibility_score[idx] = visibility_score.to(device=device)
-        # visibility_score_list.append(visibility_score.cpu())
+        if n_top_k is None:
+            all_visibility_score[idx] = visibility_score.to(device=device)
+        else:
+            all_visibility_score.add_column(visibility_score, idx)
+
+    if n_top_k is not None:
+        all_visibility_score.flush()
 
     torch.cuda.empty_cache()
 
@@ -65,27 +81,32 @@ def prune_gaussian_model(gaussian_model, mask):
 
 
 @torch.no_grad()
-def prune_and_get_weights(gaussian_model, cameras, n_average_cameras, weight_device: torch.device):
-    # calculate Gaussians' visibility score to each camera; the output may consume a lot of memory, so put it on CPU
-    visibility_score = calculate_gaussian_scores(cameras, gaussian_model, "cpu").T  # [N_gaussians, N_cameras]
-    # calculate total visibility score for each Gaussian
-    visibility_score_acc = torch.sum(visibility_score, dim=-1)
+def prune_and_get_weights(gaussian_model, cameras, n_average_cameras, weight_device: torch.device, camera_buffer_size: int = 16):
+    assert n_average_cameras <= len(cameras), "`n_average_cameras` can not be greater than the number of the cameras"
+
+    # keep the top `n_average_cameras` visibility scores of each Gaussian while iterating cameras,
+    # instead of materializing the `[N_gaussians, N_cameras]` scores
+    visibility_score_top_k = calculate_gaussian_scores(
+        cameras,
+        gaussian_model,
+        weight_device,
+        n_top_k=n_average_cameras,
+        camera_buffer_size=camera_buffer_size,
+    )
     # find Gaussian whose total visibility is closed to zero
-    visibility_score_acc_is_close_to_zero = torch.isclose(visibility_score_acc, torch.tensor(0., device=visibility_score_acc.device))
+    visibility_score_acc_is_close_to_zero = torch.isclose(visibility_score_top_k.sum, torch.tensor(0., device=visibility_score_top_k.sum.device))
     gaussian_to_preserve = ~visibility_score_acc_is_close_to_zero
     # prune
     prune_gaussian_model(gaussian_model, gaussian_to_preserve.to(device=gaussian_model.means.device))
-    visibility_score_pruned = visibility_score[~visibility_score_acc_is_close_to_zero]
-    del visibility_score
-    visibility_score_acc_is_close_to_zero.sum()
+    visibility_score_top_k.prune(gaussian_to_preserve)
 
     # ===
 
     # get top `n_average_cameras` visibility cameras
-    visibility_score_pruned_sorted = torch.topk(visibility_score_pruned, k=n_average_cameras, dim=-1)
-    visibility_score_pruned_sorted_values = visibility_score_pruned_sorted.values.to(device=weight_device)
-    visibility_score_pruned_sorted_indices = visibility_score_pruned_sorted.indices.to(device=weight_device)
-    del visibility_score_pruned_sorted
+    visibility_score_pruned_sorted_values, visibility_score_pruned_sorted_indices = visibility_score_top_k.get()
+    visibility_score_pruned_sorted_values = visibility_score_pruned_sorted_values.to(device=weight_device)
+    visibility_score_pruned_sorted_indices = visibility_score_pruned_sorted_indices.to(device=weight_device)
+    del visibility_score_top_k
 
     visibility_score_pruned_top_k_acc = torch.sum(visibility_score_pruned_sorted_values, dim=-1, keepdim=True)
     # calculate the weight of each camera
@@ -236,7 +257,8 @@ def fuse(
         camera_chunk_size: int,
         mode: Literal["color", "embedding"],
         embedding_view_dir_mode: Literal["camera_center", "view_direction"],
-        dataset_path_override: str = None
+        dataset_path_override: str = None,
+        camera_buffer_size: int = 16,
 ):
     dataparser_outputs = ckpt["datamodule_hyper_parameters"]["parser"].instantiate(
         path=ckpt["datamodule_hyper_parameters"]["path"] if dataset_path_override is None else dataset_path_override,
@@ -267,6 +289,7 @@ def fuse(
         cameras=cameras,
         n_average_cameras=n_average_cameras,
         weight_device=cuda_device,
+        camera_buffer_size=camera_buffer_size,
     )
 
     # ===
@@ -371,6 +394,7 @@ def main():
         mode=args.mode,
         embedding_view_dir_mode=args.embedding_view_dir_mode,
         dataset_path_override=args.dataset_path,
+        camera_buffer_size=args.camera_buffer_size,
     )
 
     update_ckpt(gaussian_model, ckpt)
@@ -6,35 +6,10 @@ import cv2
 import json
 from joblib import delayed, Parallel
 from internal.utils.colmap import read_model, qvec2rotmat
-
-parser = argparse.ArgumentParser()
-parser.add_argument("dataset_dir")
-parser.add_argument("--depth_dir", type=str, default=None)
-parser.add_argument("--output", "-o", type=str, default=None)
-parser.add_argument("--point-max-error", type=float, default=1.5)
-args = parser.parse_args()
-
-if args.depth_dir is None:
-    args.depth_dir = os.path.join(args.dataset_dir, "estimated_depths")
-if args.output is None:
-    args.output = os.path.join(args.dataset_dir, "estimated_depth_scales.json")
-
-sparse_model_dir = os.path.join(args.dataset_dir, "sparse")
-if os.path.exists(os.path.join(sparse_model_dir, "images.bin")) is False:
-    sparse_model_dir = os.path.join(sparse_model_dir, "0")
-
-cameras, images, points3d = read_model(sparse_model_dir)
+from internal.utils.depth_scale_utils import get_depth_scales
 
 # copied from https://github.com/graphdeco-inria/hierarchical-3d-gaussians/blob/main/preprocess/make_depth_scale.py
 
-pts_indices = np.array([points3d[key].id for key in points3d])
-pts_xyzs = np.array([points3d[key].xyz for key in points3d])
-pts_errors = np.array([points3d[key].error for key in points3d])
-points3d_ordered = np.zeros([pts_indices.max() + 1, 3])
-points3d_error_ordered = np.zeros([pts_indices.max() + 1, ])
-points3d_ordered[pts_indices] = pts_xyzs
-points3d_error_ordered[pts_indices] = pts_errors
-
 
 def get_scales(key, cameras, images, points3d_ordered, points3d_error_ordered, args):
     image_meta = images[key]
@@ -107,17 +82,64 @@ def get_scales(key, cameras, images, points3d_ordered, points3d_error_ordered, a
     return {"image_name": image_meta.name, "scale": scale, "offset": offset}
 
 
-# depth_param_list = [get_scales(key, cameras, images, points3d_ordered, points3d_error_ordered, args) for key in images]
-depth_param_list = Parallel(n_jobs=-1, backend="threading")(
-    delayed(get_scales)(key, cameras, images, points3d_ordered, points3d_error_ordered, args) for key in images
-)
+def get_depth_params_per_image(sparse_model_dir: str, args):
+    cameras, images, points3d = read_model(sparse_model_dir)
+
+    pts_indices = np.array([points3d[key].id for key in points3d])
+    pts_xyzs = np.array([points3d[key].xyz for key in points3d])
+    pts_errors = np.array([points3d[key].error for key in points3d])
+    points3d_ordered = np.zeros([pts_indices.max() + 1, 3])
+    points3d_error_ordered = np.zeros([pts_indices.max() + 1, ])
+    points3d_ordered[pts_indices] = pts_xyzs
+    points3d_error_ordered[pts_indices] = pts_errors
+
+    # depth_param_list = [get_scales(key, cameras, images, points3d_ordered, points3d_error_ordered, args) for key in images]
+    depth_param_list = Parallel(n_jobs=-1, backend="threading")(
+        delayed(get_scales)(key, cameras, images, points3d_ordered, points3d_error_ordered, args) for key in images
+    )
+
+    return {
+        depth_param["image_name"]: {"scale": depth_param["scale"], "offset": depth_param["offset"]}
+        for depth_param in depth_param_list if depth_param != None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dataset_dir")
+    parser.add_argument("--depth_dir", type=str, default=None)
+    parser.add_argument("--output", "-o", type=str, default=None)
+    parser.add_argument("--point-max-error", type=float, default=1.5)
+    parser.add_argument("--n-processes", type=int, default=-1,
+                        help="the number of processes sampling the depth maps, -1 means the number of CPUs")
+    parser.add_argument("--per-image", action="store_true", default=False,
+                        help="estimate image by image, the binary COLMAP model is not required")
+    args = parser.parse_args()
+
+    if args.depth_dir is None:
+        args.depth_dir = os.path.join(args.dataset_dir, "estimated_depths")
+    if args.output is None:
+        args.output = os.path.join(args.dataset_dir, "estimated_depth_scales.json")
+
+    sparse_model_dir = os.path.join(args.dataset_dir, "sparse")
+    if os.path.exists(os.path.join(sparse_model_dir, "images.bin")) is False:
+        sparse_model_dir = os.path.join(sparse_model_dir, "0")
+
+    if args.per_image or os.path.exists(os.path.join(sparse_model_dir, "images.bin")) is False:
+        depth_params = get_depth_params_per_image(sparse_model_dir, args)
+    else:
+        depth_params = get_depth_scales(
+            sparse_model_dir,
+            args.depth_dir,
+            point_max_error=args.point_max_error,
+            n_processes=args.n_processes,
+        )
+
+    with open(args.output, "w") as f:
+        json.dump(depth_params, f, indent=4, ensure_ascii=False)
 
-depth_params = {
-    depth_param["image_name"]: {"scale": depth_param["scale"], "offset": depth_param["offset"]}
-    for depth_param in depth_param_list if depth_param != None
-}
+    print("Saved to `{}`".format(args.output))
 
-with open(args.output, "w") as f:
-    json.dump(depth_params, f, indent=4, ensure_ascii=False)
 
-print("Saved to `{}`".format(args.output))
+if __name__ == "__main__":
+    main()
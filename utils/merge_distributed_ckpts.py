@@ -4,6 +4,8 @@ from tqdm import tqdm
 
 parser = argparse.ArgumentParser()
 parser.add_argument("path", help="Path to the model output directory")
+parser.add_argument("--no-mmap", action="store_true", default=False,
+                    help="Allocate the merged tensors in memory, instead of memory-mapped temporary files")
 args = parser.parse_args()
 
 checkpoint_dir = os.path.join(args.path, "checkpoints")
@@ -27,141 +29,220 @@ for i in os.listdir(checkpoint_dir):
 
 assert len(checkpoint_files) > 0
 
+# merge in the rank order
+checkpoint_files = sorted(checkpoint_files, key=lambda x: int(x[x.rindex("-rank=") + 6:x.rindex(".")]))
 print(checkpoint_files)
 
 import add_pypath
+import gc
+import shutil
 import torch
 from internal.models.gaussian import Gaussian
+from internal.utils.gaussian_model_loader import GaussianModelLoader
+
+"""
+The merging is performed in two passes:
+    1. Read the shapes of the tensors to be concatenated, the checkpoints are memory-mapped, so the tensors are not loaded;
+    2. Preallocate the merged tensors, then copy the tensors of each rank into them, releasing each rank before loading the next.
+A tensor to be merged is identified by its location in the checkpoint, i.e. the keys to access it.
+"""
+
+
+def get_mergeable_tensor_locations(ckpt) -> list[tuple]:
+    locations = []
 
-is_new_model = True
-param_list_key_by_name = {}
-extra_param_list_key_by_name = {}
-optimizer_state_exp_avg_list_key_by_index = {}
-optimizer_state_exp_avg_sq_list_key_by_index = {}
-density_controller_state_list_key_by_name = {}
-number_of_gaussians = []
-for i in tqdm(checkpoint_files, desc="Loading checkpoints"):
-    ckpt = torch.load(os.path.join(checkpoint_dir, i), map_location="cpu")
     if isinstance(ckpt["hyper_parameters"]["gaussian"], Gaussian) is True:
         property_names = []
         gaussian_property_dict_key_prefix = "gaussian_model.gaussians."
         density_controller_state_dict_key_prefix = "density_controller."
-        # extract gaussian properties
-        for key, value in ckpt["state_dict"].items():
+        # gaussian properties and density controller states
+        for key in ckpt["state_dict"]:
             if key.startswith(gaussian_property_dict_key_prefix):
-                param_list_key_by_name.setdefault(key, []).append(value)
+                locations.append(("state_dict", key))
                 property_names.append(key[len(gaussian_property_dict_key_prefix):])
             elif key.startswith(density_controller_state_dict_key_prefix):
-                param_list_key_by_name.setdefault(key, []).append(value)
+                locations.append(("state_dict", key))
 
-        # extract optimizer states, assume meet gaussian optimizers first
+        # optimizer states, assume meet gaussian optimizers first
         for optimizer_idx, optimizer in enumerate(ckpt["optimizer_states"]):
             for param_group_idx, param_group in enumerate(optimizer["param_groups"]):
                 if param_group["name"] not in property_names:
                     continue
 
                 property_names.remove(param_group["name"])
-                state = optimizer["state"][param_group_idx]
-
-                # [optimizer_idx][param_group_idx] = [state, ...]
-                optimizer_state_exp_avg_list_key_by_index.setdefault(optimizer_idx, {}).setdefault(param_group_idx, []).append(state["exp_avg"])
-                optimizer_state_exp_avg_sq_list_key_by_index.setdefault(optimizer_idx, {}).setdefault(param_group_idx, []).append(state["exp_avg_sq"])
+                for state_name in ["exp_avg", "exp_avg_sq"]:
+                    locations.append(("optimizer_states", optimizer_idx, "state", param_group_idx, state_name))
 
             if len(property_names) == 0:
                 break
-
-        number_of_gaussians.append(ckpt["state_dict"]["gaussian_model.gaussians.means"].shape[0])
     else:
-        is_new_model = False
         # previous version
-        for i in ckpt["state_dict"]:
-            if i.startswith("gaussian_model."):
-                param_list_key_by_name.setdefault(i, []).append(ckpt["state_dict"][i])
-        for i in ckpt["gaussian_model_extra_state_dict"]:
-            if isinstance(ckpt["gaussian_model_extra_state_dict"][i], torch.Tensor) is False:
+        for key in ckpt["state_dict"]:
+            if key.startswith("gaussian_model."):
+                locations.append(("state_dict", key))
+        for key, value in ckpt["gaussian_model_extra_state_dict"].items():
+            if isinstance(value, torch.Tensor) is False:
                 continue
-            if ckpt["gaussian_model_extra_state_dict"][i].dim() == 0:
+            if value.dim() == 0:
                 continue
-            extra_param_list_key_by_name.setdefault(i, []).append(ckpt["gaussian_model_extra_state_dict"][i])
+            locations.append(("gaussian_model_extra_state_dict", key))
 
         # TODO: find gaussian optimizer index automatically
         gaussian_optimizer_index = 0
-        for i in ckpt["optimizer_states"][gaussian_optimizer_index]["state"]:
-            optimizer_state_exp_avg_list_key_by_index.setdefault(i, []).append(ckpt["optimizer_states"][gaussian_optimizer_index]["state"][i]["exp_avg"])
-            optimizer_state_exp_avg_sq_list_key_by_index.setdefault(i, []).append(ckpt["optimizer_states"][gaussian_optimizer_index]["state"][i]["exp_avg_sq"])
-
-        number_of_gaussians.append(ckpt["state_dict"]["gaussian_model._xyz"].shape[0])
-
-print("Merging Gaussians and density controller states...")
-for i in param_list_key_by_name:
-    ckpt["state_dict"][i] = torch.concat(param_list_key_by_name[i], dim=0)
-if is_new_model is True:
-    print("Merging optimizers...")
-    for optimizer_idx in optimizer_state_exp_avg_list_key_by_index.keys():
-        for param_group_idx in optimizer_state_exp_avg_list_key_by_index[optimizer_idx].keys():
-            ckpt["optimizer_states"][optimizer_idx]["state"][param_group_idx]["exp_avg"] = torch.concat(
-                optimizer_state_exp_avg_list_key_by_index[optimizer_idx][param_group_idx],
-                dim=0,
-            )
-            ckpt["optimizer_states"][optimizer_idx]["state"][param_group_idx]["exp_avg_sq"] = torch.concat(
-                optimizer_state_exp_avg_sq_list_key_by_index[optimizer_idx][param_group_idx],
-                dim=0,
-            )
-else:
-    for i in extra_param_list_key_by_name:
-        ckpt["gaussian_model_extra_state_dict"][i] = torch.concat(extra_param_list_key_by_name[i], dim=0)
-    print("Merging optimizers...")
-    for i in optimizer_state_exp_avg_list_key_by_index.keys():
-        ckpt["optimizer_states"][0]["state"][i]["exp_avg"] = torch.concat(optimizer_state_exp_avg_list_key_by_index[i], dim=0)
-        ckpt["optimizer_states"][0]["state"][i]["exp_avg_sq"] = torch.concat(optimizer_state_exp_avg_sq_list_key_by_index[i], dim=0)
+        for param_idx in ckpt["optimizer_states"][gaussian_optimizer_index]["state"]:
+            for state_name in ["exp_avg", "exp_avg_sq"]:
+                locations.append(("optimizer_states", gaussian_optimizer_index, "state", param_idx, state_name))
 
+    return locations
 
-def rename_ddp_appearance_states():
-    gaussian_property_dict_key_prefix = "renderer.appearance_model.module."
-    for i in list(ckpt["state_dict"].keys()):
-        if i.startswith(gaussian_property_dict_key_prefix) is False:
-            continue
-        new_key = "renderer.model.{}".format(i[len(gaussian_property_dict_key_prefix):])
-        ckpt["state_dict"][new_key] = ckpt["state_dict"][i]
-        del ckpt["state_dict"][i]
+
+def get_by_location(ckpt, location: tuple):
+    value = ckpt
+    for key in location:
+        value = value[key]
+    return value
 
 
-# replace renderer to non-distributed one
-if ckpt["hyper_parameters"]["renderer"].__class__.__name__ == "GSplatDistributedRenderer":
-    print("Replace renderer with `GSPlatRenderer`")
+def set_by_location(ckpt, location: tuple, value):
+    get_by_location(ckpt, location[:-1])[location[-1]] = value
 
-    import internal.renderers.gsplat_renderer
 
-    ckpt["hyper_parameters"]["renderer"] = internal.renderers.gsplat_renderer.GSPlatRenderer()
-elif ckpt["hyper_parameters"]["renderer"].__class__.__name__ == "GSplatDistributedAppearanceEmbeddingRenderer":
-    print("Replace renderer with `GSplatAppearanceEmbeddingRenderer`")
+def get_number_of_gaussians(ckpt) -> int:
+    if "gaussian_model.gaussians.means" in ckpt["state_dict"]:
+        return ckpt["state_dict"]["gaussian_model.gaussians.means"].shape[0]
+    return ckpt["state_dict"]["gaussian_model._xyz"].shape[0]
 
-    from internal.renderers.gsplat_appearance_embedding_renderer import GSplatAppearanceEmbeddingRenderer
 
-    renderer = GSplatAppearanceEmbeddingRenderer(
-        model=ckpt["hyper_parameters"]["renderer"].appearance,
-        optimization=ckpt["hyper_parameters"]["renderer"].appearance_optimization,
-    )
-    ckpt["hyper_parameters"]["renderer"] = renderer
+def load_checkpoint(filename: str):
+    return GaussianModelLoader.load_checkpoint(os.path.join(checkpoint_dir, filename), lazy=True)
 
-    rename_ddp_appearance_states()
-elif ckpt["hyper_parameters"]["renderer"].__class__.__name__ == "GSplatDistributedAppearanceMipRenderer":
-    print("Replace renderer with `GSplatAppearanceEmbeddingMipRenderer`")
 
-    from internal.renderers.gsplat_appearance_embedding_renderer import GSplatAppearanceEmbeddingMipRenderer
+# first pass: shapes
+tensor_shapes = {}  # {location: [shape of each rank, ...]}
+tensor_dtypes = {}
+number_of_gaussians = []
+for i in tqdm(checkpoint_files, desc="Reading shapes"):
+    ckpt = load_checkpoint(i)
+    locations = get_mergeable_tensor_locations(ckpt)
+    if len(tensor_shapes) > 0:
+        assert set(locations) == set(tensor_shapes.keys()), "'{}' has different states".format(i)
+    for location in locations:
+        tensor = get_by_location(ckpt, location)
+        previous_dtype = tensor_dtypes.setdefault(location, tensor.dtype)
+        assert previous_dtype == tensor.dtype, "dtype of {} not match".format(location)
+        tensor_shapes.setdefault(location, []).append(tensor.shape)
+    number_of_gaussians.append(get_number_of_gaussians(ckpt))
+    del ckpt
+    gc.collect()
+
+# allocate merged tensors
+mmap_dir = None
+if not args.no_mmap:
+    mmap_dir = os.path.join(checkpoint_dir, ".merging-step={}".format(max_iteration))
+    os.makedirs(mmap_dir, exist_ok=True)
+
+
+def allocate(location_idx: int, shape, dtype):
+    if mmap_dir is not None:
+        numel = 1
+        for i in shape:
+            numel *= i
+        try:
+            return torch.from_file(
+                os.path.join(mmap_dir, "{}.bin".format(location_idx)),
+                shared=True,
+                size=numel,
+                dtype=dtype,
+            ).view(shape)
+        except Exception as err:
+            print("can not allocate memory-mapped tensor, fallback to memory: {}".format(err))
+    return torch.empty(shape, dtype=dtype)
 
-    renderer = GSplatAppearanceEmbeddingMipRenderer(
-        model=ckpt["hyper_parameters"]["renderer"].appearance,
-        optimization=ckpt["hyper_parameters"]["renderer"].appearance_optimization,
-        filter_2d_kernel_size=ckpt["hyper_parameters"]["renderer"].filter_2d_kernel_size
-    )
-    ckpt["hyper_parameters"]["renderer"] = renderer
 
-    rename_ddp_appearance_states()
+def rename_ddp_appearance_states():
+    gaussian_property_dict_key_prefix = "renderer.appearance_model.module."
+    for i in list(ckpt["state_dict"].keys()):
+        if i.startswith(gaussian_property_dict_key_prefix) is False:
+            continue
+        new_key = "renderer.model.{}".format(i[len(gaussian_property_dict_key_prefix):])
+        ckpt["state_dict"][new_key] = ckpt["state_dict"][i]
+        del ckpt["state_dict"][i]
 
 
-print("number_of_gaussians=sum({})={}".format(number_of_gaussians, sum(number_of_gaussians)))
-output_path = os.path.join(checkpoint_dir, checkpoint_files[0][:checkpoint_files[0].rfind("-")] + ".ckpt")
-print("Saving...")
-torch.save(ckpt, output_path)
-print(f"Saved to '{output_path}'")
+merged_tensors = {}
+try:
+    for location_idx, (location, shapes) in enumerate(tensor_shapes.items()):
+        for shape in shapes[1:]:
+            assert shape[1:] == shapes[0][1:], "shapes of {} not match: {}".format(location, shapes)
+        merged_tensors[location] = allocate(
+            location_idx,
+            (sum([shape[0] for shape in shapes]), *shapes[0][1:]),
+            tensor_dtypes[location],
+        )
+
+    # second pass: copy each rank's tensors into the merged ones
+    offsets = {location: 0 for location in merged_tensors}
+    for i in tqdm(checkpoint_files, desc="Merging"):
+        ckpt = load_checkpoint(i)
+        for location, merged_tensor in merged_tensors.items():
+            tensor = get_by_location(ckpt, location)
+            offset = offsets[location]
+            merged_tensor[offset:offset + tensor.shape[0]].copy_(tensor)
+            offsets[location] = offset + tensor.shape[0]
+            del tensor
+        del ckpt
+        gc.collect()
+    for location, merged_tensor in merged_tensors.items():
+        assert offsets[location] == merged_tensor.shape[0]
+
+    # use the first rank's checkpoint as the base of the output
+    ckpt = load_checkpoint(checkpoint_files[0])
+    for location, merged_tensor in merged_tensors.items():
+        set_by_location(ckpt, location, merged_tensor)
+
+
+    # replace renderer to non-distributed one
+    if ckpt["hyper_parameters"]["renderer"].__class__.__name__ == "GSplatDistributedRenderer":
+        print("Replace renderer with `GSPlatRenderer`")
+
+        import internal.renderers.gsplat_renderer
+
+        ckpt["hyper_parameters"]["renderer"] = internal.renderers.gsplat_renderer.GSPlatRenderer()
+    elif ckpt["hyper_parameters"]["renderer"].__class__.__name__ == "GSplatDistributedAppearanceEmbeddingRenderer":
+        print("Replace renderer with `GSplatAppearanceEmbeddingRenderer`")
+
+        from internal.renderers.gsplat_appearance_embedding_renderer import GSplatAppearanceEmbeddingRenderer
+
+        renderer = GSplatAppearanceEmbeddingRenderer(
+            model=ckpt["hyper_parameters"]["renderer"].appearance,
+            optimization=ckpt["hyper_parameters"]["renderer"].appearance_optimization,
+        )
+        ckpt["hyper_parameters"]["renderer"] = renderer
+
+        rename_ddp_appearance_states()
+    elif ckpt["hyper_parameters"]["renderer"].__class__.__name__ == "GSplatDistributedAppearanceMipRenderer":
+        print("Replace renderer with `GSplatAppearanceEmbeddingMipRenderer`")
+
+        from internal.renderers.gsplat_appearance_embedding_renderer import GSplatAppearanceEmbeddingMipRenderer
+
+        renderer = GSplatAppearanceEmbeddingMipRenderer(
+            model=ckpt["hyper_parameters"]["renderer"].appearance,
+            optimization=ckpt["hyper_parameters"]["renderer"].appearance_optimization,
+            filter_2d_kernel_size=ckpt["hyper_parameters"]["renderer"].filter_2d_kernel_size
+        )
+        ckpt["hyper_parameters"]["renderer"] = renderer
+
+        rename_ddp_appearance_states()
+
+    print("number_of_gaussians=sum({})={}".format(number_of_gaussians, sum(number_of_gaussians)))
+    output_path = os.path.join(checkpoint_dir, checkpoint_files[0][:checkpoint_files[0].rfind("-")] + ".ckpt")
+    print("Saving...")
+    torch.save(ckpt, output_path)
+    print(f"Saved to '{output_path}'")
+finally:
+    # also remove the memory-mapped files on failure, they are as large as the merged checkpoint
+    if mmap_dir is not None:
+        ckpt = None
+        merged_tensors.clear()
+        gc.collect()
+        shutil.rmtree(mmap_dir, ignore_errors=True)
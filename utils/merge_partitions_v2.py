@@ -158,7 +158,8 @@ def main():
         for partition_idx, partition_id_str, ckpt_file, bounding_box in t:
             t.set_description("{}".format(partition_id_str))
             t.set_postfix_str("Loading checkpoint...")
-            ckpt = torch.load(ckpt_file, map_location="cpu")
+            # optimizer states are dropped by `update_ckpt()`, so skip them
+            ckpt = GaussianModelLoader.load_checkpoint(ckpt_file, load_optimizer_states=False)
 
             t.set_postfix_str("Splitting...")
             gaussian_model, _, _ = split_partition_gaussians(
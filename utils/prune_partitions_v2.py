@@ -6,7 +6,8 @@ import torch
 import json
 from tqdm.auto import tqdm
 from internal.cameras.cameras import Cameras
-from internal.utils.light_gaussian import get_count_and_score, calculate_v_imp_score, get_prune_mask
+from internal.utils.gaussian_model_loader import GaussianModelLoader
+from internal.utils.light_gaussian import ImportanceScoreEngine, calculate_v_imp_score, get_prune_mask
 from trained_partition_utils import get_trained_partitions, split_partition_gaussians
 from distibuted_tasks import configure_arg_parser_v2
 
@@ -84,7 +85,7 @@ def main():
         for partition_idx, partition_id_str, ckpt_file, bounding_box in t:
             t.set_description(partition_id_str)
             t.set_postfix_str("Loading checkpoint...")
-            ckpt = torch.load(ckpt_file, map_location="cpu")
+            ckpt = GaussianModelLoader.load_checkpoint(ckpt_file)
 
             t.set_postfix_str("Splitting..")
             gaussian_model, outside_part, is_inside = split_partition_gaussians(
@@ -103,20 +104,28 @@ def main():
 
             # ===
             t.set_postfix_str("Pruning...")
-            _, opacity_score_total, _, visibility_score_total = get_count_and_score(
-                gaussian_model,
-                tqdm(cameras, leave=False),
-                anti_aliased=True,
-            )
+            # the scores are saved alongside the checkpoint, and reused if the partition is pruned again
+            importance_engine = ImportanceScoreEngine(anti_aliased=True)
+            importance_cache_file = "{}.light_gaussian_importance.pt".format(ckpt_file)
+            if os.path.exists(importance_cache_file):
+                importance_engine.load_state_dict(torch.load(importance_cache_file, map_location="cpu"))
+            cached_scores = importance_engine.cache
+            scores = importance_engine.get_scores(gaussian_model, tqdm(cameras, leave=False))
+            if scores is not cached_scores:
+                torch.save(importance_engine.state_dict(), importance_cache_file)
+            visibility_score_total = scores.visibility_score
             # prune with zero visibilities
             nonzero_visibility_mask = ~torch.isclose(visibility_score_total, torch.tensor(0., device=visibility_score_total.device))
             gaussian_model.properties = {k: v[nonzero_visibility_mask] for k, v in gaussian_model.properties.items()}
-            opacity_score_total = opacity_score_total[nonzero_visibility_mask]
+            # index the scores of the remaining ones instead of recounting
+            importance_engine.prune(nonzero_visibility_mask, gaussian_model)
+            opacity_score_total = importance_engine.cache.opacity_score
 
             # prune by opacity
             v_imp_score = calculate_v_imp_score(gaussian_model.get_scaling, opacity_score_total, 0.1)
             high_opacity_score_mask = ~get_prune_mask(args.prune_percent, v_imp_score)
             gaussian_model.properties = {k: v[high_opacity_score_mask] for k, v in gaussian_model.properties.items()}
+            importance_engine.prune(high_opacity_score_mask, gaussian_model)
 
             n_after_pruning += gaussian_model.n_gaussians
 
@@ -167,6 +176,9 @@ def main():
                 if i.startswith("density_controller."):
                     ckpt["state_dict"][i] = torch.zeros((gaussian_model.n_gaussians, *ckpt["state_dict"][i].shape[1:]))
 
+            # the scores of the pruned Gaussians, restored by `GaussianSplatting.on_load_checkpoint()`
+            ckpt["light_gaussian_importance_scores"] = importance_engine.state_dict(gaussian_model)
+
             # save checkpoint
             checkpoint_save_dir = os.path.join(os.path.dirname(os.path.dirname(ckpt_file)), "pruned_checkpoints")
             os.makedirs(checkpoint_save_dir, exist_ok=True)
@@ -1,5 +1,7 @@
 import os
 from dataclasses import dataclass
+from typing import Dict, Optional
+import numpy as np
 from train_partitions import PartitionTrainingConfig, PartitionTraining
 import argparse
 
@@ -21,15 +23,43 @@ class ColmapPartitionTrainingConfig(PartitionTrainingConfig):
 
 
 class ColmapPartitionTraining(PartitionTraining):
+    _image_point_ids: Optional[Dict[str, np.ndarray]] = None
+
     def get_default_dataparser_name(self) -> str:
         return "Colmap"
 
+    def get_image_list_path(self, partition_idx: int) -> str:
+        return os.path.join(self.path, "{}.txt".format(self.get_partition_id_str(partition_idx)))
+
+    def get_image_point_ids(self) -> Dict[str, np.ndarray]:
+        """The ids of the SfM points observed by each image, key by the image names"""
+
+        if self._image_point_ids is None:
+            import internal.utils.colmap as colmap_utils
+
+            # the same as `ColmapDataParser.detect_sparse_model_dir()`
+            sparse_model_dir = os.path.join(self.dataset_path, "sparse", "0")
+            if os.path.isdir(sparse_model_dir) is False:
+                sparse_model_dir = os.path.join(self.dataset_path, "sparse")
+            images = colmap_utils.read_images_binary(os.path.join(sparse_model_dir, "images.bin"))
+            self._image_point_ids = {i.name: i.point3D_ids[i.point3D_ids >= 0] for i in images.values()}
+        return self._image_point_ids
+
+    def get_partition_point_number(self, partition_idx: int) -> int:
+        # `ColmapDataParser` loads the SfM points observed by any image in the image list
+        try:
+            image_point_ids = self.get_image_point_ids()
+        except FileNotFoundError:
+            return 0
+        with open(self.get_image_list_path(partition_idx), "r") as f:
+            point_ids = [image_point_ids[i] for i in f.read().splitlines() if i in image_point_ids]
+        if len(point_ids) == 0:
+            return 0
+        return np.unique(np.concatenate(point_ids)).shape[0]
+
     def get_dataset_specific_args(self, partition_idx: int) -> list[str]:
         return [
-            "--data.parser.image_list={}".format(os.path.join(
-                self.path,
-                "{}.txt".format(self.get_partition_id_str(partition_idx)),
-            )),
+            "--data.parser.image_list={}".format(self.get_image_list_path(partition_idx)),
             "--data.parser.split_mode={}".format("experiment" if self.config.eval else "reconstruction"),
             "--data.parser.eval_step=64",
         ]
@@ -7,6 +7,11 @@ class MatrixCityPartitionTraining(PartitionTraining):
     def get_default_dataparser_name(self) -> str:
         return "MatrixCity"
 
+    def get_partition_point_number(self, partition_idx: int) -> int:
+        # `MatrixCityDataParser` samples this number of points from the depth maps of the partition
+        from internal.dataparsers.matrix_city_dataparser import MatrixCity
+        return MatrixCity.max_points
+
     def get_dataset_specific_args(self, partition_idx: int) -> list[str]:
         return [
             "--data.parser.train={}".format([os.path.join(
@@ -37,6 +37,15 @@ class PartitionTrainingConfig:
     training_args: Union[Tuple, List] = None
     config_file: Optional[str] = None
     srun_args: List[str] = field(default_factory=lambda: [])
+    devices: Optional[List[str]] = None
+    """Train partitions concurrently on these devices with the local scheduler"""
+    processes_per_device: int = 1
+    device_memory: float = -1
+    """In MB, non-positive value disables the memory check"""
+    max_retries: int = 2
+    retry_delay: float = 30.
+    memory_estimates: Optional[str] = None
+    """A yaml file contains the memory (MB) required by each partition, measured in the previous runs"""
 
     def __post_init__(self):
         if self.scalable_params is None:
@@ -68,6 +77,15 @@ class PartitionTrainingConfig:
         parser.add_argument("--dry-run", action="store_true")
         parser.add_argument("--name-suffix", type=str, default="")
         parser.add_argument("--ff-densify", action="store_true", default=False)
+        parser.add_argument("--devices", type=str, default=None, nargs="+", action="extend",
+                            help="Train partitions concurrently on these devices without SLURM")
+        parser.add_argument("--processes-per-device", type=int, default=1)
+        parser.add_argument("--device-memory", type=float, default=-1,
+                            help="The memory of each device in MB, used to pack partitions onto devices")
+        parser.add_argument("--max-retries", type=int, default=2)
+        parser.add_argument("--retry-delay", type=float, default=30.)
+        parser.add_argument("--memory-estimates", type=str, default=None,
+                            help="A yaml file contains the memory (MB) required by each partition, overrides the peak memory recorded in the previous runs")
         configure_arg_parser_v2(parser)
 
     @staticmethod
@@ -127,6 +145,12 @@ class PartitionTrainingConfig:
             config_file=args.config,
             training_args=training_args,
             srun_args=srun_args,
+            devices=args.devices,
+            processes_per_device=args.processes_per_device,
+            device_memory=args.device_memory,
+            max_retries=args.max_retries,
+            retry_delay=args.retry_delay,
+            memory_estimates=args.memory_estimates,
             **cls.get_extra_init_kwargs(args),
         )
 
@@ -165,6 +189,14 @@ class PartitionTraining:
     def srun_output_dir(self) -> str:
         return os.path.join(self.project_output_dir, "srun-outputs")
 
+    @property
+    def local_output_dir(self) -> str:
+        return os.path.join(self.project_output_dir, "local-outputs")
+
+    @property
+    def local_status_path(self) -> str:
+        return os.path.join(self.project_output_dir, "partition-training-status.json")
+
     def run_subprocess(self, args, output_redirect) -> int:
         sel = selectors.DefaultSelector()
 
@@ -230,6 +262,10 @@ class PartitionTraining:
     def get_partition_trained_step_filename(self, partition_idx: int):
         return "{}-trained".format(self.get_experiment_name(partition_idx))
 
+    def get_partition_point_number(self, partition_idx: int) -> int:
+        """The number of the initial points loaded by the training of the partition, used to estimate the resources, 0 means unknown"""
+        return 0
+
     def get_partition_image_number(self, partition_idx: int) -> int:
         return torch.logical_or(
             self.scene["location_based_assignments"][partition_idx],
@@ -239,50 +275,35 @@ class PartitionTraining:
     def get_experiment_name(self, partition_idx: int) -> str:
         return "{}{}".format(self.get_partition_id_str(partition_idx), self.config.name_suffix)
 
-    def train_a_partition(
-            self,
-            partition_idx: int,
-    ):
-        partition_image_number = self.get_partition_image_number(partition_idx)
-        extra_epoches = self.config.extra_epoches
-        scalable_params = self.config.scalable_params
-        extra_epoch_scalable_params = self.config.extra_epoch_scalable_params
-        project_output_dir = self.project_output_dir
-        config_file = self.config.config_file
-        extra_training_args = self.config.training_args
-        project_name = self.config.project_name
-        dry_run = self.config.dry_run
-
-        # scale hyper parameters
+    def get_partition_max_steps(self, partition_idx: int) -> Tuple[int, Dict[str, Any]]:
         max_steps, scaled_params, scale_up = auto_hyper_parameter(
-            partition_image_number,
-            extra_epoch=extra_epoches,
-            scalable_params=scalable_params,
-            extra_epoch_scalable_params=extra_epoch_scalable_params,
+            self.get_partition_image_number(partition_idx),
+            extra_epoch=self.config.extra_epoches,
+            scalable_params=self.config.scalable_params,
+            extra_epoch_scalable_params=self.config.extra_epoch_scalable_params,
             scale_mode=self.config.scale_param_mode,
         )
+        return max_steps, scaled_params
 
-        # whether a trained partition
-        partition_trained_step_file_path = os.path.join(
-            project_output_dir,
+    def get_partition_trained_step_file_path(self, partition_idx: int) -> str:
+        return os.path.join(
+            self.project_output_dir,
             self.get_partition_trained_step_filename(partition_idx)
         )
 
-        try:
-            with open(partition_trained_step_file_path, "r") as f:
-                trained_steps = int(f.read())
-                if trained_steps >= max_steps:
-                    print("Skip trained partition '{}'".format(self.partition_coordinates.id[partition_idx].tolist()))
-                    return partition_idx, 0
-        except:
-            pass
-
-        partition_output_dir = os.path.join(project_output_dir, self.get_experiment_name(partition_idx))
+    def move_existing_partition_output(self, partition_idx: int):
+        partition_output_dir = os.path.join(self.project_output_dir, self.get_experiment_name(partition_idx))
         if os.path.exists(partition_output_dir):
             previous_output_new_dir = "{}-{}".format(partition_output_dir, int(time.time()))
             print("Move existing {} to {}".format(partition_output_dir, previous_output_new_dir))
             os.rename(partition_output_dir, previous_output_new_dir)
 
+    def get_partition_training_args(self, partition_idx: int, max_steps: int, scaled_params: Dict[str, Any]) -> List[str]:
+        project_output_dir = self.project_output_dir
+        config_file = self.config.config_file
+        extra_training_args = self.config.training_args
+        project_name = self.config.project_name
+
         # build args
         # basic
         args = [
@@ -321,6 +342,34 @@ class PartitionTraining:
 
         args += self.get_partition_specific_args(partition_idx)
 
+        return args
+
+    def train_a_partition(
+            self,
+            partition_idx: int,
+    ):
+        dry_run = self.config.dry_run
+
+        # scale hyper parameters
+        max_steps, scaled_params = self.get_partition_max_steps(partition_idx)
+
+        # whether a trained partition
+        partition_trained_step_file_path = self.get_partition_trained_step_file_path(partition_idx)
+
+        try:
+            with open(partition_trained_step_file_path, "r") as f:
+                trained_steps = int(f.read())
+                if trained_steps >= max_steps:
+                    print("Skip trained partition '{}'".format(self.partition_coordinates.id[partition_idx].tolist()))
+                    return partition_idx, 0
+        except:
+            pass
+
+        self.move_existing_partition_output(partition_idx)
+
+        args = self.get_partition_training_args(partition_idx, max_steps, scaled_params)
+        experiment_name = self.get_experiment_name(partition_idx)
+
         print_func = print
         run_func = subprocess.call
         if len(self.config.srun_args) > 0:
@@ -379,7 +428,9 @@ class PartitionTraining:
                 continue
             trainable_partition_idx_list.append(partition_idx)
 
-        if len(self.config.srun_args) == 0:
+        if len(self.config.srun_args) == 0 and self.config.devices is not None:
+            self.train_partitions_locally(trainable_partition_idx_list)
+        elif len(self.config.srun_args) == 0:
             with tqdm(trainable_partition_idx_list) as t:
                 for partition_idx in t:
                     self.train_a_partition(partition_idx=partition_idx)
@@ -420,6 +471,63 @@ class PartitionTraining:
                             total_trainable_partitions,
                         ))
 
+    def get_local_partition_tasks(self, partition_idx_list: List[int]):
+        from internal.utils.partition_scheduler import PartitionTask
+
+        tasks = []
+        for partition_idx in partition_idx_list:
+            max_steps, scaled_params = self.get_partition_max_steps(partition_idx)
+            experiment_name = self.get_experiment_name(partition_idx)
+            tasks.append(PartitionTask(
+                name=experiment_name,
+                command=self.get_partition_training_args(partition_idx, max_steps, scaled_params),
+                n_images=self.get_partition_image_number(partition_idx),
+                n_points=self.get_partition_point_number(partition_idx),
+                max_steps=max_steps,
+                trained_step_file=self.get_partition_trained_step_file_path(partition_idx),
+                log_file=os.path.join(self.local_output_dir, "{}.txt".format(experiment_name)),
+                before_launch=lambda task, partition_idx=partition_idx: self.move_existing_partition_output(partition_idx),
+            ))
+        return tasks
+
+    def train_partitions_locally(self, partition_idx_list: List[int]):
+        """Train partitions concurrently on the devices of this machine, see `internal.utils.partition_scheduler`"""
+
+        from internal.utils.partition_scheduler import LocalPartitionScheduler, ResourceEstimator
+
+        tasks = self.get_local_partition_tasks(partition_idx_list)
+        if self.config.dry_run:
+            for task in tasks:
+                print(" \\\n  ".join(task.command))
+            return
+
+        estimator = ResourceEstimator(
+            previous_elapsed=ResourceEstimator.load_previous_elapsed(self.local_status_path),
+            memory_mb=ResourceEstimator.load_previous_memory_mb(self.local_status_path),
+        )
+        if self.config.memory_estimates is not None:
+            with open(self.config.memory_estimates, "r") as f:
+                estimator.memory_mb.update({str(k): float(v) for k, v in yaml.safe_load(f).items()})
+
+        print("Local mode enabled, devices: {}".format(self.config.devices))
+        print("Running outputs will be saved to '{}'".format(self.local_output_dir))
+        scheduler = LocalPartitionScheduler(
+            devices=self.config.devices,
+            slots_per_device=self.config.processes_per_device,
+            device_memory_mb=self.config.device_memory,
+            max_retries=self.config.max_retries,
+            retry_delay=self.config.retry_delay,
+            status_path=self.local_status_path,
+            estimator=estimator,
+            print_func=lambda i: tqdm.write("[{}] {}".format(time.strftime('%Y-%m-%d %H:%M:%S'), i)),
+        )
+        status = scheduler.run(tasks)
+
+        failed = [name for name, i in status.items() if i["state"] == "failed"]
+        if len(failed) > 0:
+            print("Failed partitions: {}".format(failed))
+        print("Status saved to '{}'".format(self.local_status_path))
+
     @classmethod
     def start_with_configured_argparser(cls, parser, config_cls=PartitionTrainingConfig):
         config, args = config_cls.instantiate_with_parser(parser)